@@ -0,0 +1,406 @@
+import glob
+import queue
+import shutil
+import threading
+from pathlib import Path
+from typing import Union
+from concurrent.futures import as_completed, wait, FIRST_COMPLETED
+from traceback import format_exception
+from logging import getLogger
+
+from . import utils
+from . import lasheader
+from . import scheduler
+from . import py3dtiles_iface
+from . import precompress as precompression
+from .pipeline import Pipeline
+
+LAS_SUFFIXES = ['.las', '.laz']
+"File extensions picked up when searching a directory"
+DEFAULT_QUEUE_DEPTH = 2
+"Default number of prepared files allowed to wait for tiling in pipelined mode"
+DEFAULT_MIN_FREE_GB = 5.
+"Default disk space (GB) to leave free beside the rewritten files in pipelined mode"
+DISK_POLL = 5.
+"Seconds between free disk space checks while waiting for space"
+
+def find_inputs(source: Union[str, Path, list]) -> list[Path]:
+    """
+    Resolve a batch source to a sorted list of input files.
+    The source can be a directory (all LAS/LAZ files directly inside it),
+    a glob pattern, a manifest file (one path per line; blank lines and
+    lines starting with ``#`` are ignored; relative paths are resolved
+    against the manifest's directory), or a list of any of these.
+
+    :param source: Directory, glob pattern, manifest file, or list thereof
+    :type source: str or pathlib.Path or list
+    :return: The input files
+    :rtype: list
+    """
+    if isinstance(source, (list, tuple)):
+        files = []
+        for s in source:
+            files += find_inputs(s)
+        return sorted(set(files))
+    p = Path(source)
+    if p.is_dir():
+        files = [f for f in p.iterdir() if f.is_file() and f.suffix.lower() in LAS_SUFFIXES]
+    elif p.is_file() and p.suffix.lower() not in LAS_SUFFIXES:
+        files = []
+        with open(p, 'r') as fr:
+            for line in fr:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    f = Path(line)
+                    files.append(f if f.is_absolute() else p.parent / f)
+    elif p.is_file():
+        files = [p]
+    else:
+        files = [Path(f) for f in glob.glob(str(source), recursive=True)]
+    return sorted(set(f.absolute() for f in files))
+
+def run_one(f: Path, kwargs: dict) -> dict:
+    """
+    Run a single :py:class:`pdgpoints.pipeline.Pipeline` without merging,
+    catching every error (including a failed lastools command) so that
+    one bad file cannot stop the batch. An interrupt (Ctrl-C) still
+    stops it.
+
+    :param f: The file to process
+    :type f: pathlib.Path
+    :param dict kwargs: Keyword arguments passed to the pipeline
+    :return: Result record with ``file``, ``ok``, ``out_dir``, ``error``, ``report``, ``entry``, and ``seconds`` keys
+    :rtype: dict
+    """
+    start = utils.timer()
+    result = {'file': str(f), 'ok': False, 'out_dir': None, 'error': None, 'report': None, 'entry': None}
+    try:
+        kwargs = dict(kwargs, merge=False)
+        p = Pipeline(f=f, **kwargs)
+        if p.report:
+            result['report'] = str(p.report_name)
+        result['out_dir'] = str(p.run())
+        result['entry'] = p.entry
+        result['ok'] = True
+    except Exception as e:
+        result['error'] = ''.join(format_exception(type(e), e, e.__traceback__)).strip()
+    result['seconds'], _ = utils.timer(start)
+    return result
+
+def run_batch(source: Union[str, Path, list],
+              workers: int=1,
+              merge: bool=True,
+              memory_gb: float=0.,
+              **kwargs) -> dict:
+    """
+    Process many input files with a pool of worker processes, then merge
+    each output directory once at the end instead of once per file.
+    Per-file failures are collected into the summary rather than aborting
+    the batch.
+
+    With a memory budget, the files are run largest first, and a file is
+    only started while the predicted peak memory of the running files
+    (see :py:mod:`pdgpoints.scheduler`) stays within the budget, so the
+    number of files running at once adapts to their size.
+
+    :param source: Directory, glob pattern, manifest file, or list thereof (see :py:func:`find_inputs`)
+    :type source: str or pathlib.Path or list
+    :param int workers: Number of files to process at once
+    :param bool merge: Whether to merge each output directory after all files are processed
+    :param float memory_gb: Memory budget in GB for the files running at once (0 to start files as workers free up)
+    :param kwargs: Keyword arguments passed to each :py:class:`pdgpoints.pipeline.Pipeline`
+    :return: Summary with ``total``, ``succeeded``, ``failed``, ``merged``, and ``results`` keys
+    :rtype: dict
+    """
+    L = getLogger(__name__)
+    batchstart = utils.timer()
+    files = find_inputs(source)
+    L.info('Found %s input files (%s workers)' % (len(files), workers))
+    results = []
+    if memory_gb:
+        model = scheduler.calibrate(sorted(set(f.parent / '3dtiles' for f in files)))
+        results = run_admitted(scheduler.plan(files, model), kwargs,
+                               workers=workers, budget=int(memory_gb * 1024**3))
+    elif workers > 1:
+        with utils.spawn_pool(workers) as ex:
+            futures = {ex.submit(run_one, f, kwargs): f for f in files}
+            for fut in as_completed(futures):
+                results.append(collect(fut, futures[fut]))
+                L.info('Finished %s of %s (%s)' % (len(results), len(files), futures[fut].name))
+    else:
+        for f in files:
+            results.append(run_one(f, kwargs))
+            L.info('Finished %s of %s (%s)' % (len(results), len(files), f.name))
+
+    failed = [r for r in results if not r['ok']]
+    for r in failed:
+        L.error('Failed to process %s:\n%s' % (r['file'], r['error']))
+
+    merged = []
+    if merge:
+        merged = merge_results(results, **merge_options(kwargs))
+    return summarize(files, results, merged, batchstart)
+
+def collect(fut, f: Path) -> dict:
+    """
+    Get the result of a :py:func:`run_one` call made in a worker process.
+
+    :param concurrent.futures.Future fut: The finished call
+    :param f: The file it processed
+    :type f: pathlib.Path
+    :return: Result record (see :py:func:`run_one`)
+    :rtype: dict
+    """
+    try:
+        return fut.result()
+    except Exception as e:
+        # the worker process itself died (e.g. killed by the OOM killer)
+        return {'file': str(f), 'ok': False, 'out_dir': None, 'error': repr(e),
+                'report': None, 'entry': None, 'seconds': None}
+
+def run_admitted(jobs: list, kwargs: dict, workers: int, budget: int) -> list[dict]:
+    """
+    Run jobs in a pool of worker processes, starting each one when
+    :py:func:`pdgpoints.scheduler.admit` finds room for it in the memory
+    budget.
+
+    :param list jobs: The jobs, largest first (see :py:func:`pdgpoints.scheduler.plan`)
+    :param dict kwargs: Keyword arguments passed to each pipeline
+    :param int workers: Most files to process at once
+    :param int budget: Memory budget in bytes
+    :return: Result records (see :py:func:`run_one`)
+    :rtype: list
+    """
+    L = getLogger(__name__)
+    pending, running, results = list(jobs), {}, []
+    L.info('Memory budget: %.1f GB for up to %s files at once' % (budget / 1024**3, workers))
+    with utils.spawn_pool(max(1, workers)) as ex:
+        while pending or running:
+            while pending and (len(running) < workers):
+                in_use = sum(j.peak_bytes for j in running.values())
+                job = scheduler.admit(pending, in_use, len(running), budget)
+                if job is None:
+                    break
+                if job.peak_bytes > budget:
+                    L.warning('%s is predicted to need %.1f GB, more than the budget; running it alone' % (job.file.name,
+                              job.peak_bytes / 1024**3))
+                pending.remove(job)
+                running[ex.submit(run_one, job.file, kwargs)] = job
+                L.info('Started %s (predicted peak %.1f GB; %.1f of %.1f GB in use)' % (job.file.name,
+                       job.peak_bytes / 1024**3, (in_use + job.peak_bytes) / 1024**3, budget / 1024**3))
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                job = running.pop(fut)
+                results.append(collect(fut, job.file))
+                L.info('Finished %s of %s (%s)' % (len(results), len(jobs), job.file.name))
+    return results
+
+def merge_options(kwargs: dict) -> dict:
+    """
+    Get the options of :py:func:`pdgpoints.py3dtiles_iface.merge` from
+    pipeline keyword arguments.
+
+    :param dict kwargs: Keyword arguments for each :py:class:`pdgpoints.pipeline.Pipeline`
+    :return: The ``incremental``, ``fan_out``, ``workers``, ``precompress``, and ``precompress_workers`` options
+    :rtype: dict
+    """
+    return dict(incremental=kwargs.get('incremental_merge', False),
+                fan_out=kwargs.get('merge_fan_out', 0),
+                workers=kwargs.get('merge_workers', 1),
+                precompress=precompression.available(kwargs.get('precompress') or []),
+                precompress_workers=kwargs.get('precompress_workers', precompression.DEFAULT_WORKERS))
+
+def merge_results(results: list[dict],
+                  incremental: bool=False,
+                  fan_out: int=0,
+                  workers: int=1,
+                  precompress: Union[list[str], None]=None,
+                  precompress_workers: int=precompression.DEFAULT_WORKERS) -> list[str]:
+    """
+    Merge each output directory of a set of successful results once.
+
+    :param list results: Result records (see :py:func:`run_one`)
+    :param bool incremental: Whether to add the new datasets to the existing roots instead of rebuilding them
+    :param int fan_out: Largest number of children of a tree node (0 for flat roots; see :py:func:`pdgpoints.mergetree.write_tree`)
+    :param int workers: Number of processes reading dataset tilesets and building tree nodes
+    :param precompress: Encodings to write compressed copies of the merged root files in (see :py:func:`pdgpoints.precompress.precompress_root`)
+    :type precompress: list or None
+    :param int precompress_workers: Number of threads compressing files
+    :return: The merged output directories
+    :rtype: list
+    """
+    out_dirs = sorted(set(r['out_dir'] for r in results if r['ok']))
+    for d in out_dirs:
+        py3dtiles_iface.merge(dir=Path(d),
+                              overwrite=True,
+                              incremental=incremental,
+                              new=[Path(r['out_dir']) / Path(r['file']).stem / 'tileset.json'
+                                   for r in results if r['ok'] and r['out_dir'] == d],
+                              fan_out=fan_out,
+                              workers=workers,
+                              precompress=precompress,
+                              precompress_workers=precompress_workers)
+    return out_dirs
+
+def summarize(files: list[Path], results: list[dict], merged: list[str], batchstart: float) -> dict:
+    """
+    Build and log the batch summary.
+
+    :param list files: The input files
+    :param list results: Result records (see :py:func:`run_one`)
+    :param list merged: The merged output directories
+    :param float batchstart: Start time of the batch (from :py:func:`pdgpoints.utils.timer`)
+    :return: Summary with ``total``, ``succeeded``, ``failed``, ``merged``, and ``results`` keys
+    :rtype: dict
+    """
+    L = getLogger(__name__)
+    failed = [r for r in results if not r['ok']]
+    summary = {
+        'total': len(files),
+        'succeeded': len(results) - len(failed),
+        'failed': len(failed),
+        'merged': sorted(set(merged)),
+        'results': sorted(results, key=lambda r: r['file']),
+    }
+    s, m = utils.timer(batchstart)
+    L.info('Batch finished: %s succeeded, %s failed (%.1f sec / %.1f min)' % (summary['succeeded'],
+                                                                           summary['failed'],
+                                                                           s, m))
+    return summary
+
+def rewrite_bytes(f: Path) -> int:
+    """
+    Estimate the size of the uncompressed LAS file the rewrite stage
+    writes for an input (with room for added RGB values).
+
+    :param f: The input file
+    :type f: pathlib.Path
+    :return: Estimated size in bytes
+    :rtype: int
+    """
+    try:
+        h = lasheader.read_header(f)
+        return h.offset_to_points + h.point_count * (h.point_record_length + 6)
+    except Exception:
+        return Path(f).stat().st_size * 10
+
+def run_pipelined(source: Union[str, Path, list],
+                  queue_depth: int=DEFAULT_QUEUE_DEPTH,
+                  prep_workers: int=1,
+                  min_free_gb: float=DEFAULT_MIN_FREE_GB,
+                  merge: bool=True,
+                  merge_every: int=0,
+                  **kwargs) -> dict:
+    """
+    Process many input files with their stages overlapped: while one file
+    is being tiled (CPU-heavy), the next ones go through the WKT, info,
+    mean/geoid, and rewrite stages (I/O-heavy) in ``prep_workers``
+    background threads.
+
+    Prepared files wait in a queue of at most ``queue_depth`` files; when
+    it is full, preparation pauses until tiling catches up. Preparation
+    also waits while starting another rewrite would leave less than
+    ``min_free_gb`` free on the disk holding the rewrite directory,
+    unless nothing is waiting to be tiled (so that one large file can
+    always proceed). Output directories are merged every ``merge_every``
+    tiled files (0 to merge once at the end).
+
+    Stage metrics in the run reports are measured per process, so CPU
+    and I/O figures of overlapping stages include each other.
+
+    :param source: Directory, glob pattern, manifest file, or list thereof (see :py:func:`find_inputs`)
+    :type source: str or pathlib.Path or list
+    :param int queue_depth: Number of prepared files allowed to wait for tiling
+    :param int prep_workers: Number of files to prepare at once
+    :param float min_free_gb: Disk space (GB) to leave free beside the rewritten files
+    :param bool merge: Whether to merge the output directories
+    :param int merge_every: Merge after this many files are tiled (0 to merge once at the end)
+    :param kwargs: Keyword arguments passed to each :py:class:`pdgpoints.pipeline.Pipeline`
+    :return: Summary with ``total``, ``succeeded``, ``failed``, ``merged``, and ``results`` keys
+    :rtype: dict
+    """
+    L = getLogger(__name__)
+    batchstart = utils.timer()
+    files = find_inputs(source)
+    L.info('Found %s input files (pipelined, queue depth %s, %s prep workers)' % (len(files), queue_depth, prep_workers))
+    kwargs = dict(kwargs, merge=False)
+    todo = queue.Queue()
+    for f in files:
+        todo.put(f)
+    ready = queue.Queue(maxsize=max(1, queue_depth))
+    space = threading.Condition()
+    # files prepared or being prepared but not yet tiled, and the space
+    # that rewrites still in progress are about to take up
+    in_flight, reserved = [0], [0]
+    min_free = min_free_gb * 1024**3
+
+    def wait_for_space(f: Path) -> int:
+        need = rewrite_bytes(f)
+        with space:
+            while in_flight[0] > 0:
+                free = shutil.disk_usage(f.parent).free - reserved[0]
+                if free - need >= min_free:
+                    break
+                L.info('Waiting for disk space to rewrite %s (%.1f GB free, %.1f GB needed)' % (f.name,
+                                                                                                free / 1024**3,
+                                                                                                need / 1024**3))
+                space.wait(timeout=DISK_POLL)
+            in_flight[0] += 1
+            reserved[0] += need
+        return need
+
+    def prepare():
+        while True:
+            try:
+                f = todo.get_nowait()
+            except queue.Empty:
+                return
+            need = wait_for_space(f)
+            start = utils.timer()
+            p, todo_finish, error = None, False, None
+            try:
+                p = Pipeline(f=f, **kwargs)
+                todo_finish = p.prepare()
+            except Exception as e:
+                error = ''.join(format_exception(type(e), e, e.__traceback__)).strip()
+            with space:
+                reserved[0] -= need
+            ready.put((f, p, todo_finish, error, start))
+
+    threads = [threading.Thread(target=prepare, daemon=True) for i in range(max(1, prep_workers))]
+    for t in threads:
+        t.start()
+
+    results, pending, merged = [], [], []
+    for i in range(len(files)):
+        f, p, todo_finish, error, start = ready.get()
+        result = {'file': str(f), 'ok': False, 'out_dir': None, 'error': error,
+                  'report': str(p.report_name) if (p is not None) and p.report else None}
+        if error is None:
+            try:
+                result['out_dir'] = str(p.finish() if todo_finish else p.out_dir)
+                result['ok'] = True
+            except Exception as e:
+                result['error'] = ''.join(format_exception(type(e), e, e.__traceback__)).strip()
+        result['entry'] = getattr(p, 'entry', None)
+        with space:
+            in_flight[0] -= 1
+            space.notify_all()
+        result['seconds'], _ = utils.timer(start)
+        results.append(result)
+        pending.append(result)
+        L.info('Finished %s of %s (%s)' % (len(results), len(files), f.name))
+        if result['error']:
+            L.error('Failed to process %s:\n%s' % (result['file'], result['error']))
+        if merge and merge_every and (len([r for r in pending if r['ok']]) >= merge_every):
+            merged += merge_results(pending, **merge_options(kwargs))
+            pending = []
+
+    for t in threads:
+        t.join()
+    if merge:
+        if merge_every:
+            merged += merge_results(pending, **merge_options(kwargs))
+        else:
+            merged = merge_results(results, **merge_options(kwargs))
+    return summarize(files, results, merged, batchstart)
@@ -0,0 +1,470 @@
+import json
+import sys
+import shutil
+import subprocess
+import platform
+import statistics
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Tuple, Union
+from logging import getLogger
+
+from . import utils
+from . import crs_registry
+from ._version import __version__
+from .defs import CACHE_DIR
+from .pipeline import Pipeline
+
+BENCH_DIR = CACHE_DIR / 'bench'
+"Default directory for synthetic files and benchmark runs"
+
+DEFAULT_SIZES = [100_000, 1_000_000, 5_000_000]
+"Default number of points in each synthetic file"
+DEFAULT_CRS = 'EPSG:32618'
+"Default CRS of synthetic files (horizontal only, so no geoid lookup is triggered)"
+DEFAULT_EXTENT = 1000.
+"Default width and height of synthetic files in CRS units"
+DEFAULT_SEED = 42
+"Default random seed, so that the same parameters always give the same file"
+DEFAULT_TOLERANCE = 0.2
+"Default fraction by which a stage may be slower than the baseline before it counts as a regression"
+DEFAULT_MIN_SECONDS = 0.5
+"Default number of seconds a stage must slow down by to count as a regression (ignores noise in short stages)"
+GENERATE_CHUNK = 1_000_000
+"Number of points generated and written per iteration"
+IMPORT_MODULES = ['pdgpoints', 'pdgpoints.cli', 'pdgpoints.batch', 'pdgpoints.lasheader']
+"Modules whose import time is benchmarked (what the command line tools and batch drivers load before doing any work)"
+HEAVY_MODULES = ['numpy', 'pandas', 'laspy', 'pyproj', 'pyegt.height', 'py3dtiles.convert', 'py3dtiles.merger']
+"Dependencies that only the processing stages should load; importing any of them at startup counts as a regression"
+DEFAULT_IMPORT_TOLERANCE = 0.5
+"Default fraction by which an import may be slower than the baseline before it counts as a regression"
+DEFAULT_IMPORT_MIN_SECONDS = 0.05
+"Default number of seconds an import must slow down by to count as a regression"
+IMPORT_CODE = """
+import sys, json, time
+sys.stderr.write('%s\\n')
+sys.stderr.flush()
+start = time.perf_counter()
+import %s
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'heavy': [m for m in %r if m in sys.modules]}))
+"""
+"Code run in a fresh interpreter to time an import (marker, module name, and heavy module list filled in)"
+IMPORT_MARKER = '-- pdgpoints import --'
+"Line written to standard error just before the timed import, so that interpreter startup is left out of the list of slowest modules"
+
+LAYOUTS = {
+    'intensity': ('1.2', 1),
+    'rgb': ('1.2', 3),
+    'intensity14': ('1.4', 6),
+    'rgb14': ('1.4', 7),
+}
+"Synthetic file layouts: LAS version and point format (GeoTIFF keys below 1.4, WKT from 1.4)"
+
+def synth_name(points: int,
+               layout: str='intensity',
+               crs: str=DEFAULT_CRS,
+               seed: int=DEFAULT_SEED,
+               ext: str='.laz') -> str:
+    """
+    Get the file name of a synthetic point cloud, which encodes every
+    parameter so that files can be reused between runs.
+
+    :param int points: Number of points
+    :param str layout: One of :py:data:`LAYOUTS`
+    :param str crs: CRS of the file
+    :param int seed: Random seed
+    :param str ext: ``'.las'`` or ``'.laz'``
+    :return: The file name
+    :rtype: str
+    """
+    c = crs_registry.normalize(crs).replace(':', '').replace('+', '-')
+    return 'synth_%s_%s_%s_%s%s' % (points, layout, c, seed, ext)
+
+def crs_center(crs: str) -> Tuple[float, float]:
+    """
+    Get the center of a CRS's area of use, in the CRS's own horizontal
+    coordinates.
+
+    :param str crs: The CRS
+    :return: X and Y of the center
+    :rtype: float, float
+    """
+    c, epsg_h, epsg_v, h_name, v_name = crs_registry.split_crs(crs)
+    aou = c.area_of_use
+    if aou is None:
+        return 0., 0.
+    lon = (aou.west + aou.east) / 2
+    lat = (aou.south + aou.north) / 2
+    t = crs_registry.get_transformer(4326, epsg_h or c, always_xy=True)
+    x, y = t.transform(lon, lat)
+    return float(x), float(y)
+
+def synth_las(f: Path,
+              points: int,
+              layout: str='intensity',
+              crs: str=DEFAULT_CRS,
+              extent: float=DEFAULT_EXTENT,
+              seed: int=DEFAULT_SEED,
+              chunk_size: int=GENERATE_CHUNK) -> Path:
+    """
+    Write a reproducible synthetic point cloud: a smooth, noisy terrain
+    surface with intensity, classification, and (for RGB layouts) color
+    values. Points are generated in chunks, so files larger than memory
+    can be written. A ``.laz`` suffix gives a compressed file.
+
+    :param f: The file to write
+    :type f: str or pathlib.Path
+    :param int points: Number of points
+    :param str layout: One of :py:data:`LAYOUTS`
+    :param str crs: CRS of the file (EPSG code, compound ``'EPSG:XXXX+YYYY'``, or WKT)
+    :param float extent: Width and height of the file in CRS units
+    :param int seed: Random seed
+    :param int chunk_size: Number of points to generate per iteration
+    :return: The file written
+    :rtype: pathlib.Path
+    """
+    import numpy as np
+    import laspy
+    L = getLogger(__name__)
+    if layout not in LAYOUTS:
+        raise ValueError('Unknown layout "%s" (choose from %s)' % (layout, list(LAYOUTS)))
+    synthstart = utils.timer()
+    f = Path(f)
+    f.parent.mkdir(parents=True, exist_ok=True)
+    version, point_format = LAYOUTS[layout]
+    cx, cy = crs_center(crs)
+    header = laspy.LasHeader(version=version, point_format=point_format)
+    header.scales = np.array([0.01, 0.01, 0.01])
+    header.offsets = np.array([np.floor(cx), np.floor(cy), 0.])
+    header.add_crs(crs_registry.get_crs(crs))
+    has_rgb = 'red' in header.point_format.dimension_names
+    L.info('Generating %s points (%s, %s) in %s' % (points, layout, crs, f))
+    with utils.atomic_path(f) as tmp:
+        with laspy.open(tmp, mode='w', header=header) as writer:
+            for i, start in enumerate(range(0, points, chunk_size)):
+                n = min(chunk_size, points - start)
+                rng = np.random.default_rng([seed, i])
+                rec = laspy.ScaleAwarePointRecord.zeros(n, header=header)
+                x = rng.uniform(-extent / 2, extent / 2, n)
+                y = rng.uniform(-extent / 2, extent / 2, n)
+                z = (20 * np.sin(x / extent * 2 * np.pi) * np.cos(y / extent * 3 * np.pi)
+                     + 100 + rng.normal(0, 0.3, n))
+                rec.x = cx + x
+                rec.y = cy + y
+                rec.z = z
+                rec.intensity = np.clip(rng.gamma(2., 40., n), 0, 65535).astype(np.uint16)
+                rec.classification = np.where(rng.random(n) < 0.6, 2, 5).astype(np.uint8)
+                if has_rgb:
+                    shade = np.clip((z - 80) / 40 * 65535, 0, 65535).astype(np.uint16)
+                    rec.red = shade
+                    rec.green = 65535 - shade
+                    rec.blue = (shade // 2).astype(np.uint16)
+                writer.write_points(rec)
+    L.info('Finished generating (%.1f sec / %.1f min)' % utils.timer(synthstart))
+    return f
+
+def make_dataset(sizes: list=DEFAULT_SIZES,
+                 layout: str='intensity',
+                 crs: str=DEFAULT_CRS,
+                 seed: int=DEFAULT_SEED,
+                 ext: str='.laz',
+                 data_dir: Path=BENCH_DIR / 'data') -> list[Path]:
+    """
+    Generate (or reuse previously generated) synthetic files of several sizes.
+
+    :param list sizes: Number of points in each file
+    :param str layout: One of :py:data:`LAYOUTS`
+    :param str crs: CRS of the files
+    :param int seed: Random seed
+    :param str ext: ``'.las'`` or ``'.laz'``
+    :param data_dir: Directory to keep the files in
+    :type data_dir: pathlib.Path
+    :return: The files, in the same order as ``sizes``
+    :rtype: list
+    """
+    files = []
+    for n in sizes:
+        f = Path(data_dir) / synth_name(n, layout=layout, crs=crs, seed=seed, ext=ext)
+        if not f.is_file():
+            synth_las(f, points=n, layout=layout, crs=crs, seed=seed)
+        files.append(f)
+    return files
+
+def run_case(f: Path,
+             work_dir: Path,
+             **kwargs) -> dict:
+    """
+    Run one file through a fresh :py:class:`pdgpoints.pipeline.Pipeline`
+    and collect its per-stage metrics.
+    The file is copied into an empty working directory first so that every
+    repeat starts from the same state.
+
+    :param f: The input file
+    :type f: pathlib.Path
+    :param work_dir: Directory to run in (emptied first)
+    :type work_dir: pathlib.Path
+    :param kwargs: Keyword arguments passed to the pipeline
+    :return: Stage records (see :py:class:`pdgpoints.metrics.Metrics`) and run total
+    :rtype: dict
+    """
+    work_dir = Path(work_dir)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    work_dir.mkdir(parents=True)
+    fc = work_dir / Path(f).name
+    shutil.copyfile(f, fc)
+    p = Pipeline(f=fc, **dict(kwargs, report=False))
+    p.run()
+    return {'stages': p.metrics.stages, 'total': p.metrics.total()}
+
+def summarize(runs: list[dict]) -> dict:
+    """
+    Reduce repeated runs of one case to median stage times (and the
+    largest peak RSS seen).
+
+    :param list runs: Outputs of :py:func:`run_case`
+    :return: Per-stage medians and median total wall time
+    :rtype: dict
+    """
+    stages = {}
+    for name in runs[0]['stages']:
+        recs = [r['stages'][name] for r in runs if name in r['stages']]
+        d = {
+            'wall_s': statistics.median(r['wall_s'] for r in recs),
+            'cpu_s': statistics.median(r['cpu_s'] for r in recs),
+            'peak_rss_bytes': max(r['peak_rss_bytes'] for r in recs),
+            'peak_rss_children_bytes': max(r['peak_rss_children_bytes'] for r in recs),
+        }
+        if 'points' in recs[0]:
+            d['points_per_s'] = recs[0]['points'] / d['wall_s'] if d['wall_s'] > 0 else None
+        stages[name] = d
+    return {'stages': stages,
+            'wall_s': statistics.median(r['total']['wall_s'] for r in runs)}
+
+def scaling(cases: dict) -> dict:
+    """
+    Fit how each stage's wall time grows with point count. An exponent of
+    1 is linear scaling; larger values mean throughput falls as files grow.
+
+    :param dict cases: Case results keyed by case name, each with ``points`` and ``stages``
+    :return: For each stage, the point counts, wall times, throughput, and log-log slope
+    :rtype: dict
+    """
+    import numpy as np
+    curves = {}
+    ordered = sorted(cases.values(), key=lambda c: c['points'])
+    names = []
+    for c in ordered:
+        names += [n for n in c['stages'] if n not in names]
+    for name in names:
+        pts = [c['points'] for c in ordered if name in c['stages']]
+        wall = [c['stages'][name]['wall_s'] for c in ordered if name in c['stages']]
+        curve = {'points': pts,
+                 'wall_s': wall,
+                 'points_per_s': [p / w if w > 0 else None for p, w in zip(pts, wall)],
+                 'exponent': None}
+        if (len(set(pts)) > 1) and all(w > 0 for w in wall):
+            curve['exponent'] = float(np.polyfit(np.log(pts), np.log(wall), 1)[0])
+        curves[name] = curve
+    return curves
+
+def run_bench(sizes: list=DEFAULT_SIZES,
+              layout: str='intensity',
+              crs: str=DEFAULT_CRS,
+              seed: int=DEFAULT_SEED,
+              ext: str='.laz',
+              repeat: int=3,
+              bench_dir: Path=BENCH_DIR,
+              **kwargs) -> dict:
+    """
+    Benchmark the pipeline across synthetic files of several sizes.
+
+    :param list sizes: Number of points in each file
+    :param str layout: One of :py:data:`LAYOUTS`
+    :param str crs: CRS of the files (a compound CRS will trigger a geoid lookup)
+    :param int seed: Random seed
+    :param str ext: ``'.las'`` or ``'.laz'``
+    :param int repeat: Number of times to run each size (medians are reported)
+    :param bench_dir: Directory for synthetic files and runs
+    :type bench_dir: pathlib.Path
+    :param kwargs: Keyword arguments passed to each :py:class:`pdgpoints.pipeline.Pipeline`
+    :return: Benchmark results with ``cases`` and ``scaling`` keys
+    :rtype: dict
+    """
+    L = getLogger(__name__)
+    bench_dir = Path(bench_dir)
+    files = make_dataset(sizes, layout=layout, crs=crs, seed=seed, ext=ext,
+                         data_dir=bench_dir / 'data')
+    cases = {}
+    for n, f in zip(sizes, files):
+        runs = []
+        for i in range(repeat):
+            L.info('Benchmarking %s (run %s of %s)' % (f.name, i + 1, repeat))
+            runs.append(run_case(f, work_dir=bench_dir / 'run', **kwargs))
+        case = summarize(runs)
+        case.update({'points': n, 'layout': layout, 'crs': crs, 'bytes': f.stat().st_size})
+        cases[f.stem] = case
+    shutil.rmtree(bench_dir / 'run', ignore_errors=True)
+    return {
+        'version': __version__,
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'started': datetime.now(timezone.utc).isoformat(),
+        'repeat': repeat,
+        'parameters': {k: str(v) if isinstance(v, Path) else v for k, v in kwargs.items()},
+        'cases': cases,
+        'scaling': scaling(cases),
+    }
+
+def compare(results: dict,
+            baseline: dict,
+            tolerance: float=DEFAULT_TOLERANCE,
+            min_seconds: float=DEFAULT_MIN_SECONDS) -> list[dict]:
+    """
+    Compare benchmark results with a stored baseline, stage by stage, for
+    every case present in both.
+
+    :param dict results: Output of :py:func:`run_bench`
+    :param dict baseline: An earlier output of :py:func:`run_bench`
+    :param float tolerance: Fraction by which a stage may be slower before it counts as a regression
+    :param float min_seconds: Smallest slowdown in seconds that counts as a regression
+    :return: One record per compared stage with ``case``, ``stage``, ``baseline_s``, ``current_s``, ``ratio``, and ``regression`` keys
+    :rtype: list
+    """
+    L = getLogger(__name__)
+    out = []
+    for case, c in results['cases'].items():
+        b = baseline.get('cases', {}).get(case)
+        if b is None:
+            L.info('No baseline for %s' % (case))
+            continue
+        for stage, rec in c['stages'].items():
+            if stage not in b['stages']:
+                continue
+            bs, cs = b['stages'][stage]['wall_s'], rec['wall_s']
+            ratio = cs / bs if bs > 0 else None
+            regression = (cs > bs * (1 + tolerance)) and (cs - bs > min_seconds)
+            out.append({'case': case, 'stage': stage, 'baseline_s': bs, 'current_s': cs,
+                        'ratio': ratio, 'regression': regression})
+            if regression:
+                L.warning('Regression in %s %s: %.2f s -> %.2f s (x%.2f)' % (case, stage, bs, cs, ratio))
+    return out
+
+def load(f: Union[str, Path]) -> dict:
+    """
+    Read benchmark results (e.g. a baseline) from JSON.
+
+    :param f: The file to read
+    :type f: str or pathlib.Path
+    :return: The results
+    :rtype: dict
+    """
+    with open(f, 'r') as fr:
+        return json.load(fr)
+
+def save(results: dict, f: Union[str, Path]) -> Path:
+    """
+    Write benchmark results to JSON (atomically, via a temporary file).
+
+    :param dict results: The results
+    :param f: The file to write
+    :type f: str or pathlib.Path
+    :return: The file written
+    :rtype: pathlib.Path
+    """
+    f = Path(f)
+    f.parent.mkdir(parents=True, exist_ok=True)
+    utils.write_json_atomic(f, results, indent=2)
+    return f
+
+def import_time(module: str, repeat: int=5, top: int=5) -> dict:
+    """
+    Time the import of a module in fresh interpreters (run with
+    ``python -X importtime``, so that the slowest modules it pulls in can
+    be listed), and check which of :py:data:`HEAVY_MODULES` it loads.
+
+    :param str module: The module to import
+    :param int repeat: Number of interpreters to time (the median is reported)
+    :param int top: Number of the slowest imported modules to list
+    :return: Median and all seconds, the heavy modules loaded, and the slowest imported modules (cumulative microseconds)
+    :rtype: dict
+    """
+    seconds, heavy, slowest = [], [], {}
+    for i in range(repeat):
+        p = subprocess.run([sys.executable, '-X', 'importtime', '-c', IMPORT_CODE % (IMPORT_MARKER, module, HEAVY_MODULES)],
+                           capture_output=True, text=True)
+        if p.returncode != 0:
+            raise RuntimeError('Could not import %s:\n%s' % (module, p.stderr.strip()))
+        out = json.loads(p.stdout.strip().splitlines()[-1])
+        seconds.append(out['seconds'])
+        heavy = out['heavy']
+        # lines look like "import time:  self [us] | cumulative | imported package"
+        lines = p.stderr.splitlines()
+        start = lines.index(IMPORT_MARKER) + 1 if IMPORT_MARKER in lines else 0
+        for line in lines[start:]:
+            parts = line.split('|')
+            if line.startswith('import time:') and (len(parts) == 3) and parts[1].strip().isdigit():
+                name = parts[2].strip()
+                if name != module:
+                    slowest[name] = max(slowest.get(name, 0), int(parts[1]))
+    return {
+        'seconds': statistics.median(seconds),
+        'runs': seconds,
+        'heavy': heavy,
+        'slowest': dict(sorted(slowest.items(), key=lambda i: -i[1])[:top]),
+    }
+
+def run_import_bench(modules: list=IMPORT_MODULES, repeat: int=5) -> dict:
+    """
+    Benchmark the import time of the package's entry points.
+
+    :param list modules: The modules to import
+    :param int repeat: Number of interpreters to time per module
+    :return: Benchmark results with an ``imports`` key
+    :rtype: dict
+    """
+    L = getLogger(__name__)
+    imports = {}
+    for m in modules:
+        imports[m] = import_time(m, repeat=repeat)
+        L.info('import %s: %.3f s%s' % (m, imports[m]['seconds'],
+                                       ' (loads %s)' % (', '.join(imports[m]['heavy'])) if imports[m]['heavy'] else ''))
+    return {
+        'version': __version__,
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'started': datetime.now(timezone.utc).isoformat(),
+        'repeat': repeat,
+        'imports': imports,
+    }
+
+def compare_imports(results: dict,
+                    baseline: Union[dict, None]=None,
+                    tolerance: float=DEFAULT_IMPORT_TOLERANCE,
+                    min_seconds: float=DEFAULT_IMPORT_MIN_SECONDS) -> list[dict]:
+    """
+    Check import benchmark results for regressions: an import that loads
+    any of :py:data:`HEAVY_MODULES`, or (given a baseline) one that got
+    slower.
+
+    :param dict results: Output of :py:func:`run_import_bench`
+    :param baseline: An earlier output of :py:func:`run_import_bench`
+    :type baseline: dict or None
+    :param float tolerance: Fraction by which an import may be slower before it counts as a regression
+    :param float min_seconds: Smallest slowdown in seconds that counts as a regression
+    :return: One record per module with ``module``, ``baseline_s``, ``current_s``, ``heavy``, and ``regression`` keys
+    :rtype: list
+    """
+    L = getLogger(__name__)
+    out = []
+    for m, rec in results['imports'].items():
+        b = (baseline or {}).get('imports', {}).get(m)
+        bs, cs = (b['seconds'] if b else None), rec['seconds']
+        slower = (bs is not None) and (cs > bs * (1 + tolerance)) and (cs - bs > min_seconds)
+        out.append({'module': m, 'baseline_s': bs, 'current_s': cs, 'heavy': rec['heavy'],
+                    'regression': slower or bool(rec['heavy'])})
+        if rec['heavy']:
+            L.warning('Importing %s loads %s' % (m, ', '.join(rec['heavy'])))
+        if slower:
+            L.warning('Regression in import %s: %.3f s -> %.3f s' % (m, bs, cs))
+    return out
@@ -0,0 +1,322 @@
+import glob
+import json
+import time
+import sqlite3
+from pathlib import Path
+from typing import Tuple, Union
+from logging import getLogger
+
+from . import crs_registry
+from . import py3dtiles_iface
+
+CATALOG_NAME = 'catalog.sqlite'
+"Name of the catalogue file in an output (``3dtiles``) directory"
+GEOGRAPHIC_CRS = 'EPSG:4326'
+"CRS of the catalogued bounding boxes (longitude, latitude)"
+TILESET_CRS = 'EPSG:4978'
+"CRS of the tilesets' bounding volumes (Earth-centered, Earth-fixed)"
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS datasets (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    uri TEXT NOT NULL,
+    source TEXT,
+    source_hash TEXT,
+    crs TEXT,
+    points INTEGER,
+    params TEXT,
+    child TEXT NOT NULL,
+    west REAL NOT NULL,
+    south REAL NOT NULL,
+    east REAL NOT NULL,
+    north REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS datasets_source_hash ON datasets (source_hash);
+CREATE VIRTUAL TABLE IF NOT EXISTS datasets_bbox USING rtree (id, west, east, south, north);
+'''
+
+COLUMNS = ['name', 'uri', 'source', 'source_hash', 'crs', 'points', 'params',
+           'child', 'west', 'south', 'east', 'north', 'updated']
+"Columns of a catalogue entry, in the order they are selected"
+
+def box_bounds(child: dict) -> Tuple[float, float, float, float]:
+    """
+    Get the longitude/latitude bounds of a tileset entry's (Earth-centered)
+    bounding box from its eight corners. The box is oriented, so the
+    result can be somewhat larger than the bounds of the points.
+
+    :param dict child: A tileset entry (see :py:func:`pdgpoints.py3dtiles_iface.child_tile`)
+    :return: West, south, east, and north bounds in degrees
+    :rtype: tuple
+    """
+    import numpy as np
+    from py3dtiles.tileset.bounding_volume_box import BoundingVolumeBox
+    corners = np.array(BoundingVolumeBox.from_dict(child['boundingVolume']).get_corners(), dtype=np.float64)
+    t = crs_registry.get_transformer(TILESET_CRS, GEOGRAPHIC_CRS, always_xy=True)
+    lon, lat, _ = t.transform(corners[:, 0], corners[:, 1], corners[:, 2])
+    return float(min(lon)), float(min(lat)), float(max(lon)), float(max(lat))
+
+def to_geographic(bbox: Tuple[float, float, float, float],
+                  crs: Union[str, int]) -> Tuple[float, float, float, float]:
+    """
+    Convert a bounding box to longitude/latitude bounds, following the
+    edges so that curved edges in the other CRS are still covered.
+
+    :param tuple bbox: West, south, east, and north bounds (min x, min y, max x, max y)
+    :param crs: The CRS of ``bbox``
+    :type crs: str or int
+    :return: West, south, east, and north bounds in degrees
+    :rtype: tuple
+    """
+    if crs_registry.normalize(crs) == GEOGRAPHIC_CRS:
+        return tuple(float(v) for v in bbox)
+    t = crs_registry.get_transformer(crs, GEOGRAPHIC_CRS, always_xy=True)
+    return tuple(float(v) for v in t.transform_bounds(*bbox, densify_pts=21))
+
+class Catalog():
+    """
+    Catalogue of the tilesets in an output directory: for each dataset,
+    the input file it came from (and a hash of it), its longitude/latitude
+    bounds, CRS, point count, processing parameters, and the entry that
+    references it from the merged root tileset. Bounds are kept in an
+    SQLite R-tree, so bounding box queries do not read any tileset.
+
+    Entries are added by :py:class:`pdgpoints.pipeline.Pipeline` as each
+    dataset is tiled, and :py:func:`pdgpoints.py3dtiles_iface.merge` takes
+    its list of datasets and their entries from the catalogue instead of
+    reading every ``tileset.json``. A new catalogue in a directory that
+    already holds datasets starts with them (see :py:meth:`sync`).
+
+    :param dir: The output directory the catalogue lives in (and its tileset URIs are relative to)
+    :type dir: str or pathlib.Path
+    """
+    def __init__(self, dir: Union[str, Path]):
+        self.L = getLogger(__name__)
+        self.dir = Path(dir).absolute()
+        self.f = self.dir / CATALOG_NAME
+        self.dir.mkdir(parents=True, exist_ok=True)
+        created = not self.f.is_file()
+        with self.connect() as con:
+            con.executescript(SCHEMA)
+        if created:
+            # datasets tiled before the catalogue existed would otherwise
+            # be left out of every merge
+            self.sync()
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Open a connection to the catalogue database. Output directories are
+        often on network filesystems, where SQLite's write-ahead log does
+        not work, so the default rollback journal is kept.
+
+        :return: The connection
+        :rtype: sqlite3.Connection
+        """
+        return sqlite3.connect(self.f, timeout=60)
+
+    def _rows(self, where: str='', args: tuple=()) -> list[dict]:
+        with self.connect() as con:
+            rows = con.execute('SELECT %s FROM datasets %s ORDER BY name' % (', '.join(COLUMNS), where),
+                               args).fetchall()
+        entries = []
+        for row in rows:
+            e = dict(zip(COLUMNS, row))
+            e['params'] = json.loads(e['params']) if e['params'] else None
+            e['child'] = json.loads(e['child'])
+            entries.append(e)
+        return entries
+
+    def add(self,
+            tileset: Path,
+            source: Union[Path, None]=None,
+            source_hash: Union[str, None]=None,
+            crs: Union[str, int, None]=None,
+            bounds: Union[Tuple[float, float, float, float], None]=None,
+            points: Union[int, None]=None,
+            params: Union[dict, None]=None,
+            child: Union[dict, None]=None) -> dict:
+        """
+        Add a dataset, or replace the entry of one with the same name
+        (its subdirectory). The tileset is read once, to build the entry
+        that references it from the merged root.
+
+        :param tileset: The dataset's ``tileset.json``
+        :type tileset: pathlib.Path
+        :param source: The input file the dataset was made from
+        :type source: pathlib.Path or None
+        :param source_hash: Content hash of the input (see :py:func:`pdgpoints.checkpoint.fingerprint`)
+        :type source_hash: str or None
+        :param crs: CRS of the input points
+        :type crs: str or int or None
+        :param bounds: Min x, min y, max x, max y of the input points in ``crs`` (default: from the tileset's bounding box)
+        :type bounds: tuple or None
+        :param points: Number of points
+        :type points: int or None
+        :param params: The processing parameters
+        :type params: dict or None
+        :param child: The root tileset entry, if already built (see :py:func:`pdgpoints.py3dtiles_iface.child_tile`)
+        :type child: dict or None
+        :return: The catalogue entry
+        :rtype: dict
+        """
+        tileset = Path(tileset).absolute()
+        child = child or py3dtiles_iface.child_tile(tileset, self.dir)
+        if (bounds is not None) and (crs is not None):
+            west, south, east, north = to_geographic(bounds, crs)
+        else:
+            west, south, east, north = box_bounds(child)
+        name = tileset.parent.name
+        row = (name, child['content']['uri'], str(source) if source else None, source_hash,
+               str(crs) if crs is not None else None, points,
+               json.dumps(params, default=str) if params is not None else None,
+               json.dumps(child), west, south, east, north, time.time())
+        with self.connect() as con:
+            old = con.execute('SELECT id FROM datasets WHERE name=?', (name,)).fetchone()
+            if old:
+                con.execute('DELETE FROM datasets_bbox WHERE id=?', old)
+                con.execute('DELETE FROM datasets WHERE id=?', old)
+            cur = con.execute('INSERT INTO datasets (%s) VALUES (%s)' % (', '.join(COLUMNS),
+                                                                         ', '.join('?' * len(COLUMNS))), row)
+            con.execute('INSERT INTO datasets_bbox VALUES (?, ?, ?, ?, ?)',
+                        (cur.lastrowid, west, east, south, north))
+        self.L.info('Catalogued %s (%.5f, %.5f, %.5f, %.5f)' % (name, west, south, east, north))
+        return dict(zip(COLUMNS, row), params=params, child=child)
+
+    def remove(self, name: str) -> bool:
+        """
+        Remove a dataset from the catalogue (its files are left alone).
+
+        :param str name: The dataset name (its subdirectory)
+        :return: Whether there was an entry to remove
+        :rtype: bool
+        """
+        with self.connect() as con:
+            old = con.execute('SELECT id FROM datasets WHERE name=?', (name,)).fetchone()
+            if old:
+                con.execute('DELETE FROM datasets_bbox WHERE id=?', old)
+                con.execute('DELETE FROM datasets WHERE id=?', old)
+        return bool(old)
+
+    def get(self, name: str) -> Union[dict, None]:
+        """
+        Get a dataset's entry.
+
+        :param str name: The dataset name (its subdirectory)
+        :return: The entry, or None if the dataset is not catalogued
+        :rtype: dict or None
+        """
+        rows = self._rows('WHERE name=?', (name,))
+        return rows[0] if rows else None
+
+    def datasets(self) -> list[dict]:
+        """
+        Get every entry, by name.
+
+        :return: The entries
+        :rtype: list
+        """
+        return self._rows()
+
+    def intersects(self,
+                   bbox: Tuple[float, float, float, float],
+                   crs: Union[str, int]=GEOGRAPHIC_CRS) -> list[dict]:
+        """
+        Find the datasets whose bounds intersect a bounding box.
+
+        :param tuple bbox: West, south, east, and north bounds (min x, min y, max x, max y)
+        :param crs: The CRS of ``bbox`` (default: longitude/latitude)
+        :type crs: str or int
+        :return: The entries of the intersecting datasets
+        :rtype: list
+        """
+        west, south, east, north = to_geographic(bbox, crs)
+        # the R-tree stores 32-bit floats rounded outward, so its hits are
+        # checked again against the exact bounds
+        return self._rows('WHERE id IN (SELECT id FROM datasets_bbox '
+                          'WHERE west <= ? AND east >= ? AND south <= ? AND north >= ?) '
+                          'AND west <= ? AND east >= ? AND south <= ? AND north >= ?',
+                          (east, west, north, south) * 2)
+
+    def overlaps(self, name: str) -> list[dict]:
+        """
+        Find the other datasets whose bounds intersect a dataset's bounds.
+
+        :param str name: The dataset name (its subdirectory)
+        :return: The entries of the overlapping datasets
+        :rtype: list
+        """
+        e = self.get(name)
+        if e is None:
+            return []
+        return [o for o in self.intersects((e['west'], e['south'], e['east'], e['north']))
+                if o['name'] != name]
+
+    def duplicates(self) -> list[list[dict]]:
+        """
+        Find datasets made from the same input content under different
+        names (e.g. a file that was copied or renamed and processed again).
+
+        :return: Groups of entries with the same source hash, newest first
+        :rtype: list
+        """
+        groups = {}
+        for e in self._rows('WHERE source_hash IN (SELECT source_hash FROM datasets '
+                            'WHERE source_hash IS NOT NULL '
+                            'GROUP BY source_hash HAVING COUNT(*) > 1)'):
+            groups.setdefault(e['source_hash'], []).append(e)
+        return [sorted(g, key=lambda e: e['updated'], reverse=True) for g in groups.values()]
+
+    def tilesets(self, dedup: bool=True) -> list[Path]:
+        """
+        Get the ``tileset.json`` of every catalogued dataset.
+
+        :param bool dedup: Whether to leave out all but the newest dataset made from the same input
+        :return: The tileset files
+        :rtype: list
+        """
+        entries = self.datasets()
+        if dedup:
+            stale = set()
+            for g in self.duplicates():
+                self.L.warning('%s were made from the same input; using %s' % (', '.join(e['name'] for e in g),
+                                                                              g[0]['name']))
+                stale.update(e['name'] for e in g[1:])
+            entries = [e for e in entries if e['name'] not in stale]
+        return [self.dir / e['uri'] for e in entries]
+
+    def sync(self) -> Tuple[int, int]:
+        """
+        Bring the catalogue in line with the directory: drop the entries of
+        datasets that no longer exist and add datasets that are not yet
+        catalogued (e.g. made before the catalogue existed, or tiled without
+        cataloguing). Only the datasets that are added are read.
+
+        :return: Number of entries added and removed
+        :rtype: tuple
+        """
+        known = {e['name']: e for e in self.datasets()}
+        removed = 0
+        for name, e in known.items():
+            if not (self.dir / e['uri']).is_file():
+                self.L.info('Removing %s (tileset no longer exists)' % (name))
+                removed += self.remove(name)
+        added = 0
+        for p in sorted(glob.glob(str(self.dir / '*' / 'tileset.json'))):
+            if Path(p).parent.name not in known:
+                self.add(tileset=Path(p))
+                added += 1
+        self.L.info('Catalogue of %s: %s added, %s removed' % (self.dir, added, removed))
+        return added, removed
+
+def open_catalog(dir: Union[str, Path]) -> Union[Catalog, None]:
+    """
+    Open the catalogue of an output directory, if it has one.
+
+    :param dir: The output directory
+    :type dir: str or pathlib.Path
+    :return: The catalogue, or None
+    :rtype: pdgpoints.catalog.Catalog or None
+    """
+    return Catalog(dir) if (Path(dir) / CATALOG_NAME).is_file() else None
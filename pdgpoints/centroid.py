@@ -0,0 +1,135 @@
+from pathlib import Path
+from typing import Tuple
+from logging import getLogger
+
+from . import utils
+from . import lasheader
+
+STRATEGIES = ['auto', 'header', 'memmap', 'chunk']
+"Ways of calculating the mean XY position of a point cloud"
+
+DEFAULT_STRIDE = 10000
+"Sample every nth point by default"
+DEFAULT_CHUNK_SIZE = 1_000_000
+"Number of point records decompressed per iteration in ``chunk`` mode"
+
+def header_center(header: lasheader.Header) -> Tuple[float, float]:
+    """
+    Get the center of the header bounding box.
+
+    :param pdgpoints.lasheader.Header header: The parsed header
+    :return: Center X and Y
+    :rtype: float, float
+    """
+    return ((header.mins[0] + header.maxs[0]) / 2,
+            (header.mins[1] + header.maxs[1]) / 2)
+
+def memmap_mean(f: Path,
+                header: lasheader.Header,
+                stride: int=DEFAULT_STRIDE) -> Tuple[float, float]:
+    """
+    Get the mean XY position of every nth point in an uncompressed LAS file
+    by memory-mapping its point records. Only the pages holding sampled
+    records are read from disk.
+
+    :param f: The input file
+    :type f: str or pathlib.Path
+    :param pdgpoints.lasheader.Header header: The parsed header
+    :param int stride: Sample every nth point
+    :return: Mean X and Y
+    :rtype: float, float
+    :raises ValueError: If the stride is less than 1
+    """
+    import numpy as np
+    if stride < 1:
+        raise ValueError('Centroid stride must be at least 1 (got %s)' % (stride))
+    dtype = np.dtype([('X', '<i4'),
+                      ('Y', '<i4'),
+                      ('rest', 'V%s' % (header.point_record_length - 8))])
+    points = np.memmap(f, dtype=dtype, mode='r',
+                       offset=header.offset_to_points,
+                       shape=(header.point_count,))
+    x = points['X'][::stride].astype(np.float64).mean() * header.scales[0] + header.offsets[0]
+    y = points['Y'][::stride].astype(np.float64).mean() * header.scales[1] + header.offsets[1]
+    del points
+    return float(x), float(y)
+
+def chunk_mean(f: Path,
+               stride: int=DEFAULT_STRIDE,
+               chunk_size: int=DEFAULT_CHUNK_SIZE) -> Tuple[float, float]:
+    """
+    Get the mean XY position of every nth point by streaming the point
+    records in chunks. Works with LAZ as well as LAS.
+
+    :param f: The input file
+    :type f: str or pathlib.Path
+    :param int stride: Sample every nth point
+    :param int chunk_size: Number of points to read per iteration
+    :return: Mean X and Y
+    :rtype: float, float
+    :raises ValueError: If the stride is less than 1
+    """
+    import numpy as np
+    import laspy
+    if stride < 1:
+        raise ValueError('Centroid stride must be at least 1 (got %s)' % (stride))
+    sx, sy, n, done = 0., 0., 0, 0
+    with laspy.open(f) as reader:
+        for chunk in reader.chunk_iterator(chunk_size):
+            # align the stride to the global point index
+            first = (-done) % stride
+            sx += float(np.sum(chunk.x[first::stride]))
+            sy += float(np.sum(chunk.y[first::stride]))
+            n += len(range(first, len(chunk), stride))
+            done += len(chunk)
+    if not n:
+        raise ValueError('No points sampled from %s' % (f))
+    return sx / n, sy / n
+
+def lasmean(f: Path,
+            name: str="none",
+            strategy: str='auto',
+            stride: int=DEFAULT_STRIDE,
+            chunk_size: int=DEFAULT_CHUNK_SIZE) -> Tuple[float, float]:
+    """
+    Get the mean XY position of a point cloud without an intermediate text file.
+
+    Strategies:
+
+    - ``header``: center of the header bounds (no point data is read; the
+      center is only the mean for evenly spread points, so this is opt-in)
+    - ``memmap``: every nth point of a memory-mapped uncompressed LAS file
+    - ``chunk``: every nth point, streamed in chunks (LAS or LAZ)
+    - ``auto``: ``memmap`` for LAS and ``chunk`` for LAZ
+
+    :param f: The input file
+    :type f: str or pathlib.Path
+    :param str name: The name of the coordinate reference system in use
+    :param str strategy: One of :py:data:`STRATEGIES`
+    :param int stride: Sample every nth point
+    :param int chunk_size: Number of points to read per iteration in ``chunk`` mode
+    :return: Mean X and Y of the dataset
+    :rtype: float, float
+    """
+    L = getLogger(__name__)
+    lasmeanstart = utils.timer()
+    header = lasheader.read_header(f)
+    if strategy == 'auto':
+        strategy = 'chunk' if header.compressed else 'memmap'
+        L.debug('Compressed=%s: using %s strategy' % (header.compressed, strategy))
+    if (strategy == 'memmap') and header.compressed:
+        L.warning('Cannot memory-map compressed points in %s. Reading in chunks instead.' % (f))
+        strategy = 'chunk'
+
+    if strategy == 'header':
+        x, y = header_center(header)
+    elif strategy == 'memmap':
+        x, y = memmap_mean(f, header=header, stride=stride)
+    elif strategy == 'chunk':
+        x, y = chunk_mean(f, stride=stride, chunk_size=chunk_size)
+    else:
+        raise ValueError('Unknown centroid strategy "%s" (choose from %s)' % (strategy, STRATEGIES))
+
+    L.info('X mean: %.3f Y mean: %.3f (%s, %s strategy)' % (x, y, name, strategy))
+    L.info('Finished centroid (%.1f sec / %.1f min)' % utils.timer(lasmeanstart))
+    return x, y
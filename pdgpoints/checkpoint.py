@@ -0,0 +1,166 @@
+import json
+import hashlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Union
+from logging import getLogger
+
+from . import utils
+from ._version import __version__
+
+MANIFEST_VERSION = 1
+"Version of the run manifest format (manifests of other versions are ignored)"
+HASH_BLOCK = 1 << 20
+"Number of bytes hashed from each of the start, middle, and end of a file"
+
+def fingerprint(f: Path, content: bool=True) -> Union[dict, None]:
+    """
+    Get a fingerprint of a file: its size, modification time, and
+    (optionally) a hash of its first, middle, and last megabyte.
+    The partial hash catches files rewritten in place with the same size
+    and a restored mtime without reading multi-gigabyte inputs in full.
+
+    :param f: The file
+    :type f: str or pathlib.Path
+    :param bool content: Whether to include the content hash
+    :return: The fingerprint, or None if the file does not exist
+    :rtype: dict or None
+    """
+    f = Path(f)
+    try:
+        st = f.stat()
+    except FileNotFoundError:
+        return None
+    fp = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if content:
+        h = hashlib.blake2b(digest_size=16)
+        with open(f, 'rb') as fr:
+            for pos in sorted(set([0, max(st.st_size // 2 - HASH_BLOCK // 2, 0),
+                                   max(st.st_size - HASH_BLOCK, 0)])):
+                fr.seek(pos)
+                h.update(fr.read(HASH_BLOCK))
+        fp['hash'] = h.hexdigest()
+    return fp
+
+class Manifest():
+    """
+    Per-input run manifest that records, for each completed stage, the
+    fingerprints of the stage's inputs and outputs, the parameters used,
+    and any state later stages need (e.g. the CRS and Z translation).
+
+    A stage is up to date if it was recorded with the same parameters,
+    its inputs still have the recorded fingerprints, and its outputs
+    still exist with the recorded fingerprints. Stages are only recorded
+    after they finish, and the manifest is replaced atomically, so a file
+    left half-written by a crash never matches a record.
+
+    :param f: The manifest file
+    :type f: pathlib.Path
+    :param dict params: The parameters that affect stage outputs
+    :param list stages: Stage names in processing order (completing a stage discards the records of the stages after it)
+    """
+    def __init__(self, f: Path, params: dict, stages: list):
+        self.L = getLogger(__name__)
+        self.f = Path(f)
+        self.params = json.loads(json.dumps(params, default=str))
+        self.stages = stages
+        self.records = {}
+        self.load()
+
+    def load(self) -> dict:
+        """
+        Read the manifest from disk, if there is a readable one.
+
+        :return: The stage records
+        :rtype: dict
+        """
+        try:
+            with open(self.f, 'r') as fr:
+                d = json.load(fr)
+            if d.get('manifest_version') == MANIFEST_VERSION:
+                self.records = d.get('stages', {})
+        except FileNotFoundError:
+            self.records = {}
+        except (ValueError, OSError) as e:
+            self.L.warning('Ignoring unreadable manifest %s (%s)' % (self.f, e))
+            self.records = {}
+        return self.records
+
+    def save(self) -> Path:
+        """
+        Write the manifest to disk atomically (via a temporary file).
+
+        :return: The manifest file
+        :rtype: pathlib.Path
+        """
+        self.f.parent.mkdir(parents=True, exist_ok=True)
+        utils.write_json_atomic(self.f, {'manifest_version': MANIFEST_VERSION,
+                                         'version': __version__,
+                                         'stages': self.records}, indent=2)
+        return self.f
+
+    def fresh(self, stage: str, inputs: list=[], outputs: list=[]) -> bool:
+        """
+        Check whether a stage is up to date.
+
+        :param str stage: The stage name
+        :param list inputs: Files the stage reads
+        :param list outputs: Files the stage writes
+        :return: Whether the stage can be skipped
+        :rtype: bool
+        """
+        r = self.records.get(stage)
+        if r is None:
+            return False
+        if r['params'] != self.params:
+            self.L.info('Stage %s is stale: parameters changed' % (stage))
+            return False
+        for key, files in [('inputs', inputs), ('outputs', outputs)]:
+            if sorted(r[key]) != sorted(str(f) for f in files):
+                self.L.info('Stage %s is stale: %s changed' % (stage, key))
+                return False
+            for f in files:
+                fp = fingerprint(f)
+                if (fp is None) or (fp != r[key][str(f)]):
+                    self.L.info('Stage %s is stale: %s %s' % (stage, 'missing' if fp is None else 'changed', f))
+                    return False
+        return True
+
+    def state(self, stage: str) -> dict:
+        """
+        Get the state saved with a stage.
+
+        :param str stage: The stage name
+        :return: The saved state
+        :rtype: dict
+        """
+        return self.records.get(stage, {}).get('state', {})
+
+    def done(self, stage: str, inputs: list=[], outputs: list=[], state: dict={}):
+        """
+        Record a completed stage and discard the records of later stages.
+
+        :param str stage: The stage name
+        :param list inputs: Files the stage read
+        :param list outputs: Files the stage wrote
+        :param dict state: Values later stages need if this stage is skipped
+        """
+        if stage in self.stages:
+            for later in self.stages[self.stages.index(stage) + 1:]:
+                self.records.pop(later, None)
+        self.records[stage] = {
+            'params': self.params,
+            'inputs': {str(f): fingerprint(f) for f in inputs},
+            'outputs': {str(f): fingerprint(f) for f in outputs},
+            'state': json.loads(json.dumps(state, default=str)),
+            'finished': datetime.now(timezone.utc).isoformat(),
+        }
+        self.save()
+
+    def clear(self):
+        """
+        Forget all stage records.
+        """
+        self.records = {}
+        if self.f.is_file():
+            self.f.unlink()
@@ -1,36 +1,344 @@
 from pathlib import Path
 import argparse
+import signal
+import json
 from pyegt.defs import MODEL_LIST, REGIONS
 
 import logging as L
-from .pipeline import Pipeline
+from .pipeline import Pipeline, RGB_ENGINES, CENTROID_STRATEGIES
+from .centroid import DEFAULT_STRIDE
+from .thin import MODES as THIN_MODES
+from .batch import run_batch, run_pipelined, DEFAULT_MIN_FREE_GB
+from . import bench
+from . import hostconfig
+from . import watch
+from . import distributed
+from . import subproc
+from .catalog import Catalog
+from .mergetree import DEFAULT_FAN_OUT
+from .implicit import DEFAULT_SUBTREE_LEVELS
+from .precompress import ENCODINGS, DEFAULT_WORKERS as DEFAULT_PRECOMPRESS_WORKERS
+from .geoid_cache import GeoidCache, DEFAULT_CACHE_FILE, DEFAULT_RESOLUTION
 
-def cli():
+def add_pipeline_args(parser: argparse.ArgumentParser):
     """
-    Parse the command options and arguments.
+    Add the options shared by every command that runs a pipeline.
+
+    :param argparse.ArgumentParser parser: The parser to add arguments to
     """
-    parser = argparse.ArgumentParser(prog='pdgpoints', description='Convert LiDAR files (LAS, LAZ) to Cesium tilesets.')
     parser.add_argument('-c', '--copy_i_to_rgb', action='store_true', help='Whether to copy intensity values to RGB')
+    parser.add_argument('-e', '--rgb_engine', choices=RGB_ENGINES, default=RGB_ENGINES[0], help='Tool to copy intensity to RGB with (lastools text pipe or in-process laspy)')
+    parser.add_argument('-u', '--fused', action='store_true', help='Do the WKT, mean, and rewrite steps in a single in-process pass')
+    parser.add_argument('-C', '--centroid', choices=CENTROID_STRATEGIES, default=CENTROID_STRATEGIES[0], help='How to calculate the mean position used for geoid lookups')
+    parser.add_argument('-n', '--sample_every', type=int, default=DEFAULT_STRIDE, help='Sample every nth point when calculating the mean position')
     parser.add_argument('-m', '--merge', action='store_true', help='Whether to use merge function')
+    parser.add_argument('-i', '--incremental_merge', action='store_true', help='Add new datasets to the existing merged tileset instead of rebuilding it')
+    parser.add_argument('--merge_fan_out', type=int, default=0, help='Group merged datasets into a spatial tree of tilesets with at most this many children each (e.g. %s; 0 to list every dataset in the root tileset)' % (DEFAULT_FAN_OUT))
+    parser.add_argument('--merge_workers', type=int, default=1, help='Number of processes reading dataset tilesets and building tree nodes when merging')
     parser.add_argument('-a', '--archive', action='store_true', help='Whether to archive the input dataset')
     parser.add_argument('-s', '--rgb_scale', type=float, default=1.0, help='Scale multiplier for RGB values')
     parser.add_argument('-z', '--translate_z', type=float, default=0.0, help='Float translation for z values')
     parser.add_argument('-g', '--from_geoid', choices=MODEL_LIST, default=None, help='The geoid, tidal, or geopotential model to translate from')
     parser.add_argument('-r', '--geoid_region', choices=REGIONS, default=REGIONS[0], help='The NGS region (https://vdatum.noaa.gov/docs/services.html#step140)')
+    parser.add_argument('-G', '--geoid_cache', type=str, default=None, help='Path of a persistent geoid height cache (SQLite) to use for lookups')
+    parser.add_argument('-P', '--split_points', type=int, default=0, help='Split files with more points than this into spatial chunks that are tiled separately (0 to never split)')
+    parser.add_argument('-W', '--split_workers', type=int, default=1, help='Number of spatial chunks to tile at once')
+    parser.add_argument('--implicit', action='store_true', help='Write 3D Tiles 1.1 implicit tiling (template URIs and subtree availability files) instead of an explicit tile hierarchy')
+    parser.add_argument('--subtree_levels', type=int, default=DEFAULT_SUBTREE_LEVELS, help='Number of tree levels in each subtree file when writing implicit tiling')
+    parser.add_argument('--precompress', choices=list(ENCODINGS), nargs='+', default=None, help='Write compressed copies of the tileset files in these encodings (e.g. tileset.json.gz) for static web servers to send as they are')
+    parser.add_argument('--precompress_workers', type=int, default=DEFAULT_PRECOMPRESS_WORKERS, help='Number of threads compressing tileset files')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of py3dtiles converter processes (default: number of CPUs)')
+    parser.add_argument('-M', '--cache_size', type=int, default=None, help='py3dtiles converter cache size in MB (default: a tenth of total memory)')
+    parser.add_argument('-H', '--hosts', type=str, default=None, help='Per-host settings profile (JSON keyed by hostname; default: ~/.config/pdgpoints/hosts.json)')
+    parser.add_argument('-F', '--force', action='store_true', help='Redo every stage, even if the run manifest shows its outputs are up to date')
+    parser.add_argument('-R', '--no_report', action='store_true', help='Do not write the per-stage metrics report (report.json) to the output tileset directory')
+    parser.add_argument('-K', '--no_catalog', action='store_true', help='Do not record datasets in the output directory catalogue (catalog.sqlite)')
+    parser.add_argument('-T', '--thin', choices=THIN_MODES, default=None, help='Thin the points before tiling: first point per voxel, a random sample, or every nth point')
+    parser.add_argument('-V', '--thin_spacing', type=float, default=0., help='Target distance between thinned points (voxel size in voxel mode), in CRS units')
+    parser.add_argument('-B', '--thin_budget', type=int, default=0, help='Target number of thinned points (used if no spacing is given)')
+    parser.add_argument('--proc_timeout', type=float, default=None, help='Seconds a lastools command may run before it is killed')
+    parser.add_argument('--proc_retries', type=int, default=subproc.DEFAULT_RETRIES, help='Number of times to retry a lastools command that failed transiently (e.g. killed by the OOM killer)')
+    parser.add_argument('--proc_memory', type=int, default=None, help='Largest address space of a lastools process in MB')
+    parser.add_argument('--proc_cpu', type=int, default=None, help='Most CPU seconds of a lastools process')
+    parser.add_argument('--profile', action='store_true', help='Profile each stage and write cProfile and collapsed-stack files beside the run report')
+
+def pipeline_kwargs(args: argparse.Namespace) -> dict:
+    """
+    Convert parsed command options to :py:class:`pdgpoints.pipeline.Pipeline` keyword arguments.
+
+    :param argparse.Namespace args: The parsed arguments
+    :return: Keyword arguments for the pipeline
+    :rtype: dict
+    """
+    return dict(intensity_to_RGB=args.copy_i_to_rgb,
+                merge=args.merge,
+                archive=args.archive,
+                rgb_scale=args.rgb_scale,
+                translate_z=args.translate_z,
+                from_geoid=args.from_geoid,
+                geoid_region=args.geoid_region,
+                rgb_engine=args.rgb_engine,
+                fused=args.fused,
+                sample_every=args.sample_every,
+                centroid_strategy=args.centroid,
+                geoid_cache=args.geoid_cache,
+                incremental_merge=args.incremental_merge,
+                merge_fan_out=args.merge_fan_out,
+                merge_workers=args.merge_workers,
+                report=not args.no_report,
+                catalog=not args.no_catalog,
+                thin_mode=args.thin,
+                thin_spacing=args.thin_spacing,
+                thin_budget=args.thin_budget,
+                proc_timeout=args.proc_timeout,
+                proc_retries=args.proc_retries,
+                proc_memory_mb=args.proc_memory,
+                proc_cpu_seconds=args.proc_cpu,
+                profile=args.profile,
+                resume=not args.force,
+                split_points=args.split_points,
+                split_workers=args.split_workers,
+                implicit=args.implicit,
+                subtree_levels=args.subtree_levels,
+                precompress=args.precompress,
+                precompress_workers=args.precompress_workers,
+                jobs=args.jobs,
+                cache_size=args.cache_size)
+
+def parse_args(parser: argparse.ArgumentParser) -> argparse.Namespace:
+    """
+    Parse the command options, using this host's settings profile (see
+    :py:func:`pdgpoints.hostconfig.load_profile`) for the defaults of any
+    options it names. Options given on the command line take precedence.
+
+    :param argparse.ArgumentParser parser: The parser
+    :return: The parsed arguments
+    :rtype: argparse.Namespace
+    """
+    args, _ = parser.parse_known_args()
+    dests = [a.dest for a in parser._actions]
+    profile = hostconfig.load_profile(f=args.hosts)
+    parser.set_defaults(**{k: v for k, v in profile.items() if k in dests})
+    return parser.parse_args()
+
+def cli():
+    """
+    Parse the command options and arguments.
+    """
+    parser = argparse.ArgumentParser(prog='pdgpoints', description='Convert LiDAR files (LAS, LAZ) to Cesium tilesets.')
+    add_pipeline_args(parser)
     parser.add_argument('-f', '--file', type=str, required=True, help='The file to process')
 
-    args = parser.parse_args()
+    args = parse_args(parser)
     p = Path(args.file)
     if not p.is_file():
         L.error('No file at %s' % (p))
         exit(1)
 
-    p = Pipeline(f=args.file,
-                 intensity_to_RGB=args.copy_i_to_rgb,
-                 merge=args.merge,
-                 archive=args.archive,
-                 rgb_scale=args.rgb_scale,
-                 translate_z=args.translate_z,
-                 from_geoid=args.from_geoid,
-                 geoid_region=args.geoid_region)
-    p.run()
\ No newline at end of file
+    p = Pipeline(f=args.file, **pipeline_kwargs(args))
+    try:
+        p.run()
+    except subproc.CommandError as e:
+        L.error(e)
+        exit(1)
+
+def batch_cli():
+    """
+    Parse the command options and arguments for batch processing.
+    """
+    parser = argparse.ArgumentParser(prog='pdgpoints-batch', description='Convert many LiDAR files (LAS, LAZ) to Cesium tilesets in parallel.')
+    add_pipeline_args(parser)
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of files to process at once (with -Q, the number to prepare at once)')
+    parser.add_argument('-Q', '--queue_depth', type=int, default=0, help='Overlap the rewrite of upcoming files with tiling, keeping up to this many prepared files waiting (0: off)')
+    parser.add_argument('-D', '--min_free_gb', type=float, default=DEFAULT_MIN_FREE_GB, help='In overlapped mode, disk space (GB) to leave free beside the rewritten files')
+    parser.add_argument('-E', '--merge_every', type=int, default=0, help='In overlapped mode, merge after this many files are tiled (0: once at the end)')
+    parser.add_argument('-b', '--memory_gb', type=float, default=0., help='Start files largest first, only while their predicted peak memory stays within this many GB (0: off)')
+    parser.add_argument('-o', '--summary', type=str, default=None, help='Write the batch summary as JSON to this file')
+    parser.add_argument('source', nargs='+', help='Directories, glob patterns, or manifest files listing the files to process')
+
+    args = parse_args(parser)
+    if args.queue_depth:
+        summary = run_pipelined(source=args.source,
+                                queue_depth=args.queue_depth,
+                                prep_workers=args.workers,
+                                min_free_gb=args.min_free_gb,
+                                merge_every=args.merge_every,
+                                **pipeline_kwargs(args))
+    else:
+        summary = run_batch(source=args.source,
+                            workers=args.workers,
+                            memory_gb=args.memory_gb,
+                            **pipeline_kwargs(args))
+    if args.summary:
+        with open(args.summary, 'w') as fw:
+            json.dump(summary, fw, indent=2)
+    if summary['failed']:
+        exit(1)
+
+def watch_cli():
+    """
+    Parse the command options and arguments for the watch-folder ingest service.
+    """
+    parser = argparse.ArgumentParser(prog='pdgpoints-watch', description='Continuously convert LiDAR files (LAS, LAZ) arriving in drop directories to Cesium tilesets.')
+    add_pipeline_args(parser)
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of files to process at once')
+    parser.add_argument('-S', '--state', type=str, default=str(watch.DEFAULT_STATE_FILE), help='Path of the persistent queue database')
+    parser.add_argument('-I', '--interval', type=float, default=watch.DEFAULT_INTERVAL, help='Seconds between directory scans')
+    parser.add_argument('-t', '--settle', type=float, default=watch.DEFAULT_SETTLE, help='Seconds a file must stay unchanged before it is processed')
+    parser.add_argument('-d', '--merge_delay', type=float, default=watch.DEFAULT_MERGE_DELAY, help='Quiet seconds to wait before merging')
+    parser.add_argument('-X', '--merge_max_wait', type=float, default=watch.DEFAULT_MERGE_MAX_WAIT, help='Longest seconds a finished file waits to be merged')
+    parser.add_argument('-A', '--max_attempts', type=int, default=watch.DEFAULT_MAX_ATTEMPTS, help='Number of times to try a failing file')
+    parser.add_argument('dirs', nargs='+', help='Directories to watch')
+
+    args = parse_args(parser)
+    kwargs = pipeline_kwargs(args)
+    w = watch.Watcher(dirs=args.dirs,
+                      state=args.state,
+                      workers=args.workers,
+                      interval=args.interval,
+                      settle=args.settle,
+                      merge=kwargs.pop('merge'),
+                      merge_delay=args.merge_delay,
+                      merge_max_wait=args.merge_max_wait,
+                      max_attempts=args.max_attempts,
+                      **kwargs)
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(sig, lambda signum, frame: w.stop())
+    w.run()
+
+def worker_cli():
+    """
+    Parse the command options and arguments for a distributed worker.
+    """
+    parser = argparse.ArgumentParser(prog='pdgpoints-worker', description='Convert LiDAR files (LAS, LAZ) to Cesium tilesets as one of many workers sharing a queue directory.')
+    add_pipeline_args(parser)
+    parser.add_argument('-q', '--queue_dir', type=str, required=True, help='Queue directory on the filesystem shared by every worker')
+    parser.add_argument('-b', '--heartbeat', type=float, default=distributed.DEFAULT_HEARTBEAT, help='Seconds between heartbeats')
+    parser.add_argument('-L', '--lease_timeout', type=float, default=distributed.DEFAULT_LEASE_TIMEOUT, help='Seconds without a heartbeat after which a claimed file is taken back')
+    parser.add_argument('-A', '--max_attempts', type=int, default=distributed.DEFAULT_MAX_ATTEMPTS, help='Number of times to try a failing file')
+    parser.add_argument('-I', '--poll', type=float, default=distributed.DEFAULT_POLL, help='Seconds between checks while waiting for other workers')
+    parser.add_argument('-o', '--summary', type=str, default=None, help='Write this worker\'s summary as JSON to this file')
+    parser.add_argument('source', nargs='+', help='Directories, glob patterns, or manifest files listing the files to process')
+
+    args = parse_args(parser)
+    kwargs = pipeline_kwargs(args)
+    w = distributed.Worker(source=args.source,
+                           queue_dir=args.queue_dir,
+                           merge=kwargs.pop('merge'),
+                           heartbeat=args.heartbeat,
+                           lease_timeout=args.lease_timeout,
+                           poll=args.poll,
+                           max_attempts=args.max_attempts,
+                           **kwargs)
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(sig, lambda signum, frame: w.stop())
+    summary = w.run()
+    if args.summary:
+        with open(args.summary, 'w') as fw:
+            json.dump(summary, fw, indent=2, default=str)
+    if summary['failed']:
+        exit(1)
+
+def geoid_warm_cli():
+    """
+    Parse the command options and arguments for warming the geoid height cache.
+    """
+    parser = argparse.ArgumentParser(prog='pdgpoints-geoid-warm', description='Fill the geoid height cache ahead of a (possibly offline) run.')
+    parser.add_argument('-g', '--from_geoid', choices=MODEL_LIST, required=True, help='The geoid, tidal, or geopotential model to cache')
+    parser.add_argument('-r', '--geoid_region', choices=REGIONS, default=REGIONS[0], help='The NGS region (https://vdatum.noaa.gov/docs/services.html#step140)')
+    parser.add_argument('-G', '--geoid_cache', type=str, default=str(DEFAULT_CACHE_FILE), help='Path of the geoid height cache')
+    parser.add_argument('-d', '--resolution', type=float, default=DEFAULT_RESOLUTION, help='Cache cell size in decimal degrees')
+    parser.add_argument('coords', help='File with one "lat,lon" pair per line')
+
+    args = parser.parse_args()
+    coords = []
+    with open(args.coords, 'r') as fr:
+        for line in fr:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                lat, lon = line.replace(',', ' ').split()[:2]
+                coords.append((float(lat), float(lon)))
+    cache = GeoidCache(path=args.geoid_cache, resolution=args.resolution)
+    cache.warm(coords=coords, model=args.from_geoid, region=args.geoid_region)
+
+def bench_cli():
+    """
+    Parse the command options and arguments for benchmarking.
+    """
+    parser = argparse.ArgumentParser(prog='pdgpoints-bench', description='Benchmark the pipeline on synthetic point clouds of several sizes.')
+    add_pipeline_args(parser)
+    parser.add_argument('-S', '--sizes', type=int, nargs='+', default=bench.DEFAULT_SIZES, help='Number of points in each synthetic file')
+    parser.add_argument('-l', '--layout', choices=list(bench.LAYOUTS), default='intensity', help='LAS version and point format of the synthetic files')
+    parser.add_argument('-p', '--crs', type=str, default=bench.DEFAULT_CRS, help='CRS of the synthetic files (e.g. EPSG:32618+5703 for a compound CRS)')
+    parser.add_argument('-x', '--ext', choices=['.laz', '.las'], default='.laz', help='Whether to generate compressed or uncompressed files')
+    parser.add_argument('-k', '--repeat', type=int, default=3, help='Number of runs per size (medians are reported)')
+    parser.add_argument('-d', '--bench_dir', type=str, default=str(bench.BENCH_DIR), help='Directory for synthetic files and runs')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Write the results as JSON to this file')
+    parser.add_argument('-b', '--baseline', type=str, default=None, help='Compare the results with this baseline file')
+    parser.add_argument('-t', '--tolerance', type=float, default=None, help='Fraction by which a stage (default: %s) or import (default: %s) may be slower than the baseline' % (bench.DEFAULT_TOLERANCE, bench.DEFAULT_IMPORT_TOLERANCE))
+    parser.add_argument('--imports', action='store_true', help='Benchmark the import time of the package entry points instead (fails if it regresses or loads a processing dependency)')
+
+    args = parse_args(parser)
+    if args.imports:
+        results = bench.run_import_bench(repeat=args.repeat)
+        results['comparison'] = bench.compare_imports(results,
+                                                      bench.load(args.baseline) if args.baseline else None,
+                                                      tolerance=bench.DEFAULT_IMPORT_TOLERANCE if args.tolerance is None else args.tolerance)
+        if args.output:
+            bench.save(results, args.output)
+        regressions = [r for r in results['comparison'] if r['regression']]
+        if regressions:
+            L.error('%s imports regressed' % (len(regressions)))
+            exit(1)
+        return
+    results = bench.run_bench(sizes=args.sizes,
+                              layout=args.layout,
+                              crs=args.crs,
+                              ext=args.ext,
+                              repeat=args.repeat,
+                              bench_dir=Path(args.bench_dir),
+                              **pipeline_kwargs(args))
+    for case, c in results['cases'].items():
+        for stage, rec in c['stages'].items():
+            L.info('%s %s: %.2f s (%s pts/s)' % (case, stage, rec['wall_s'],
+                                                '%.0f' % rec['points_per_s'] if rec.get('points_per_s') else '-'))
+    for stage, curve in results['scaling'].items():
+        if curve['exponent'] is not None:
+            L.info('Scaling of %s: time ~ points^%.2f' % (stage, curve['exponent']))
+    regressions = []
+    if args.baseline:
+        results['comparison'] = bench.compare(results, bench.load(args.baseline),
+                                              tolerance=bench.DEFAULT_TOLERANCE if args.tolerance is None else args.tolerance)
+        regressions = [r for r in results['comparison'] if r['regression']]
+    if args.output:
+        bench.save(results, args.output)
+    if regressions:
+        L.error('%s stages slower than the baseline' % (len(regressions)))
+        exit(1)
+
+def catalog_cli():
+    """
+    Parse the command options and arguments for querying an output directory's catalogue.
+    """
+    parser = argparse.ArgumentParser(prog='pdgpoints-catalog', description='Query the catalogue of processed datasets in an output (3dtiles) directory.')
+    parser.add_argument('dir', type=str, help='The output directory')
+    parser.add_argument('-b', '--bbox', type=float, nargs=4, metavar=('MINX', 'MINY', 'MAXX', 'MAXY'), default=None, help='List the datasets that intersect this bounding box')
+    parser.add_argument('-c', '--crs', type=str, default='EPSG:4326', help='CRS of the bounding box')
+    parser.add_argument('-O', '--overlaps', type=str, default=None, help='List the datasets that overlap this dataset')
+    parser.add_argument('-d', '--duplicates', action='store_true', help='List groups of datasets made from the same input')
+    parser.add_argument('-s', '--sync', action='store_true', help='Add uncatalogued datasets and drop missing ones first')
+
+    args = parser.parse_args()
+    cat = Catalog(args.dir)
+    if args.sync:
+        cat.sync()
+    if args.duplicates:
+        found = [[e['name'] for e in g] for g in cat.duplicates()]
+    elif args.overlaps:
+        found = [e['name'] for e in cat.overlaps(args.overlaps)]
+    elif args.bbox:
+        found = [e['name'] for e in cat.intersects(args.bbox, crs=args.crs)]
+    else:
+        found = [{k: e[k] for k in ['name', 'source', 'crs', 'points', 'west', 'south', 'east', 'north']}
+                 for e in cat.datasets()]
+    print(json.dumps(found, indent=2))
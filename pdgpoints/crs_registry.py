@@ -0,0 +1,124 @@
+import threading
+from functools import lru_cache
+from typing import Tuple, Union, TYPE_CHECKING
+
+# pyproj is imported where it is first needed, as loading it takes a
+# noticeable part of a second and many callers never need it
+if TYPE_CHECKING:
+    import pyproj
+
+CRS_CACHE_SIZE = 128
+"Number of parsed CRS objects to keep"
+TRANSFORMER_CACHE_SIZE = 64
+"Number of Transformer objects to keep"
+
+def normalize(crs: Union['pyproj.CRS', int, str]) -> str:
+    """
+    Normalize a CRS given as an EPSG code, ``'EPSG:XXXX'`` string, WKT,
+    PROJ string, or :py:class:`pyproj.crs.CRS` to a string that can be
+    used as a cache key. Equivalent spellings of the same EPSG code map
+    to the same key.
+
+    :param crs: The CRS to normalize
+    :type crs: pyproj.crs.CRS or int or str
+    :return: The cache key
+    :rtype: str
+    """
+    from pyproj import CRS
+    if isinstance(crs, CRS):
+        return crs.srs
+    s = str(crs).strip()
+    if s.isdigit():
+        return 'EPSG:%s' % (int(s))
+    if s.upper().startswith('EPSG:') and s[5:].strip().isdigit():
+        return 'EPSG:%s' % (int(s[5:]))
+    return s
+
+@lru_cache(maxsize=CRS_CACHE_SIZE)
+def _crs(key: str) -> 'pyproj.CRS':
+    from pyproj import CRS
+    return CRS.from_user_input(key)
+
+def get_crs(crs: Union['pyproj.CRS', int, str, None]) -> Union['pyproj.CRS', None]:
+    """
+    Get a (shared) :py:class:`pyproj.crs.CRS` object, parsing each distinct
+    CRS only once per process. No CRS (e.g. the horizontal EPSG code of a
+    WKT that has none) gives None, leaving the converter to use the CRS
+    of the file.
+
+    :param crs: The CRS as an EPSG code, string, or CRS object
+    :type crs: pyproj.crs.CRS or int or str or None
+    :return: The parsed CRS, or None
+    :rtype: pyproj.crs.CRS or None
+    """
+    from pyproj import CRS
+    if crs is None:
+        return None
+    if isinstance(crs, CRS):
+        return crs
+    return _crs(normalize(crs))
+
+@lru_cache(maxsize=TRANSFORMER_CACHE_SIZE)
+def _transformer(from_key: str, to_key: str, always_xy: bool, thread: int) -> 'pyproj.Transformer':
+    from pyproj import Transformer
+    return Transformer.from_crs(crs_from=_crs(from_key), crs_to=_crs(to_key), always_xy=always_xy)
+
+def get_transformer(crs_from: Union['pyproj.CRS', int, str],
+                    crs_to: Union['pyproj.CRS', int, str],
+                    always_xy: bool=False) -> 'pyproj.Transformer':
+    """
+    Get a (shared) :py:class:`pyproj.Transformer`, building each distinct
+    pair only once per thread. Transformers are not safe to share between
+    threads, so each thread gets its own.
+
+    :param crs_from: The CRS to convert from
+    :type crs_from: pyproj.crs.CRS or int or str
+    :param crs_to: The CRS to convert to
+    :type crs_to: pyproj.crs.CRS or int or str
+    :param bool always_xy: Whether to use traditional GIS (x, y) axis order
+    :return: The transformer
+    :rtype: pyproj.Transformer
+    """
+    return _transformer(normalize(crs_from), normalize(crs_to), always_xy, threading.get_ident())
+
+@lru_cache(maxsize=CRS_CACHE_SIZE)
+def _split(key: str) -> Tuple['pyproj.CRS', int, int, str, str]:
+    crs = _crs(key)
+    epsg_h, epsg_v = None, None
+    h_name, v_name = None, None
+    if crs.is_compound:
+        for c in crs.sub_crs_list:
+            if c.is_vertical:
+                epsg_v = c.to_epsg()
+                v_name = c.name
+            else:
+                epsg_h = c.to_epsg()
+                h_name = c.name
+    else:
+        if crs.is_vertical:
+            epsg_v = crs.to_epsg()
+            v_name = crs.name
+        else:
+            epsg_h = crs.to_epsg()
+            h_name = crs.name
+    return crs, epsg_h, epsg_v, h_name, v_name
+
+def split_crs(crs: Union['pyproj.CRS', int, str]) -> Tuple['pyproj.CRS', int, int, str, str]:
+    """
+    Split a (possibly compound) CRS into its horizontal and vertical EPSG
+    codes and names. EPSG identification is slow, so results are cached.
+
+    :param crs: The CRS as an EPSG code, string, or CRS object
+    :type crs: pyproj.crs.CRS or int or str
+    :return: CRS object, horizontal EPSG, vertical EPSG, horizontal name, vertical name
+    :rtype: tuple
+    """
+    return _split(normalize(crs))
+
+def clear():
+    """
+    Empty all caches.
+    """
+    _crs.cache_clear()
+    _transformer.cache_clear()
+    _split.cache_clear()
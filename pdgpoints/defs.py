@@ -1,3 +1,4 @@
+import os
 import json
 from pathlib import Path
 from datetime import datetime
@@ -15,6 +16,11 @@ BIN_LOC = MOD_LOC.joinpath('bin')
 LAS2LAS_LOC = BIN_LOC.joinpath('las2las')
 LASINFO_LOC = BIN_LOC.joinpath('lasinfo')
 
+CACHE_DIR = Path(os.environ.get('PDGPOINTS_CACHE_DIR',
+                               Path.home().joinpath('.cache', 'pdgpoints')))
+HOST_PROFILES = Path(os.environ.get('PDGPOINTS_HOSTS',
+                                    Path.home().joinpath('.config', 'pdgpoints', 'hosts.json')))
+
 LOGCONFIG = MOD_LOC.joinpath('log/config.json')
 with open(LOGCONFIG, 'r') as lc:
     LOGGING_CONFIG = json.load(lc)
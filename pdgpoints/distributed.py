@@ -0,0 +1,460 @@
+import os
+import json
+import uuid
+import socket
+import hashlib
+import threading
+from pathlib import Path
+from typing import Union
+from logging import getLogger
+
+from . import utils
+from . import batch
+from .catalog import Catalog
+
+DEFAULT_HEARTBEAT = 30.
+"Default seconds between heartbeats (lease and worker file touches)"
+DEFAULT_LEASE_TIMEOUT = 120.
+"Default seconds without a heartbeat after which a lease is taken to belong to a crashed worker"
+DEFAULT_POLL = 10.
+"Default seconds between checks while waiting for other workers"
+DEFAULT_MAX_ATTEMPTS = 3
+"Default number of times a file is tried (including attempts cut short by a crash)"
+MERGE_LEASE = '_merge'
+"Name of the lease held by the worker elected to merge"
+
+def read_json(f: Path) -> Union[dict, None]:
+    """
+    Read a JSON file, if it exists.
+
+    :param f: The file to read
+    :type f: pathlib.Path
+    :return: The data, or None
+    :rtype: dict or None
+    """
+    try:
+        with open(f, 'r') as fr:
+            return json.load(fr)
+    except FileNotFoundError:
+        return None
+
+def file_key(f: Path) -> str:
+    """
+    Name an input in the queue: its stem plus a hash of its full path, so
+    that files with the same name in different directories do not clash.
+
+    :param f: The input file
+    :type f: pathlib.Path
+    :return: The queue key
+    :rtype: str
+    """
+    return '%s-%s' % (f.stem, hashlib.blake2b(str(f).encode(), digest_size=5).hexdigest())
+
+class Lease():
+    """
+    An exclusive, renewable claim on a named resource, kept as a file in a
+    shared directory. Lease files are numbered by generation
+    (``<name>.<generation>``), and the highest generation present is the
+    current lease. A lease is taken by hard-linking a private file to the
+    next generation's name, which succeeds for exactly one worker even on
+    NFS or Lustre. An expired lease is reclaimed the same way, by taking
+    the generation after it, so a crashed owner that comes back finds a
+    newer generation and knows it has lost the lease.
+
+    :param dir: The lease directory
+    :type dir: pathlib.Path
+    :param str name: The resource name
+    :param str owner: This worker's ID
+    """
+    def __init__(self, dir: Path, name: str, owner: str):
+        self.dir = Path(dir)
+        self.name = name
+        self.owner = owner
+        self.generation = None
+
+    def path(self, generation: int) -> Path:
+        return self.dir / ('%s.%s' % (self.name, generation))
+
+    def generations(self) -> list[int]:
+        """
+        Find the generations of this lease that exist.
+
+        :return: The generations, lowest first
+        :rtype: list
+        """
+        prefix = self.name + '.'
+        gens = []
+        for n in os.listdir(self.dir):
+            if n.startswith(prefix) and n[len(prefix):].isdigit():
+                gens.append(int(n[len(prefix):]))
+        return sorted(gens)
+
+    def acquire(self, now: float, timeout: float) -> bool:
+        """
+        Take the lease if it is free or has expired.
+
+        :param float now: The current time by the shared filesystem's clock
+        :param float timeout: Seconds without a heartbeat after which a lease has expired
+        :return: Whether this worker now holds the lease
+        :rtype: bool
+        """
+        L = getLogger(__name__)
+        gens = self.generations()
+        if gens:
+            try:
+                age = now - self.path(gens[-1]).stat().st_mtime
+            except FileNotFoundError:
+                return False
+            if age < timeout:
+                return False
+            L.warning('Lease %s (generation %s) has had no heartbeat for %.0f sec; reclaiming' % (self.name,
+                                                                                                 gens[-1], age))
+        target = gens[-1] + 1 if gens else 1
+        tmp = self.dir / ('.%s.%s.tmp' % (self.name, uuid.uuid4().hex))
+        with open(tmp, 'w') as fw:
+            json.dump({'owner': self.owner, 'host': socket.gethostname(), 'pid': os.getpid()}, fw)
+        try:
+            os.link(tmp, self.path(target))
+            won = True
+        except FileExistsError:
+            won = False
+        except OSError:
+            # on NFS the link can succeed even though the reply is lost
+            won = os.stat(tmp).st_nlink == 2
+        finally:
+            os.unlink(tmp)
+        if not won:
+            return False
+        self.generation = target
+        for g in gens:
+            try:
+                self.path(g).unlink()
+            except FileNotFoundError:
+                pass
+        return True
+
+    def held(self) -> bool:
+        """
+        Check that this worker still holds the lease (its generation is the
+        newest and still names it as the owner).
+
+        :return: Whether the lease is held
+        :rtype: bool
+        """
+        if self.generation is None:
+            return False
+        d = read_json(self.path(self.generation))
+        if (d is None) or (d.get('owner') != self.owner):
+            return False
+        return self.generations()[-1] == self.generation
+
+    def heartbeat(self) -> bool:
+        """
+        Renew the lease.
+
+        :return: Whether the lease is still held
+        :rtype: bool
+        """
+        if not self.held():
+            return False
+        os.utime(self.path(self.generation))
+        return True
+
+    def release(self):
+        """
+        Give up the lease.
+        """
+        if self.held():
+            self.path(self.generation).unlink()
+        self.generation = None
+
+class Worker():
+    """
+    One of several workers, on one or many nodes, that share the inputs of
+    a batch through a queue directory on a shared filesystem. Nothing but
+    the filesystem is used to coordinate.
+
+    Each worker claims an input by taking its :py:class:`Lease`, records
+    the attempt, runs the pipeline (without merging), and records the
+    result in ``results/<key>.json``. While it works, a heartbeat thread
+    renews its lease; the lease of a worker that crashed expires after
+    ``lease_timeout`` seconds and the input is claimed again (up to
+    ``max_attempts`` times in all). Lease ages are measured by the file
+    server's clock, so the nodes' clocks need not agree.
+
+    Once every input has a final result and no lease is live, the worker
+    that takes the merge lease records every dataset in its output
+    directory's catalogue and merges each output directory, then writes
+    ``merged.json``. Meanwhile the other workers wait, and take over if
+    the merging worker's lease expires. Only the merging worker writes to
+    a catalogue, as SQLite locking cannot be trusted on network
+    filesystems.
+
+    :param source: Directory, glob pattern, manifest file, or list thereof (see :py:func:`pdgpoints.batch.find_inputs`)
+    :type source: str or pathlib.Path or list
+    :param queue_dir: The shared queue directory
+    :type queue_dir: str or pathlib.Path
+    :param bool merge: Whether to merge the output directories once every input is finished
+    :param float heartbeat: Seconds between heartbeats
+    :param float lease_timeout: Seconds without a heartbeat after which a lease expires
+    :param float poll: Seconds between checks while waiting for other workers
+    :param int max_attempts: Number of times an input is tried
+    :param kwargs: Keyword arguments passed to each :py:class:`pdgpoints.pipeline.Pipeline`
+    """
+    def __init__(self,
+                 source: Union[str, Path, list],
+                 queue_dir: Union[str, Path],
+                 merge: bool=True,
+                 heartbeat: float=DEFAULT_HEARTBEAT,
+                 lease_timeout: float=DEFAULT_LEASE_TIMEOUT,
+                 poll: float=DEFAULT_POLL,
+                 max_attempts: int=DEFAULT_MAX_ATTEMPTS,
+                 **kwargs):
+        self.L = getLogger(__name__)
+        self.source = source
+        self.queue_dir = Path(queue_dir).absolute()
+        self.merge = merge
+        self.heartbeat_interval = heartbeat
+        self.lease_timeout = lease_timeout
+        self.poll = poll
+        self.max_attempts = max_attempts
+        self.catalog = kwargs.pop('catalog', True)
+        self.kwargs = dict(kwargs, merge=False, catalog=False)
+        self.id = '%s-%s-%s' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:6])
+        self.lease_dir = self.queue_dir / 'leases'
+        self.result_dir = self.queue_dir / 'results'
+        self.worker_dir = self.queue_dir / 'workers'
+        self.worker_file = self.worker_dir / ('%s.json' % (self.id))
+        self.merged_file = self.queue_dir / 'merged.json'
+        for d in [self.lease_dir, self.result_dir, self.worker_dir]:
+            d.mkdir(parents=True, exist_ok=True)
+        self.lease = None
+        self.finished = {}
+        self.processed = []
+        self.stopping = threading.Event()
+
+    def clock(self) -> float:
+        """
+        Get the current time by the shared filesystem's clock, by touching
+        this worker's file and reading back its modification time.
+
+        :return: The file server's current time
+        :rtype: float
+        """
+        os.utime(self.worker_file)
+        return self.worker_file.stat().st_mtime
+
+    def beat(self):
+        """
+        Heartbeat thread: touch this worker's file and renew the lease it
+        holds until the worker stops.
+        """
+        while not self.stopping.wait(self.heartbeat_interval):
+            try:
+                os.utime(self.worker_file)
+                lease = self.lease
+                if (lease is not None) and not lease.heartbeat():
+                    self.L.warning('Lost lease %s to another worker' % (lease.name))
+            except OSError as e:
+                self.L.warning('Heartbeat failed: %s' % (e))
+
+    def leased(self, key: str) -> bool:
+        """
+        Check whether another worker holds a live lease on an input.
+
+        :param str key: The input's queue key
+        :return: Whether the input's newest lease has not expired (and is not this worker's)
+        :rtype: bool
+        """
+        if (self.lease is not None) and (self.lease.name == key):
+            return False
+        lease = Lease(self.lease_dir, key, self.id)
+        gens = lease.generations()
+        if not gens:
+            return False
+        now = self.clock()
+        try:
+            return now - lease.path(gens[-1]).stat().st_mtime < self.lease_timeout
+        except FileNotFoundError:
+            return False
+
+    def result(self, key: str) -> Union[dict, None]:
+        """
+        Get the latest result record of an input. Final records (done, or
+        failed on the last attempt) are cached. A record still running on
+        the last attempt is taken as failed once its lease has expired, as
+        the worker running it has crashed.
+
+        :param str key: The input's queue key
+        :return: The record, or None if the input was never tried
+        :rtype: dict or None
+        """
+        if key in self.finished:
+            return self.finished[key]
+        f = self.result_dir / ('%s.json' % (key))
+        r = read_json(f)
+        if r and (r['state'] == 'running') and (r['attempts'] >= self.max_attempts) and not self.leased(key):
+            # read it again, as the worker may have finished just before it released the lease
+            r = read_json(f)
+            if r['state'] == 'running':
+                r = dict(r, state='failed', error='Worker %s stopped during the last attempt' % (r['worker']))
+        if r and ((r['state'] == 'done') or ((r['state'] == 'failed') and (r['attempts'] >= self.max_attempts))):
+            self.finished[key] = r
+        return r
+
+    def claim(self, f: Path, key: str) -> bool:
+        """
+        Try to claim an input and, if claimed, process it.
+
+        :param f: The input file
+        :type f: pathlib.Path
+        :param str key: The input's queue key
+        :return: Whether the input was claimed
+        :rtype: bool
+        """
+        lease = Lease(self.lease_dir, key, self.id)
+        if not lease.acquire(now=self.clock(), timeout=self.lease_timeout):
+            return False
+        self.lease = lease
+        try:
+            # another worker may have finished it between our check and the claim
+            r = self.result(key)
+            if key in self.finished:
+                return True
+            attempts = (r['attempts'] if r else 0) + 1
+            utils.write_json_atomic(self.result_dir / ('%s.json' % (key)),
+                                    {'file': str(f), 'state': 'running', 'attempts': attempts, 'worker': self.id})
+            self.L.info('Processing %s (attempt %s of %s)' % (f, attempts, self.max_attempts))
+            result = batch.run_one(f, self.kwargs)
+            if not lease.held():
+                self.L.warning('Lease on %s was reclaimed while it was processed; discarding the result' % (f))
+                return True
+            result.update(state='done' if result['ok'] else 'failed', attempts=attempts, worker=self.id)
+            utils.write_json_atomic(self.result_dir / ('%s.json' % (key)), result)
+            self.processed.append(result)
+            if not result['ok']:
+                self.L.error('Failed to process %s (attempt %s of %s):\n%s' % (f, attempts, self.max_attempts,
+                                                                               result['error']))
+            return True
+        finally:
+            self.lease = None
+            lease.release()
+
+    def live_leases(self) -> int:
+        """
+        Count the input leases that have not expired.
+
+        :return: Number of live leases
+        :rtype: int
+        """
+        now = self.clock()
+        live = 0
+        for n in os.listdir(self.lease_dir):
+            if n.startswith('.') or n.startswith(MERGE_LEASE + '.'):
+                continue
+            try:
+                if now - (self.lease_dir / n).stat().st_mtime < self.lease_timeout:
+                    live += 1
+            except FileNotFoundError:
+                pass
+        return live
+
+    def merge_all(self, results: list[dict]) -> list[str]:
+        """
+        Catalogue and merge every output directory (on the elected worker).
+
+        :param list results: The successful result records
+        :return: The merged output directories
+        :rtype: list
+        """
+        if self.catalog:
+            for out_dir in sorted(set(r['out_dir'] for r in results)):
+                cat = Catalog(out_dir)
+                for r in results:
+                    if (r['out_dir'] == out_dir) and r.get('entry'):
+                        cat.add(**r['entry'])
+        return batch.merge_results(results, **batch.merge_options(self.kwargs))
+
+    def try_merge(self, keys: list[str]) -> bool:
+        """
+        Merge if no other worker is merging and it has not been done yet.
+
+        :param list keys: The queue keys of every input
+        :return: Whether the merge of the current results is done
+        :rtype: bool
+        """
+        ok = sorted(k for k in keys if self.finished[k]['state'] == 'done')
+        marker = read_json(self.merged_file)
+        if marker and (marker['keys'] == ok):
+            return True
+        lease = Lease(self.lease_dir, MERGE_LEASE, self.id)
+        if not lease.acquire(now=self.clock(), timeout=self.lease_timeout):
+            return False
+        self.lease = lease
+        try:
+            marker = read_json(self.merged_file)
+            if marker and (marker['keys'] == ok):
+                return True
+            mergestart = utils.timer()
+            self.L.info('Elected to merge %s datasets' % (len(ok)))
+            merged = self.merge_all([self.finished[k] for k in ok])
+            if lease.held():
+                utils.write_json_atomic(self.merged_file, {'keys': ok, 'out_dirs': merged, 'worker': self.id,
+                                                           'seconds': utils.timer(mergestart)[0]})
+            return True
+        finally:
+            self.lease = None
+            lease.release()
+
+    def run(self) -> dict:
+        """
+        Claim and process inputs until none are left, then merge (or wait
+        for the elected worker to merge).
+
+        :return: Summary with ``worker``, ``total``, ``processed``, ``succeeded``, ``failed``, and ``merged`` keys
+        :rtype: dict
+        """
+        runstart = utils.timer()
+        files = batch.find_inputs(self.source)
+        keys = [file_key(f) for f in files]
+        utils.write_json_atomic(self.worker_file, {'worker': self.id, 'host': socket.gethostname(), 'pid': os.getpid()})
+        self.L.info('Worker %s: %s inputs in %s' % (self.id, len(files), self.queue_dir))
+        beat = threading.Thread(target=self.beat, daemon=True)
+        beat.start()
+        # start at a different place in the list on each worker to spread out the claims
+        offset = int(hashlib.blake2b(self.id.encode(), digest_size=4).hexdigest(), 16) % max(len(files), 1)
+        order = list(range(offset, len(files))) + list(range(offset))
+        try:
+            while not self.stopping.is_set():
+                claimed = False
+                for i in order:
+                    self.result(keys[i])
+                    if (keys[i] not in self.finished) and self.claim(files[i], keys[i]):
+                        claimed = True
+                        break
+                if claimed:
+                    continue
+                if all(k in self.finished for k in keys) and (self.live_leases() == 0):
+                    if (not self.merge) or self.try_merge(keys):
+                        break
+                self.stopping.wait(self.poll)
+        finally:
+            self.stopping.set()
+            beat.join()
+            self.worker_file.unlink(missing_ok=True)
+        summary = {'worker': self.id,
+                   'total': len(files),
+                   'processed': len(self.processed),
+                   'succeeded': len([r for r in self.finished.values() if r['state'] == 'done']),
+                   'failed': [r['file'] for r in self.finished.values() if r['state'] != 'done'],
+                   'merged': (read_json(self.merged_file) or {}).get('out_dirs', []),
+                   'results': self.processed}
+        self.L.info('Worker %s processed %s files; %s of %s inputs done (%.1f sec / %.1f min)' % ((self.id,
+                    summary['processed'], summary['succeeded'], summary['total']) + utils.timer(runstart)))
+        return summary
+
+    def stop(self):
+        """
+        Ask the worker to stop after the input it is processing.
+        """
+        self.stopping.set()
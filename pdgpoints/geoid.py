@@ -1,10 +1,14 @@
 from typing import Union, Literal
-from pyproj import CRS, Transformer
+import numpy as np
+from pyproj import CRS
 from logging import getLogger
 
 from pyegt.height import HeightModel
 from pyegt.utils import model_search
 
+from . import crs_registry
+from . import profiling
+
 def use_model(user_vrs: Union[str, Literal[None]]=None,
                las_vrs: Union[str, Literal[None]]=None, # overrides user_vrs.
                # consequently implies we trust file headers;
@@ -103,34 +107,31 @@ def use_model(user_vrs: Union[str, Literal[None]]=None,
                 exit(1)
     return vrs
 
-def crs_to_wgs84(x: Union[str, int, float], y: Union[str, int, float], from_crs: Union[CRS, int, str]):
+def crs_to_wgs84(x: Union[str, int, float, np.ndarray],
+                 y: Union[str, int, float, np.ndarray],
+                 from_crs: Union[CRS, int, str]):
     """
     Convert grid coordinates to cartographic (lat/lon) in order to use the
     :py:class:`pyegt.height.HeightModel` API lookup.
+    Transformers are shared through :py:mod:`pdgpoints.crs_registry`, and
+    arrays of coordinates are converted in one vectorized call.
 
-    :param x: The X-coordinate to convert to longitude
-    :type x: str or int or float
-    :param y: The Y-coordinate to convert to latitude
-    :type y: str or int or float
+    :param x: The X-coordinate(s) to convert to longitude
+    :type x: str or int or float or numpy.ndarray
+    :param y: The Y-coordinate(s) to convert to latitude
+    :type y: str or int or float or numpy.ndarray
     :param from_crs: The projected coordinate reference system to convert from
     :type from_crs: pyproj.crs.CRS or int or str
-    :return: The lat and long position equivalent to the X and Y position in the input CRS
-    :rtype: tuple(float, float)
+    :return: The lat and long position(s) equivalent to the X and Y position(s) in the input CRS
+    :rtype: tuple(float, float) or tuple(numpy.ndarray, numpy.ndarray)
     """
-    if type(from_crs) == int:
-        crs = CRS.from_epsg(from_crs)
-    elif type(from_crs) == CRS:
-        crs = from_crs
-    elif type(from_crs) == str:
-        if "AUTHORITY" in from_crs:
-            crs = CRS.from_wkt(from_crs)
-        else:
-            crs = CRS.from_string(from_crs)
-    wgs84 = CRS.from_epsg(4326)
-    t = Transformer.from_crs(crs_from=crs, crs_to=wgs84)
+    t = crs_registry.get_transformer(crs_from=from_crs, crs_to=4326)
+    if np.ndim(x) or np.ndim(y):
+        return t.transform(xx=np.asarray(x, dtype=np.float64),
+                           yy=np.asarray(y, dtype=np.float64))
     return t.transform(xx=float(x), yy=float(y))
 
-def get_adjustment(lat: float, lon: float, model=str, region=str):
+def get_adjustment(lat: float, lon: float, model=str, region=str, cache=None):
     """
     Get the modeled height of a specified location and a specified geoid or
     tidal model from :py:class:`pyegt.height.HeightModel`.
@@ -139,7 +140,13 @@ def get_adjustment(lat: float, lon: float, model=str, region=str):
     :param float lon: Decimal longitude
     :param str model: The geoid or tidal model to query the height of
     :param str region: The geoid or tidal region (for options, see :py:data:`pyegt.defs.REGION`)
+    :param cache: Persistent cache to look the height up in (default: always query the model)
+    :type cache: pdgpoints.geoid_cache.GeoidCache or None
     :return: The ellipsoid height of the given geoid model at the given location
-    :rtype: pyegt.height.HeightModel
+    :rtype: pyegt.height.HeightModel or float
     """
-    return HeightModel(lat=lat, lon=lon, from_model=model, region=region)
+    if cache is not None:
+        return cache.lookup(lat=lat, lon=lon, model=model, region=region)
+    profiling.count('geoid.queries')
+    with profiling.section('geoid_query'):
+        return HeightModel(lat=lat, lon=lon, from_model=model, region=region)
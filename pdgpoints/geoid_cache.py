@@ -0,0 +1,201 @@
+import math
+import sqlite3
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Tuple, Union
+from logging import getLogger
+
+from .defs import CACHE_DIR
+from . import profiling
+
+DEFAULT_CACHE_FILE = CACHE_DIR / 'geoid.sqlite'
+"Default location of the geoid height cache database"
+DEFAULT_RESOLUTION = 0.01
+"Default size of a cache cell in decimal degrees (about 1 km of latitude)"
+DEFAULT_TTL = 90 * 24 * 3600
+"Default number of seconds a cached height stays valid"
+DEFAULT_MAX_ENTRIES = 100000
+"Default number of cells kept before the least recently used are evicted"
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS heights (
+    model TEXT NOT NULL,
+    region TEXT NOT NULL,
+    resolution REAL NOT NULL,
+    lat_cell INTEGER NOT NULL,
+    lon_cell INTEGER NOT NULL,
+    height REAL NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (model, region, resolution, lat_cell, lon_cell)
+);
+CREATE INDEX IF NOT EXISTS heights_accessed ON heights (accessed);
+'''
+
+class GeoidCache():
+    """
+    Persistent, process-safe cache of geoid/tidal model heights.
+
+    Heights are keyed by model, region, and a lat/lon cell of
+    ``resolution`` degrees, and are always looked up at the center of the
+    cell so that every file falling in the same cell gets the same value
+    regardless of which one populated the cache.
+    The cache is an SQLite database in WAL mode, so several processes
+    (e.g. a batch run) can read and write it at once.
+
+    :param path: The cache database file
+    :type path: str or pathlib.Path
+    :param float resolution: Cell size in decimal degrees
+    :param ttl: Seconds a cached height stays valid (None to never expire)
+    :type ttl: int or float or None
+    :param int max_entries: Number of cells to keep before evicting the least recently used
+    :param height_model: Callable taking ``lat``, ``lon``, ``from_model``, and ``region`` keywords and returning an object convertible to float (default: :py:class:`pyegt.height.HeightModel`)
+    :type height_model: callable or None
+    """
+    def __init__(self,
+                 path: Union[str, Path]=DEFAULT_CACHE_FILE,
+                 resolution: float=DEFAULT_RESOLUTION,
+                 ttl: Union[int, float, None]=DEFAULT_TTL,
+                 max_entries: int=DEFAULT_MAX_ENTRIES,
+                 height_model: Union[Callable, None]=None):
+        self.L = getLogger(__name__)
+        self.path = Path(path)
+        self.resolution = float(resolution)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        if height_model is None:
+            from pyegt.height import HeightModel as height_model
+        self.height_model = height_model
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as con:
+            con.executescript(SCHEMA)
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Open a connection to the cache database.
+        Connections wait up to 30 seconds for other writers instead of failing.
+
+        :return: The connection
+        :rtype: sqlite3.Connection
+        """
+        con = sqlite3.connect(self.path, timeout=30)
+        con.execute('PRAGMA journal_mode=WAL')
+        return con
+
+    def cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        """
+        Get the cell indices of a location.
+
+        :param float lat: Decimal latitude
+        :param float lon: Decimal longitude
+        :return: Latitude and longitude cell index
+        :rtype: int, int
+        """
+        return math.floor(lat / self.resolution), math.floor(lon / self.resolution)
+
+    def center(self, lat_cell: int, lon_cell: int) -> Tuple[float, float]:
+        """
+        Get the center of a cell.
+
+        :param int lat_cell: Latitude cell index
+        :param int lon_cell: Longitude cell index
+        :return: Decimal latitude and longitude of the cell center
+        :rtype: float, float
+        """
+        return (lat_cell + 0.5) * self.resolution, (lon_cell + 0.5) * self.resolution
+
+    def get(self, lat: float, lon: float, model: str, region: str) -> Union[float, None]:
+        """
+        Get a cached height, if there is a valid one.
+
+        :param float lat: Decimal latitude
+        :param float lon: Decimal longitude
+        :param str model: The geoid or tidal model
+        :param str region: The geoid or tidal region
+        :return: The cached height or None
+        :rtype: float
+        """
+        lat_cell, lon_cell = self.cell(lat, lon)
+        key = (str(model), str(region), self.resolution, lat_cell, lon_cell)
+        now = time.time()
+        with self.connect() as con:
+            row = con.execute('SELECT height, created FROM heights WHERE model=? AND region=? '
+                              'AND resolution=? AND lat_cell=? AND lon_cell=?', key).fetchone()
+            if row is None:
+                return None
+            height, created = row
+            if (self.ttl is not None) and (now - created > self.ttl):
+                con.execute('DELETE FROM heights WHERE model=? AND region=? '
+                            'AND resolution=? AND lat_cell=? AND lon_cell=?', key)
+                return None
+            con.execute('UPDATE heights SET accessed=? WHERE model=? AND region=? '
+                        'AND resolution=? AND lat_cell=? AND lon_cell=?', (now,) + key)
+        return height
+
+    def put(self, lat: float, lon: float, model: str, region: str, height: float):
+        """
+        Store a height and evict the least recently used cells if the cache is full.
+
+        :param float lat: Decimal latitude
+        :param float lon: Decimal longitude
+        :param str model: The geoid or tidal model
+        :param str region: The geoid or tidal region
+        :param float height: The model height at the cell center
+        """
+        lat_cell, lon_cell = self.cell(lat, lon)
+        now = time.time()
+        with self.connect() as con:
+            con.execute('INSERT OR REPLACE INTO heights VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (str(model), str(region), self.resolution, lat_cell, lon_cell,
+                         float(height), now, now))
+            if self.max_entries:
+                con.execute('DELETE FROM heights WHERE rowid IN (SELECT rowid FROM heights '
+                            'ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def lookup(self, lat: float, lon: float, model: str, region: str) -> float:
+        """
+        Get the model height of the cell containing a location, querying
+        the height model (at the cell center) on a cache miss.
+
+        :param float lat: Decimal latitude
+        :param float lon: Decimal longitude
+        :param str model: The geoid or tidal model
+        :param str region: The geoid or tidal region
+        :return: The model height
+        :rtype: float
+        """
+        height = self.get(lat, lon, model, region)
+        if height is not None:
+            profiling.count('geoid.cache_hits')
+            self.L.info('Geoid cache hit for %s (%s) at (%.3f, %.3f): %.3f' % (model, region, lat, lon, height))
+            return height
+        clat, clon = self.center(*self.cell(lat, lon))
+        self.L.info('Geoid cache miss for %s (%s) at (%.3f, %.3f); querying cell center (%.4f, %.4f)' % (model, region,
+                                                                                                         lat, lon,
+                                                                                                         clat, clon))
+        profiling.count('geoid.queries')
+        with profiling.section('geoid_query'):
+            height = float(self.height_model(lat=clat, lon=clon, from_model=model, region=region))
+        self.put(lat, lon, model, region, height)
+        return height
+
+    def warm(self, coords: Iterable[Tuple[float, float]], model: str, region: str) -> int:
+        """
+        Fill the cache ahead of time (e.g. before an offline batch run).
+
+        :param coords: Decimal (lat, lon) pairs
+        :type coords: list
+        :param str model: The geoid or tidal model
+        :param str region: The geoid or tidal region
+        :return: The number of cells that had to be queried
+        :rtype: int
+        """
+        queried = 0
+        cells = sorted(set(self.cell(lat, lon) for lat, lon in coords))
+        for lat_cell, lon_cell in cells:
+            lat, lon = self.center(lat_cell, lon_cell)
+            if self.get(lat, lon, model, region) is None:
+                self.lookup(lat, lon, model, region)
+                queried += 1
+        self.L.info('Warmed %s cells (%s queried, %s already cached)' % (len(cells), queried, len(cells) - queried))
+        return queried
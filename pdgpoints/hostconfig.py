@@ -0,0 +1,51 @@
+import json
+import socket
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Union
+from logging import getLogger
+
+from .defs import HOST_PROFILES
+
+def load_profile(f: Union[str, Path, None]=None,
+                 host: Union[str, None]=None) -> dict:
+    """
+    Get the settings profile for this host from a JSON file keyed by
+    hostname. Keys can be exact hostnames or shell-style patterns
+    (e.g. ``"node-*"``); the ``"default"`` entry applies to every host,
+    then the first matching pattern, then the exact hostname, each
+    overriding the last. For example::
+
+        {
+            "default": {"jobs": 4, "cache_size": 1000},
+            "node-*": {"jobs": 60, "cache_size": 16000, "split_workers": 4},
+            "small-vm": {"jobs": 1, "cache_size": 300}
+        }
+
+    The ``jobs`` and ``cache_size`` entries are used by every
+    :py:class:`pdgpoints.pipeline.Pipeline`; the command line tools also
+    take any other entry named after a long option (e.g.
+    ``split_workers``) as that option's default.
+
+    :param f: The profile file (default: :py:data:`pdgpoints.defs.HOST_PROFILES`)
+    :type f: str or pathlib.Path or None
+    :param host: The hostname to look up (default: this host)
+    :type host: str or None
+    :return: The merged settings (empty if there is no profile file)
+    :rtype: dict
+    """
+    L = getLogger(__name__)
+    f = Path(f) if f else HOST_PROFILES
+    host = host or socket.gethostname()
+    if not f.is_file():
+        return {}
+    with open(f, 'r') as fr:
+        profiles = json.load(fr)
+    settings = dict(profiles.get('default', {}))
+    for pattern, s in profiles.items():
+        if (pattern not in ['default', host]) and fnmatch(host, pattern):
+            settings.update(s)
+            break
+    settings.update(profiles.get(host, {}))
+    L.debug('Host profile for %s from %s: %s' % (host, f, settings))
+    return settings
@@ -0,0 +1,402 @@
+import os
+import json
+import struct
+from pathlib import Path
+from typing import Tuple, TYPE_CHECKING
+from logging import getLogger
+
+from . import utils
+from . import profiling
+
+if TYPE_CHECKING:
+    import numpy as np
+
+DEFAULT_SUBTREE_LEVELS = 6
+"Default number of tree levels in each subtree availability file"
+CONTENT_DIR = 'content'
+"Subdirectory of a dataset holding the point content of implicit tiles"
+SUBTREE_DIR = 'subtrees'
+"Subdirectory of a dataset holding the subtree availability files"
+SUBTREE_MAGIC = b'subt'
+"Magic bytes of a binary subtree file"
+SCHEMES = {2: 'QUADTREE', 3: 'OCTREE'}
+"Implicit subdivision scheme by number of subdivided axes"
+
+def template(dir: str, dims: int, suffix: str) -> str:
+    """
+    Build the template URI of the implicit tiles' content or subtree files.
+
+    :param str dir: The subdirectory the files are in
+    :param int dims: Number of subdivided axes (2 for a quadtree, 3 for an octree)
+    :param str suffix: The file suffix
+    :return: The template (e.g. ``content/{level}/{x}/{y}.pnts``)
+    :rtype: str
+    """
+    return '%s/{level}/%s%s' % (dir, '/'.join('{%s}' % (a) for a in 'xyz'[:dims]), suffix)
+
+def cell_path(dir: str, level: int, cell: tuple, suffix: str) -> str:
+    """
+    Fill in a template URI (see :py:func:`template`) for one tile.
+
+    :param str dir: The subdirectory the files are in
+    :param int level: The tile's level
+    :param tuple cell: The tile's coordinates within its level
+    :param str suffix: The file suffix
+    :return: The path, relative to the dataset directory
+    :rtype: str
+    """
+    return '%s/%s/%s%s' % (dir, level, '/'.join(str(c) for c in cell), suffix)
+
+def node_name(uri: str) -> str:
+    """
+    Get the py3dtiles node name (the child index at each level, e.g.
+    ``'0214'``) of a point content file. The converter splits names
+    longer than 8 digits into subdirectories (``02140536/r21.pnts``).
+
+    :param str uri: The content URI, relative to the dataset directory
+    :return: The node name (empty for the root)
+    :rtype: str
+    """
+    p = Path(uri)
+    return ''.join(p.parts[:-1]) + p.stem[1:]
+
+def scheme(aabb: 'np.ndarray', depth: int) -> int:
+    """
+    Find the implicit subdivision scheme that matches the converter's
+    octree. py3dtiles always halves x and y, but only halves z at levels
+    where the node is not much flatter than it is wide, so the tree is an
+    octree only if z was halved at every level; otherwise it is mapped
+    onto a quadtree whose tiles span the whole height.
+
+    :param numpy.ndarray aabb: The converter's root bounding box (min and max corners)
+    :param int depth: Number of levels below the root
+    :return: Number of subdivided axes (2 for a quadtree, 3 for an octree)
+    :rtype: int
+    """
+    from py3dtiles.utils import aabb_size_to_subdivision_type, SubdivisionType
+    size = aabb[1] - aabb[0]
+    for _ in range(depth):
+        half = size * 0.5
+        if aabb_size_to_subdivision_type(half) == SubdivisionType.QUADTREE:
+            return 2
+        size = half
+    return 3
+
+def cell(name: str, dims: int) -> tuple:
+    """
+    Get the implicit tile coordinates of a py3dtiles node. Each digit of
+    the name is the child index at one level, with bit 4 set for the
+    upper half in x, bit 2 for y, and bit 1 for z.
+
+    :param str name: The node name
+    :param int dims: Number of subdivided axes
+    :return: The coordinates within the node's level (the name's length)
+    :rtype: tuple
+    """
+    x = y = z = 0
+    for c in name:
+        c = int(c)
+        x, y, z = 2 * x + ((c >> 2) & 1), 2 * y + ((c >> 1) & 1), 2 * z + (c & 1)
+    return (x, y, z)[:dims]
+
+def morton(cell: tuple) -> int:
+    """
+    Get the Morton (Z-order) index of a tile within its level, with the
+    bits of x, y (and z) interleaved in that order.
+
+    :param tuple cell: The tile's coordinates
+    :return: The index
+    :rtype: int
+    """
+    i = 0
+    for b in range(max(c.bit_length() for c in cell)):
+        for a, c in enumerate(cell):
+            i |= ((c >> b) & 1) << (b * len(cell) + a)
+    return i
+
+def read_tiles(dir: Path) -> Tuple[dict, list[str]]:
+    """
+    List the point content files of a converter output directory and
+    their tiles' bounding boxes, following its external tilesets.
+
+    :param dir: The dataset directory
+    :type dir: pathlib.Path
+    :return: The boxes by content URI, and the external tileset files, relative to ``dir``
+    :rtype: dict, list
+    """
+    contents, externals = {}, []
+    with open(dir / 'tileset.json', 'r') as fr:
+        stack = [(Path('.'), json.load(fr)['root'])]
+    while stack:
+        base, t = stack.pop()
+        uri = t.get('content', {}).get('uri')
+        if uri and uri.endswith('.json'):
+            uri = Path(os.path.normpath(base / uri)).as_posix()
+            externals.append(uri)
+            with open(dir / uri, 'r') as fr:
+                stack.append((Path(uri).parent, json.load(fr)['root']))
+            continue
+        if uri:
+            contents[Path(os.path.normpath(base / uri)).as_posix()] = t['boundingVolume']['box']
+        stack += [(base, c) for c in t.get('children', [])]
+    return contents, externals
+
+def read_points(f: Path) -> tuple:
+    """
+    Read the points of a point content file.
+
+    :param f: The file
+    :type f: pathlib.Path
+    :return: Positions (float32, one row per point), and colors and classifications if the file has them (or None)
+    :rtype: tuple
+    """
+    import numpy as np
+    from py3dtiles.tileset.content import read_binary_tile_content
+    body = read_binary_tile_content(f).body
+    xyz = body.feature_table.body.position.view(np.float32).reshape((-1, 3))
+    rgb = body.feature_table.body.color
+    cls = None
+    if 'Classification' in body.batch_table.header.data:
+        cls = body.batch_table.get_binary_property('Classification')
+    return xyz, None if rgb is None else rgb.reshape((-1, 3)), cls
+
+def write_points(f: Path, parts: list[tuple]):
+    """
+    Write points to a point content file, the way the converter merges
+    small nodes into their parent. Colors and classifications are kept
+    if every part has them.
+
+    :param f: The file to write
+    :type f: pathlib.Path
+    :param list parts: Positions, colors, and classifications (see :py:func:`read_points`)
+    """
+    import numpy as np
+    from py3dtiles.tileset.content import Pnts
+    include_rgb = all(p[1] is not None for p in parts)
+    include_cls = all(p[2] is not None for p in parts)
+    arrays = [np.ascontiguousarray(p[0]).view(np.uint8).ravel() for p in parts]
+    arrays += [p[1].ravel() for p in parts] if include_rgb else []
+    arrays += [p[2].ravel() for p in parts] if include_cls else []
+    Pnts.from_points(np.concatenate(arrays), include_rgb, include_cls).save_as(f)
+
+def rebin(dir: Path, nodes: dict, lo: 'np.ndarray', hi: 'np.ndarray', dims: int) -> set:
+    """
+    Write the points of the converter's nodes to the implicit tiles of
+    their level that hold them. This is needed when points lie outside
+    the converter's root box (which py3dtiles works out from two corners
+    of the input, so the Earth's curvature or a rotated frame can leave
+    points outside it, clamped into the edge nodes): the implicit tree is
+    then laid over a box that holds every point, and its tiles no longer
+    line up with the nodes. One level is held in memory at a time.
+
+    :param dir: The dataset directory
+    :type dir: pathlib.Path
+    :param dict nodes: Content URIs by node name (without the root)
+    :param numpy.ndarray lo: Minimum corner of the implicit root box
+    :param numpy.ndarray hi: Maximum corner of the implicit root box
+    :param int dims: Number of subdivided axes
+    :return: Level and coordinates of the tiles written
+    :rtype: set
+    """
+    import numpy as np
+    written = set()
+    for level in sorted({len(name) for name in nodes}):
+        n = 2 ** level
+        parts = {}
+        for name in [name for name in nodes if len(name) == level]:
+            for uri in nodes[name]:
+                xyz, rgb, cls = read_points(dir / uri)
+                idx = ((xyz[:, :dims] - lo[:dims]) / (hi - lo)[:dims] * n).astype(np.int64).clip(0, n - 1)
+                keys = idx @ (n ** np.arange(dims))
+                order = np.argsort(keys, kind='stable')
+                breaks = np.flatnonzero(np.diff(keys[order])) + 1
+                for sel in np.split(order, breaks):
+                    c = tuple(int(x) for x in idx[sel[0]])
+                    parts.setdefault(c, []).append((xyz[sel], None if rgb is None else rgb[sel],
+                                                    None if cls is None else cls[sel]))
+                (dir / uri).unlink()
+        for c, p in parts.items():
+            out = dir / cell_path(CONTENT_DIR, level, c, '.pnts')
+            out.parent.mkdir(parents=True, exist_ok=True)
+            write_points(out, p)
+            written.add((level, c))
+    return written
+
+def bitstream(bits: set, count: int, views: list, buf: bytearray) -> dict:
+    """
+    Build an availability object: a constant if every tile or none is
+    available, otherwise a bitstream (one bit per tile in Morton order,
+    least significant bit first) appended to the subtree's binary body.
+
+    :param set bits: Indices of the available tiles
+    :param int count: Number of tiles
+    :param list views: Buffer views of the subtree (appended to)
+    :param bytearray buf: Binary body of the subtree (appended to)
+    :return: The availability object
+    :rtype: dict
+    """
+    if not bits:
+        return {'constant': 0}
+    if len(bits) == count:
+        return {'constant': 1}
+    data = bytearray((count + 7) // 8)
+    for i in bits:
+        data[i >> 3] |= 1 << (i & 7)
+    views.append({'buffer': 0, 'byteOffset': len(buf), 'byteLength': len(data)})
+    buf += data + bytes(-len(data) % 8)
+    return {'bitstream': len(views) - 1, 'availableCount': len(bits)}
+
+def write_subtree(f: Path, tiles: set, contents: set, children: set, levels: int, dims: int):
+    """
+    Write a binary subtree file (a 24-byte header, the JSON chunk, and
+    the availability bitstreams, each padded to 8 bytes).
+
+    :param f: The file to write
+    :type f: pathlib.Path
+    :param set tiles: Indices of the available tiles of the subtree (counting every level, root first)
+    :param set contents: Indices of the tiles with content
+    :param set children: Morton indices of the available child subtrees
+    :param int levels: Number of levels in a subtree
+    :param int dims: Number of subdivided axes
+    """
+    n = 2 ** dims
+    views, buf = [], bytearray()
+    subtree = {'tileAvailability': bitstream(tiles, (n ** levels - 1) // (n - 1), views, buf),
+               'contentAvailability': [bitstream(contents, (n ** levels - 1) // (n - 1), views, buf)],
+               'childSubtreeAvailability': bitstream(children, n ** levels, views, buf)}
+    if views:
+        subtree = dict(buffers=[{'byteLength': len(buf)}], bufferViews=views, **subtree)
+    js = json.dumps(subtree, separators=(',', ':')).encode()
+    js += b' ' * (-len(js) % 8)
+    f.parent.mkdir(parents=True, exist_ok=True)
+    with open(f, 'wb') as fw:
+        fw.write(SUBTREE_MAGIC + struct.pack('<IQQ', 1, len(js), len(buf)) + js + bytes(buf))
+
+def convert(dir: Path, aabb: 'np.ndarray', subtree_levels: int=DEFAULT_SUBTREE_LEVELS) -> dict:
+    """
+    Rewrite a converter output directory as a 3D Tiles 1.1 implicit
+    tileset. The converter's root tile keeps its transform and preview
+    points (`r.pnts`); its one child is the root of an implicit quadtree
+    or octree (see :py:func:`scheme`) over the converter's root bounding
+    box, whose tiles are found from template URIs rather than listed:
+    point content in :py:data:`CONTENT_DIR` and, every ``subtree_levels``
+    levels, a subtree file in :py:data:`SUBTREE_DIR` saying which tiles
+    below exist. The size of `tileset.json` no longer grows with the
+    number of tiles, and clients only fetch the subtrees they reach.
+
+    Each node's points go to the tile of its level that holds them (see
+    :py:func:`rebin` for when that is not the node's own cell). Geometric
+    errors halve at each level from the converter's root error, as they
+    do in its own tileset.
+
+    :param dir: The dataset directory
+    :type dir: pathlib.Path
+    :param numpy.ndarray aabb: The converter's root bounding box, in the frame of the root transform
+    :param int subtree_levels: Number of levels in each subtree file
+    :return: Subdivision scheme, available levels, and number of content and subtree files
+    :rtype: dict
+    """
+    import numpy as np
+    L = getLogger(__name__)
+    implicitstart = utils.timer()
+    if subtree_levels < 1:
+        raise ValueError('Subtree levels must be at least 1 (got %s)' % (subtree_levels))
+    ts_path = dir / 'tileset.json'
+    with open(ts_path, 'r') as fr:
+        tileset = json.load(fr)
+    uris, externals = read_tiles(dir)
+    nodes = {}
+    for uri in uris:
+        nodes.setdefault(node_name(uri), []).append(uri)
+    depth = max(len(n) for n in nodes)
+    if depth == 0:
+        L.info('Tileset has a single tile; keeping it explicit')
+        return {}
+    dims = scheme(aabb, depth)
+    # the implicit root box holds every point; in a quadtree, stretching it
+    # in height leaves the tiles in line with the converter's nodes
+    boxes = np.array(list(uris.values()))
+    bounds = np.array([(boxes[:, :3] - boxes[:, 3::4]).min(axis=0), (boxes[:, :3] + boxes[:, 3::4]).max(axis=0)])
+    lo, hi = np.minimum(aabb[0], bounds[0]), np.maximum(aabb[1], bounds[1])
+    tol = 1e-6 * (aabb[1] - aabb[0])
+    outside = ((bounds[0] < aabb[0] - tol) | (bounds[1] > aabb[1] + tol))[:dims].any()
+    if not outside:
+        lo[:dims], hi[:dims] = aabb[0][:dims], aabb[1][:dims]
+
+    if outside:
+        L.info('Points lie outside the converter\'s root box; sorting them into implicit tiles')
+        cells = rebin(dir, {name: files for name, files in nodes.items() if name}, lo, hi, dims)
+    else:
+        # each node's points are in one tile: the nodes the converter split in z share a quadtree tile
+        groups = {}
+        for name, files in nodes.items():
+            if name:
+                groups.setdefault((len(name), cell(name, dims)), []).extend(files)
+        for (level, c), files in groups.items():
+            out = dir / cell_path(CONTENT_DIR, level, c, '.pnts')
+            out.parent.mkdir(parents=True, exist_ok=True)
+            if len(files) == 1:
+                os.replace(dir / files[0], out)
+            else:
+                write_points(out, [read_points(dir / f) for f in files])
+                for f in files:
+                    (dir / f).unlink()
+        cells = set(groups)
+    # the available tiles: every tile with content and its ancestors
+    available = set()
+    for level, c in cells:
+        while (level >= 0) and ((level, c) not in available):
+            available.add((level, c))
+            level, c = level - 1, tuple(x >> 1 for x in c)
+
+    subtrees = {}
+    for level, c in available:
+        top = level - level % subtree_levels
+        r = level - top
+        root = tuple(x >> r for x in c)
+        s = subtrees.setdefault((top, root), (set(), set(), set()))
+        local = tuple(x - (y << r) for x, y in zip(c, root))
+        index = ((2 ** dims) ** r - 1) // (2 ** dims - 1) + morton(local)
+        s[0].add(index)
+        if (level, c) in cells:
+            s[1].add(index)
+    for (top, root), s in subtrees.items():
+        if top > 0:
+            parent = tuple(x >> subtree_levels for x in root)
+            subtrees[(top - subtree_levels, parent)][2].add(morton(tuple(x - (y << subtree_levels)
+                                                                         for x, y in zip(root, parent))))
+    for (top, root), (tiles, contents, children) in subtrees.items():
+        write_subtree(dir / cell_path(SUBTREE_DIR, top, root, '.subtree'), tiles, contents, children,
+                      subtree_levels, dims)
+
+    # remove the converter's node files and directories
+    for uri in externals:
+        (dir / uri).unlink()
+    for d in sorted({p for uri in list(uris) + externals for p in Path(uri).parents if p != Path('.')},
+                    key=lambda p: -len(p.parts)):
+        try:
+            (dir / d).rmdir()
+        except OSError:
+            pass
+
+    root = tileset['root']
+    center = ((lo + hi) * 0.5).tolist()
+    half = ((hi - lo) * 0.5).tolist()
+    root['children'] = [{
+        'boundingVolume': {'box': center + [half[0], 0, 0, 0, half[1], 0, 0, 0, half[2]]},
+        'geometricError': root['geometricError'],
+        'refine': 'ADD',
+        'content': {'uri': template(CONTENT_DIR, dims, '.pnts')},
+        'implicitTiling': {'subdivisionScheme': SCHEMES[dims],
+                           'subtreeLevels': subtree_levels,
+                           'availableLevels': depth + 1,
+                           'subtrees': {'uri': template(SUBTREE_DIR, dims, '.subtree')}},
+    }]
+    tileset['asset']['version'] = '1.1'
+    utils.write_json_atomic(ts_path, tileset)
+    profiling.count('implicit.contents', len(cells))
+    profiling.count('implicit.subtrees', len(subtrees))
+    L.info('Wrote implicit %s of %s levels (%s content files, %s subtrees) (%.1f sec / %.1f min)' % (
+        SCHEMES[dims].lower(), depth + 1, len(cells), len(subtrees), *utils.timer(implicitstart)))
+    return {'scheme': SCHEMES[dims], 'levels': depth + 1, 'subtree_levels': subtree_levels,
+            'contents': len(cells), 'subtrees': len(subtrees)}
@@ -0,0 +1,252 @@
+from pathlib import Path
+from typing import NamedTuple, Tuple, Union
+import struct
+from logging import getLogger
+
+from . import utils
+from . import crs_registry
+
+PROJECTION_USER_ID = 'LASF_Projection'
+"User ID shared by all coordinate system VLRs"
+WKT_RECORD_ID = 2112
+"Record ID of the OGC WKT coordinate system VLR"
+GEOKEY_RECORD_ID = 34735
+"Record ID of the GeoTIFF GeoKeyDirectoryTag VLR"
+
+GEOGRAPHIC_KEY = 2048
+"GeographicTypeGeoKey"
+PROJECTED_KEY = 3072
+"ProjectedCSTypeGeoKey"
+VERTICAL_KEY = 4096
+"VerticalCSTypeGeoKey"
+USER_DEFINED = 32767
+"GeoKey value meaning the CRS is user-defined rather than an EPSG code"
+
+HEADER_FMT = '<4sHH16sBB32s32sHHHIIBHI5I3d3d6d'
+"Struct format of the LAS 1.0-1.2 public header block"
+HEADER_14_FMT = '<QQIQ15Q'
+"Struct format of the fields LAS 1.3 and 1.4 append to the public header block"
+VLR_FMT = '<H16sHH32s'
+"Struct format of a variable length record header"
+EVLR_FMT = '<H16sHQ32s'
+"Struct format of an extended variable length record header"
+
+class VLR(NamedTuple):
+    """
+    A (extended) variable length record.
+    Only coordinate system records carry their data; for all others
+    ``data`` is empty.
+    """
+    user_id: str
+    record_id: int
+    description: str
+    data: bytes
+
+class Header(NamedTuple):
+    """
+    The parts of a LAS/LAZ header needed to plan and describe processing.
+    """
+    version: Tuple[int, int]
+    global_encoding: int
+    header_size: int
+    offset_to_points: int
+    point_format: int
+    point_record_length: int
+    compressed: bool
+    point_count: int
+    scales: Tuple[float, float, float]
+    offsets: Tuple[float, float, float]
+    mins: Tuple[float, float, float]
+    maxs: Tuple[float, float, float]
+    vlrs: list
+    evlrs: list
+
+def _decode(b: bytes) -> str:
+    """
+    Decode a fixed-length, null-padded header string.
+
+    :param bytes b: The raw bytes
+    :return: The decoded string
+    :rtype: str
+    """
+    return b.split(b'\x00', 1)[0].decode('ascii', errors='replace').strip()
+
+def _keep_data(user_id: str) -> bool:
+    """
+    Whether the payload of a record should be read into memory.
+
+    :param str user_id: The record's user ID
+    :rtype: bool
+    """
+    return user_id == PROJECTION_USER_ID
+
+def read_header(f: Path) -> Header:
+    """
+    Read the public header block, VLRs, and EVLRs of a LAS or LAZ file
+    without touching the point records.
+
+    :param f: The file to read
+    :type f: str or pathlib.Path
+    :return: The parsed header
+    :rtype: Header
+    """
+    with open(f, 'rb') as fh:
+        base = fh.read(struct.calcsize(HEADER_FMT))
+        if len(base) < struct.calcsize(HEADER_FMT) or base[:4] != b'LASF':
+            raise ValueError('%s is not a LAS or LAZ file' % (f))
+        (_sig, _source_id, global_encoding, _guid, major, minor, _system, _software,
+         _day, _year, header_size, offset_to_points, n_vlrs, point_format,
+         point_record_length, legacy_count, *rest) = struct.unpack(HEADER_FMT, base)
+        scales = tuple(rest[5:8])
+        offsets = tuple(rest[8:11])
+        maxx, minx, maxy, miny, maxz, minz = rest[11:17]
+        point_count = legacy_count
+        evlr_start, n_evlrs = 0, 0
+        if (major, minor) >= (1, 4):
+            ext = fh.read(struct.calcsize(HEADER_14_FMT))
+            _waveform, evlr_start, n_evlrs, point_count, *_by_return = struct.unpack(HEADER_14_FMT, ext)
+
+        vlrs = []
+        fh.seek(header_size)
+        vlr_size = struct.calcsize(VLR_FMT)
+        for _ in range(n_vlrs):
+            _reserved, user_id, record_id, length, desc = struct.unpack(VLR_FMT, fh.read(vlr_size))
+            user_id = _decode(user_id)
+            if _keep_data(user_id):
+                data = fh.read(length)
+            else:
+                data = b''
+                fh.seek(length, 1)
+            vlrs.append(VLR(user_id, record_id, _decode(desc), data))
+
+        evlrs = []
+        if n_evlrs and evlr_start:
+            fh.seek(evlr_start)
+            evlr_size = struct.calcsize(EVLR_FMT)
+            for _ in range(n_evlrs):
+                _reserved, user_id, record_id, length, desc = struct.unpack(EVLR_FMT, fh.read(evlr_size))
+                user_id = _decode(user_id)
+                if _keep_data(user_id):
+                    data = fh.read(length)
+                else:
+                    data = b''
+                    fh.seek(length, 1)
+                evlrs.append(VLR(user_id, record_id, _decode(desc), data))
+
+    return Header(version=(major, minor),
+                  global_encoding=global_encoding,
+                  header_size=header_size,
+                  offset_to_points=offset_to_points,
+                  point_format=point_format & 0x3F,
+                  point_record_length=point_record_length,
+                  compressed=bool(point_format & 0xC0),
+                  point_count=point_count,
+                  scales=scales,
+                  offsets=offsets,
+                  mins=(minx, miny, minz),
+                  maxs=(maxx, maxy, maxz),
+                  vlrs=vlrs,
+                  evlrs=evlrs)
+
+def get_geokeys(header: Header) -> dict:
+    """
+    Get the GeoTIFF keys stored directly in the GeoKeyDirectoryTag record
+    (keys whose values live in the double or ASCII param records are skipped).
+
+    :param Header header: The parsed header
+    :return: Mapping of key ID to value
+    :rtype: dict
+    """
+    keys = {}
+    for vlr in header.vlrs + header.evlrs:
+        if vlr.user_id == PROJECTION_USER_ID and vlr.record_id == GEOKEY_RECORD_ID:
+            shorts = struct.unpack('<%sH' % (len(vlr.data) // 2), vlr.data[:len(vlr.data) // 2 * 2])
+            n_keys = shorts[3]
+            for i in range(n_keys):
+                key_id, location, _count, value = shorts[4 + i*4:8 + i*4]
+                if location == 0:
+                    keys[key_id] = value
+    return keys
+
+def get_wkt(header: Header) -> Union[str, None]:
+    """
+    Get the OGC WKT stored in a header, if any. EVLRs take precedence
+    over VLRs, as writers use them for WKT too large for a VLR.
+
+    :param Header header: The parsed header
+    :return: The well-known text of the CRS, or None if there is no WKT record
+    :rtype: str
+    """
+    for vlr in header.evlrs + header.vlrs:
+        if vlr.user_id == PROJECTION_USER_ID and vlr.record_id == WKT_RECORD_ID:
+            wkt = vlr.data.split(b'\x00', 1)[0].decode('utf-8', errors='replace').strip()
+            if wkt:
+                return wkt
+    return None
+
+def wkt_from_geokeys(keys: dict) -> Union[str, None]:
+    """
+    Convert EPSG codes in GeoTIFF keys to OGC WKT the way
+    ``las2las -set_ogc_wkt`` would, combining horizontal and vertical
+    codes into a compound CRS.
+
+    :param dict keys: Mapping of GeoKey ID to value (see :py:func:`get_geokeys`)
+    :return: The well-known text of the CRS, or None if the keys do not name an EPSG CRS
+    :rtype: str
+    """
+    from pyproj.crs import CompoundCRS
+    from pyproj.enums import WktVersion
+    h = keys.get(PROJECTED_KEY) or keys.get(GEOGRAPHIC_KEY)
+    v = keys.get(VERTICAL_KEY)
+    h = crs_registry.get_crs(h) if h and h != USER_DEFINED else None
+    v = crs_registry.get_crs(v) if v and v != USER_DEFINED else None
+    if h and v:
+        crs = CompoundCRS(name='%s + %s' % (h.name, v.name), components=[h, v])
+    else:
+        crs = h or v
+    if crs is None:
+        return None
+    return crs.to_wkt(WktVersion.WKT1_GDAL)
+
+def header_wkt(f: Path) -> Union[str, None]:
+    """
+    Get the CRS of a LAS or LAZ file as OGC WKT from its header, falling back
+    to converting GeoTIFF keys if there is no WKT record.
+
+    :param f: The file to read
+    :type f: str or pathlib.Path
+    :return: The well-known text of the CRS, or None if the header has no usable CRS info
+    :rtype: str
+    """
+    header = read_header(f)
+    return get_wkt(header) or wkt_from_geokeys(get_geokeys(header))
+
+def lasinfo(f: Path) -> Tuple[str, str, str, Path, str, str]:
+    """
+    Drop-in replacement for :py:func:`pdgpoints.lastools_iface.lasinfo` that
+    reads CRS info straight from the file's VLRs/EVLRs instead of running
+    ``lasinfo | grep``.
+
+    :param f: The input file
+    :type f: pathlib.Path
+
+    :return: The EPSG code of the CRS, and CRS info as WKT
+    :rtype: str, str, str, pathlib.Path, str, str
+    :raises ValueError: If the header contains no usable CRS info
+    """
+    L = getLogger(__name__)
+    lasinfostart = utils.timer()
+    wkt = header_wkt(f)
+    if wkt is None:
+        raise ValueError('No CRS information found in the header of %s' % (f))
+    L.debug('WKT string: %s' % (wkt))
+    crs, epsg_h, epsg_v, h_name, v_name = utils.get_epsgs_from_wkt(wkt)
+    cpd = 'Compound ' if crs.is_compound else ''
+    L.info('%sCRS: %s' % (cpd, h_name))
+    L.info('%sVRS: %s' % (cpd, v_name))
+    L.debug('%sCRS object: \n%s' % (cpd, repr(crs)))
+    wktf = Path(str(f) + '-wkt.txt')
+    L.info('Writing WKT to %s' % (wktf))
+    utils.write_wkt_to_file(f=wktf, wkt=wkt)
+    L.info('Finished header read (%.1f sec / %.1f min)' % utils.timer(lasinfostart))
+    return epsg_h, epsg_v, wkt, wktf, h_name, v_name
@@ -0,0 +1,285 @@
+from pathlib import Path
+from typing import Tuple, Union
+import struct
+import numpy as np
+import laspy
+from laspy.vlrs.known import WktCoordinateSystemVlr
+from logging import getLogger
+
+from . import utils
+from . import lasheader
+
+DEFAULT_CHUNK_SIZE = 1_000_000
+"Number of point records read and written per iteration"
+
+RGB_FORMATS = {
+    0: 2,
+    1: 3,
+    4: 5,
+    6: 7,
+    9: 10,
+}
+"Mapping of LAS point formats without color to their closest equivalent with RGB"
+
+Z_OFFSET_POS = 171
+"Byte position of the Z offset in the LAS public header block"
+Z_MAX_POS = 211
+"Byte position of the maximum Z value in the LAS public header block (minimum Z follows)"
+
+def rgb_point_format(point_format: int) -> int:
+    """
+    Get the LAS point format id that carries the same fields as the input
+    format plus RGB.
+
+    :param int point_format: The input point format id
+    :return: A point format id that has red, green and blue dimensions
+    :rtype: int
+    """
+    return RGB_FORMATS.get(point_format, point_format)
+
+def scale_intensity(intensity: np.ndarray,
+                    rgb_scale: float=1.0) -> np.ndarray:
+    """
+    Scale intensity values the same way ``las2las -scale_intensity`` does
+    (multiply, truncate, then clamp to the unsigned 16-bit range).
+
+    :param numpy.ndarray intensity: Array of intensity values
+    :param float rgb_scale: Scale multiplier
+    :return: Scaled intensity values
+    :rtype: numpy.ndarray
+    """
+    scaled = np.asarray(intensity, dtype=np.float32) * np.float32(rgb_scale)
+    return np.clip(scaled, 0, 65535).astype(np.uint16)
+
+def intensity_to_rgb(intensity: np.ndarray) -> np.ndarray:
+    """
+    Convert (already scaled) intensity values to a 16-bit color channel the
+    same way the ``-iparse xyziRGB -scale_rgb_up`` pipe does, by shifting
+    8-bit values into the upper byte. Values above 255 are clipped rather
+    than allowed to wrap around as they would in the lastools pipe.
+
+    :param numpy.ndarray intensity: Array of scaled intensity values
+    :return: 16-bit color values
+    :rtype: numpy.ndarray
+    """
+    return (np.minimum(intensity, 255).astype(np.uint16) * 256).astype(np.uint16)
+
+def set_wkt(header: laspy.LasHeader, wkt: str):
+    """
+    Replace any OGC WKT VLR in a header with the given well-known text.
+
+    :param laspy.LasHeader header: The header to modify in place
+    :param str wkt: The well-known text of the CRS
+    """
+    header.vlrs = [v for v in header.vlrs if not isinstance(v, WktCoordinateSystemVlr)]
+    header.vlrs.append(WktCoordinateSystemVlr(wkt))
+    if header.version.minor >= 4:
+        header.global_encoding.wkt = True
+
+def rgb_header(header: laspy.LasHeader,
+               wkt: str=None) -> laspy.LasHeader:
+    """
+    Create an output header from an input header, switching to a point format
+    that has RGB and (optionally) loading a new OGC WKT.
+
+    :param laspy.LasHeader header: The input header
+    :param str wkt: The well-known text of the CRS to write (default: keep existing VLRs)
+    :return: A new header ready to be passed to a writer
+    :rtype: laspy.LasHeader
+    """
+    out = header.copy()
+    out.set_version_and_point_format(header.version,
+                                     laspy.PointFormat(rgb_point_format(header.point_format.id)))
+    if wkt:
+        set_wkt(header=out, wkt=wkt)
+    return out
+
+def rewrite(f: Path,
+            output_file: Path,
+            wkt: Union[str, None]=None,
+            intensity_to_RGB: bool=False,
+            rgb_scale: float=1.0,
+            translate_z: float=0.0,
+            sample_every: int=0,
+            chunk_size: int=DEFAULT_CHUNK_SIZE) -> Tuple[float, float]:
+    """
+    Stream a point cloud from ``f`` to ``output_file`` in one read and one
+    write, optionally loading a new OGC WKT, copying intensity to RGB,
+    translating Z values, and sampling every nth XY position along the way.
+
+    :param f: The input file
+    :type f: str or pathlib.Path
+    :param output_file: The output file
+    :type output_file: str or pathlib.Path
+    :param str wkt: The well-known text of the CRS to write (default: keep existing VLRs)
+    :param bool intensity_to_RGB: Whether or not to copy intensity values to RGB
+    :param float rgb_scale: RGB scale multiplier
+    :param float translate_z: Z translation value
+    :param int sample_every: Sample the XY position of every nth point (0 to skip sampling)
+    :param int chunk_size: Number of points to process per iteration
+    :return: Mean X and Y of the sampled points (None if sampling is off or nothing was sampled)
+    :rtype: float, float
+    """
+    L = getLogger(__name__)
+    sx, sy, n = 0., 0., 0
+    done = 0
+    with laspy.open(f) as reader:
+        if intensity_to_RGB:
+            out_header = rgb_header(reader.header, wkt=wkt)
+        else:
+            out_header = reader.header.copy()
+            if wkt:
+                set_wkt(header=out_header, wkt=wkt)
+        L.debug('Point format: %s -> %s' % (reader.header.point_format.id,
+                                             out_header.point_format.id))
+        with laspy.open(output_file, mode='w', header=out_header) as writer:
+            for chunk in reader.chunk_iterator(chunk_size):
+                if sample_every:
+                    # align the stride to the global point index
+                    first = (-done) % sample_every
+                    sx += float(np.sum(chunk.x[first::sample_every]))
+                    sy += float(np.sum(chunk.y[first::sample_every]))
+                    n += len(range(first, len(chunk), sample_every))
+                done += len(chunk)
+                if intensity_to_RGB:
+                    points = laspy.ScaleAwarePointRecord.zeros(len(chunk), header=out_header)
+                    points.copy_fields_from(chunk)
+                    intensity = scale_intensity(chunk.intensity, rgb_scale=rgb_scale)
+                    rgb = intensity_to_rgb(intensity)
+                    points.intensity = intensity
+                    points.red = rgb
+                    points.green = rgb
+                    points.blue = rgb
+                else:
+                    points = chunk
+                if translate_z:
+                    points.z = chunk.z + translate_z
+                writer.write_points(points)
+    L.info('Rewrote %s points to %s' % (done, output_file))
+    if n:
+        L.info('Sampled %s points (every %sth)' % (n, sample_every))
+        return sx / n, sy / n
+    return None, None
+
+def shift_z(f: Path,
+            translate_z: float):
+    """
+    Translate all Z values of a LAS/LAZ file by moving the Z offset and
+    bounds in its header. Point records are left untouched, so this costs
+    a few bytes of I/O regardless of file size.
+
+    :param f: The file to modify in place
+    :type f: str or pathlib.Path
+    :param float translate_z: Z translation value
+    """
+    L = getLogger(__name__)
+    with open(f, 'r+b') as fh:
+        fh.seek(Z_OFFSET_POS)
+        z_off, = struct.unpack('<d', fh.read(8))
+        fh.seek(Z_MAX_POS)
+        z_max, z_min = struct.unpack('<dd', fh.read(16))
+        fh.seek(Z_OFFSET_POS)
+        fh.write(struct.pack('<d', z_off + translate_z))
+        fh.seek(Z_MAX_POS)
+        fh.write(struct.pack('<dd', z_max + translate_z, z_min + translate_z))
+    L.info('Translated Z values in %s by %.3f (header offset %.3f -> %.3f)' % (f, translate_z,
+                                                                            z_off, z_off + translate_z))
+
+def las2las(f: Path,
+            output_file: Path,
+            archive_dir: Path=Path(''),
+            archive: bool=False,
+            rgb_scale: float=1.0,
+            translate_z: float=0.0,
+            chunk_size: int=DEFAULT_CHUNK_SIZE):
+    """
+    In-process replacement for the intensity to RGB pipe in
+    :py:func:`pdgpoints.lastools_iface.las2las`.
+    Point records are streamed in chunks into NumPy arrays, intensity is
+    scaled and copied into R, G, and B, and the result is written straight
+    to LAS/LAZ without a text round trip.
+
+    The output is not byte-for-byte that of the lastools pipe. The pipe
+    only carries the fields it parses (``xyziRGBtanr``: coordinates,
+    intensity, color, GPS time, scan angle, and return numbers), so it
+    drops classification, flags, user data, point source ID, and extra
+    bytes; here every field of the input is carried through unchanged.
+    GPS times also differ slightly, as the pipe rounds them to the
+    decimals it prints.
+
+    :param f: The input file
+    :type f: str or pathlib.Path
+    :param output_file: The output file
+    :type output_file: str or pathlib.Path
+    :param archive_dir: Location to archive input file, if applicable
+    :type output_file: str or pathlib.Path
+    :param bool archive: Whether or not to archive input files
+    :param float rgb_scale: RGB scale multiplier
+    :param float translate_z: Z translation value
+    :param int chunk_size: Number of points to process per iteration
+    """
+    L = getLogger(__name__)
+    las2lasstart = utils.timer()
+    f = Path(f)
+    wktf = Path(str(f) + '-wkt.txt')
+    wkt = utils.read_wkt_from_file(wktf) if wktf.is_file() else None
+
+    L.info('Copying intensity to RGB in-process (chunk size: %s)' % (chunk_size))
+    rewrite(f=f,
+            output_file=output_file,
+            wkt=wkt,
+            intensity_to_RGB=True,
+            rgb_scale=rgb_scale,
+            translate_z=translate_z,
+            chunk_size=chunk_size)
+
+    if archive:
+        utils.archive_file(f=f, archive_dir=archive_dir)
+
+    L.info('Finished in-process rewrite (%.1f sec / %.1f min)' % utils.timer(las2lasstart))
+
+def fused_rewrite(f: Path,
+                  output_file: Path,
+                  intensity_to_RGB: bool=False,
+                  rgb_scale: float=1.0,
+                  sample_every: int=10000,
+                  chunk_size: int=DEFAULT_CHUNK_SIZE) -> Tuple[str, Path, float, float]:
+    """
+    Do the work of :py:func:`pdgpoints.lastools_iface.las2las_ogc_wkt`,
+    :py:func:`pdgpoints.lastools_iface.lasmean` and
+    :py:func:`pdgpoints.lastools_iface.las2las` in a single streaming read of
+    the input and a single write of the output.
+    Z translation is not applied here because the geoid adjustment depends
+    on the sampled mean; use :py:func:`shift_z` on the output afterwards.
+
+    :param f: The input file
+    :type f: str or pathlib.Path
+    :param output_file: The output file
+    :type output_file: str or pathlib.Path
+    :param bool intensity_to_RGB: Whether or not to copy intensity values to RGB
+    :param float rgb_scale: RGB scale multiplier
+    :param int sample_every: Sample the XY position of every nth point
+    :param int chunk_size: Number of points to process per iteration
+    :return: The WKT of the CRS, the file it was written to, and the mean X and Y of the sampled points
+    :rtype: str, pathlib.Path, float, float
+    """
+    L = getLogger(__name__)
+    fusedstart = utils.timer()
+    wkt = lasheader.header_wkt(f)
+    if wkt is None:
+        raise ValueError('No CRS information found in the header of %s' % (f))
+    L.debug('WKT string: %s' % (wkt))
+    wktf = Path(str(output_file) + '-wkt.txt')
+    L.info('Writing WKT to %s' % (wktf))
+    utils.write_wkt_to_file(f=wktf, wkt=wkt)
+    x, y = rewrite(f=f,
+                   output_file=output_file,
+                   wkt=wkt,
+                   intensity_to_RGB=intensity_to_RGB,
+                   rgb_scale=rgb_scale,
+                   sample_every=sample_every,
+                   chunk_size=chunk_size)
+    if x is not None:
+        L.info('X mean: %.3f Y mean: %.3f' % (x, y))
+    L.info('Finished fused rewrite (%.1f sec / %.1f min)' % utils.timer(fusedstart))
+    return wkt, wktf, x, y
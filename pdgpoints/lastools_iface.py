@@ -1,63 +1,70 @@
+import re
 from pathlib import Path
 from typing import Union, Tuple
-from subprocess import Popen, PIPE, STDOUT, CalledProcessError, check_output
-from datetime import datetime
-import pandas as pd
 from logging import getLogger
 
 from .defs import LAS2LAS_LOC, LASINFO_LOC
 from . import utils
+from . import subproc
 
-def log_subprocess_output(pipe: PIPE):
+WKT_START = re.compile(r'\b(COMPD_CS|PROJCS|GEOGCS|GEOCCS|VERT_CS|COMPOUNDCRS|PROJCRS|GEOGCRS|GEODCRS|VERTCRS|BOUNDCRS)\[')
+"Start of a well-known text (WKT) CRS definition in a line of lasinfo output"
+
+class AmbiguousWKTError(ValueError):
+    """
+    Command output held more than one different WKT string.
     """
-    Log the output from a lastools subprocess.
 
-    :param subprocess.PIPE pipe: The pipe to listen to
-    :param bool verbose: Whether to log more messages 
+def find_wkt(lines: list[str]) -> str:
     """
-    L = getLogger(__name__)
-    try:
-        for line in iter(pipe.readline, b''): # b'\n'-separated lines
-            L.info('subprocess output: %r', line.decode('utf-8').strip())
-    except CalledProcessError as e:
-        L.error("Subprocess Error> %s: %s" % (repr(e), str(e)))
+    Find the single WKT string in lines of command output. Text before
+    the WKT on its line (e.g. a label) is left out, and repeats of the
+    same WKT (e.g. in a VLR and an EVLR) count once.
+
+    :param list lines: The output lines
+    :return: The WKT, or an empty string if there is none
+    :rtype: str
+    :raises pdgpoints.lastools_iface.AmbiguousWKTError: If the lines hold different WKT strings
+    """
+    found = []
+    for line in lines:
+        m = WKT_START.search(line)
+        if m and (line[m.start():].strip() not in found):
+            found.append(line[m.start():].strip())
+    if len(found) > 1:
+        raise AmbiguousWKTError('Found %s different WKT strings:\n%s' % (len(found), '\n'.join(found)))
+    return found[0] if found else ''
 
 def run_proc(command: list[str],
-             get_wkt: bool=False) -> Union[str, None]:
+             get_wkt: bool=False,
+             proc: Union[dict, None]=None) -> Union[str, None]:
     """
-    Start a subprocess with a given command.
+    Run a lastools command with :py:func:`pdgpoints.subproc.run`. Its
+    output is only logged if it fails, in which case a
+    :py:class:`pdgpoints.subproc.CommandError` is raised.
 
     :param list command: List of command arguments
     :param bool get_wkt: Whether to grep the well-known text (WKT) string from lasinfo output
-    :param bool verbose: Whether to log more messages
+    :param proc: Subprocess options, e.g. ``timeout``, ``retries``, and ``memory_mb`` (see :py:func:`pdgpoints.subproc.run_pipe`)
+    :type proc: dict or None
 
-    :return: Well-known text (WKT) of the file's coordinate reference system (CRS)
+    :return: Well-known text (WKT) of the file's coordinate reference system (CRS) (see :py:func:`find_wkt`)
     :rtype: str
+    :raises pdgpoints.lastools_iface.AmbiguousWKTError: If the output holds different WKT strings
     """
-    L = getLogger(__name__)
-    L.debug('Command args: %s' % (command))
-    process = Popen(command,
-                    stdout=PIPE,
-                    stderr=STDOUT)
+    r = subproc.run(command, match='EPSG' if get_wkt else None, **(proc or {}))
     if get_wkt:
-        wktstr = check_output(('grep', 'EPSG'), stdin=process.stdout).decode().strip().strip('\n')
-    # pass pipe to be parsed
-    with process.stdout:
-        log_subprocess_output(process.stdout)
-    # start subprocess
-    exitcode = process.wait()
-    if exitcode != 0:
-        L.error('las2las rewrite subprocess exited with nonzero exit code--check log output')
-        exit(1)
-    if get_wkt:
-        return wktstr
+        return find_wkt(r.matches)
 
-def lasinfo(f: Path) -> Tuple[str, str, str, Path]:
+def lasinfo(f: Path,
+            proc: Union[dict, None]=None) -> Tuple[str, str, str, Path]:
     """
     Use lasinfo to extract CRS info (in EPSG format) from a LAS or LAZ point cloud file.
 
     :param f: The input file
     :type f: pathlib.Path
+    :param proc: Subprocess options (see :py:func:`pdgpoints.subproc.run_pipe`)
+    :type proc: dict or None
 
     :return: The EPSG code of the CRS, and CRS info as WKT
     :rtype: str, str, str, pathlib.Path
@@ -70,7 +77,9 @@ def lasinfo(f: Path) -> Tuple[str, str, str, Path]:
         '-nc', # shaves a lot of time off large jobs by telling lasinfo not to compute min/maxes
         '-stdout',
     ]
-    wkt = run_proc(command=command, get_wkt=True)
+    wkt = run_proc(command=command, get_wkt=True, proc=proc)
+    if not wkt:
+        raise ValueError('No CRS information found in the lasinfo output of %s' % (f))
     L.debug('WKT string: %s' % (wkt))
     crs, epsg_h, epsg_v, h_name, v_name = utils.get_epsgs_from_wkt(wkt)
     cpd = 'Compound ' if crs.is_compound else ''
@@ -80,11 +89,12 @@ def lasinfo(f: Path) -> Tuple[str, str, str, Path]:
     wktf = Path(str(f) + '-wkt.txt')
     L.info('Writing WKT to %s' % (wktf))
     utils.write_wkt_to_file(f=wktf, wkt=wkt)
-    L.info('Finished lasinfo (%s sec / %.1f min)' % utils.timer(lasinfostart))
+    L.info('Finished lasinfo (%.1f sec / %.1f min)' % utils.timer(lasinfostart))
     return epsg_h, epsg_v, wkt, wktf, h_name, v_name
 
 def lasmean(f: Path,
-            name: str="none"):
+            name: str="none",
+            proc: Union[dict, None]=None):
     """
     Use las2txt to output values of X and Y for a dataset,
     then return the mean of those points. To save resources,
@@ -93,9 +103,12 @@ def lasmean(f: Path,
     :param f: The input file
     :type f: str or pathlib.Path
     :param str name: The name of the coordinate reference system in use
+    :param proc: Subprocess options (see :py:func:`pdgpoints.subproc.run_pipe`)
+    :type proc: dict or None
     :return: Mean X and Y of the dataset, and the location of the ascii file used to calculate these
     :rtype: float, float, str
     """
+    import pandas as pd
     L = getLogger(__name__)
     lasmeanstart = utils.timer()
     xyf = Path(str(f) + '-xy.txt')
@@ -107,16 +120,16 @@ def lasmean(f: Path,
         '-o', str(xyf),
         '-oparse', 'xy'
     ]
-    run_proc(command=command)
+    run_proc(command=command, proc=proc)
     df = pd.read_csv(xyf, sep=' ', header=None, names=['x', 'y'])
     mean = df.mean()
     L.info('X mean: %.3f Y mean: %.3f (%s)' % (mean.x, mean.y, name))
-    lasmeantime = (datetime.now() - lasmeanstart).seconds
-    L.info('Finished las2las (%s sec / %.1f min)' % (lasmeantime, lasmeantime/60))
+    L.info('Finished las2las (%.1f sec / %.1f min)' % utils.timer(lasmeanstart))
     return mean.x, mean.y, xyf
 
 def las2las_ogc_wkt(f: Path,
-                    output_file: Path):
+                    output_file: Path,
+                    proc: Union[dict, None]=None):
     """
     Use las2las to write CRS info in OGC WKT format to the output file.
 
@@ -124,10 +137,11 @@ def las2las_ogc_wkt(f: Path,
     :type f: str or pathlib.Path
     :param output_file: The output file
     :type output_file: str or pathlib.Path
-    :param bool verbose: Whether or not to write STDOUT (output will always be written to log file)
+    :param proc: Subprocess options (see :py:func:`pdgpoints.subproc.run_pipe`)
+    :type proc: dict or None
     """
     L = getLogger(__name__)
-    las2lasstart = datetime.now()
+    las2lasstart = utils.timer()
     # construct command
     command = [
             LAS2LAS_LOC,
@@ -135,9 +149,8 @@ def las2las_ogc_wkt(f: Path,
             '-set_ogc_wkt',
             '-o', output_file
         ]
-    run_proc(command=command)
-    las2lastime = (datetime.now() - las2lasstart).seconds
-    L.info('Finished las2las (%s sec / %.1f min)' % (las2lastime, las2lastime/60))
+    run_proc(command=command, proc=proc)
+    L.info('Finished las2las (%.1f sec / %.1f min)' % utils.timer(las2lasstart))
 
 def las2las(f: Path,
             output_file: Path,
@@ -146,7 +159,8 @@ def las2las(f: Path,
             archive: bool=False,
             intensity_to_RGB: bool=False,
             rgb_scale: float=1.0,
-            translate_z: float=0.0):
+            translate_z: float=0.0,
+            proc: Union[dict, None]=None):
     """
     Simple wrapper around las2las to repair and rework LAS files.
     LAS is rewritten with valid VLRs to correct errors propagated by processing suites
@@ -154,7 +168,8 @@ def las2las(f: Path,
     Output is converted to WGS84 earth-centered earth-fixed (ECEF) CRS, EPSG 4326
     by default, to prepare for display in Cesium.
     Also, an option exists to copy intensity values into RGB for viewing.
-    Commands are written to log output and STDOUT from las2las should be as well.
+    Commands are written to debug log output; the output of las2las is only
+    logged if it fails.
 
     :param f: The input file
     :type f: str or pathlib.Path
@@ -166,10 +181,11 @@ def las2las(f: Path,
     :param bool intensity_to_RGB: Whether or not to copy intensity values to RGB
     :param float rgb_scale: RGB scale multiplier
     :param float translate_z: Z translation value
-    :param bool verbose: Whether or not to write STDOUT (output will always be written to log file)
+    :param proc: Subprocess options (see :py:func:`pdgpoints.subproc.run_pipe`)
+    :type proc: dict or None
     """
     L = getLogger(__name__)
-    las2lasstart = datetime.now()
+    las2lasstart = utils.timer()
     # construct command
     wktf = str(f) + '-wkt.txt'
 
@@ -193,13 +209,7 @@ def las2las(f: Path,
             '-load_ogc_wkt', wktf,
             '-o', output_file
         ]
-        L.debug('Cmd L of pipe: %s' % read_command)
-        L.debug('Cmd R of pipe: %s' % write_command)
-        r_process = Popen(read_command, stdout=PIPE)
-        w_process = Popen(write_command, stdin=r_process.stdout, stdout=PIPE)
-        r_process.stdout.close()
-        output = w_process.communicate()[0]
-        L.debug('Piped cmd output: %s' % output)
+        subproc.run_pipe([read_command, write_command], **(proc or {}))
     else:
         L.info('Rewriting LAS to avoid VLR size errors (e.g. PDAL reading QTModeler files)')
         command = [
@@ -209,19 +219,9 @@ def las2las(f: Path,
             '-translate_z', '%s' % (translate_z),
             '-o', output_file
         ]
-        run_proc(command=command)
+        run_proc(command=command, proc=proc)
 
     if archive:
-        # move the file to the archive
-        try:
-            assert (str(archive_dir) != '')
-            an = archive_dir.joinpath(f.name)
-            L.info('Archiving to %s' % (an))
-            f.rename(an)
-        except AssertionError as e:
-            L.error('Archiving is on but no archive directory set! Cannot archive files!')
-        except Exception as e:
-            L.error('%s: %s' % (repr(e), e))
-
-    las2lastime = (datetime.now() - las2lasstart).seconds
-    L.info('Finished las2las (%s sec / %.1f min)' % (las2lastime, las2lastime/60))
+        utils.archive_file(f=f, archive_dir=archive_dir)
+
+    L.info('Finished las2las (%.1f sec / %.1f min)' % utils.timer(las2lasstart))
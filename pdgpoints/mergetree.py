@@ -0,0 +1,298 @@
+import os
+import json
+import math
+import time
+import shutil
+from pathlib import Path
+from typing import Tuple, Union
+from logging import getLogger
+
+from . import utils
+from . import py3dtiles_iface
+
+TREE_DIR = '_tree'
+"Subdirectory of an output directory holding the intermediate node tilesets of a tree merge"
+DEFAULT_FAN_OUT = 64
+"Default largest number of children of a node in a tree merge"
+MIN_FAN_OUT = 4
+"Smallest fan-out, so that every level of the quadtree can be split"
+
+def center(child: dict) -> Tuple[float, float]:
+    """
+    Get the longitude and (geocentric) latitude of the center of a tileset
+    entry's Earth-centered bounding box. This is only used to group
+    datasets, so the spherical approximation is enough.
+
+    :param dict child: A tileset entry (see :py:func:`pdgpoints.py3dtiles_iface.child_tile`)
+    :return: Longitude and latitude in degrees
+    :rtype: float, float
+    """
+    x, y, z = child['boundingVolume']['box'][:3]
+    return math.degrees(math.atan2(y, x)), math.degrees(math.atan2(z, math.hypot(x, y)))
+
+def grid_size(fan_out: int) -> int:
+    """
+    Get the number of cells along each axis that one level of the tree
+    splits a node into: the most quadtree levels taken at once whose cells
+    number at most ``fan_out``.
+
+    :param int fan_out: Largest number of children of a node
+    :return: Cells along each axis (a power of 2)
+    :rtype: int
+    """
+    return 2 ** max(1, int(math.log(fan_out, 4) + 1e-9))
+
+def partition(items: list[tuple], fan_out: int, id: str='0') -> dict:
+    """
+    Group tileset entries into a tree of nodes with at most ``fan_out``
+    children each. A node with too many entries is split into a grid of
+    quadtree cells over the extent of their centers (see
+    :py:func:`grid_size`), and each occupied cell becomes a child node.
+    Entries whose centers all coincide are split into equal groups in
+    order instead.
+
+    :param list items: Longitude, latitude, and tileset entry of each dataset
+    :param int fan_out: Largest number of children of a node
+    :param str id: Identifier of the node (the cell path from the root)
+    :return: The node, with ``id`` and either ``entries`` (a leaf) or ``nodes``
+    :rtype: dict
+    """
+    if len(items) <= fan_out:
+        return {'id': id, 'entries': [c for x, y, c in items]}
+    x0, x1 = min(i[0] for i in items), max(i[0] for i in items)
+    y0, y1 = min(i[1] for i in items), max(i[1] for i in items)
+    if (x1 <= x0) and (y1 <= y0):
+        size = math.ceil(len(items) / fan_out)
+        groups = [items[i:i + size] for i in range(0, len(items), size)]
+    else:
+        n = grid_size(fan_out)
+        cells = {}
+        for i in items:
+            cx = min(n - 1, int((i[0] - x0) / (x1 - x0) * n)) if x1 > x0 else 0
+            cy = min(n - 1, int((i[1] - y0) / (y1 - y0) * n)) if y1 > y0 else 0
+            cells.setdefault(cy * n + cx, []).append(i)
+        groups = [cells[k] for k in sorted(cells)]
+    return {'id': id, 'nodes': [partition(g, fan_out, id='%s-%s' % (id, k)) for k, g in enumerate(groups)]}
+
+def levels(node: dict) -> list[list[dict]]:
+    """
+    List the nodes of a tree by depth, deepest first, so that each level
+    only refers to nodes already built.
+
+    :param dict node: The root node (see :py:func:`partition`)
+    :return: The nodes of each level
+    :rtype: list
+    """
+    out, level = [], [node]
+    while level:
+        out.append(level)
+        level = [n for parent in level for n in parent.get('nodes', [])]
+    return out[::-1]
+
+def union(children: list[dict]) -> dict:
+    """
+    Build the bounding volume and geometric error of a node from its
+    children's, as a root tile without content.
+
+    :param list children: The child tileset entries
+    :return: The tile
+    :rtype: dict
+    """
+    from py3dtiles.tileset.bounding_volume_box import BoundingVolumeBox
+    bv = BoundingVolumeBox.from_dict(children[0]['boundingVolume'])
+    for c in children[1:]:
+        bv.add(BoundingVolumeBox.from_dict(c['boundingVolume']))
+    return {'boundingVolume': bv.to_dict(),
+            'geometricError': max(c['geometricError'] for c in children),
+            'refine': 'REPLACE',
+            'children': children}
+
+def write_node(f: Path, uri: str, children: list[dict]) -> dict:
+    """
+    Write a node tileset, and build the entry that references it from its
+    parent.
+
+    :param f: The node tileset file
+    :type f: pathlib.Path
+    :param str uri: The node's URI relative to its parent
+    :param list children: The node's child entries, with URIs relative to ``f``
+    :return: The entry referencing the node
+    :rtype: dict
+    """
+    root = union(children)
+    utils.write_json_atomic(f, {'asset': {'version': '1.0'},
+                                'geometricError': root['geometricError'],
+                                'root': root})
+    return {'boundingVolume': root['boundingVolume'],
+            'geometricError': root['geometricError'],
+            'refine': 'REPLACE',
+            'content': {'uri': uri}}
+
+def node_children(node: dict, built: dict) -> list[dict]:
+    """
+    Get the child entries of a node tileset in the tree directory: its
+    datasets (one directory up) or its already built child nodes.
+
+    :param dict node: The node (see :py:func:`partition`)
+    :param dict built: Entries of the built nodes, by node ID
+    :return: The child entries
+    :rtype: list
+    """
+    if 'entries' in node:
+        return [dict(c, content={'uri': '../../%s' % (c['content']['uri'])}) for c in node['entries']]
+    return [built[n['id']] for n in node['nodes']]
+
+def write_tree(dir: Path,
+               children: list[dict],
+               fan_out: int=DEFAULT_FAN_OUT,
+               workers: int=1) -> int:
+    """
+    Write a merged root `tileset.json` that references the datasets
+    through a spatial tree of node tilesets (see :py:func:`partition`)
+    instead of listing them all, so the root and every node stay small
+    and the depth grows with the logarithm of the number of datasets.
+    Nodes are written one level at a time, deepest first, with up to
+    ``workers`` processes building the nodes of a level at once.
+
+    Each merge writes its nodes to a new generation directory under
+    :py:data:`TREE_DIR` and replaces the root last, so a client reading
+    the tree during a merge never sees a mix of old and new nodes. The
+    generation the replaced root referenced is kept until the next merge,
+    so a client that loaded the old root can still fetch its nodes; older
+    generations are removed.
+
+    :param dir: Directory holding the root tileset and the dataset subdirectories
+    :type dir: pathlib.Path
+    :param list children: The tileset entry of each dataset (see :py:func:`pdgpoints.py3dtiles_iface.child_tile`)
+    :param int fan_out: Largest number of children of a node
+    :param int workers: Number of processes building nodes
+    :return: Number of levels below the root
+    :rtype: int
+    """
+    L = getLogger(__name__)
+    treestart = utils.timer()
+    if fan_out < MIN_FAN_OUT:
+        raise ValueError('Tree merge fan-out must be at least %s (got %s)' % (MIN_FAN_OUT, fan_out))
+    tree = partition([center(c) + (c,) for c in children], fan_out)
+    nodes = levels(tree)
+    # the root node is written as the root tileset itself
+    below = nodes[:-1]
+    gen = '%x' % (time.time_ns()) if below else None
+    if below:
+        gen_dir = dir / TREE_DIR / gen
+        gen_dir.mkdir(parents=True)
+    built = {}
+    workers = max(1, min(workers, max((len(level) for level in below), default=1)))
+    ex = utils.spawn_pool(workers) if workers > 1 else None
+    try:
+        for level in below:
+            args = [(gen_dir / ('%s.json' % (n['id'])), '%s.json' % (n['id']), node_children(n, built))
+                    for n in level]
+            if ex is not None:
+                entries = list(ex.map(write_node, *zip(*args), chunksize=max(1, len(args) // (4 * workers))))
+            else:
+                entries = [write_node(*a) for a in args]
+            built.update((n['id'], e) for n, e in zip(level, entries))
+    finally:
+        if ex is not None:
+            ex.shutdown()
+
+    if 'entries' in tree:
+        root = union(tree['entries'])
+    else:
+        root = union([dict(built[n['id']], content={'uri': '%s/%s/%s' % (TREE_DIR, gen, built[n['id']]['content']['uri'])})
+                      for n in tree['nodes']])
+    prev = current_generation(dir)
+    utils.write_json_atomic(dir / 'tileset.json', {'asset': {'version': '1.0'},
+                                                   'geometricError': root['geometricError'],
+                                                   'root': root})
+    remove_tree(dir, keep=[gen, prev])
+    L.info('Wrote tree of %s datasets (%s nodes, %s levels below the root, fan-out %s) (%.1f sec / %.1f min)' % (
+        len(children), sum(len(level) for level in below), len(below), fan_out, *utils.timer(treestart)))
+    return len(below)
+
+def current_generation(dir: Path) -> Union[str, None]:
+    """
+    Get the generation of tree nodes the merged root of an output
+    directory references.
+
+    :param dir: The output directory
+    :type dir: pathlib.Path
+    :return: The generation, or None if there is no root or it is not a tree root
+    :rtype: str or None
+    """
+    try:
+        with open(dir / 'tileset.json', 'r') as fr:
+            tileset = json.load(fr)
+    except (OSError, ValueError):
+        return None
+    for c in tileset.get('root', {}).get('children', []):
+        parts = c.get('content', {}).get('uri', '').split('/')
+        if (len(parts) > 2) and (parts[0] == TREE_DIR):
+            return parts[1]
+    return None
+
+def remove_tree(dir: Path, keep: list=[]):
+    """
+    Remove the node tilesets of earlier tree merges. Call
+    :py:func:`current_generation` before replacing a root and keep its
+    generation, so clients that loaded the replaced root can still read it.
+
+    :param dir: The output directory
+    :type dir: pathlib.Path
+    :param list keep: Generations to keep (e.g. the ones the new and the replaced root reference; None entries are ignored)
+    """
+    tree_dir = dir / TREE_DIR
+    if not tree_dir.is_dir():
+        return
+    for d in tree_dir.iterdir():
+        if d.name not in keep:
+            shutil.rmtree(d, ignore_errors=True)
+    if not any(tree_dir.iterdir()):
+        shutil.rmtree(tree_dir, ignore_errors=True)
+
+def read_tree(dir: Path, tileset: dict) -> list[dict]:
+    """
+    Get the dataset entries of a merged root, following the node
+    tilesets of a tree merge down to the datasets. No dataset tileset is
+    read.
+
+    :param dir: Directory holding the root tileset
+    :type dir: pathlib.Path
+    :param dict tileset: The root tileset
+    :return: The dataset entries, with URIs relative to ``dir``
+    :rtype: list
+    """
+    out = []
+    stack = [(Path('.'), c) for c in tileset['root'].get('children', [])]
+    while stack:
+        base, c = stack.pop()
+        uri = Path(os.path.normpath(base / c['content']['uri'])).as_posix()
+        if uri.startswith(TREE_DIR + '/'):
+            with open(dir / uri, 'r') as fr:
+                node = json.load(fr)
+            stack += [(Path(uri).parent, n) for n in node['root'].get('children', [])]
+        else:
+            out.append(dict(c, content={'uri': uri}))
+    return out[::-1]
+
+def read_children(paths: list[Path], dir: Path, workers: int=1) -> list[dict]:
+    """
+    Build the tileset entries of datasets by reading their tilesets (see
+    :py:func:`pdgpoints.py3dtiles_iface.child_tile`), with up to
+    ``workers`` processes reading at once.
+
+    :param list paths: The dataset `tileset.json` files
+    :param dir: Directory of the merged root
+    :type dir: pathlib.Path
+    :param int workers: Number of processes
+    :return: The entries, in the order of ``paths``
+    :rtype: list
+    """
+    paths = [Path(p).absolute() for p in paths]
+    dirs = [dir.absolute()] * len(paths)
+    workers = max(1, min(workers, len(paths)))
+    if workers == 1:
+        return list(map(py3dtiles_iface.child_tile, paths, dirs))
+    with utils.spawn_pool(workers) as ex:
+        return list(ex.map(py3dtiles_iface.child_tile, paths, dirs, chunksize=max(1, len(paths) // (4 * workers))))
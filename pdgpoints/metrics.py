@@ -0,0 +1,205 @@
+import time
+import resource
+import platform
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Union
+from logging import getLogger
+
+from ._version import __version__
+from . import utils
+from . import profiling
+
+def _rusage() -> dict:
+    """
+    Get resource usage of this process and of its waited-for children
+    (e.g. lastools subprocesses and py3dtiles workers).
+
+    :return: CPU seconds, max RSS (bytes), and block I/O (bytes) for self and children
+    :rtype: dict
+    """
+    s = resource.getrusage(resource.RUSAGE_SELF)
+    c = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss_unit = 1 if platform.system() == 'Darwin' else 1024
+    return {
+        'cpu_self': s.ru_utime + s.ru_stime,
+        'cpu_children': c.ru_utime + c.ru_stime,
+        'rss_self': s.ru_maxrss * rss_unit,
+        'rss_children': c.ru_maxrss * rss_unit,
+        'read': (s.ru_inblock + c.ru_inblock) * 512,
+        'write': (s.ru_oublock + c.ru_oublock) * 512,
+    }
+
+def _size(files: list) -> int:
+    """
+    Get the total size of the files (or directory trees) that exist.
+
+    :param list files: Paths to measure
+    :return: Total size in bytes
+    :rtype: int
+    """
+    total = 0
+    for f in files:
+        f = Path(f)
+        if f.is_file():
+            total += f.stat().st_size
+        elif f.is_dir():
+            total += sum(p.stat().st_size for p in f.rglob('*') if p.is_file())
+    return total
+
+class Metrics():
+    """
+    Collect per-stage performance metrics using monotonic, high-resolution
+    clocks.
+
+    For each stage this records wall time, CPU time (this process plus
+    waited-for child processes), peak RSS, bytes read and written, and
+    points per second. Peak RSS values are the process high-water marks
+    at the end of the stage as reported by ``getrusage``, so they never
+    decrease from one stage to the next. Child RSS is the largest single
+    child process.
+
+    Stages can add their own counters with :py:func:`pdgpoints.profiling.count`.
+    With a ``profile_dir``, each stage is also profiled (see
+    :py:class:`pdgpoints.profiling.Profiler`).
+
+    :param str name: Name of the run (e.g. the input file)
+    :param profile_dir: Directory to write profiles to (default: do not profile)
+    :type profile_dir: pathlib.Path or None
+    """
+    def __init__(self, name: str='', profile_dir: Union[Path, None]=None):
+        self.name = name
+        self.stages = {}
+        self.counters = {}
+        self.profiler = profiling.Profiler(profile_dir) if profile_dir else None
+        self.started = datetime.now(timezone.utc).isoformat()
+        self._t0 = time.perf_counter()
+        self._r0 = _rusage()
+
+    @contextmanager
+    def stage(self,
+              name: str,
+              points: Union[int, None]=None,
+              inputs: list=[],
+              outputs: list=[]):
+        """
+        Measure a block of code as a named stage.
+
+        Usage::
+
+            with metrics.stage('rewrite', points=n, inputs=[f], outputs=[o]) as st:
+                ...
+                st['points_out'] = m
+
+        :param str name: The stage name
+        :param int points: Number of points the stage handles (for points/second)
+        :param list inputs: Files the stage reads (their size is recorded as ``input_bytes``)
+        :param list outputs: Files or directories the stage writes (their size is recorded as ``output_bytes``)
+        :return: The stage record, which the block may add fields to
+        :rtype: dict
+        """
+        L = getLogger(__name__)
+        record = {'ok': False}
+        self.stages[name] = record
+        r0 = _rusage()
+        t0 = time.perf_counter()
+        try:
+            with profiling.stage(record, self, self.profiler):
+                if self.profiler is None:
+                    yield record
+                else:
+                    with self.profiler.stage(name):
+                        yield record
+            record['ok'] = True
+        finally:
+            wall = time.perf_counter() - t0
+            r1 = _rusage()
+            record.update({
+                'wall_s': wall,
+                'cpu_s': (r1['cpu_self'] - r0['cpu_self']) + (r1['cpu_children'] - r0['cpu_children']),
+                'cpu_children_s': r1['cpu_children'] - r0['cpu_children'],
+                'peak_rss_bytes': r1['rss_self'],
+                'peak_rss_children_bytes': r1['rss_children'],
+                'io_read_bytes': r1['read'] - r0['read'],
+                'io_write_bytes': r1['write'] - r0['write'],
+                'input_bytes': _size(inputs),
+                'output_bytes': _size(outputs),
+            })
+            if points:
+                record['points'] = points
+                record['points_per_s'] = points / wall if wall > 0 else None
+            L.debug('Stage %s: %.3f s wall, %.3f s CPU' % (name, wall, record['cpu_s']))
+
+    def skip(self, name: str):
+        """
+        Record that a stage was skipped (e.g. because its outputs were up to date).
+
+        :param str name: The stage name
+        """
+        self.stages[name] = {'ok': True, 'skipped': True}
+
+    def count(self, name: str, value: Union[int, float]=1):
+        """
+        Add to a named counter.
+
+        :param str name: The counter name
+        :param value: Amount to add
+        :type value: int or float
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def total(self) -> dict:
+        """
+        Get whole-run totals since this object was created.
+
+        :return: Wall time, CPU time, and peak RSS of the run so far
+        :rtype: dict
+        """
+        r1 = _rusage()
+        return {
+            'wall_s': time.perf_counter() - self._t0,
+            'cpu_s': (r1['cpu_self'] - self._r0['cpu_self']) + (r1['cpu_children'] - self._r0['cpu_children']),
+            'peak_rss_bytes': r1['rss_self'],
+            'peak_rss_children_bytes': r1['rss_children'],
+            'io_read_bytes': r1['read'] - self._r0['read'],
+            'io_write_bytes': r1['write'] - self._r0['write'],
+        }
+
+    def report(self, **extra) -> dict:
+        """
+        Build the machine-readable run report.
+
+        :param extra: Additional top-level fields (e.g. parameters, point count)
+        :return: The report
+        :rtype: dict
+        """
+        d = {
+            'name': self.name,
+            'version': __version__,
+            'host': platform.node(),
+            'started': self.started,
+            'stages': self.stages,
+            'counters': self.counters,
+            'total': self.total(),
+        }
+        d.update(extra)
+        return d
+
+    def write(self, f: Path, **extra) -> Path:
+        """
+        Write the run report as JSON (atomically, via a temporary file).
+
+        :param f: The file to write
+        :type f: pathlib.Path
+        :param extra: Additional top-level fields (see :py:meth:`report`)
+        :return: The file written
+        :rtype: pathlib.Path
+        """
+        f = Path(f)
+        if self.profiler is not None:
+            self.profiler.write()
+        f.parent.mkdir(parents=True, exist_ok=True)
+        utils.write_json_atomic(f, self.report(**extra), indent=2)
+        return f
@@ -1,12 +1,28 @@
+import shutil
 from pathlib import Path
 from typing import Union, Literal
 from pyegt.defs import REGIONS
 from logging import getLogger
 
 from . import utils
-from . import geoid
+from . import centroid
+from . import metrics
+from . import checkpoint
+from . import thin
+from . import subproc
+from . import hostconfig
+from . import lasheader
 from . import lastools_iface
 from . import py3dtiles_iface
+from . import implicit as implicit_tiling
+from . import precompress as precompression
+from .geoid_cache import GeoidCache
+from .catalog import Catalog
+
+RGB_ENGINES = ['lastools', 'laspy']
+CENTROID_STRATEGIES = centroid.STRATEGIES + ['lastools']
+STAGES = ['wkt', 'rewrite', 'thin', 'tile', 'merge', 'complete']
+"Checkpointed stages, in processing order"
 
 class Pipeline():
     """
@@ -19,6 +35,42 @@ class Pipeline():
     :param bool merge: Whether to use py3dtiles.merger.merge() to incorporate the processed dataset into an existing set of 3dtiles datasets
     :param bool intensity_to_RGB: Whether to copy intensity values to RGB (straight copy I->R I->G I->B, so will show up as greyscale)
     :param bool archive: Archive the input dataset to `./archive` directory
+    :param str rgb_engine: Tool to copy intensity to RGB with (``'lastools'`` text pipe or in-process ``'laspy'``)
+    :param bool fused: Whether to do the WKT, mean, and rewrite steps in a single in-process pass
+    :param int sample_every: Sample every nth point when calculating the mean position
+    :param str centroid_strategy: How to calculate the mean position (see :py:func:`pdgpoints.centroid.lasmean`, or ``'lastools'`` for a las2las text dump)
+    :param geoid_cache: Persistent geoid height cache, or the path of one (default: no cache)
+    :type geoid_cache: pdgpoints.geoid_cache.GeoidCache or str or pathlib.Path or None
+    :param bool incremental_merge: Whether to add the new dataset to the existing merged root instead of rebuilding it
+    :param int merge_fan_out: Group the merged datasets into a spatial tree of node tilesets with at most this many children each (0 to list every dataset in the root; see :py:func:`pdgpoints.mergetree.write_tree`)
+    :param int merge_workers: Number of processes reading dataset tilesets and building tree nodes when merging
+    :param bool implicit: Whether to write 3D Tiles 1.1 implicit tiling (template URIs and subtree availability files; see :py:func:`pdgpoints.implicit.convert`) instead of an explicit tile hierarchy
+    :param int subtree_levels: Number of tree levels in each subtree file when writing implicit tiling
+    :param precompress: Encodings to write compressed copies of the tileset files in, for static serving (see :py:func:`pdgpoints.precompress.precompress`; default: none)
+    :type precompress: list or None
+    :param int precompress_workers: Number of threads compressing files
+    :param bool report: Whether to write a JSON report of per-stage metrics to the output tileset directory
+    :param bool resume: Whether to skip stages whose outputs are up to date according to the run manifest
+    :param int split_points: Split files with more points than this into spatial chunks that are tiled separately and stitched into one tileset (0 to never split)
+    :param int split_workers: Number of spatial chunks to tile at once
+    :param jobs: Number of py3dtiles converter processes (default: from the host profile, or the number of CPUs)
+    :type jobs: int or None
+    :param cache_size: py3dtiles converter cache size in MB (default: from the host profile, or a tenth of total memory)
+    :type cache_size: int or None
+    :param bool auto: Whether the pipeline was started by an automatic ingest service rather than by hand
+    :param bool catalog: Whether to record the dataset in the output directory's catalogue (see :py:class:`pdgpoints.catalog.Catalog`)
+    :param thin_mode: How to thin the points before tiling (see :py:data:`pdgpoints.thin.MODES`; default: no thinning)
+    :type thin_mode: str or None
+    :param float thin_spacing: Target distance between thinned points (voxel size in ``'voxel'`` mode)
+    :param int thin_budget: Target number of thinned points (used if ``thin_spacing`` is not set)
+    :param proc_timeout: Seconds a lastools command may run before it is killed (default: no limit)
+    :type proc_timeout: float or None
+    :param int proc_retries: Number of times to retry a lastools command that failed transiently
+    :param proc_memory_mb: Largest address space of a lastools process in MB (default: no limit)
+    :type proc_memory_mb: int or None
+    :param proc_cpu_seconds: Most CPU seconds of a lastools process (default: no limit)
+    :type proc_cpu_seconds: int or None
+    :param bool profile: Whether to profile each stage and write the profiles to a ``profile`` directory beside the run report (see :py:class:`pdgpoints.profiling.Profiler`)
     :param bool verbose: Whether to log more messages
     """
     def __init__(self,
@@ -29,7 +81,35 @@ class Pipeline():
                  translate_z: Union[float, int, Literal[False]]=False,
                  from_geoid: Union[str, Literal[None]]=None,
                  geoid_region: str=REGIONS[0],
-                 archive: bool=False):
+                 archive: bool=False,
+                 rgb_engine: Literal['lastools', 'laspy']='lastools',
+                 fused: bool=False,
+                 sample_every: int=centroid.DEFAULT_STRIDE,
+                 centroid_strategy: str='auto',
+                 geoid_cache: Union[GeoidCache, str, Path, None]=None,
+                 incremental_merge: bool=False,
+                 merge_fan_out: int=0,
+                 merge_workers: int=1,
+                 implicit: bool=False,
+                 subtree_levels: int=implicit_tiling.DEFAULT_SUBTREE_LEVELS,
+                 precompress: Union[list[str], None]=None,
+                 precompress_workers: int=precompression.DEFAULT_WORKERS,
+                 report: bool=True,
+                 resume: bool=True,
+                 split_points: int=0,
+                 split_workers: int=1,
+                 jobs: Union[int, None]=None,
+                 cache_size: Union[int, None]=None,
+                 auto: bool=False,
+                 catalog: bool=True,
+                 thin_mode: Union[str, None]=None,
+                 thin_spacing: float=0.,
+                 thin_budget: int=0,
+                 proc_timeout: Union[float, None]=None,
+                 proc_retries: int=subproc.DEFAULT_RETRIES,
+                 proc_memory_mb: Union[int, None]=None,
+                 proc_cpu_seconds: Union[int, None]=None,
+                 profile: bool=False):
         """
         Initialize the processing pipeline.
 
@@ -43,11 +123,47 @@ class Pipeline():
         :param translate_z: Float translation for z values
         :type translate_z: float or int or False
         :param bool archive: Archive the input dataset to `./archive` directory
+        :param str rgb_engine: Tool to copy intensity to RGB with (``'lastools'`` text pipe or in-process ``'laspy'``)
+        :param bool fused: Whether to do the WKT, mean, and rewrite steps in a single in-process pass
+        :param int sample_every: Sample every nth point when calculating the mean position
+        :param str centroid_strategy: How to calculate the mean position (see :py:func:`pdgpoints.centroid.lasmean`, or ``'lastools'`` for a las2las text dump)
+        :param geoid_cache: Persistent geoid height cache, or the path of one (default: no cache)
+        :type geoid_cache: pdgpoints.geoid_cache.GeoidCache or str or pathlib.Path or None
+        :param bool incremental_merge: Whether to add the new dataset to the existing merged root instead of rebuilding it
+        :param int merge_fan_out: Group the merged datasets into a spatial tree of node tilesets with at most this many children each (0 to list every dataset in the root; see :py:func:`pdgpoints.mergetree.write_tree`)
+        :param int merge_workers: Number of processes reading dataset tilesets and building tree nodes when merging
+        :param bool implicit: Whether to write 3D Tiles 1.1 implicit tiling (template URIs and subtree availability files; see :py:func:`pdgpoints.implicit.convert`) instead of an explicit tile hierarchy
+        :param int subtree_levels: Number of tree levels in each subtree file when writing implicit tiling
+        :param precompress: Encodings to write compressed copies of the tileset files in, for static serving (see :py:func:`pdgpoints.precompress.precompress`; default: none)
+        :type precompress: list or None
+        :param int precompress_workers: Number of threads compressing files
+        :param bool report: Whether to write a JSON report of per-stage metrics to the output tileset directory
+        :param bool resume: Whether to skip stages whose outputs are up to date according to the run manifest
+        :param int split_points: Split files with more points than this into spatial chunks that are tiled separately and stitched into one tileset (0 to never split)
+        :param int split_workers: Number of spatial chunks to tile at once
+        :param jobs: Number of py3dtiles converter processes (default: from the host profile, or the number of CPUs)
+        :type jobs: int or None
+        :param cache_size: py3dtiles converter cache size in MB (default: from the host profile, or a tenth of total memory)
+        :type cache_size: int or None
+        :param bool auto: Whether the pipeline was started by an automatic ingest service rather than by hand
+        :param bool catalog: Whether to record the dataset in the output directory's catalogue (see :py:class:`pdgpoints.catalog.Catalog`)
+        :param thin_mode: How to thin the points before tiling (see :py:data:`pdgpoints.thin.MODES`; default: no thinning)
+        :type thin_mode: str or None
+        :param float thin_spacing: Target distance between thinned points (voxel size in ``'voxel'`` mode)
+        :param int thin_budget: Target number of thinned points (used if ``thin_spacing`` is not set)
+        :param proc_timeout: Seconds a lastools command may run before it is killed (default: no limit)
+        :type proc_timeout: float or None
+        :param int proc_retries: Number of times to retry a lastools command that failed transiently
+        :param proc_memory_mb: Largest address space of a lastools process in MB (default: no limit)
+        :type proc_memory_mb: int or None
+        :param proc_cpu_seconds: Most CPU seconds of a lastools process (default: no limit)
+        :type proc_cpu_seconds: int or None
+        :param bool profile: Whether to profile each stage and write the profiles to a ``profile`` directory beside the run report (see :py:class:`pdgpoints.profiling.Profiler`)
         :param bool verbose: Whether to log more messages
         """
         super().__init__()
         self.starttime = utils.timer()
-        self.auto = False # if auto-processing
+        self.auto = auto # if auto-processing
         self.L = getLogger(__name__)
         self.L.debug('Initializing pipeline.')
         self.f = Path(f).absolute()
@@ -60,6 +176,16 @@ class Pipeline():
         self.archive_dir = self.base_dir / 'archive'
         self.out_dir = self.base_dir / '3dtiles'
         self.las_name = self.rewrite_dir / ('%s.las' % (self.given_name))
+        self.report = report
+        self.report_name = self.out_dir / self.given_name / 'report.json'
+        self.profile = profile
+        self.metrics = metrics.Metrics(name=self.bn,
+                                       profile_dir=self.out_dir / self.given_name / 'profile' if profile else None)
+        self.points = None
+        self.point_record_length = None
+        self.files = []
+        self.complete = False
+        self.merged = False
         self.intensity_to_RGB = intensity_to_RGB
         try:
             self.rgb_scale = float(rgb_scale) if rgb_scale else 1.
@@ -71,102 +197,504 @@ class Pipeline():
         except ValueError:
             self.L.warning('Could not convert Z-translation value to float. Not translating Z values.')
             self.translate_z = 0.
+        if rgb_engine not in RGB_ENGINES:
+            self.L.warning('Unknown RGB engine "%s". Using lastools.' % (rgb_engine))
+            rgb_engine = 'lastools'
+        self.rgb_engine = rgb_engine
+        self.fused = fused
+        self.sample_every = sample_every
+        if centroid_strategy not in CENTROID_STRATEGIES:
+            self.L.warning('Unknown centroid strategy "%s". Using auto.' % (centroid_strategy))
+            centroid_strategy = 'auto'
+        self.centroid_strategy = centroid_strategy
+        self.centroid_time = None
         self.las_crs = None
         self.x = None
         self.y = None
         self.from_geoid = from_geoid
         self.geoid_region = geoid_region
         self.ellips_lkup = None
+        if (geoid_cache is not None) and (not isinstance(geoid_cache, GeoidCache)):
+            geoid_cache = GeoidCache(path=geoid_cache)
+        self.geoid_cache = geoid_cache
         self.geoid_adj = 0
         self.archive = archive
         self.merge = merge
-        self.steps = 4
+        self.incremental_merge = incremental_merge
+        self.merge_fan_out = merge_fan_out
+        self.merge_workers = merge_workers
+        self.implicit = implicit
+        self.subtree_levels = subtree_levels
+        self.precompress = precompression.available(precompress or [])
+        self.precompress_workers = precompress_workers
+        self.resume = resume
+        self.split_points = split_points
+        self.split_workers = split_workers
+        self.split_dir = self.rewrite_dir / ('%s-split' % (self.given_name))
+        if thin_mode and (thin_mode not in thin.MODES):
+            self.L.warning('Unknown thinning mode "%s". Not thinning.' % (thin_mode))
+            thin_mode = None
+        if thin_mode and not (thin_spacing or thin_budget):
+            self.L.warning('Thinning needs a target spacing or point budget. Not thinning.')
+            thin_mode = None
+        self.thin_mode = thin_mode
+        self.thin_spacing = thin_spacing
+        self.thin_budget = thin_budget
+        self.thin_name = self.rewrite_dir / 'thin' / ('%s.las' % (self.given_name))
+        self.tile_name = self.thin_name if thin_mode else self.las_name
+        self.proc = {'timeout': proc_timeout, 'retries': proc_retries,
+                     'memory_mb': proc_memory_mb, 'cpu_seconds': proc_cpu_seconds}
+        host_profile = hostconfig.load_profile()
+        self.jobs = jobs or host_profile.get('jobs')
+        self.cache_size = cache_size or host_profile.get('cache_size')
+        self.tileset_name = self.out_dir / self.given_name / 'tileset.json'
+        self.catalog = Catalog(self.out_dir) if catalog else None
+        self.entry = None
+        self.manifest_name = self.base_dir / 'manifest' / ('%s.json' % (self.given_name))
+        self.params = {k: getattr(self, k) for k in ['intensity_to_RGB', 'rgb_scale', 'translate_z',
+                                                     'from_geoid', 'geoid_region', 'rgb_engine',
+                                                     'fused', 'sample_every', 'centroid_strategy',
+                                                     'split_points', 'thin_mode', 'thin_spacing', 'thin_budget',
+                                                     'implicit', 'subtree_levels']}
+        self.manifest = checkpoint.Manifest(f=self.manifest_name, params=self.params, stages=STAGES)
+        self.steps = 2 if fused else 4
         self.steps = self.steps + 1 if merge else self.steps
         self.steps = self.steps + 1 if from_geoid else self.steps
+        self.steps = self.steps + 1 if thin_mode else self.steps
         self.step = 1
         utils.log_init_stats(self)
 
-    def run(self) -> Path:
+    def geoid_adjust(self, las_vrs: Union[str, None]):
         """
-        Process the input LAS file.
+        Resolve the geoid/tidal model, look up its ellipsoid height at the
+        mean position of the dataset, and add it to the Z translation.
+        Requires ``self.x`` and ``self.y`` to be set.
 
         :param self self:
-        :return: The path of the output directory
-        :rtype: pathlib.Path
+        :param las_vrs: The vertical reference system found in the file header
+        :type las_vrs: str or None
         """
+        from . import geoid
         L = getLogger(__name__)
-        for d in [self.rewrite_dir, self.archive_dir, self.out_dir]:
-            self.L.info('Creating dir %s' % (d))
-            utils.make_dirs(d)
+        self.lat, self.lon = geoid.crs_to_wgs84(x=self.x, y=self.y,
+                                                from_crs=self.las_crs)
+        L.info('Resolving geoid/tidal model... (step %s of %s)' % (self.step, self.steps))
+        self.from_geoid = geoid.use_model(user_vrs=self.from_geoid,
+                                          las_vrs=las_vrs)
+        L.info('Looking up ellipsoid height of %s at (%.3f, %.3f)... (step %s of %s)' % (self.from_geoid,
+                                                                                         self.lat, self.lon,
+                                                                                         self.step,
+                                                                                         self.steps))
+        self.ellips_lkup = geoid.get_adjustment(lat=self.lat,
+                                                lon=self.lon,
+                                                model=self.from_geoid,
+                                                region=self.geoid_region,
+                                                cache=self.geoid_cache)
+        self.geoid_adj = float(self.ellips_lkup)
+        L.info('Manual Z transformation: %.3f' % (self.translate_z))
+        L.info('Geoid height adjustment: %.3f' % (self.geoid_adj))
+        if self.ellips_lkup is not None:
+            self.translate_z = self.translate_z + self.geoid_adj
+            L.info('Translating Z values by %.3f' % (self.translate_z))
+        else:
+            raise LookupError('Could not get ellipsoid height of %s. Query URL: %s' % (self.from_geoid,
+                                                                                       self.lat,
+                                                                                       self.lon))
+
+    def run_lastools(self) -> list[Path]:
+        """
+        Rewrite the input file using separate lastools passes for the WKT,
+        CRS info, mean position, and final rewrite.
 
+        :param self self:
+        :return: Intermediate files to clean up
+        :rtype: list
+        """
+        L = getLogger(__name__)
         L.info('Rewriting file with new OGC WKT... (step %s of %s)' % (self.step, self.steps))
-        lastools_iface.las2las_ogc_wkt(f=self.f,
-                                       output_file=self.ogcwkt_name)
+        if self.resume and self.manifest.fresh('wkt', inputs=[self.f], outputs=[self.ogcwkt_name]):
+            L.info('%s is up to date. Skipping.' % (self.ogcwkt_name))
+            self.metrics.skip('wkt')
+        else:
+            with self.metrics.stage('wkt', points=self.points, inputs=[self.f], outputs=[self.ogcwkt_name]):
+                lastools_iface.las2las_ogc_wkt(f=self.f,
+                                               output_file=self.ogcwkt_name,
+                                               proc=self.proc)
+            self.manifest.done('wkt', inputs=[self.f], outputs=[self.ogcwkt_name])
 
         self.step += 1
-        L.info('Doing lasinfo dump... (step %s of %s)' % (self.step, self.steps))
-        self.las_crs, las_vrs, self.wkt, wktf, h_name, v_name = lastools_iface.lasinfo(f=self.ogcwkt_name)
-        
+        L.info('Reading CRS info from header... (step %s of %s)' % (self.step, self.steps))
+        with self.metrics.stage('info', inputs=[self.ogcwkt_name]):
+            try:
+                self.las_crs, las_vrs, self.wkt, wktf, h_name, v_name = lasheader.lasinfo(f=self.ogcwkt_name)
+            except ValueError as e:
+                L.warning('%s. Falling back to lasinfo dump.' % (e))
+                self.las_crs, las_vrs, self.wkt, wktf, h_name, v_name = lastools_iface.lasinfo(f=self.ogcwkt_name, proc=self.proc)
+        files = [self.ogcwkt_name, wktf]
+
         if self.from_geoid or las_vrs:
             L.info('self.from_geoid="%s", las_vrs="%s"' % (self.from_geoid, las_vrs))
             self.step += 1
             L.info('Getting mean lat/lon from las file... (step %s of %s)' % (self.step, self.steps))
-            self.x, self.y, xyf = lastools_iface.lasmean(f=self.ogcwkt_name, name=h_name)
-            self.lat, self.lon = geoid.crs_to_wgs84(x=self.x, y=self.y,
-                                                    from_crs=self.las_crs)
-            L.info('Resolving geoid/tidal model... (step %s of %s)' % (self.step, self.steps))
-            self.from_geoid = geoid.use_model(user_vrs=self.from_geoid,
-                                              las_vrs=las_vrs)
-            L.info('Looking up ellipsoid height of %s at (%.3f, %.3f)... (step %s of %s)' % (self.from_geoid,
-                                                                                             self.lat, self.lon,
-                                                                                             self.step,
-                                                                                             self.steps))
-            self.ellips_lkup = geoid.get_adjustment(lat=self.lat,
-                                                    lon=self.lon,
-                                                    model=self.from_geoid,
-                                                    region=self.geoid_region)
-            self.geoid_adj = float(self.ellips_lkup)
-            L.info('Manual Z transformation: %.3f' % (self.translate_z))
-            L.info('Geoid height adjustment: %.3f' % (self.geoid_adj))
-            if self.ellips_lkup:
-                self.translate_z = self.translate_z + self.geoid_adj
-                L.info('Translating Z values by %.3f' % (self.translate_z))
-            else:
-                raise LookupError('Could not get ellipsoid height of %s. Query URL: %s' % (self.from_geoid,
-                                                                                           self.lat,
-                                                                                           self.lon))
+            with self.metrics.stage('centroid', points=self.points, inputs=[self.ogcwkt_name]) as st:
+                if self.centroid_strategy == 'lastools':
+                    self.x, self.y, xyf = lastools_iface.lasmean(f=self.ogcwkt_name, name=h_name, proc=self.proc)
+                    files.append(xyf)
+                else:
+                    self.x, self.y = centroid.lasmean(f=self.ogcwkt_name,
+                                                      name=h_name,
+                                                      strategy=self.centroid_strategy,
+                                                      stride=self.sample_every)
+            self.centroid_time = st['wall_s']
+            with self.metrics.stage('geoid'):
+                self.geoid_adjust(las_vrs=las_vrs)
 
         self.step += 1
         L.info('Starting las2las rewrite... (step %s of %s)' % (self.step, self.steps))
-        lastools_iface.las2las(f=self.ogcwkt_name,
-                               output_file=self.las_name,
-                               archive_dir=self.archive_dir,
-                               intensity_to_RGB=self.intensity_to_RGB,
-                               archive=self.archive,
-                               rgb_scale=self.rgb_scale,
-                               translate_z=self.translate_z)
+        with self.metrics.stage('rewrite', points=self.points, inputs=[self.ogcwkt_name], outputs=[self.las_name]):
+            if self.intensity_to_RGB and (self.rgb_engine == 'laspy'):
+                from . import laspy_iface
+                laspy_iface.las2las(f=self.ogcwkt_name,
+                                    output_file=self.las_name,
+                                    archive_dir=self.archive_dir,
+                                    archive=self.archive,
+                                    rgb_scale=self.rgb_scale,
+                                    translate_z=self.translate_z)
+            else:
+                lastools_iface.las2las(f=self.ogcwkt_name,
+                                       output_file=self.las_name,
+                                       archive_dir=self.archive_dir,
+                                       intensity_to_RGB=self.intensity_to_RGB,
+                                       archive=self.archive,
+                                       rgb_scale=self.rgb_scale,
+                                       translate_z=self.translate_z,
+                                       proc=self.proc)
+        return files
 
-        self.step += 1
-        L.info('Starting tiling process... (step %s of %s)' % (self.step, self.steps))
-        py3dtiles_iface.tile(f=self.las_name,
-                             out_dir=self.out_dir,
-                             las_crs=self.las_crs,
-                             out_crs='4978')
+    def run_fused(self) -> list[Path]:
+        """
+        Rewrite the input file in a single streaming pass that loads the OGC
+        WKT, samples XY positions, and copies intensity to RGB, then apply
+        the Z translation (manual plus any geoid adjustment) to the output
+        header.
+
+        :param self self:
+        :return: Intermediate files to clean up
+        :rtype: list
+        """
+        from . import laspy_iface
+        L = getLogger(__name__)
+        L.info('Starting fused rewrite... (step %s of %s)' % (self.step, self.steps))
+        with self.metrics.stage('fused_rewrite', points=self.points, inputs=[self.f], outputs=[self.las_name]):
+            self.wkt, wktf, self.x, self.y = laspy_iface.fused_rewrite(f=self.f,
+                                                                       output_file=self.las_name,
+                                                                       intensity_to_RGB=self.intensity_to_RGB,
+                                                                       rgb_scale=self.rgb_scale,
+                                                                       sample_every=0 if self.centroid_strategy == 'header' else self.sample_every)
+        if self.centroid_strategy == 'header':
+            self.x, self.y = centroid.header_center(lasheader.read_header(self.las_name))
+        crs, self.las_crs, las_vrs, h_name, v_name = utils.get_epsgs_from_wkt(self.wkt)
 
-        if self.merge:
+        if self.from_geoid or las_vrs:
+            L.info('self.from_geoid="%s", las_vrs="%s"' % (self.from_geoid, las_vrs))
             self.step += 1
-            L.info('Starting merge process... (step %s of %s)' % (self.step, self.steps))
-            py3dtiles_iface.merge(dir=self.out_dir,
-                                  overwrite=True)
+            with self.metrics.stage('geoid'):
+                self.geoid_adjust(las_vrs=las_vrs)
+
+        if self.translate_z:
+            with self.metrics.stage('shift_z', outputs=[self.las_name]):
+                from . import laspy_iface
+                laspy_iface.shift_z(f=self.las_name, translate_z=self.translate_z)
+
+        if self.archive:
+            utils.archive_file(f=self.f, archive_dir=self.archive_dir)
+        return [wktf]
+
+    def rewrite(self) -> list[Path]:
+        """
+        Produce the rewritten LAS file that gets tiled, unless the run
+        manifest shows it is up to date, in which case the CRS, mean
+        position, and Z translation of the earlier run are restored.
+
+        :param self self:
+        :return: Intermediate files to clean up
+        :rtype: list
+        """
+        L = getLogger(__name__)
+        if self.resume and self.manifest.fresh('rewrite', inputs=[self.f], outputs=[self.las_name]):
+            L.info('%s is up to date. Skipping rewrite.' % (self.las_name))
+            self.metrics.skip('rewrite')
+            for k, v in self.manifest.state('rewrite').items():
+                setattr(self, k, v)
+            self.step = self.steps - (2 if self.merge else 1) - (1 if self.thin_mode else 0)
+            return [] if self.fused else [self.ogcwkt_name]
+        if self.fused:
+            files = self.run_fused()
+        else:
+            files = self.run_lastools()
+        self.manifest.done('rewrite', inputs=[self.f], outputs=[self.las_name],
+                           state={k: getattr(self, k) for k in ['las_crs', 'wkt', 'x', 'y', 'translate_z',
+                                                                'geoid_adj', 'from_geoid']})
+        return files
+
+    def thin(self):
+        """
+        Thin the rewritten file, unless the run manifest shows the thinned
+        file is up to date.
+
+        :param self self:
+        """
+        L = getLogger(__name__)
+        self.step += 1
+        if self.resume and self.manifest.fresh('thin', inputs=[self.las_name], outputs=[self.thin_name]):
+            L.info('%s is up to date. Skipping thinning.' % (self.thin_name))
+            self.metrics.skip('thin')
+            return
+        L.info('Starting %s thinning... (step %s of %s)' % (self.thin_mode, self.step, self.steps))
+        points = lasheader.read_header(self.las_name).point_count
+        utils.make_dirs(self.thin_name.parent)
+        with self.metrics.stage('thin', points=points, inputs=[self.las_name], outputs=[self.thin_name]) as st:
+            st.update(thin.thin_las(f=self.las_name,
+                                    output_file=self.thin_name,
+                                    mode=self.thin_mode,
+                                    spacing=self.thin_spacing,
+                                    budget=self.thin_budget))
+        self.manifest.done('thin', inputs=[self.las_name], outputs=[self.thin_name])
+
+    def tile(self):
+        """
+        Tile the rewritten (and possibly thinned) file. Files with more than ``split_points``
+        points are first partitioned into spatial chunks, which are tiled
+        ``split_workers`` at a time and stitched into a single tileset.
+
+        :param self self:
+        """
+        L = getLogger(__name__)
+        points = lasheader.read_header(self.tile_name).point_count
+        tiledir = self.out_dir / self.given_name
+        if self.split_points and (points > self.split_points):
+            from . import split
+            with self.metrics.stage('split', points=points, inputs=[self.tile_name], outputs=[self.split_dir]):
+                chunks = split.split_las(f=self.tile_name,
+                                         out_dir=self.split_dir,
+                                         max_points=self.split_points)
+            L.info('Tiling %s chunks (%s at a time)' % (len(chunks), self.split_workers))
+            with self.metrics.stage('tile', points=points, inputs=chunks, outputs=[tiledir]) as st:
+                st['converter'] = split.tile_chunks(files=chunks,
+                                                    out_dir=tiledir,
+                                                    las_crs=self.las_crs,
+                                                    out_crs='4978',
+                                                    workers=self.split_workers,
+                                                    jobs=self.jobs,
+                                                    cache_size=self.cache_size,
+                                                    implicit=self.implicit,
+                                                    subtree_levels=self.subtree_levels)
+                st['chunks'] = len(chunks)
+            shutil.rmtree(self.split_dir, ignore_errors=True)
+        else:
+            with self.metrics.stage('tile', points=points, inputs=[self.tile_name], outputs=[tiledir]) as st:
+                st['converter'] = py3dtiles_iface.tile(f=self.tile_name,
+                                                       out_dir=self.out_dir,
+                                                       las_crs=self.las_crs,
+                                                       out_crs='4978',
+                                                       jobs=self.jobs,
+                                                       cache_size=self.cache_size,
+                                                       implicit=self.implicit,
+                                                       subtree_levels=self.subtree_levels)
+
+    def catalog_entry(self) -> dict:
+        """
+        Describe the tiled dataset for the catalogue. This must be called
+        before cleanup removes the file that was tiled.
+
+        :param self self:
+        :return: Keyword arguments for :py:meth:`pdgpoints.catalog.Catalog.add`
+        :rtype: dict
+        """
+        header = lasheader.read_header(self.tile_name)
+        source = self.f if (self.f.is_file() or not self.archive) else self.archive_dir / self.bn
+        fp = checkpoint.fingerprint(source)
+        return {'tileset': str(self.tileset_name),
+                'source': str(source),
+                'source_hash': fp['hash'] if fp else None,
+                'crs': self.las_crs,
+                'bounds': (header.mins[0], header.mins[1], header.maxs[0], header.maxs[1]),
+                'points': header.point_count,
+                'params': self.params}
 
-        L.info('Cleaning up processing artifacts.')
-        files = [self.ogcwkt_name, wktf, xyf]
-        if not self.archive:
-            files.append(self.las_name)
-        L.debug('Removing files: %s' % (files))
-        utils.rm_files(files=files)
+    def add_to_catalog(self):
+        """
+        Record the tiled dataset in the output directory's catalogue, and
+        log any other datasets it overlaps or duplicates.
+
+        :param self self:
+        """
+        L = getLogger(__name__)
+        with self.metrics.stage('catalog'):
+            self.catalog.add(**self.entry)
+            overlaps = self.catalog.overlaps(self.given_name)
+        if overlaps:
+            L.info('%s overlaps %s other datasets: %s' % (self.given_name, len(overlaps),
+                                                         ', '.join(o['name'] for o in overlaps)))
+        for o in overlaps:
+            if self.entry['source_hash'] and (o['source_hash'] == self.entry['source_hash']):
+                L.warning('%s was made from the same input as %s (%s)' % (self.given_name, o['name'], o['source']))
+
+    def prepare(self) -> bool:
+        """
+        Run the stages that come before tiling (WKT, CRS info, mean
+        position, geoid lookup, rewrite, and thinning), skipping those the run
+        manifest shows are up to date. Together with :py:meth:`finish`
+        this makes up :py:meth:`run`; calling them separately lets a
+        scheduler prepare one file while another is tiling.
+
+        :param self self:
+        :return: Whether there is anything left for :py:meth:`finish` to do
+        :rtype: bool
+        """
+        L = getLogger(__name__)
+        for d in [self.rewrite_dir, self.archive_dir, self.out_dir]:
+            self.L.info('Creating dir %s' % (d))
+            utils.make_dirs(d)
+
+        self.complete = self.resume and self.manifest.fresh('complete', inputs=[self.f], outputs=[self.tileset_name])
+        self.merged = self.resume and (self.out_dir / 'tileset.json').is_file() and \
+                      self.manifest.fresh('merge', inputs=[self.tileset_name])
+        if self.complete and (self.merged or not self.merge):
+            L.info('%s has already been processed with these parameters. Skipping.' % (self.bn))
+            return False
+
+        try:
+            header = lasheader.read_header(self.f)
+            self.points, self.point_record_length = header.point_count, header.point_record_length
+        except Exception as e:
+            L.debug('Could not read point count from header: %s' % (e))
+
+        self.files = []
+        if self.complete:
+            L.info('%s has already been tiled with these parameters. Skipping to merge.' % (self.bn))
+            self.step = self.steps - 1
+            return True
+        try:
+            self.files = self.rewrite()
+            if self.thin_mode:
+                self.thin()
+        except BaseException as e:
+            if self.report:
+                self.write_report(error=repr(e))
+            raise
+        return True
+
+    def finish(self) -> Path:
+        """
+        Run the stages that come after :py:meth:`prepare` (tiling, merge,
+        and cleanup) and write the run report.
+
+        :param self self:
+        :return: The path of the output directory
+        :rtype: pathlib.Path
+        """
+        L = getLogger(__name__)
+        error = None
+        try:
+            if not self.complete:
+                self.step += 1
+                if self.resume and self.manifest.fresh('tile', inputs=[self.tile_name], outputs=[self.tileset_name]):
+                    L.info('%s is up to date. Skipping tiling.' % (self.tileset_name))
+                    self.metrics.skip('tile')
+                else:
+                    L.info('Starting tiling process... (step %s of %s)' % (self.step, self.steps))
+                    self.tile()
+                    self.manifest.done('tile', inputs=[self.tile_name], outputs=[self.tileset_name])
+                self.entry = self.catalog_entry()
+                if self.catalog is not None:
+                    self.add_to_catalog()
+
+            if self.precompress:
+                L.info('Precompressing tiles (%s)' % (', '.join(self.precompress)))
+                with self.metrics.stage('precompress', outputs=[self.out_dir / self.given_name]) as st:
+                    st.update(precompression.precompress(self.out_dir / self.given_name,
+                                                         encodings=self.precompress,
+                                                         workers=self.precompress_workers))
+
+            if self.merge:
+                self.step += 1
+                if self.merged:
+                    L.info('%s is already merged. Skipping merge.' % (self.given_name))
+                    self.metrics.skip('merge')
+                else:
+                    L.info('Starting merge process... (step %s of %s)' % (self.step, self.steps))
+                    with self.metrics.stage('merge'):
+                        py3dtiles_iface.merge(dir=self.out_dir,
+                                              overwrite=True,
+                                              incremental=self.incremental_merge,
+                                              new=[self.tileset_name],
+                                              fan_out=self.merge_fan_out,
+                                              workers=self.merge_workers,
+                                              precompress=self.precompress,
+                                              precompress_workers=self.precompress_workers)
+                    self.manifest.done('merge', inputs=[self.tileset_name])
+
+            L.info('Cleaning up processing artifacts.')
+            files = list(self.files)
+            if not self.archive:
+                files.append(self.las_name)
+            if self.thin_mode:
+                files.append(self.thin_name)
+            L.debug('Removing files: %s' % (files))
+            with self.metrics.stage('cleanup'):
+                utils.rm_files(files=files)
+            self.manifest.done('complete', inputs=[self.f], outputs=[self.tileset_name])
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            if self.report:
+                self.write_report(error=error)
 
         s, m = utils.timer(self.starttime)
-        L.info('Finished processing %s (%s sec / %.1f min)' % (self.bn, s, m))
+        L.info('Finished processing %s (%.1f sec / %.1f min)' % (self.bn, s, m))
+
+        return self.out_dir
+
+    def run(self) -> Path:
+        """
+        Process the input LAS file.
 
+        :param self self:
+        :return: The path of the output directory
+        :rtype: pathlib.Path
+        """
+        if self.prepare():
+            self.finish()
         return self.out_dir
+
+    def write_report(self, error: Union[str, None]=None) -> Path:
+        """
+        Write the machine-readable run report (per-stage wall time, CPU
+        time, peak RSS, bytes read and written, and points per second) to
+        ``report.json`` in the output tileset directory.
+
+        :param self self:
+        :param error: The error that stopped the run, if any
+        :type error: str or None
+        :return: The report file
+        :rtype: pathlib.Path
+        """
+        L = getLogger(__name__)
+        params = {k: getattr(self, k) for k in ['intensity_to_RGB', 'rgb_scale', 'translate_z',
+                                                'from_geoid', 'geoid_region', 'geoid_adj', 'archive',
+                                                'rgb_engine', 'fused', 'sample_every',
+                                                'centroid_strategy', 'merge', 'incremental_merge', 'merge_fan_out',
+                                                'split_points', 'split_workers', 'implicit', 'subtree_levels', 'precompress', 'jobs', 'cache_size', 'auto',
+                                                'thin_mode', 'thin_spacing', 'thin_budget', 'proc', 'profile']}
+        params['catalog'] = self.catalog is not None
+        self.metrics.write(self.report_name,
+                           file=str(self.f),
+                           points=self.points,
+                           point_record_length=self.point_record_length,
+                           ok=error is None,
+                           error=error,
+                           parameters=params)
+        L.info('Wrote run report to %s' % (self.report_name))
+        return self.report_name
@@ -0,0 +1,300 @@
+import os
+import gzip
+import json
+import time
+from pathlib import Path
+from typing import Union
+from importlib.util import find_spec
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+
+from . import utils
+from . import profiling
+
+ENCODINGS = {'gzip': '.gz', 'br': '.br'}
+"Supported content encodings and the suffix of the file each one is written to (as looked for by e.g. nginx ``gzip_static`` and ``brotli_static``)"
+DEFAULT_WORKERS = 4
+"Default number of threads compressing files"
+GZIP_LEVEL = 9
+"gzip compression level (files are compressed once and served many times, so the slowest level pays)"
+BROTLI_QUALITY = 11
+"Brotli compression quality"
+MANIFEST_NAME = 'precompress.json'
+"Name of the file recording the compressed files of a directory"
+TILE_SUFFIXES = ['.pnts', '.json', '.subtree']
+"Suffixes of the tileset files that are compressed"
+SKIP_NAMES = ['report.json', MANIFEST_NAME]
+"Files with a tile suffix that are not part of a tileset"
+
+def available(encodings: list[str]) -> list[str]:
+    """
+    Get the encodings of a list that can be written here, leaving out
+    unknown ones and Brotli if the ``brotli`` package is not installed
+    (``pip install pdgpoints[brotli]``).
+
+    :param list encodings: The requested encodings (see :py:data:`ENCODINGS`)
+    :return: The usable encodings, in order and without duplicates
+    :rtype: list
+    """
+    L = getLogger(__name__)
+    out = []
+    for enc in encodings:
+        if enc not in ENCODINGS:
+            L.warning('Unknown precompression encoding "%s". Skipping it.' % (enc))
+            continue
+        if (enc == 'br') and (find_spec('brotli') is None):
+            L.warning('Brotli precompression needs the brotli package. Skipping it.')
+            continue
+        if enc not in out:
+            out.append(enc)
+    return out
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """
+    Compress file contents. gzip output has no timestamp, so the same
+    input always gives the same bytes.
+
+    :param bytes data: The contents
+    :param str encoding: The encoding (see :py:data:`ENCODINGS`)
+    :return: The compressed contents
+    :rtype: bytes
+    """
+    if encoding == 'br':
+        import brotli
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+def sibling(f: Path, encoding: str) -> Path:
+    """
+    Get the path of a file's compressed version.
+
+    :param f: The original file
+    :type f: pathlib.Path
+    :param str encoding: The encoding (see :py:data:`ENCODINGS`)
+    :return: The compressed file
+    :rtype: pathlib.Path
+    """
+    return f.with_name(f.name + ENCODINGS[encoding])
+
+def tile_files(dir: Path) -> list[Path]:
+    """
+    Find the tileset files (see :py:data:`TILE_SUFFIXES`) under a
+    directory, leaving out run reports, precompression manifests, and
+    hidden temporary files.
+
+    :param dir: The directory
+    :type dir: pathlib.Path
+    :return: The files
+    :rtype: list
+    """
+    return sorted(p for p in Path(dir).rglob('*')
+                  if (p.suffix in TILE_SUFFIXES) and (p.name not in SKIP_NAMES)
+                  and (not p.name.startswith('.')) and p.is_file())
+
+def root_files(dir: Path) -> list[Path]:
+    """
+    Find the files a merge writes in an output directory: the root
+    `tileset.json`, its preview points (`r.pnts`), and the node tilesets
+    of a tree merge (see :py:data:`pdgpoints.mergetree.TREE_DIR`). The
+    dataset subdirectories are left out.
+
+    :param dir: The output directory
+    :type dir: pathlib.Path
+    :return: The files that exist
+    :rtype: list
+    """
+    from .mergetree import TREE_DIR
+    dir = Path(dir)
+    files = [f for f in [dir / 'tileset.json', dir / 'r.pnts'] if f.is_file()]
+    tree_dir = dir / TREE_DIR
+    if tree_dir.is_dir():
+        files += tile_files(tree_dir)
+    return files
+
+def compress_file(f: Path, encodings: list[str]) -> dict:
+    """
+    Write the compressed versions of a file beside it, each to a temporary
+    file renamed into place and with the original's modification time. A
+    version that would not be smaller than the original is not written,
+    and versions in encodings that were not asked for are removed, so a
+    server never sends stale content.
+
+    :param f: The file
+    :type f: pathlib.Path
+    :param list encodings: The encodings to write
+    :return: The original size and modification time, and the size of each encoding (None if not written)
+    :rtype: dict
+    """
+    st = f.stat()
+    with open(f, 'rb') as fr:
+        data = fr.read()
+    out = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'encodings': {}}
+    for enc in ENCODINGS:
+        g = sibling(f, enc)
+        packed = compress(data, enc) if enc in encodings else None
+        if (packed is None) or (len(packed) >= len(data)):
+            g.unlink(missing_ok=True)
+            if enc in encodings:
+                out['encodings'][enc] = None
+            continue
+        with utils.atomic_path(g) as tmp:
+            with open(tmp, 'wb') as fw:
+                fw.write(packed)
+            os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        out['encodings'][enc] = len(packed)
+    return out
+
+def up_to_date(f: Path, entry: Union[dict, None], encodings: list[str]) -> bool:
+    """
+    Check whether a file's compressed versions are current: the file has
+    the size and modification time recorded in the manifest, was
+    compressed in exactly these encodings, and its compressed files are
+    still there.
+
+    :param f: The file
+    :type f: pathlib.Path
+    :param entry: The file's manifest entry
+    :type entry: dict or None
+    :param list encodings: The requested encodings
+    :return: Whether the file can be skipped
+    :rtype: bool
+    """
+    if entry is None:
+        return False
+    st = f.stat()
+    if (entry['size'] != st.st_size) or (entry['mtime_ns'] != st.st_mtime_ns):
+        return False
+    if sorted(entry['encodings']) != sorted(encodings):
+        return False
+    return all(sibling(f, enc).is_file() for enc, size in entry['encodings'].items() if size is not None)
+
+def read_manifest(f: Path) -> dict:
+    """
+    Read a precompression manifest, or start an empty one if there is
+    none or it cannot be read.
+
+    :param f: The manifest file
+    :type f: pathlib.Path
+    :return: The manifest
+    :rtype: dict
+    """
+    L = getLogger(__name__)
+    if f.is_file():
+        try:
+            with open(f, 'r') as fr:
+                return json.load(fr)
+        except (OSError, ValueError) as e:
+            L.warning('Could not read %s (%s); compressing every file again' % (f, e))
+    return {'files': {}}
+
+def totals(files: dict, encodings: list[str]) -> dict:
+    """
+    Sum the sizes in a manifest. A file with no compressed version in an
+    encoding counts at its original size, as that is what is served.
+
+    :param dict files: The manifest's file entries
+    :param list encodings: The encodings
+    :return: File count, original bytes, and bytes and ratio (compressed over original) of each encoding
+    :rtype: dict
+    """
+    size = sum(e['size'] for e in files.values())
+    out = {'files': len(files), 'bytes': size, 'encodings': {}}
+    for enc in encodings:
+        packed = sum((e['encodings'].get(enc) or e)['size'] for e in files.values())
+        out['encodings'][enc] = {'bytes': packed, 'ratio': round(packed / size, 4) if size else None}
+    return out
+
+def precompress(dir: Path,
+                files: Union[list[Path], None]=None,
+                encodings: list[str]=['gzip'],
+                workers: int=DEFAULT_WORKERS) -> dict:
+    """
+    Write compressed versions of tileset files beside the originals (e.g.
+    `tileset.json.gz`), so a static web server can send them as they are
+    instead of compressing every response. Files are compressed by up to
+    ``workers`` threads at once (the compressors release the GIL).
+
+    The sizes and compression ratios are recorded in
+    :py:data:`MANIFEST_NAME` in ``dir``, along with the size and
+    modification time of each original. Files that have not changed since
+    they were last compressed are skipped, and entries of files that no
+    longer exist are dropped with their compressed versions, so a run after
+    a merge (with ``files`` from :py:func:`root_files`) only compresses the
+    root files the merge rewrote.
+
+    :param dir: Directory holding the files and the manifest
+    :type dir: pathlib.Path
+    :param files: Files to compress (default: every tileset file under ``dir``; see :py:func:`tile_files`)
+    :type files: list or None
+    :param list encodings: Encodings to write (see :py:data:`ENCODINGS`)
+    :param int workers: Number of threads compressing files
+    :return: Number of files, of files compressed, skipped, and dropped, and the totals of the manifest
+    :rtype: dict
+    :raises ValueError: If an encoding is unknown
+    :raises ImportError: If Brotli is asked for and the brotli package is not installed
+    """
+    L = getLogger(__name__)
+    start = utils.timer()
+    for enc in encodings:
+        if enc not in ENCODINGS:
+            raise ValueError('Unknown precompression encoding "%s" (choose from %s)' % (enc, ', '.join(ENCODINGS)))
+        if (enc == 'br') and (find_spec('brotli') is None):
+            raise ImportError('Brotli precompression needs the brotli package (pip install pdgpoints[brotli])')
+    dir = Path(dir)
+    mf = dir / MANIFEST_NAME
+    manifest = read_manifest(mf)
+    if files is None:
+        files = tile_files(dir)
+    rels = {Path(os.path.relpath(f, dir)).as_posix(): Path(f) for f in files}
+    old = manifest.get('files', {})
+
+    removed = 0
+    for rel in [r for r in old if r not in rels]:
+        for enc in ENCODINGS:
+            sibling(dir / rel, enc).unlink(missing_ok=True)
+        removed += 1
+    todo = [rel for rel, f in rels.items() if not up_to_date(f, old.get(rel), encodings)]
+    entries = {rel: old[rel] for rel in rels if rel not in todo}
+    if todo:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(todo)))) as ex:
+            done = list(ex.map(compress_file, [rels[rel] for rel in todo], [encodings] * len(todo)))
+        for rel, e in zip(todo, done):
+            e['encodings'] = {enc: {'size': size, 'ratio': round(size / e['size'], 4)}
+                              if size is not None else None
+                              for enc, size in e['encodings'].items()}
+            entries[rel] = e
+    summary = totals(entries, encodings)
+    utils.write_json_atomic(mf, {'encodings': encodings,
+                                 'updated': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                                 'totals': summary,
+                                 'files': {rel: entries[rel] for rel in sorted(entries)}})
+    profiling.count('precompress.files', len(todo))
+    profiling.count('precompress.bytes', sum(entries[rel]['size'] for rel in todo))
+    L.info('Precompressed %s of %s files in %s (%s unchanged, %s dropped; %s) (%.1f sec / %.1f min)' % (
+        len(todo), len(rels), dir, len(rels) - len(todo), removed,
+        ', '.join('%s %.1f%%' % (enc, 100 * v['ratio']) for enc, v in summary['encodings'].items()
+                  if v['ratio'] is not None) or 'nothing to compress',
+        *utils.timer(start)))
+    return {'files': len(rels), 'compressed': len(todo), 'skipped': len(rels) - len(todo),
+            'dropped': removed, 'totals': summary}
+
+def precompress_root(dir: Path,
+                     encodings: Union[list[str], None]=None,
+                     workers: int=DEFAULT_WORKERS) -> Union[dict, None]:
+    """
+    Compress the files a merge writes in an output directory (see
+    :py:func:`root_files`), leaving the dataset subdirectories to their own
+    manifests. Does nothing if no encodings are given.
+
+    :param dir: The output directory
+    :type dir: pathlib.Path
+    :param encodings: Encodings to write (see :py:data:`ENCODINGS`)
+    :type encodings: list or None
+    :param int workers: Number of threads compressing files
+    :return: The summary (see :py:func:`precompress`), or None
+    :rtype: dict or None
+    """
+    if not encodings:
+        return None
+    with profiling.section('precompress'):
+        return precompress(dir, files=root_files(dir), encodings=encodings, workers=workers)
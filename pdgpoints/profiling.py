@@ -0,0 +1,219 @@
+import sys
+import time
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Union
+from logging import getLogger
+
+DEFAULT_INTERVAL = 0.005
+"Default seconds between stack samples when profiling"
+STACKS_NAME = 'stacks.txt'
+"Name of the collapsed-stack file (one ``frame;frame;... count`` line per stack, as read by flamegraph.pl or speedscope)"
+
+_local = threading.local()
+
+def _current():
+    """
+    Get the stage record and metrics of the stage running in this thread.
+
+    :return: The stage record, the metrics, and the profiler (or None), or None outside a stage
+    :rtype: tuple or None
+    """
+    return getattr(_local, 'stage', None)
+
+def count(name: str, value: Union[int, float]=1):
+    """
+    Add to a named counter of the stage running in this thread, and to
+    the run's totals (see :py:meth:`pdgpoints.metrics.Metrics.count`).
+    Outside a stage this does nothing, so calls can stay in code that
+    also runs on its own.
+
+    :param str name: The counter name (e.g. ``'geoid.queries'``)
+    :param value: Amount to add
+    :type value: int or float
+    """
+    stage = _current()
+    if stage is None:
+        return
+    record, metrics, profiler = stage
+    counters = record.setdefault('counters', {})
+    counters[name] = counters.get(name, 0) + value
+    metrics.count(name, value)
+
+def section(name: str):
+    """
+    Mark a part of a stage (e.g. the converter call inside tiling). When
+    profiling, samples taken inside it are filed under it in the
+    collapsed stacks, and its wall time is added to the
+    ``<name>.seconds`` counter. Otherwise this returns a context manager
+    that does nothing.
+
+    Usage::
+
+        with profiling.section('convert'):
+            converter.convert()
+
+    :param str name: The section name
+    :return: A context manager
+    """
+    stage = _current()
+    if (stage is None) or (stage[2] is None):
+        return nullcontext()
+    return stage[2].section(name)
+
+@contextmanager
+def stage(record: dict, metrics, profiler=None):
+    """
+    Make a stage the target of :py:func:`count` and :py:func:`section`
+    calls in this thread while it runs (used by
+    :py:meth:`pdgpoints.metrics.Metrics.stage`).
+
+    :param dict record: The stage record
+    :param pdgpoints.metrics.Metrics metrics: The run's metrics
+    :param profiler: The run's profiler, if profiling
+    :type profiler: pdgpoints.profiling.Profiler or None
+    """
+    outer = _current()
+    _local.stage = (record, metrics, profiler)
+    try:
+        yield
+    finally:
+        _local.stage = outer
+
+def frame_name(frame) -> str:
+    """
+    Name a stack frame as ``module:function``.
+
+    :param frame: The frame
+    :return: The name
+    :rtype: str
+    """
+    code = frame.f_code
+    return '%s:%s' % (frame.f_globals.get('__name__', code.co_filename), getattr(code, 'co_qualname', code.co_name))
+
+class Profiler():
+    """
+    Profile the stages of a run two ways: each stage under
+    :py:mod:`cProfile` (written to ``<stage>.prof`` for
+    :py:mod:`pstats` or snakeviz), and all stages together by sampling
+    the stacks of the threads running them every ``interval`` seconds
+    (written to :py:data:`STACKS_NAME` in collapsed-stack form, prefixed
+    by stage and section names, for flame graphs).
+
+    Only the Python code of this process is seen. Time spent in lastools
+    or in the converter's worker processes shows up as time waiting for
+    them; their share can be read from the stage's CPU time for child
+    processes in the run report.
+
+    :param dir: Directory to write the profile files to
+    :type dir: pathlib.Path
+    :param float interval: Seconds between stack samples
+    """
+    def __init__(self, dir: Path, interval: float=DEFAULT_INTERVAL):
+        self.dir = Path(dir)
+        self.interval = interval
+        self.stacks = Counter()
+        self.profiles = {}
+        self.labels = {}
+        self.lock = threading.Lock()
+        self.sampler = None
+        self.stopping = threading.Event()
+
+    def sample(self):
+        """
+        Sampler thread: record the stack of every thread inside a stage.
+        """
+        while not self.stopping.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                labels = {tid: list(l) for tid, l in self.labels.items() if l}
+            for tid, l in labels.items():
+                frame = frames.get(tid)
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame))
+                    frame = frame.f_back
+                self.stacks[';'.join(l + stack[::-1])] += 1
+
+    @contextmanager
+    def label(self, name: str):
+        """
+        File the samples of this thread under a name while the block runs.
+
+        :param str name: The stage or section name
+        """
+        tid = threading.get_ident()
+        with self.lock:
+            self.labels.setdefault(tid, []).append(name)
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self.sample, daemon=True)
+                self.sampler.start()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.labels[tid].pop()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Profile a stage with :py:mod:`cProfile` and the sampler. A stage
+        that starts inside another one in the same thread is only
+        sampled, as only one :py:mod:`cProfile` profiler can run per
+        thread; its time stays in the outer stage's profile.
+
+        :param str name: The stage name
+        """
+        prof = None
+        if not getattr(_local, 'profiling', False):
+            prof = cProfile.Profile()
+            _local.profiling = True
+        with self.label(name):
+            if prof is not None:
+                prof.enable()
+            try:
+                yield
+            finally:
+                if prof is not None:
+                    prof.disable()
+                    _local.profiling = False
+                    # kept until the end, as tiling replaces the directory the files go in
+                    self.profiles[name] = prof
+
+    @contextmanager
+    def section(self, name: str):
+        """
+        Mark a part of a stage (see :py:func:`section`).
+
+        :param str name: The section name
+        """
+        start = time.perf_counter()
+        with self.label(name):
+            try:
+                yield
+            finally:
+                count('%s.seconds' % (name), time.perf_counter() - start)
+
+    def write(self) -> Path:
+        """
+        Stop sampling and write the stage profiles and the collapsed stacks.
+
+        :return: The collapsed-stack file
+        :rtype: pathlib.Path
+        """
+        L = getLogger(__name__)
+        self.stopping.set()
+        if self.sampler is not None:
+            self.sampler.join()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        for name, prof in self.profiles.items():
+            prof.dump_stats(self.dir / ('%s.prof' % (name)))
+        f = self.dir / STACKS_NAME
+        with open(f, 'w') as fw:
+            for stack, n in sorted(self.stacks.items()):
+                fw.write('%s %s\n' % (stack, n))
+        L.info('Wrote profiles (%s stack samples) to %s' % (sum(self.stacks.values()), self.dir))
+        return f
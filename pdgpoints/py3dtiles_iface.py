@@ -1,11 +1,21 @@
+import io
 import glob
+import json
 from pathlib import Path
+from contextlib import redirect_stdout
 from typing import Union
-from py3dtiles import convert, merger
-from py3dtiles.utils import str_to_CRS
 from logging import getLogger
 
 from . import utils
+from . import crs_registry
+from . import catalog
+from . import mergetree
+from . import implicit as implicit_tiling
+from . import precompress as precompression
+from . import profiling
+
+BENCHMARK_TAG = 'pdgpoints'
+"Tag the converter's benchmark summary line starts with"
 
 def log_tileset_error(e: Union[ValueError, RuntimeError]):
     """
@@ -36,12 +46,41 @@ def rm_file(f: Path):
     except FileNotFoundError as e:
         L.warning('FileNotFoundError caught when deleting %s. This might mean nothing.' % (f))
 
+def parse_benchmark(out: str, tag: str) -> Union[dict, None]:
+    """
+    Parse the summary py3dtiles prints when given a benchmark tag
+    (``tag,file names,points,seconds``). It follows the progress display
+    on the same line, so it is found by its tag rather than by line.
+
+    Variables:
+    :param str out: Captured converter output
+    :param str tag: The benchmark tag passed to the converter
+    :return: Point count and seconds, or None if there is no summary line
+    :rtype: dict or None
+    """
+    i = out.rfind('%s,' % (tag))
+    if i < 0:
+        return None
+    line = out[i + len(tag) + 1:].splitlines()[0].strip()
+    try:
+        files, points, seconds = line.rsplit(',', 2)
+        return {'files': files, 'points': int(points), 'seconds': float(seconds)}
+    except ValueError:
+        return None
+
 def tile(f: Path,
          out_dir: Path,
          las_crs: str,
-         out_crs: str='4978'):
+         out_crs: str='4978',
+         jobs: Union[int, None]=None,
+         cache_size: Union[int, None]=None,
+         fraction: int=100,
+         implicit: bool=False,
+         subtree_levels: Union[int, None]=None) -> dict:
     """
     Use py3dtiles.converter.convert() to create 3dtiles from a LAS or LAZ file.
+    With ``implicit``, the output is then rewritten as a 3D Tiles 1.1
+    implicit tileset (see :py:func:`pdgpoints.implicit.convert`).
 
     Variables:
     :param f: LAS or LAZ file to convert to 3dtiles
@@ -50,18 +89,33 @@ def tile(f: Path,
     :type out_dir: pathlib.Path
     :param str las_crs: Coordinate reference system (CRS) of the input LAS file
     :param str out_crs: CRS of the output tileset
-    :param bool verbose: Whether to log more messages
+    :param jobs: Number of converter worker processes (default: number of CPUs)
+    :type jobs: int or None
+    :param cache_size: Converter node cache size in MB (default: a tenth of total memory)
+    :type cache_size: int or None
+    :param int fraction: Percentage of the points to keep
+    :param bool implicit: Whether to write implicit tiling with subtree files instead of an explicit tile hierarchy
+    :param subtree_levels: Number of levels in each subtree file (default: :py:data:`pdgpoints.implicit.DEFAULT_SUBTREE_LEVELS`)
+    :type subtree_levels: int or None
+    :return: Converter settings and the point count and seconds it reported
+    :rtype: dict
     """
+    from py3dtiles import convert
     L = getLogger(__name__)
     tilestart = utils.timer()
     L.info('File: %s' % (f))
     L.info('Creating tile directory')
     fndir = out_dir / f.stem
-    CRSi = str_to_CRS(las_crs)
-    CRSo = str_to_CRS(out_crs)
+    with profiling.section('crs'):
+        CRSi = crs_registry.get_crs(las_crs)
+        CRSo = crs_registry.get_crs(out_crs)
     L.info('CRS to convert from: %s' % (CRSi))
     L.info('CRS to convert to:   %s' % (CRSo))
 
+    settings = {'jobs': jobs or convert.CPU_COUNT,
+                'cache_size': cache_size or convert.DEFAULT_CACHE_SIZE,
+                'fraction': fraction}
+    L.info('Converter jobs: %(jobs)s, cache size: %(cache_size)s MB, fraction: %(fraction)s%%' % (settings))
     converter = convert._Convert(files=f,
                                  outfolder=fndir,
                                  overwrite=True,
@@ -69,18 +123,173 @@ def tile(f: Path,
                                  crs_out=CRSo,
                                  force_crs_in=True,
                                  rgb=True,
-                                 benchmark=True,
-                                 verbose=False)
-    converter.convert()
+                                 benchmark=BENCHMARK_TAG,
+                                 verbose=False,
+                                 **settings)
+    out = io.StringIO()
+    with redirect_stdout(out), profiling.section('convert'):
+        converter.convert()
+    L.debug('Converter output: %s' % (out.getvalue().strip()))
+
+    result = dict(settings, tileset=str(fndir / 'tileset.json'))
+    result.update(parse_benchmark(out.getvalue(), BENCHMARK_TAG) or {})
+    if 'points' in result:
+        profiling.count('tile.points', result['points'])
+    if implicit:
+        with profiling.section('implicit'):
+            result['implicit'] = implicit_tiling.convert(fndir, converter.root_aabb,
+                                                         subtree_levels=subtree_levels or implicit_tiling.DEFAULT_SUBTREE_LEVELS)
+    L.info('Finished tiling (%.1f sec / %.1f min)' % utils.timer(tilestart))
+    return result
+
+
+def child_tile(ts_path: Path,
+               root_dir: Path) -> dict:
+    """
+    Build the entry that references a dataset's tileset from the merged root,
+    the same way :py:func:`py3dtiles.merger.merge` does (root bounding volume
+    moved into the parent frame by the dataset's root transform).
+
+    Variables:
+    :param ts_path: The dataset's `tileset.json`
+    :type ts_path: pathlib.Path
+    :param root_dir: The directory of the merged root tileset
+    :type root_dir: pathlib.Path
+    :return: The child tile as a dict
+    :rtype: dict
+    """
+    import numpy as np
+    from py3dtiles.tileset.bounding_volume_box import BoundingVolumeBox
+    with open(ts_path, 'r') as fr:
+        root = json.load(fr)['root']
+    bv = BoundingVolumeBox.from_dict(root['boundingVolume'])
+    if 'transform' in root:
+        bv.transform(np.array(root['transform']).reshape((4, 4)))
+    return {
+        'boundingVolume': bv.to_dict(),
+        'geometricError': root['geometricError'],
+        'refine': 'REPLACE',
+        'content': {'uri': ts_path.relative_to(root_dir).as_posix()},
+    }
+
+def merge_incremental(dir: Path,
+                      new: Union[list[Path], None]=None,
+                      cat: Union['catalog.Catalog', None]=None,
+                      fan_out: int=0,
+                      workers: int=1) -> bool:
+    """
+    Add new dataset tilesets to an existing merged root `tileset.json`
+    without rereading the datasets already in it. The root bounding volume
+    and geometric error are updated from the child entries, entries whose
+    dataset has been removed are dropped, and entries for re-tiled datasets
+    are refreshed. A missing root is created from scratch.
+
+    With a catalogue, the datasets and their entries come from it rather
+    than from the filesystem, so no dataset tileset is read at all.
+
+    Roots carrying preview points (`r.pnts` content) cannot be updated
+    incrementally; in that case nothing is written and False is returned.
+
+    With a ``fan_out``, the root is written as a tree of node tilesets
+    (see :py:func:`pdgpoints.mergetree.write_tree`). The entries of a
+    root already written that way are read back from its nodes.
+
+    Variables:
+    :param dir: Directory holding the root tileset and the dataset subdirectories
+    :type dir: pathlib.Path
+    :param list new: Dataset `tileset.json` files to add or refresh (default: any on disk, or in the catalogue, that are not yet in the root)
+    :param cat: The catalogue of ``dir``
+    :type cat: pdgpoints.catalog.Catalog or None
+    :param int fan_out: Largest number of children of a tree node (0 to list every dataset in the root)
+    :param int workers: Number of processes building tree nodes
+    :return: Whether the root was updated
+    :rtype: bool
+    """
+    L = getLogger(__name__)
+    ts_path = Path(dir.joinpath('tileset.json'))
+    if ts_path.is_file():
+        with open(ts_path, 'r') as fr:
+            tileset = json.load(fr)
+        if 'content' in tileset['root']:
+            L.warning('Root tileset has preview point content; falling back to a full merge')
+            return False
+    else:
+        tileset = {'asset': {'version': '1.0'},
+                   'geometricError': 0.,
+                   'root': {'geometricError': 0., 'refine': 'REPLACE', 'children': []}}
 
-    L.info('Finished tiling (%s sec / %.1f min)' % utils.timer(tilestart))
+    current = mergetree.read_tree(dir, tileset)
+    if cat is not None:
+        entries = {p.relative_to(cat.dir).as_posix(): None for p in cat.tilesets()}
+        entries.update((e['uri'], e['child']) for e in cat.datasets() if e['uri'] in entries)
+        exists = lambda uri: uri in entries
+    else:
+        entries = {}
+        exists = lambda uri: dir.joinpath(uri).is_file()
+    children = [c for c in current if exists(c['content']['uri'])]
+    if len(children) < len(current):
+        L.info('Dropping %s entries whose dataset no longer exists%s' % (len(current) - len(children),
+                                                                        ' or duplicates a newer one' if cat else ''))
+    known = {c['content']['uri']: i for i, c in enumerate(children)}
+    if (new is None) and (cat is not None):
+        new = [dir.joinpath(uri) for uri in entries if uri not in known]
+    elif new is None:
+        new = [p for p in (Path(path) for path in glob.glob(str(dir.joinpath('*', 'tileset.json'))))
+               if p.relative_to(dir).as_posix() not in known]
+    for p in new:
+        uri = Path(p).absolute().relative_to(dir.absolute()).as_posix()
+        if (cat is not None) and (uri not in entries):
+            L.info('Skipping %s (not in the catalogue, or a duplicate)' % (uri))
+            continue
+        child = entries.get(uri) or child_tile(Path(p).absolute(), dir.absolute())
+        uri = child['content']['uri']
+        if uri in known:
+            L.info('Refreshing %s' % (uri))
+            children[known[uri]] = child
+        else:
+            L.info('Adding %s' % (uri))
+            known[uri] = len(children)
+            children.append(child)
 
+    if not children:
+        L.warning('No dataset tilesets found in %s' % (dir))
+        return True
+    if fan_out:
+        mergetree.write_tree(dir, children, fan_out=fan_out, workers=workers)
+        L.info('Root tileset now references %s datasets' % (len(children)))
+        return True
+    from py3dtiles.tileset.bounding_volume_box import BoundingVolumeBox
+    union = BoundingVolumeBox.from_dict(children[0]['boundingVolume'])
+    for c in children[1:]:
+        union.add(BoundingVolumeBox.from_dict(c['boundingVolume']))
+    err = max(c['geometricError'] for c in children)
+    tileset['root']['children'] = children
+    tileset['root']['boundingVolume'] = union.to_dict()
+    tileset['root']['geometricError'] = err
+    tileset['geometricError'] = err
+    prev = mergetree.current_generation(dir)
+    utils.write_json_atomic(ts_path, tileset)
+    mergetree.remove_tree(dir, keep=[prev])
+    L.info('Root tileset now references %s datasets' % (len(children)))
+    return True
 
 def merge(dir: Path,
-          overwrite: bool=False):
+          overwrite: bool=False,
+          incremental: bool=False,
+          new: Union[list[Path], None]=None,
+          fan_out: int=0,
+          workers: int=1,
+          precompress: Union[list[str], None]=None,
+          precompress_workers: int=precompression.DEFAULT_WORKERS):
     """
     Use py3dtiles.merger.merge() to merge more than one 3dtiles dataset.
-    This function will search for `tileset.json` files in subdirectories
+    The datasets are taken from the directory's catalogue
+    (:py:class:`pdgpoints.catalog.Catalog`) if it has one, leaving out
+    all but the newest of datasets made from the same input (the
+    directory is not searched, so datasets tiled without the catalogue
+    or deleted since it was made are only picked up once it is synced;
+    see :py:meth:`pdgpoints.catalog.Catalog.sync`); otherwise
+    this function will search for `tileset.json` files in subdirectories
     of the input directory (e.g. `input_dir/ds1/tileset.json`,
     `input_dir/ds2/tileset.json`)
 
@@ -88,27 +297,70 @@ def merge(dir: Path,
     :param dir: Directory to search for tileset subdirectories in
     :type dir: pathlib.Path
     :param bool overwrite: Whether to overwrite existing mergers in the output directory (default: False)
+    :param bool incremental: Whether to add new datasets to the existing root instead of rebuilding it (see :py:func:`merge_incremental`)
+    :param list new: Dataset `tileset.json` files to add in incremental mode (default: any not yet in the root)
+    :param int fan_out: Group the datasets into a spatial tree of node tilesets with at most this many children each instead of listing them all in the root (0 for a flat root; see :py:func:`pdgpoints.mergetree.write_tree`)
+    :param int workers: Number of processes reading dataset tilesets and building tree nodes
+    :param precompress: Encodings to write compressed copies of the files the merge wrote in (see :py:func:`pdgpoints.precompress.precompress_root`)
+    :type precompress: list or None
+    :param int precompress_workers: Number of threads compressing files
     :param bool verbose: Whether to log more messages
     """
     L = getLogger(__name__)
     L.info('Output dir: %s' % dir)
     mergestart = utils.timer()
 
-    paths = [Path(path) for path in glob.glob(str(dir.joinpath('*', 'tileset.json')))]
+    cat = catalog.open_catalog(dir)
+    if incremental:
+        with profiling.section('incremental'):
+            done = merge_incremental(dir=dir, new=new, cat=cat, fan_out=fan_out, workers=workers)
+        if done:
+            precompression.precompress_root(dir, encodings=precompress, workers=precompress_workers)
+            L.info('Finished incremental merge (%.1f sec / %.1f min)' % utils.timer(mergestart))
+            return
+
+    if cat is not None:
+        with profiling.section('catalog'):
+            paths = cat.tilesets()
+    else:
+        paths = [Path(path) for path in glob.glob(str(dir.joinpath('*', 'tileset.json')))]
     ts_path = Path(dir.joinpath('tileset.json'))
     r_path = Path(dir.joinpath('r.pnts'))
+    profiling.count('merge.tilesets', len(paths))
+
+    if fan_out:
+        if not paths:
+            L.warning('No dataset tilesets found in %s' % (dir))
+            return
+        with profiling.section('tree'):
+            # the root is replaced atomically, so only the preview points it no longer needs are removed
+            if overwrite and r_path.is_file():
+                rm_file(r_path)
+            entries = {e['uri']: e['child'] for e in cat.datasets()} if cat is not None else {}
+            uris = [Path(p).absolute().relative_to(dir.absolute()).as_posix() for p in paths]
+            unknown = [u for u in uris if u not in entries]
+            entries.update(zip(unknown, mergetree.read_children([dir / u for u in unknown], dir, workers=workers)))
+            mergetree.write_tree(dir, [entries[u] for u in uris], fan_out=fan_out, workers=workers)
+        precompression.precompress_root(dir, encodings=precompress, workers=precompress_workers)
+        L.info('Finished tree merge (%.1f sec / %.1f min)' % utils.timer(mergestart))
+        return
 
+    prev = mergetree.current_generation(dir)
     if overwrite:
         for f in [ts_path, r_path]:
             if f.is_file():
                 rm_file(f)
 
+    from py3dtiles import merger
     try:
-        merger.merge_from_files(tileset_paths=paths,
-                                output_tileset_path=ts_path,
-                                overwrite=overwrite,
-                                force_universal_merger=True)
+        with profiling.section('merge_files'):
+            merger.merge_from_files(tileset_paths=paths,
+                                    output_tileset_path=ts_path,
+                                    overwrite=overwrite,
+                                    force_universal_merger=True)
+        mergetree.remove_tree(dir, keep=[prev])
     except (RuntimeError, ValueError) as e:
         log_tileset_error(e)
 
-    L.info('Finished merge (%s sec / %.1f min)' % utils.timer(mergestart))
+    precompression.precompress_root(dir, encodings=precompress, workers=precompress_workers)
+    L.info('Finished merge (%.1f sec / %.1f min)' % utils.timer(mergestart))
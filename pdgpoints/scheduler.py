@@ -0,0 +1,198 @@
+import os
+import json
+from pathlib import Path
+from typing import NamedTuple, Union
+from logging import getLogger
+
+from . import lasheader
+
+STAGES = {'rewrite': ['wkt', 'rewrite', 'fused_rewrite', 'shift_z', 'thin', 'split'],
+          'tile': ['tile']}
+"Modelled stages, and the report stages whose memory use each one stands for"
+DEFAULT_MODEL = {'rewrite': (256 * 2**20, 1.),
+                 'tile': (512 * 2**20, 8.)}
+"Base bytes and bytes per byte of point records of each stage, used until there are enough run reports to calibrate from"
+MIN_SAMPLES = 3
+"Number of run reports a stage needs before its model is calibrated from them"
+QUANTILE = 0.9
+"Quantile of the observed bytes per byte of point records used as the calibrated slope (high, to err towards overestimating)"
+DEFAULT_MEMORY_FRACTION = 0.8
+"Fraction of total memory used as the budget when none is given"
+
+class Job(NamedTuple):
+    """
+    An input file and its predicted peak memory use.
+    """
+    file: Path
+    points: int
+    point_record_length: int
+    peak_bytes: int
+
+def total_memory() -> int:
+    """
+    Get the total physical memory of this host.
+
+    :return: Memory in bytes (0 if it cannot be found)
+    :rtype: int
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+def default_budget() -> int:
+    """
+    Get the default memory budget (see :py:data:`DEFAULT_MEMORY_FRACTION`).
+
+    :return: Budget in bytes (0 if total memory is unknown)
+    :rtype: int
+    """
+    return int(total_memory() * DEFAULT_MEMORY_FRACTION)
+
+class MemoryModel():
+    """
+    Predict the peak memory of a pipeline run from the size of its point
+    records: for each stage, ``base + slope * points * point_record_length``.
+    The stages of a run happen one after another, so a run's peak is the
+    largest of its stages'.
+
+    :param dict stages: Base bytes and slope of each stage (default: :py:data:`DEFAULT_MODEL`)
+    :param dict samples: Number of run reports each stage was calibrated from
+    """
+    def __init__(self, stages: Union[dict, None]=None, samples: Union[dict, None]=None):
+        self.stages = dict(DEFAULT_MODEL, **(stages or {}))
+        self.samples = samples or {}
+
+    def estimate(self, points: int, point_record_length: int) -> dict:
+        """
+        Predict the peak memory of each stage.
+
+        :param int points: Number of points
+        :param int point_record_length: Bytes per point record
+        :return: Predicted bytes per stage
+        :rtype: dict
+        """
+        return {stage: int(base + slope * points * point_record_length)
+                for stage, (base, slope) in self.stages.items()}
+
+    def peak(self, points: int, point_record_length: int) -> int:
+        """
+        Predict the peak memory of a run.
+
+        :param int points: Number of points
+        :param int point_record_length: Bytes per point record
+        :return: Predicted bytes
+        :rtype: int
+        """
+        return max(self.estimate(points, point_record_length).values())
+
+def report_samples(report: dict) -> dict:
+    """
+    Get the point record bytes and peak memory of each modelled stage
+    from a run report. Peak RSS values in reports are high-water marks of
+    the process that ran the pipeline (and of its largest child), so they
+    can include earlier stages or earlier files handled by the same
+    process; this only makes the calibrated model more cautious.
+
+    :param dict report: The run report (see :py:meth:`pdgpoints.pipeline.Pipeline.write_report`)
+    :return: Point record bytes and peak bytes per modelled stage
+    :rtype: dict
+    """
+    points, length = report.get('points'), report.get('point_record_length')
+    if not (report.get('ok') and points and length):
+        return {}
+    jobs = (report.get('parameters') or {}).get('jobs') or 1
+    samples = {}
+    for stage, names in STAGES.items():
+        peaks = []
+        for name in names:
+            st = report['stages'].get(name, {})
+            if st.get('ok') and not st.get('skipped') and ('peak_rss_bytes' in st):
+                # the tiler's workers each take about as much as the largest one
+                children = st['peak_rss_children_bytes'] * (jobs if stage == 'tile' else 1)
+                peaks.append(st['peak_rss_bytes'] + children)
+        if peaks:
+            samples[stage] = (points * length, max(peaks))
+    return samples
+
+def calibrate(dirs: list) -> MemoryModel:
+    """
+    Fit the memory model to the run reports found in output directories.
+    For each stage, the base is the smallest peak observed, and the slope
+    is the :py:data:`QUANTILE` quantile of the bytes above the base per
+    byte of point records. Stages with fewer than :py:data:`MIN_SAMPLES`
+    reports keep the defaults.
+
+    :param list dirs: Output directories (holding ``<dataset>/report.json`` files)
+    :return: The model
+    :rtype: pdgpoints.scheduler.MemoryModel
+    """
+    L = getLogger(__name__)
+    samples = {stage: [] for stage in STAGES}
+    for d in dirs:
+        for f in Path(d).glob('*/report.json'):
+            try:
+                with open(f, 'r') as fr:
+                    report = json.load(fr)
+            except (OSError, ValueError):
+                continue
+            for stage, sample in report_samples(report).items():
+                samples[stage].append(sample)
+    stages = {}
+    for stage, s in samples.items():
+        if len(s) < MIN_SAMPLES:
+            continue
+        base = min(peak for size, peak in s)
+        slopes = sorted((peak - base) / size for size, peak in s)
+        slope = slopes[min(len(slopes) - 1, int(QUANTILE * len(slopes)))]
+        stages[stage] = (base, slope)
+        L.info('Memory model for %s calibrated from %s reports: %.0f MB + %.2f x point bytes' % (stage, len(s),
+                                                                                              base / 2**20, slope))
+    return MemoryModel(stages=stages, samples={stage: len(s) for stage, s in samples.items()})
+
+def plan(files: list[Path], model: MemoryModel) -> list[Job]:
+    """
+    Predict the peak memory of each input from its header and order the
+    inputs largest first, so the longest runs start early instead of
+    holding up the end of the batch.
+
+    :param list files: The input files
+    :param pdgpoints.scheduler.MemoryModel model: The memory model
+    :return: The jobs, largest first
+    :rtype: list
+    """
+    L = getLogger(__name__)
+    jobs = []
+    for f in files:
+        try:
+            h = lasheader.read_header(f)
+            points, length = h.point_count, h.point_record_length
+        except Exception as e:
+            # assume the points are stored uncompressed in the most common format
+            L.warning('Could not read the header of %s (%s); estimating from its size' % (f, e))
+            length = 34
+            points = Path(f).stat().st_size // length
+        jobs.append(Job(file=f, points=points, point_record_length=length,
+                        peak_bytes=model.peak(points, length)))
+    return sorted(jobs, key=lambda j: (-j.peak_bytes, str(j.file)))
+
+def admit(pending: list[Job], in_use: int, running: int, budget: int) -> Union[Job, None]:
+    """
+    Choose the next job to start: the largest pending job that fits in
+    what is left of the budget. A job larger than the whole budget is
+    started only when nothing else is running, and nothing is started
+    beside it while it waits.
+
+    :param list pending: Jobs not yet started, largest first
+    :param int in_use: Predicted bytes of the running jobs
+    :param int running: Number of running jobs
+    :param int budget: Memory budget in bytes
+    :return: The job to start, or None to wait for a running one to finish
+    :rtype: pdgpoints.scheduler.Job or None
+    """
+    for job in pending:
+        if job.peak_bytes > budget:
+            return job if running == 0 else None
+        if in_use + job.peak_bytes <= budget:
+            return job
+    return None
@@ -0,0 +1,213 @@
+import copy
+import shutil
+from pathlib import Path
+from typing import Tuple, Union
+import numpy as np
+import laspy
+from logging import getLogger
+
+from . import utils
+from . import lasheader
+from . import py3dtiles_iface
+
+DEFAULT_SPLIT_POINTS = 50_000_000
+"Default largest number of points in a spatial chunk"
+DEFAULT_BINS = 64
+"Default number of density grid cells along each axis (a power of 2, so the quadtree divides it evenly)"
+DEFAULT_STRIDE = 1000
+"Sample every nth point when estimating point density"
+DEFAULT_CHUNK_SIZE = 1_000_000
+"Number of point records read per iteration when partitioning"
+
+def cell_index(X: np.ndarray,
+               Y: np.ndarray,
+               header: lasheader.Header,
+               bins: int=DEFAULT_BINS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the density grid cell of each point from its raw (unscaled)
+    integer coordinates.
+
+    :param numpy.ndarray X: Raw X values
+    :param numpy.ndarray Y: Raw Y values
+    :param pdgpoints.lasheader.Header header: The parsed header (bounds, scales, and offsets)
+    :param int bins: Number of grid cells along each axis
+    :return: Column and row of each point
+    :rtype: numpy.ndarray, numpy.ndarray
+    """
+    cols = []
+    for raw, i in [(X, 0), (Y, 1)]:
+        v = raw.astype(np.float64) * header.scales[i] + header.offsets[i]
+        span = max(header.maxs[i] - header.mins[i], header.scales[i])
+        cols.append(np.clip(((v - header.mins[i]) / span * bins).astype(np.int64), 0, bins - 1))
+    return cols[0], cols[1]
+
+def density(f: Path,
+            header: lasheader.Header,
+            bins: int=DEFAULT_BINS,
+            stride: int=DEFAULT_STRIDE,
+            chunk_size: int=DEFAULT_CHUNK_SIZE) -> np.ndarray:
+    """
+    Estimate the number of points in each density grid cell from every
+    nth point. Uncompressed files are memory-mapped so that only the
+    pages holding sampled records are read.
+
+    :param f: The input file
+    :type f: pathlib.Path
+    :param pdgpoints.lasheader.Header header: The parsed header
+    :param int bins: Number of grid cells along each axis
+    :param int stride: Sample every nth point
+    :param int chunk_size: Number of points read per iteration (compressed files only)
+    :return: Estimated point counts, indexed ``[column, row]``
+    :rtype: numpy.ndarray
+    """
+    counts = np.zeros((bins, bins), dtype=np.int64)
+    if not header.compressed:
+        dtype = np.dtype([('X', '<i4'),
+                          ('Y', '<i4'),
+                          ('rest', 'V%s' % (header.point_record_length - 8))])
+        points = np.memmap(f, dtype=dtype, mode='r',
+                           offset=header.offset_to_points,
+                           shape=(header.point_count,))
+        ix, iy = cell_index(points['X'][::stride], points['Y'][::stride], header, bins)
+        np.add.at(counts, (ix, iy), 1)
+        del points
+    else:
+        done = 0
+        with laspy.open(f) as reader:
+            for chunk in reader.chunk_iterator(chunk_size):
+                first = (-done) % stride
+                ix, iy = cell_index(np.asarray(chunk.X[first::stride]),
+                                    np.asarray(chunk.Y[first::stride]), header, bins)
+                np.add.at(counts, (ix, iy), 1)
+                done += len(chunk)
+    return counts * stride
+
+def quadtree(counts: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Divide the density grid into quadtree leaves holding no more than
+    ``max_points`` points each (unless a leaf is a single cell).
+
+    :param numpy.ndarray counts: Estimated point counts per cell (square, with a power of 2 side)
+    :param int max_points: Largest number of points in a leaf
+    :return: The leaf number of each cell
+    :rtype: numpy.ndarray
+    """
+    table = np.zeros(counts.shape, dtype=np.int32)
+    leaves = [0]
+    def visit(x0: int, y0: int, size: int):
+        if (size == 1) or (counts[x0:x0+size, y0:y0+size].sum() <= max_points):
+            table[x0:x0+size, y0:y0+size] = leaves[0]
+            leaves[0] += 1
+            return
+        half = size // 2
+        for dx, dy in [(0, 0), (half, 0), (0, half), (half, half)]:
+            visit(x0 + dx, y0 + dy, half)
+    visit(0, 0, counts.shape[0])
+    return table
+
+def split_las(f: Path,
+              out_dir: Path,
+              max_points: int=DEFAULT_SPLIT_POINTS,
+              bins: int=DEFAULT_BINS,
+              stride: int=DEFAULT_STRIDE,
+              chunk_size: int=DEFAULT_CHUNK_SIZE) -> list[Path]:
+    """
+    Partition a point cloud into spatial chunks of roughly ``max_points``
+    points each, using a quadtree over the header bounds that follows the
+    sampled point density. Points are streamed, so memory use is bounded
+    by ``chunk_size`` regardless of the size of the input.
+
+    :param f: The input file
+    :type f: pathlib.Path
+    :param out_dir: Directory to write the chunks to (emptied first)
+    :type out_dir: pathlib.Path
+    :param int max_points: Largest number of points in a chunk
+    :param int bins: Number of density grid cells along each axis
+    :param int stride: Sample every nth point when estimating density
+    :param int chunk_size: Number of points read per iteration
+    :return: The chunk files (empty chunks are not written)
+    :rtype: list
+    """
+    L = getLogger(__name__)
+    splitstart = utils.timer()
+    header = lasheader.read_header(f)
+    table = quadtree(density(f, header, bins=bins, stride=stride), max_points=max_points)
+    L.info('Splitting %s points from %s into up to %s chunks' % (header.point_count, f.name, table.max() + 1))
+    shutil.rmtree(out_dir, ignore_errors=True)
+    out_dir.mkdir(parents=True)
+    writers = {}
+    try:
+        with laspy.open(f) as reader:
+            for chunk in reader.chunk_iterator(chunk_size):
+                ix, iy = cell_index(np.asarray(chunk.X), np.asarray(chunk.Y), header, bins)
+                leaf = table[ix, iy]
+                order = np.argsort(leaf, kind='stable')
+                ids, starts = np.unique(leaf[order], return_index=True)
+                ends = list(starts[1:]) + [len(order)]
+                for lid, a, b in zip(ids, starts, ends):
+                    if lid not in writers:
+                        writers[lid] = laspy.open(out_dir / ('%s_%04d%s' % (f.stem, lid, f.suffix)),
+                                                  mode='w', header=copy.deepcopy(reader.header))
+                    writers[lid].write_points(chunk[order[a:b]])
+    finally:
+        for w in writers.values():
+            w.close()
+    files = sorted(out_dir / ('%s_%04d%s' % (f.stem, lid, f.suffix)) for lid in writers)
+    L.info('Wrote %s chunks (%.1f sec / %.1f min)' % ((len(files),) + utils.timer(splitstart)))
+    return files
+
+def tile_chunks(files: list[Path],
+                out_dir: Path,
+                las_crs: str,
+                out_crs: str='4978',
+                workers: int=1,
+                jobs: Union[int, None]=None,
+                cache_size: Union[int, None]=None,
+                implicit: bool=False,
+                subtree_levels: Union[int, None]=None) -> list[dict]:
+    """
+    Tile each chunk into its own subdirectory of ``out_dir``, several at
+    once, then stitch them into one tileset by writing a root
+    ``tileset.json`` in ``out_dir`` that references every chunk.
+    Unless set, the converter jobs and cache size of each chunk are the
+    py3dtiles defaults divided by ``workers``, so that running chunks side
+    by side does not use more CPUs or memory than tiling one file.
+
+    :param list files: The chunk files
+    :param out_dir: The directory of the stitched tileset (emptied first)
+    :type out_dir: pathlib.Path
+    :param str las_crs: Coordinate reference system (CRS) of the chunks
+    :param str out_crs: CRS of the output tileset
+    :param int workers: Number of chunks to tile at once
+    :param jobs: Converter worker processes per chunk
+    :type jobs: int or None
+    :param cache_size: Converter cache size per chunk in MB
+    :type cache_size: int or None
+    :param bool implicit: Whether to write each chunk as implicit tiling (see :py:func:`pdgpoints.implicit.convert`)
+    :param subtree_levels: Number of levels in each subtree file
+    :type subtree_levels: int or None
+    :return: The converter results of each chunk (see :py:func:`pdgpoints.py3dtiles_iface.tile`)
+    :rtype: list
+    """
+    from py3dtiles import convert
+    L = getLogger(__name__)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    out_dir.mkdir(parents=True)
+    workers = max(1, min(workers, len(files)))
+    kwargs = dict(out_dir=out_dir, las_crs=las_crs, out_crs=out_crs,
+                  jobs=jobs or max(1, convert.CPU_COUNT // workers),
+                  cache_size=cache_size or max(1, convert.DEFAULT_CACHE_SIZE // workers),
+                  implicit=implicit, subtree_levels=subtree_levels)
+    results = []
+    if workers > 1:
+        with utils.spawn_pool(workers) as ex:
+            futures = [ex.submit(py3dtiles_iface.tile, f=f, **kwargs) for f in files]
+            for i, fut in enumerate(futures):
+                results.append(fut.result())
+                L.info('Tiled chunk %s of %s' % (i + 1, len(files)))
+    else:
+        for i, f in enumerate(files):
+            results.append(py3dtiles_iface.tile(f=f, **kwargs))
+            L.info('Tiled chunk %s of %s' % (i + 1, len(files)))
+    py3dtiles_iface.merge(dir=out_dir, incremental=True, new=[Path(r['tileset']) for r in results])
+    return results
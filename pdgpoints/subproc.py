@@ -0,0 +1,288 @@
+import time
+import errno
+import signal
+import threading
+from collections import deque
+from subprocess import Popen, PIPE, STDOUT, DEVNULL, TimeoutExpired
+from pathlib import Path
+from typing import NamedTuple, Union
+from logging import getLogger, DEBUG, ERROR
+
+from . import profiling
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+DEFAULT_RETRIES = 2
+"Default number of times a command that failed transiently is run again"
+DEFAULT_BACKOFF = 2.
+"Default seconds to wait before the first retry (doubled for each one after)"
+DEFAULT_RING_LINES = 200
+"Default number of the last lines of output kept to show if a command fails"
+TRANSIENT_ERRNOS = [errno.EAGAIN, errno.ENOMEM, errno.ETXTBSY]
+"Errors starting a process that are worth retrying (process table or memory full, binary being replaced)"
+TRANSIENT_SIGNALS = [signal.SIGKILL]
+"Signals that kill a process for reasons outside it (e.g. the OOM killer), so a retry may succeed"
+
+class CommandError(RuntimeError):
+    """
+    A command could not be run to completion.
+
+    :param str message: What went wrong
+    :param str command: The command (pipes joined by ``|``)
+    :param returncode: Exit code of the failing process (negative if killed by a signal)
+    :type returncode: int or None
+    :param int attempts: Number of times the command was run
+    :param tail: The last lines of output
+    :type tail: list or None
+    """
+    def __init__(self, message: str, command: str, returncode: Union[int, None]=None,
+                 attempts: int=1, tail: Union[list, None]=None):
+        super().__init__(message)
+        self.command = command
+        self.returncode = returncode
+        self.attempts = attempts
+        self.tail = tail or []
+
+class CommandFailed(CommandError):
+    """
+    A command exited with a nonzero code.
+    """
+
+class CommandTimeout(CommandError):
+    """
+    A command ran longer than its timeout and was killed.
+    """
+
+class CommandNotFound(CommandError):
+    """
+    A command's executable does not exist or cannot be executed.
+    """
+
+class Result(NamedTuple):
+    """
+    The outcome of a command that ran to completion.
+    """
+    command: str
+    returncode: int
+    seconds: float
+    attempts: int
+    lines: int
+    tail: list
+    matches: list
+
+def describe(commands: list[list]) -> str:
+    """
+    Format a command or pipe for messages.
+
+    :param list commands: The commands of the pipe
+    :return: The commands joined by ``|``
+    :rtype: str
+    """
+    return ' | '.join(' '.join(str(c) for c in command) for command in commands)
+
+def set_limits(pid: Union[int, None]=None,
+               memory_mb: Union[int, None]=None,
+               cpu_seconds: Union[int, None]=None):
+    """
+    Limit the address space and CPU time of a process. On Linux the limits
+    are set on the running child; elsewhere this is called in the child
+    before it executes the command.
+
+    :param pid: The process ID (default: this process)
+    :type pid: int or None
+    :param memory_mb: Largest address space in MB
+    :type memory_mb: int or None
+    :param cpu_seconds: Most CPU seconds (the process is killed with SIGXCPU past this)
+    :type cpu_seconds: int or None
+    """
+    # a hard CPU limit above the soft one, so that the process gets SIGXCPU
+    # rather than the SIGKILL that would be taken for a transient failure
+    for limit, values in [(resource.RLIMIT_AS, (memory_mb * 2**20,) * 2 if memory_mb else None),
+                          (resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1) if cpu_seconds else None)]:
+        if values:
+            if pid is None:
+                resource.setrlimit(limit, values)
+            else:
+                resource.prlimit(pid, limit, values)
+
+def _attempt(commands: list[list],
+             timeout: Union[float, None],
+             memory_mb: Union[int, None],
+             cpu_seconds: Union[int, None],
+             ring_lines: int,
+             match: Union[str, None]) -> dict:
+    """
+    Run a pipe of commands once, reading every process's output (standard
+    error, and standard output of the last) in background threads.
+
+    :return: Return codes, whether the timeout was hit, line count, last lines, and matching lines
+    :rtype: dict
+    """
+    tail = deque(maxlen=ring_lines)
+    matches = []
+    count = [0]
+    lock = threading.Lock()
+    def read(stream, prefix: str):
+        with stream:
+            for raw in iter(stream.readline, b''):
+                line = raw.decode('utf-8', 'replace').rstrip()
+                with lock:
+                    count[0] += 1
+                    tail.append(prefix + line)
+                    if match and (match in line):
+                        matches.append(line)
+
+    limited = (memory_mb or cpu_seconds) and (resource is not None)
+    # preexec_fn can deadlock in a threaded parent, so use prlimit where there is one
+    preexec = None
+    if limited and not hasattr(resource, 'prlimit'):
+        preexec = lambda: set_limits(memory_mb=memory_mb, cpu_seconds=cpu_seconds)
+    procs, readers = [], []
+    timed_out = False
+    try:
+        for i, command in enumerate(commands):
+            last = (i == len(commands) - 1)
+            p = Popen([str(c) for c in command],
+                      stdin=procs[-1].stdout if procs else DEVNULL,
+                      stdout=PIPE,
+                      stderr=STDOUT if last else PIPE,
+                      preexec_fn=preexec)
+            if procs:
+                # only the next process holds the pipe, so the previous one sees it close
+                procs[-1].stdout.close()
+            procs.append(p)
+            if limited and (preexec is None):
+                set_limits(pid=p.pid, memory_mb=memory_mb, cpu_seconds=cpu_seconds)
+            prefix = '%s: ' % (Path(str(command[0])).name) if len(commands) > 1 else ''
+            t = threading.Thread(target=read, args=(p.stdout if last else p.stderr, prefix), daemon=True)
+            t.start()
+            readers.append(t)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            for p in procs:
+                p.wait(timeout=None if deadline is None else max(0., deadline - time.monotonic()))
+        except TimeoutExpired:
+            timed_out = True
+            raise
+    except BaseException:
+        for p in procs:
+            if p.poll() is None:
+                p.kill()
+        for p in procs:
+            p.wait()
+        if not timed_out:
+            raise
+    for t in readers:
+        t.join()
+    return {'returncodes': [p.returncode for p in procs], 'timed_out': timed_out,
+            'lines': count[0], 'tail': list(tail), 'matches': matches}
+
+def log_tail(r: dict, cmd: str, level: int=ERROR):
+    """
+    Log the kept output lines of a command.
+
+    :param dict r: The attempt record
+    :param str cmd: The command, for the message
+    :param int level: Logging level
+    """
+    L = getLogger(__name__)
+    if not r['tail']:
+        L.log(level, 'No output from %s' % (cmd))
+        return
+    L.log(level, 'Last %s of %s output lines of %s:\n%s' % (len(r['tail']), r['lines'], cmd,
+                                                           '\n'.join(r['tail'])))
+
+def run_pipe(commands: list[list],
+             timeout: Union[float, None]=None,
+             retries: int=DEFAULT_RETRIES,
+             backoff: float=DEFAULT_BACKOFF,
+             memory_mb: Union[int, None]=None,
+             cpu_seconds: Union[int, None]=None,
+             ring_lines: int=DEFAULT_RING_LINES,
+             match: Union[str, None]=None) -> Result:
+    """
+    Run a command, or several with each one's output piped into the next.
+    Output is not logged line by line; the last ``ring_lines`` lines are
+    kept and logged only if the command fails. Transient failures (see
+    :py:data:`TRANSIENT_ERRNOS` and :py:data:`TRANSIENT_SIGNALS`) are
+    retried up to ``retries`` times, waiting ``backoff`` seconds and then
+    twice as long each time.
+
+    :param list commands: The commands (each a list of arguments)
+    :param timeout: Seconds the whole pipe may run before it is killed
+    :type timeout: float or None
+    :param int retries: Number of times to retry a transient failure
+    :param float backoff: Seconds to wait before the first retry
+    :param memory_mb: Largest address space of each process in MB
+    :type memory_mb: int or None
+    :param cpu_seconds: Most CPU seconds of each process
+    :type cpu_seconds: int or None
+    :param int ring_lines: Number of the last lines of output to keep
+    :param match: Also keep every output line containing this text
+    :type match: str or None
+    :return: The result
+    :rtype: pdgpoints.subproc.Result
+    :raises pdgpoints.subproc.CommandNotFound: If an executable does not exist
+    :raises pdgpoints.subproc.CommandTimeout: If the timeout is hit
+    :raises pdgpoints.subproc.CommandFailed: If a process exits with a nonzero code
+    """
+    L = getLogger(__name__)
+    cmd = describe(commands)
+    L.debug('Command: %s' % (cmd))
+    start = time.monotonic()
+    attempts = 0
+    while True:
+        attempts += 1
+        wait = backoff * 2 ** (attempts - 1)
+        try:
+            r = _attempt(commands, timeout=timeout, memory_mb=memory_mb, cpu_seconds=cpu_seconds,
+                         ring_lines=ring_lines, match=match)
+        except OSError as e:
+            if e.errno in [errno.ENOENT, errno.EACCES, errno.ENOEXEC]:
+                raise CommandNotFound('Could not run %s (%s)' % (cmd, e), command=cmd, attempts=attempts) from e
+            if (e.errno in TRANSIENT_ERRNOS) and (attempts <= retries):
+                L.warning('Could not start %s (%s); retrying in %.0f sec (attempt %s of %s)' % (cmd, e, wait,
+                                                                                            attempts, retries + 1))
+                time.sleep(wait)
+                continue
+            raise CommandError('Could not run %s (%s)' % (cmd, e), command=cmd, attempts=attempts) from e
+
+        if r['timed_out']:
+            log_tail(r, cmd)
+            raise CommandTimeout('%s ran longer than %s sec and was killed' % (cmd, timeout),
+                                 command=cmd, attempts=attempts, tail=r['tail'])
+        # the last failure in the pipe is the cause: an upstream process
+        # killed by SIGPIPE only means a later one stopped reading
+        *upstream, last = r['returncodes']
+        code = last or next((rc for rc in reversed(upstream)
+                             if rc not in [0, -signal.SIGPIPE, 128 + signal.SIGPIPE]), 0)
+        if code == 0:
+            profiling.count('subproc.commands')
+            profiling.count('subproc.seconds', time.monotonic() - start)
+            profiling.count('subproc.retries', attempts - 1)
+            L.debug('%s finished (%s output lines, attempt %s)' % (cmd, r['lines'], attempts))
+            if L.isEnabledFor(DEBUG):
+                log_tail(r, cmd, level=DEBUG)
+            return Result(command=cmd, returncode=0, seconds=time.monotonic() - start, attempts=attempts,
+                          lines=r['lines'], tail=r['tail'], matches=r['matches'])
+        if (-code in TRANSIENT_SIGNALS) and (attempts <= retries):
+            L.warning('%s was killed by signal %s; retrying in %.0f sec (attempt %s of %s)' % (cmd, -code, wait,
+                                                                                              attempts, retries + 1))
+            time.sleep(wait)
+            continue
+        log_tail(r, cmd)
+        raise CommandFailed('%s exited with code %s' % (cmd, code),
+                            command=cmd, returncode=code, attempts=attempts, tail=r['tail'])
+
+def run(command: list, **kwargs) -> Result:
+    """
+    Run a single command (see :py:func:`run_pipe` for the options).
+
+    :param list command: The command arguments
+    :return: The result
+    :rtype: pdgpoints.subproc.Result
+    """
+    return run_pipe([command], **kwargs)
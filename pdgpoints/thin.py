@@ -0,0 +1,170 @@
+import copy
+import math
+from pathlib import Path
+from typing import Tuple, TYPE_CHECKING
+from logging import getLogger
+
+from . import utils
+from . import lasheader
+
+if TYPE_CHECKING:
+    import numpy as np
+
+MODES = ['voxel', 'random', 'nth']
+"Thinning modes: first point per voxel, a random sample, or every nth point"
+DEFAULT_CHUNK_SIZE = 1_000_000
+"Number of point records read per iteration when thinning"
+DEFAULT_BITMAP_MB = 256
+"Largest size of the voxel occupancy bitmap in MB"
+BITS_PER_VOXEL = 32
+"Bitmap bits per expected occupied voxel (hash collisions wrongly drop at most about one voxel in this many)"
+DEFAULT_SEED = 0
+"Seed of the random mode, so that reruns keep the same points"
+
+def plan(header: lasheader.Header,
+         mode: str,
+         spacing: float=0.,
+         budget: int=0) -> Tuple[float, float]:
+    """
+    Work out the voxel size and the fraction of points to keep from a
+    target spacing or point budget. The two are converted into each other
+    using the XY footprint of the header bounds, so a budget gives a
+    voxel size (and a spacing gives a random or every-nth fraction) that
+    assumes the points are spread evenly over it.
+
+    :param pdgpoints.lasheader.Header header: The parsed header
+    :param str mode: The thinning mode (see :py:data:`MODES`)
+    :param float spacing: Target distance between points (0 to use ``budget``)
+    :param int budget: Target number of points (0 to use ``spacing``)
+    :return: Voxel size and fraction of points to keep
+    :rtype: float, float
+    """
+    area = max((header.maxs[0] - header.mins[0]) * (header.maxs[1] - header.mins[1]), header.scales[0] ** 2)
+    if spacing:
+        budget = area / spacing ** 2
+    elif budget:
+        spacing = math.sqrt(area / budget)
+    else:
+        raise ValueError('Thinning needs a target spacing or point budget')
+    if mode == 'voxel':
+        return spacing, 1.
+    return spacing, min(1., budget / max(header.point_count, 1))
+
+def voxel_hash(ix: 'np.ndarray', iy: 'np.ndarray', iz: 'np.ndarray', nbits: int) -> 'np.ndarray':
+    """
+    Hash voxel indices to bitmap positions.
+
+    :param numpy.ndarray ix: Voxel column of each point
+    :param numpy.ndarray iy: Voxel row of each point
+    :param numpy.ndarray iz: Voxel layer of each point
+    :param int nbits: Number of bits in the bitmap (a power of 2)
+    :return: Bit position of each point's voxel
+    :rtype: numpy.ndarray
+    """
+    import numpy as np
+    h = ((ix.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15))
+         ^ (iy.astype(np.uint64) * np.uint64(0xC2B2AE3D27D4EB4F))
+         ^ (iz.astype(np.uint64) * np.uint64(0x165667B19E3779F9)))
+    h ^= h >> np.uint64(29)
+    h *= np.uint64(0xBF58476D1CE4E5B9)
+    h ^= h >> np.uint64(32)
+    return h & np.uint64(nbits - 1)
+
+def bitmap_bits(header: lasheader.Header, spacing: float, bitmap_mb: int=DEFAULT_BITMAP_MB) -> int:
+    """
+    Size the voxel occupancy bitmap from the number of voxels that could
+    be occupied (no more than the number of points, nor the number of
+    voxels in the bounds).
+
+    :param pdgpoints.lasheader.Header header: The parsed header
+    :param float spacing: The voxel size
+    :param int bitmap_mb: Largest size of the bitmap in MB
+    :return: Number of bits (a power of 2)
+    :rtype: int
+    """
+    cells = 1
+    for i in range(3):
+        cells *= math.floor((header.maxs[i] - header.mins[i]) / spacing) + 1
+    voxels = max(1, min(header.point_count, cells))
+    return min(1 << max(6, math.ceil(math.log2(voxels * BITS_PER_VOXEL))), bitmap_mb * 8 << 20)
+
+def thin_las(f: Path,
+             output_file: Path,
+             mode: str='voxel',
+             spacing: float=0.,
+             budget: int=0,
+             chunk_size: int=DEFAULT_CHUNK_SIZE,
+             bitmap_mb: int=DEFAULT_BITMAP_MB,
+             seed: int=DEFAULT_SEED) -> dict:
+    """
+    Thin a point cloud in one streaming pass, so memory use is bounded by
+    ``chunk_size`` and (in voxel mode) the occupancy bitmap, regardless of
+    the size of the input.
+
+    In ``'voxel'`` mode the first point in each cube of side ``spacing``
+    is kept. Voxels are tracked in a fixed-size bitmap indexed by a hash
+    of the voxel coordinates instead of a set of voxels, so now and then
+    a voxel whose hash collides with an occupied one loses its point.
+    In ``'random'`` mode each point is kept with the same probability,
+    and in ``'nth'`` mode every nth point is kept.
+
+    :param f: The input file
+    :type f: pathlib.Path
+    :param output_file: The thinned file to write
+    :type output_file: pathlib.Path
+    :param str mode: The thinning mode (see :py:data:`MODES`)
+    :param float spacing: Target distance between points (0 to use ``budget``)
+    :param int budget: Target number of points (0 to use ``spacing``)
+    :param int chunk_size: Number of points read per iteration
+    :param int bitmap_mb: Largest size of the voxel occupancy bitmap in MB
+    :param int seed: Seed of the random mode
+    :return: The mode, voxel size, fraction kept, and numbers of points in and out
+    :rtype: dict
+    """
+    import numpy as np
+    import laspy
+    L = getLogger(__name__)
+    thinstart = utils.timer()
+    if mode not in MODES:
+        raise ValueError('Unknown thinning mode "%s" (expected one of %s)' % (mode, MODES))
+    header = lasheader.read_header(f)
+    spacing, fraction = plan(header, mode, spacing=spacing, budget=budget)
+    if mode == 'voxel':
+        nbits = bitmap_bits(header, spacing, bitmap_mb=bitmap_mb)
+        bitmap = np.zeros(nbits >> 3, dtype=np.uint8)
+        L.info('Thinning %s to one point per %.3g unit voxel (%.1f MB bitmap)' % (f.name, spacing, nbits / 8 / 2**20))
+    else:
+        step = max(1, round(1 / fraction))
+        rng = np.random.default_rng(seed)
+        L.info('Thinning %s to %.2f%% of its points (%s)' % (f.name, 100 * fraction, mode))
+    points_in, points_out = 0, 0
+    with laspy.open(f) as reader:
+        with laspy.open(output_file, mode='w', header=copy.deepcopy(reader.header)) as writer:
+            for chunk in reader.chunk_iterator(chunk_size):
+                n = len(chunk)
+                keep = np.zeros(n, dtype=bool)
+                if mode == 'voxel':
+                    idx = []
+                    for i, raw in enumerate([chunk.X, chunk.Y, chunk.Z]):
+                        v = np.asarray(raw).astype(np.float64) * header.scales[i] + header.offsets[i]
+                        idx.append(np.floor((v - header.mins[i]) / spacing).astype(np.int64))
+                    h = voxel_hash(idx[0], idx[1], idx[2], nbits)
+                    # first point of each voxel in this chunk, then only voxels not seen in earlier chunks
+                    h, first = np.unique(h, return_index=True)
+                    new = ((bitmap[h >> np.uint64(3)] >> (h & np.uint64(7)).astype(np.uint8)) & 1) == 0
+                    h = h[new]
+                    np.bitwise_or.at(bitmap, h >> np.uint64(3), (np.uint64(1) << (h & np.uint64(7))).astype(np.uint8))
+                    keep[first[new]] = True
+                elif mode == 'random':
+                    keep = rng.random(n) < fraction
+                else:
+                    keep[(-points_in) % step::step] = True
+                if keep.any():
+                    writer.write_points(chunk[keep])
+                points_in += n
+                points_out += int(keep.sum())
+    L.info('Kept %s of %s points (%.1f%%) (%.1f sec / %.1f min)' % ((points_out, points_in,
+                                                                     100 * points_out / max(points_in, 1))
+                                                                    + utils.timer(thinstart)))
+    return {'mode': mode, 'spacing': spacing, 'fraction': fraction,
+            'points_in': points_in, 'points_out': points_out}
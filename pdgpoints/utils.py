@@ -1,22 +1,30 @@
+import os
+import json
+import uuid
+import multiprocessing
 from pathlib import Path
-from datetime import datetime
-from typing import Union
-from pyproj import CRS
+from time import perf_counter
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Tuple, Union
 from logging import getLogger
 
-def timer(time: Union[datetime, bool]=False) -> Union[datetime, int, float]:
+from . import crs_registry
+
+def timer(time: Union[float, bool]=False) -> Union[float, Tuple[float, float]]:
     """
     Start a timer if no argument is supplied, otherwise stop it and report the seconds and minutes elapsed.
+    Uses the monotonic, high-resolution :py:func:`time.perf_counter` clock.
 
-    :param time: The directory to create
-    :type time: bool or datetime.datetime
+    :param time: The start time returned by a previous call
+    :type time: bool or float
     :return: If no time is supplied, return start time; else return elapsed time in seconds and decimal minutes
-    :rtype: datetime.datetime or (int, float)
+    :rtype: float or (float, float)
     """
-    if not time:
-        return datetime.now()
+    if time is False:
+        return perf_counter()
     else:
-        time = (datetime.now() - time).seconds
+        time = perf_counter() - time
         return time, time/60
 
 def make_dirs(d: Path, exist_ok: bool=True):
@@ -39,6 +47,81 @@ def rm_files(files: list[Path]=[]):
         if f.is_file():
             f.unlink()
 
+def spawn_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Start a process pool whose workers are fresh interpreters rather than
+    forked copies of this process. py3dtiles starts its own worker
+    processes and ZeroMQ sockets, which can deadlock in a forked copy of
+    a process that has them (or has other threads running).
+
+    :param int workers: Number of worker processes
+    :return: The pool
+    :rtype: concurrent.futures.ProcessPoolExecutor
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+@contextmanager
+def atomic_path(f: Path) -> Iterator[Path]:
+    """
+    Get a temporary path to write a file to, which is renamed over the
+    destination once the block exits without error (and removed if it
+    raises), so readers never see a half-written file. The temporary file
+    has a unique name, so processes writing the same file at once (e.g.
+    on other nodes of a shared filesystem) do not clobber each other's.
+
+    :param f: The file to write
+    :type f: pathlib.Path
+    :return: The temporary path, in the same directory and with the same suffix
+    :rtype: pathlib.Path
+    """
+    f = Path(f)
+    tmp = f.with_name('.%s.%s.tmp%s' % (f.stem, uuid.uuid4().hex, f.suffix))
+    try:
+        yield tmp
+        os.replace(tmp, f)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+def write_json_atomic(f: Path, d: dict, indent: Union[int, None]=None):
+    """
+    Write a dict as JSON through :py:func:`atomic_path`. The file is
+    flushed to disk before the rename, so a crash cannot leave an empty
+    file in place of the old one. Values JSON cannot hold (e.g. paths)
+    are written as strings.
+
+    :param f: The file to write
+    :type f: pathlib.Path
+    :param dict d: The data to write
+    :param indent: Indentation of the JSON (default: none, on one line)
+    :type indent: int or None
+    """
+    with atomic_path(f) as tmp:
+        with open(tmp, 'w') as fw:
+            json.dump(d, fw, indent=indent, default=str)
+            fw.flush()
+            os.fsync(fw.fileno())
+
+def archive_file(f: Path, archive_dir: Path):
+    """
+    Move a processed input file to the archive directory.
+
+    :param f: The file to archive
+    :type f: pathlib.Path
+    :param archive_dir: Location to archive the file to
+    :type archive_dir: pathlib.Path
+    """
+    L = getLogger(__name__)
+    try:
+        assert (str(archive_dir) != '')
+        an = archive_dir.joinpath(f.name)
+        L.info('Archiving to %s' % (an))
+        f.rename(an)
+    except AssertionError:
+        L.error('Archiving is on but no archive directory set! Cannot archive files!')
+    except Exception as e:
+        L.error('%s: %s' % (repr(e), e))
+
 def write_wkt_to_file(f: Path, wkt: str):
     """
     Write well-known text (WKT) string to file. Will overwrite existing file.
@@ -66,7 +149,8 @@ def read_wkt_from_file(f: Path) -> str:
 
 def get_epsgs_from_wkt(wkt: str) -> tuple:
     """
-    Use pyproj to parse a well-known text string to CRS. Returns a tuple of
+    Use pyproj to parse a well-known text string to CRS (cached per process
+    by :py:mod:`pdgpoints.crs_registry`). Returns a tuple of
     `[CRS, horizontal EPSG, vertical EPSG, horizontal CRS name, vertical CRS name]`
     where the EPSG fields could be an integer representing an EPSG code or `None`.
 
@@ -75,27 +159,11 @@ def get_epsgs_from_wkt(wkt: str) -> tuple:
     :rtype: tuple
     """
     L = getLogger(__name__)
-    epsg_h, epsg_v = None, None
-    h_name, v_name = None, None
-    crs = CRS.from_wkt(wkt)
+    crs, epsg_h, epsg_v, h_name, v_name = crs_registry.split_crs(wkt)
     if crs.is_compound:
         L.info('Found compound coordinate system (COMPD_CS): %s entries' % (len(crs.sub_crs_list)))
         if len(crs.sub_crs_list) > 2: # not sure if this case exists, but should be warned anyway
             L.warning('More than 2 entries in a compound coordinate system may cause an unwanted override!')
-        for c in crs.sub_crs_list:
-            if c.is_vertical:
-                epsg_v = c.to_epsg()
-                v_name = c.name
-            else:
-                epsg_h = c.to_epsg()
-                h_name = c.name
-    else:
-        if crs.is_vertical:
-            epsg_v = crs.to_epsg()
-            v_name = crs.name
-        else:
-            epsg_h = crs.to_epsg()
-            h_name = crs.name
     if epsg_h:
         L.info('Found horizontal EPSG: %s (%s)' % (epsg_h, h_name))
     if epsg_v:
@@ -109,13 +177,27 @@ def log_init_stats(self):
 
     :param self self: The `self` object from which to extract values.
     """
-    self.L.info('File:            %s' % (self.f))
-    self.L.info('Merge:           %s' % (self.merge))
+    self.L.info('File:            %s%s' % (self.f, ' (auto-processing)' if self.auto else ''))
+    self.L.info('Merge:           %s%s%s' % (self.merge, ' (incremental)' if self.incremental_merge else '',
+                                           ' (tree, fan-out %s)' % (self.merge_fan_out) if self.merge_fan_out else ''))
     self.L.info('Intensity > RGB: %s' % (self.intensity_to_RGB))
     self.L.info('Intens. scalar:  %sx' % (self.rgb_scale))
+    self.L.info('RGB engine:      %s' % (self.rgb_engine))
+    self.L.info('Fused rewrite:   %s' % (self.fused))
+    self.L.info('Centroid:        %s (every %sth point)' % (self.centroid_strategy, self.sample_every))
     self.L.info('Translate Z:     %+.1f' % (self.translate_z))
     self.L.info('From geoid:      %s' % (self.from_geoid))
+    self.L.info('Geoid cache:     %s' % (self.geoid_cache.path if self.geoid_cache else None))
     self.L.info('Archive input:   %s' % (self.archive))
+    self.L.info('Converter:       %s jobs, %s MB cache' % (self.jobs or 'default', self.cache_size or 'default'))
+    self.L.info('Split:           %s' % ('over %s points, %s at a time' % (self.split_points, self.split_workers)
+                                          if self.split_points else False))
+    self.L.info('Implicit tiles:  %s' % ('%s levels per subtree' % (self.subtree_levels) if self.implicit else False))
+    self.L.info('Precompress:     %s' % (', '.join(self.precompress) if self.precompress else False))
+    self.L.info('Thinning:        %s' % ('%s to %s' % (self.thin_mode, '%s spacing' % (self.thin_spacing) if self.thin_spacing
+                                                             else '%s points' % (self.thin_budget))
+                                          if self.thin_mode else False))
+    self.L.info('Profiling:       %s' % (self.profile))
     self.L.info('Given name:      %s' % (self.given_name))
     self.L.info('File extension:  %s' % (self.ext))
     self.L.debug('base_dir:        %s' % (self.base_dir))
@@ -0,0 +1,284 @@
+import time
+import sqlite3
+import threading
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Union
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+
+from . import utils
+from . import batch
+from . import py3dtiles_iface
+from .defs import CACHE_DIR
+
+DEFAULT_STATE_FILE = CACHE_DIR / 'watch.sqlite'
+"Default location of the persistent ingest queue"
+DEFAULT_INTERVAL = 10.
+"Default number of seconds between scans of the watched directories"
+DEFAULT_SETTLE = 30.
+"Default number of seconds a file's size and modification time must stay the same before it is processed"
+DEFAULT_MERGE_DELAY = 60.
+"Default number of quiet seconds (no files finishing) to wait before merging"
+DEFAULT_MERGE_MAX_WAIT = 1800.
+"Default longest number of seconds a finished file waits to be merged under continuous load"
+DEFAULT_MAX_ATTEMPTS = 3
+"Default number of times a failing file is tried before it is given up on"
+IGNORE = ['.*', '*-wkt.laz']
+"Name patterns of files never picked up (hidden/partial uploads and pipeline intermediates)"
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    out_dir TEXT,
+    error TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_state ON files (state);
+CREATE TABLE IF NOT EXISTS merges (
+    out_dir TEXT NOT NULL,
+    tileset TEXT NOT NULL,
+    added REAL NOT NULL,
+    PRIMARY KEY (out_dir, tileset)
+);
+'''
+
+class Watcher():
+    """
+    Long-running ingest service that watches drop directories and runs
+    every new LAS/LAZ file through a :py:class:`pdgpoints.pipeline.Pipeline`
+    once it has been fully written.
+
+    A file is picked up once its size and modification time have stayed
+    the same for ``settle`` seconds. Picked-up files are queued in an
+    SQLite database, so queued, running, and finished-but-unmerged files
+    survive a restart (files that were running are queued again). A file
+    that changes after it was processed is processed again.
+
+    Files are processed by a pool of ``workers`` processes, and merges are
+    debounced: each output directory is merged once no file has finished
+    for ``merge_delay`` seconds (or once a finished file has waited
+    ``merge_max_wait`` seconds), so a burst of arrivals causes one merge.
+
+    :param list dirs: Directories to watch
+    :param state: The queue database file
+    :type state: str or pathlib.Path
+    :param int workers: Number of files to process at once
+    :param float interval: Seconds between scans
+    :param float settle: Seconds a file must stay unchanged before it is processed
+    :param bool merge: Whether to merge the output directories
+    :param float merge_delay: Quiet seconds to wait before merging
+    :param float merge_max_wait: Longest seconds a finished file waits to be merged
+    :param int max_attempts: Number of times a failing file is tried
+    :param kwargs: Keyword arguments passed to each :py:class:`pdgpoints.pipeline.Pipeline`
+    """
+    def __init__(self,
+                 dirs: list,
+                 state: Union[str, Path]=DEFAULT_STATE_FILE,
+                 workers: int=1,
+                 interval: float=DEFAULT_INTERVAL,
+                 settle: float=DEFAULT_SETTLE,
+                 merge: bool=True,
+                 merge_delay: float=DEFAULT_MERGE_DELAY,
+                 merge_max_wait: float=DEFAULT_MERGE_MAX_WAIT,
+                 max_attempts: int=DEFAULT_MAX_ATTEMPTS,
+                 **kwargs):
+        self.L = getLogger(__name__)
+        self.dirs = [Path(d).absolute() for d in dirs]
+        self.state = Path(state)
+        self.workers = max(1, workers)
+        self.interval = interval
+        self.settle = settle
+        self.merge = merge
+        self.merge_delay = merge_delay
+        self.merge_max_wait = merge_max_wait
+        self.max_attempts = max_attempts
+        self.kwargs = dict(kwargs, merge=False, auto=True)
+        self.seen = {}
+        self.running = {}
+        self.last_finished = 0.
+        self.stopping = threading.Event()
+        self.state.parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as con:
+            con.executescript(SCHEMA)
+            n = con.execute("UPDATE files SET state='queued', updated=? WHERE state='running'",
+                            (time.time(),)).rowcount
+        if n:
+            self.L.info('Requeued %s files that were running when the service last stopped' % (n))
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Open a connection to the queue database.
+
+        :return: The connection
+        :rtype: sqlite3.Connection
+        """
+        con = sqlite3.connect(self.state, timeout=30)
+        con.execute('PRAGMA journal_mode=WAL')
+        return con
+
+    def scan(self) -> int:
+        """
+        Look for new or changed files in the watched directories and queue
+        those that have stopped changing.
+
+        :return: The number of files queued
+        :rtype: int
+        """
+        now = time.time()
+        queued = 0
+        found = set()
+        for d in self.dirs:
+            if not d.is_dir():
+                self.L.warning('Watched directory %s does not exist' % (d))
+                continue
+            for f in batch.find_inputs(d):
+                if any(fnmatch(f.name, p) for p in IGNORE):
+                    continue
+                try:
+                    st = f.stat()
+                except FileNotFoundError:
+                    continue
+                key = str(f)
+                found.add(key)
+                sig = (st.st_size, st.st_mtime_ns)
+                if (key not in self.seen) or (self.seen[key][0] != sig):
+                    self.seen[key] = (sig, now)
+                    continue
+                if now - self.seen[key][1] < self.settle:
+                    continue
+                with self.connect() as con:
+                    row = con.execute('SELECT size, mtime_ns, state FROM files WHERE path=?', (key,)).fetchone()
+                    if (row is not None) and ((row[0], row[1]) == sig or row[2] in ['queued', 'running']):
+                        continue
+                    con.execute('INSERT OR REPLACE INTO files (path, size, mtime_ns, state, attempts, updated) '
+                                "VALUES (?, ?, ?, 'queued', 0, ?)", (key, sig[0], sig[1], now))
+                self.L.info('Queued %s' % (f))
+                queued += 1
+        for key in list(self.seen):
+            if key not in found:
+                del self.seen[key]
+        return queued
+
+    def submit(self, ex: ProcessPoolExecutor):
+        """
+        Start queued files (oldest first) until every worker is busy.
+
+        :param concurrent.futures.ProcessPoolExecutor ex: The worker pool
+        """
+        free = self.workers - len(self.running)
+        if free <= 0:
+            return
+        with self.connect() as con:
+            rows = con.execute("SELECT path FROM files WHERE state='queued' ORDER BY updated LIMIT ?",
+                               (free,)).fetchall()
+            for (path,) in rows:
+                con.execute("UPDATE files SET state='running', attempts=attempts+1, updated=? WHERE path=?",
+                            (time.time(), path))
+        for (path,) in rows:
+            self.L.info('Processing %s' % (path))
+            self.running[ex.submit(batch.run_one, Path(path), self.kwargs)] = path
+
+    def collect(self):
+        """
+        Record the results of finished files, requeue failures that have
+        attempts left, and note the new tilesets that need merging.
+        """
+        for fut in [fut for fut in self.running if fut.done()]:
+            path = self.running.pop(fut)
+            try:
+                r = fut.result()
+            except Exception as e:
+                # the worker process itself died (e.g. killed by the OOM killer)
+                r = {'ok': False, 'out_dir': None, 'error': repr(e)}
+            now = time.time()
+            with self.connect() as con:
+                if r['ok']:
+                    con.execute("UPDATE files SET state='done', out_dir=?, error=NULL, updated=? WHERE path=?",
+                                (r['out_dir'], now, path))
+                    con.execute('INSERT OR REPLACE INTO merges VALUES (?, ?, ?)',
+                                (r['out_dir'], str(Path(r['out_dir']) / Path(path).stem / 'tileset.json'), now))
+                    self.L.info('Finished %s' % (path))
+                else:
+                    attempts = con.execute('SELECT attempts FROM files WHERE path=?', (path,)).fetchone()[0]
+                    state = 'queued' if attempts < self.max_attempts else 'failed'
+                    con.execute('UPDATE files SET state=?, error=?, updated=? WHERE path=?',
+                                (state, r['error'], now, path))
+                    self.L.error('Failed to process %s (attempt %s of %s):\n%s' % (path, attempts,
+                                                                                   self.max_attempts,
+                                                                                   r['error']))
+            self.last_finished = now
+
+    def merge_pending(self, force: bool=False) -> list[str]:
+        """
+        Merge output directories with finished but unmerged tilesets, once
+        nothing is running and no file has finished for ``merge_delay``
+        seconds, or once the oldest has waited ``merge_max_wait`` seconds.
+
+        :param bool force: Merge now regardless of the timers
+        :return: The merged output directories
+        :rtype: list
+        """
+        if not self.merge:
+            return []
+        now = time.time()
+        with self.connect() as con:
+            rows = con.execute('SELECT out_dir, tileset, added FROM merges').fetchall()
+        if not rows:
+            return []
+        quiet = (not self.running) and (now - self.last_finished >= self.merge_delay)
+        overdue = now - min(r[2] for r in rows) >= self.merge_max_wait
+        if not (force or quiet or overdue):
+            return []
+        merged = []
+        for out_dir in sorted(set(r[0] for r in rows)):
+            new = [Path(r[1]) for r in rows if r[0] == out_dir]
+            self.L.info('Merging %s new tilesets into %s' % (len(new), out_dir))
+            py3dtiles_iface.merge(dir=Path(out_dir),
+                                  overwrite=True,
+                                  new=new,
+                                  **batch.merge_options(self.kwargs))
+            with self.connect() as con:
+                con.executemany('DELETE FROM merges WHERE out_dir=? AND tileset=? AND added=?',
+                                [r for r in rows if r[0] == out_dir])
+            merged.append(out_dir)
+        return merged
+
+    def status(self) -> dict:
+        """
+        Count the files in each state.
+
+        :return: Number of files per state
+        :rtype: dict
+        """
+        with self.connect() as con:
+            return dict(con.execute('SELECT state, COUNT(*) FROM files GROUP BY state').fetchall())
+
+    def stop(self):
+        """
+        Ask the service to stop after the files that are running finish.
+        """
+        self.L.info('Stopping after %s running files finish' % (len(self.running)))
+        self.stopping.set()
+
+    def run(self):
+        """
+        Watch, process, and merge until :py:meth:`stop` is called.
+        """
+        self.L.info('Watching %s (%s workers)' % (', '.join(str(d) for d in self.dirs), self.workers))
+        with utils.spawn_pool(self.workers) as ex:
+            while not self.stopping.is_set():
+                self.scan()
+                self.collect()
+                self.submit(ex)
+                self.merge_pending()
+                self.stopping.wait(self.interval)
+            while self.running:
+                time.sleep(1)
+                self.collect()
+        self.merge_pending(force=True)
+        self.L.info('Stopped. Queue: %s' % (self.status()))
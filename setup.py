@@ -17,16 +17,27 @@ setuptools.setup(
     include_package_data=True,
     install_requires=[
         'py3dtiles @ git+https://gitlab.com/Oslandia/py3dtiles.git@68cdcd9080994d38614d3aa5db75cea2456298cf',
-        'pdal'
+        'pdal',
+        'laspy[lazrs]',
     ],
     extras_require={
         'dev': [
             'sphinx',
-        ]
+            'pytest',
+        ],
+        'brotli': [
+            'brotli',
+        ],
     },
     entry_points = {
         'console_scripts': [
             'tilepoints=pdgpoints.cli:cli',
+            'tilepoints-batch=pdgpoints.cli:batch_cli',
+            'tilepoints-geoid-warm=pdgpoints.cli:geoid_warm_cli',
+            'tilepoints-bench=pdgpoints.cli:bench_cli',
+            'tilepoints-watch=pdgpoints.cli:watch_cli',
+            'tilepoints-catalog=pdgpoints.cli:catalog_cli',
+            'tilepoints-worker=pdgpoints.cli:worker_cli',
             'tilepoints-test=pdgpoints.test:test'
         ],
     },
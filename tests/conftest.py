@@ -0,0 +1,55 @@
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# keep the geoid cache, benchmark files, and host profiles of a test run
+# out of the user's home directory
+os.environ.setdefault('PDGPOINTS_CACHE_DIR', tempfile.mkdtemp(prefix='pdgpoints-test-cache-'))
+os.environ.setdefault('PDGPOINTS_HOSTS', str(Path(os.environ['PDGPOINTS_CACHE_DIR']) / 'hosts.json'))
+
+from pdgpoints import bench
+
+@pytest.fixture
+def synth(tmp_path):
+    """
+    Write small synthetic point clouds (see :py:func:`pdgpoints.bench.synth_las`).
+    """
+    def make(name: str='synth.las', points: int=2000, layout: str='intensity',
+             crs: str=bench.DEFAULT_CRS, extent: float=100., seed: int=bench.DEFAULT_SEED) -> Path:
+        return bench.synth_las(tmp_path / name, points=points, layout=layout, crs=crs,
+                               extent=extent, seed=seed)
+    return make
+
+@pytest.fixture
+def pipeline_kwargs():
+    """
+    Pipeline options that run every stage in-process (no lastools).
+    """
+    return dict(intensity_to_RGB=True, rgb_engine='laspy', fused=True)
+
+@pytest.fixture(scope='session')
+def tiled_datasets(tmp_path_factory):
+    """
+    Tile three small synthetic point clouds once per test session.
+    """
+    from pdgpoints import py3dtiles_iface
+    base = tmp_path_factory.mktemp('tiled')
+    out = base / '3dtiles'
+    out.mkdir()
+    for i, name in enumerate(['ds_a', 'ds_b', 'ds_c']):
+        f = bench.synth_las(base / ('%s.las' % (name)), points=1500, extent=30. * (i + 1), seed=i)
+        py3dtiles_iface.tile(f, out, las_crs=bench.DEFAULT_CRS, jobs=1)
+    return out
+
+@pytest.fixture
+def tiles_dir(tiled_datasets, tmp_path):
+    """
+    Get a fresh copy of the tiled datasets (see :py:func:`tiled_datasets`)
+    to merge into.
+    """
+    import shutil
+    out = tmp_path / '3dtiles'
+    shutil.copytree(tiled_datasets, out)
+    return out
@@ -0,0 +1,83 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from pdgpoints import batch
+
+def touch(p: Path) -> Path:
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_bytes(b'')
+    return p
+
+def test_find_inputs_directory(tmp_path):
+    a, b = touch(tmp_path / 'a.las'), touch(tmp_path / 'b.LAZ')
+    touch(tmp_path / 'notes.txt')
+    touch(tmp_path / 'sub' / 'c.las')
+    assert batch.find_inputs(tmp_path) == [a, b]
+
+def test_find_inputs_glob_and_list(tmp_path):
+    a, c = touch(tmp_path / 'a.las'), touch(tmp_path / 'sub' / 'c.las')
+    assert batch.find_inputs(str(tmp_path / '**' / '*.las')) == [a, c]
+    assert batch.find_inputs([tmp_path / 'a.las', str(tmp_path / 'sub' / '*.las'), a]) == [a, c]
+
+def test_find_inputs_manifest(tmp_path):
+    a, c = touch(tmp_path / 'a.las'), touch(tmp_path / 'sub' / 'c.las')
+    m = tmp_path / 'list.txt'
+    m.write_text('# inputs\n\na.las\n%s\n' % (c))
+    assert batch.find_inputs(m) == [a, c]
+
+def test_run_one_catches_failures(tmp_path):
+    r = batch.run_one(tmp_path / 'missing.las', {})
+    assert r['ok'] is False
+    assert r['error']
+    assert set(r) == {'file', 'ok', 'out_dir', 'error', 'report', 'entry', 'seconds'}
+
+def test_run_one_lets_interrupts_through(tmp_path, monkeypatch):
+    def interrupt(self):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(batch.Pipeline, 'run', interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        batch.run_one(touch(tmp_path / 'a.las'), {})
+
+def test_merge_options():
+    assert batch.merge_options({}) == {'incremental': False, 'fan_out': 0, 'workers': 1,
+                                       'precompress': [], 'precompress_workers': 4}
+    opts = batch.merge_options({'incremental_merge': True, 'merge_fan_out': 16, 'merge_workers': 2,
+                                'precompress': ['gzip', 'nope']})
+    assert opts['incremental'] and (opts['fan_out'] == 16) and (opts['workers'] == 2)
+    assert opts['precompress'] == ['gzip']
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_run_batch_merges_once(synth, pipeline_kwargs, workers):
+    files = [synth(name='in/s%s.las' % (i), points=2000, extent=50., seed=i) for i in range(2)]
+    files.append(touch(files[0].parent / 'broken.las'))
+    s = batch.run_batch(files[0].parent, workers=workers, **pipeline_kwargs)
+    assert (s['total'], s['succeeded'], s['failed']) == (3, 2, 1)
+    out = files[0].parent / '3dtiles'
+    assert s['merged'] == [str(out)]
+    with open(out / 'tileset.json') as fr:
+        root = json.load(fr)
+    uris = sorted(c['content']['uri'] for c in root['root']['children'])
+    assert uris == ['s0/tileset.json', 's1/tileset.json']
+
+def test_run_pipelined_results_match_run_one(synth, pipeline_kwargs):
+    files = [synth(name='in/s%s.las' % (i), points=2000, extent=50., seed=i) for i in range(2)]
+    files.append(touch(files[0].parent / 'broken.las'))
+    s = batch.run_pipelined(files[0].parent, queue_depth=1, **pipeline_kwargs)
+    assert (s['total'], s['succeeded'], s['failed']) == (3, 2, 1)
+    keys = set(batch.run_one(files[2], pipeline_kwargs))
+    for r in s['results']:
+        assert set(r) == keys
+        assert (r['entry'] is not None) == r['ok']
+    with open(files[0].parent / '3dtiles' / 'tileset.json') as fr:
+        root = json.load(fr)
+    assert len(root['root']['children']) == 2
+
+def test_run_pipelined_lets_interrupts_through(synth, pipeline_kwargs, monkeypatch):
+    def interrupt(self):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(batch.Pipeline, 'finish', interrupt)
+    f = synth(name='in/s.las', points=2000, extent=50.)
+    with pytest.raises(KeyboardInterrupt):
+        batch.run_pipelined(f.parent, **pipeline_kwargs)
@@ -0,0 +1,65 @@
+import laspy
+import numpy as np
+import pytest
+
+from pdgpoints import bench
+
+def test_synth_las_is_reproducible(tmp_path):
+    a = bench.synth_las(tmp_path / 'a.las', points=2500, chunk_size=1000)
+    b = bench.synth_las(tmp_path / 'b.las', points=2500, chunk_size=1000)
+    la, lb = laspy.read(a), laspy.read(b)
+    assert len(la.points) == 2500
+    assert np.array_equal(la.X, lb.X) and np.array_equal(la.intensity, lb.intensity)
+    c = laspy.read(bench.synth_las(tmp_path / 'c.las', points=2500, seed=7))
+    assert not np.array_equal(la.X, c.X)
+
+@pytest.mark.parametrize('layout', list(bench.LAYOUTS))
+def test_synth_las_layouts(tmp_path, layout):
+    las = laspy.read(bench.synth_las(tmp_path / 'x.laz', points=100, layout=layout))
+    version, point_format = bench.LAYOUTS[layout]
+    assert str(las.header.version) == version
+    assert las.header.point_format.id == point_format
+    assert las.header.parse_crs().to_epsg() == 32618
+
+def test_synth_las_unknown_layout(tmp_path):
+    with pytest.raises(ValueError, match='Unknown layout'):
+        bench.synth_las(tmp_path / 'x.las', points=10, layout='nope')
+
+def test_make_dataset_reuses_files(tmp_path):
+    files = bench.make_dataset(sizes=[100, 200], data_dir=tmp_path)
+    assert [f.name for f in files] == [bench.synth_name(100), bench.synth_name(200)]
+    mtimes = [f.stat().st_mtime_ns for f in files]
+    assert [f.stat().st_mtime_ns for f in bench.make_dataset(sizes=[100, 200], data_dir=tmp_path)] == mtimes
+
+def run(wall, points=None):
+    rec = {'wall_s': wall, 'cpu_s': wall, 'peak_rss_bytes': 1, 'peak_rss_children_bytes': 0}
+    if points:
+        rec['points'] = points
+    return rec
+
+def test_summarize_takes_medians():
+    runs = [{'stages': {'tile': run(w, 100)}, 'total': {'wall_s': w}} for w in [1., 3., 2.]]
+    s = bench.summarize(runs)
+    assert s['wall_s'] == 2.
+    assert s['stages']['tile']['wall_s'] == 2.
+    assert s['stages']['tile']['points_per_s'] == 50.
+
+def test_scaling_exponent():
+    cases = {'a': {'points': 1000, 'stages': {'tile': {'wall_s': 1.}}},
+             'b': {'points': 4000, 'stages': {'tile': {'wall_s': 16.}}}}
+    assert bench.scaling(cases)['tile']['exponent'] == pytest.approx(2.)
+
+def test_compare_flags_regressions():
+    base = {'cases': {'c': {'stages': {'tile': {'wall_s': 10.}, 'merge': {'wall_s': 0.1}}}}}
+    cur = {'cases': {'c': {'stages': {'tile': {'wall_s': 13.}, 'merge': {'wall_s': 0.3}}},
+                     'new': {'stages': {'tile': {'wall_s': 1.}}}}}
+    out = {r['stage']: r for r in bench.compare(cur, base, tolerance=0.2, min_seconds=0.5)}
+    assert out['tile']['regression']
+    # three times slower, but by less than min_seconds
+    assert not out['merge']['regression']
+    assert len(out) == 2
+
+def test_save_and_load(tmp_path):
+    d = {'cases': {'c': {'stages': {}}}, 'repeat': 1}
+    f = bench.save(d, tmp_path / 'b.json')
+    assert bench.load(f) == d
@@ -0,0 +1,72 @@
+import json
+import shutil
+
+from pdgpoints import bench, catalog, py3dtiles_iface
+from pdgpoints.pipeline import Pipeline
+
+def root_uris(d):
+    with open(d / 'tileset.json') as fr:
+        return sorted(c['content']['uri'] for c in json.load(fr)['root']['children'])
+
+def test_new_catalog_imports_existing_datasets(tiles_dir):
+    assert catalog.open_catalog(tiles_dir) is None
+    cat = catalog.Catalog(tiles_dir)
+    assert [e['name'] for e in cat.datasets()] == ['ds_a', 'ds_b', 'ds_c']
+    assert catalog.open_catalog(tiles_dir) is not None
+
+def test_first_catalogued_run_keeps_older_datasets(tiles_dir, synth, pipeline_kwargs):
+    # the datasets in tiles_dir were tiled without a catalogue
+    f = synth(name='new.las', points=1500, extent=40.)
+    assert f.parent / '3dtiles' == tiles_dir
+    Pipeline(f=f, merge=True, **pipeline_kwargs).run()
+    assert root_uris(tiles_dir) == ['ds_a/tileset.json', 'ds_b/tileset.json',
+                                    'ds_c/tileset.json', 'new/tileset.json']
+
+def test_merge_does_not_search_the_directory(tiles_dir, tmp_path, monkeypatch):
+    cat = catalog.Catalog(tiles_dir)
+    f = bench.synth_las(tmp_path / 'ds_d.las', points=1500, extent=20.)
+    py3dtiles_iface.tile(f, tiles_dir, las_crs=bench.DEFAULT_CRS, jobs=1)
+    def scan(self):
+        raise AssertionError('merge synced the catalogue')
+    monkeypatch.setattr(catalog.Catalog, 'sync', scan)
+    for incremental in [True, False]:
+        py3dtiles_iface.merge(tiles_dir, overwrite=True, incremental=incremental)
+        assert root_uris(tiles_dir) == ['ds_a/tileset.json', 'ds_b/tileset.json', 'ds_c/tileset.json']
+    assert cat.get('ds_d') is None
+
+def test_merge_after_sync_keeps_uncatalogued_datasets(tiles_dir, tmp_path):
+    cat = catalog.Catalog(tiles_dir)
+    f = bench.synth_las(tmp_path / 'ds_d.las', points=1500, extent=20.)
+    py3dtiles_iface.tile(f, tiles_dir, las_crs=bench.DEFAULT_CRS, jobs=1)
+    assert cat.sync() == (1, 0)
+    for incremental in [True, False]:
+        py3dtiles_iface.merge(tiles_dir, overwrite=True, incremental=incremental)
+        assert root_uris(tiles_dir) == ['ds_a/tileset.json', 'ds_b/tileset.json',
+                                        'ds_c/tileset.json', 'ds_d/tileset.json']
+
+def test_merge_after_sync_drops_deleted_datasets(tiles_dir):
+    cat = catalog.Catalog(tiles_dir)
+    shutil.rmtree(tiles_dir / 'ds_b')
+    assert cat.sync() == (0, 1)
+    py3dtiles_iface.merge(tiles_dir, overwrite=True)
+    assert root_uris(tiles_dir) == ['ds_a/tileset.json', 'ds_c/tileset.json']
+    assert cat.get('ds_b') is None
+
+def test_sync_counts(tiles_dir):
+    cat = catalog.Catalog(tiles_dir)
+    assert cat.sync() == (0, 0)
+    shutil.rmtree(tiles_dir / 'ds_c')
+    assert cat.sync() == (0, 1)
+
+def test_intersects_and_duplicates(tiles_dir):
+    cat = catalog.Catalog(tiles_dir)
+    a = cat.get('ds_a')
+    hits = cat.intersects((a['west'], a['south'], a['east'], a['north']))
+    # the synthetic datasets share a center, so they all overlap
+    assert [e['name'] for e in hits] == ['ds_a', 'ds_b', 'ds_c']
+    assert [e['name'] for e in cat.overlaps('ds_a')] == ['ds_b', 'ds_c']
+    assert cat.duplicates() == []
+    cat.add(tiles_dir / 'ds_a' / 'tileset.json', source_hash='h')
+    cat.add(tiles_dir / 'ds_b' / 'tileset.json', source_hash='h')
+    assert [[e['name'] for e in g] for g in cat.duplicates()] == [['ds_b', 'ds_a']]
+    assert [p.parent.name for p in cat.tilesets()] == ['ds_b', 'ds_c']
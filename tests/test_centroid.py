@@ -0,0 +1,53 @@
+import laspy
+import numpy as np
+import pytest
+
+from pdgpoints import centroid
+from pdgpoints import lasheader
+
+def sampled_mean(f, stride):
+    las = laspy.read(f)
+    return np.asarray(las.x)[::stride].mean(), np.asarray(las.y)[::stride].mean()
+
+@pytest.mark.parametrize('strategy', ['memmap', 'chunk'])
+def test_strided_mean(synth, strategy):
+    f = synth(points=5000)
+    x, y = centroid.lasmean(f, strategy=strategy, stride=7)
+    ex, ey = sampled_mean(f, 7)
+    assert x == pytest.approx(ex, abs=1e-6)
+    assert y == pytest.approx(ey, abs=1e-6)
+
+def test_chunk_mean_aligns_stride_across_chunks(synth):
+    f = synth(points=5000)
+    ex, ey = sampled_mean(f, 3)
+    x, y = centroid.chunk_mean(f, stride=3, chunk_size=1000)
+    assert (x, y) == pytest.approx((ex, ey), abs=1e-6)
+
+def test_header_center(synth):
+    f = synth(points=1000)
+    h = lasheader.read_header(f)
+    x, y = centroid.lasmean(f, strategy='header')
+    assert x == pytest.approx((h.mins[0] + h.maxs[0]) / 2)
+    assert y == pytest.approx((h.mins[1] + h.maxs[1]) / 2)
+
+@pytest.mark.parametrize('name', ['small.las', 'small.laz'])
+def test_auto_samples_points_even_for_small_extents(synth, name):
+    # a file a few metres across, or in degrees, is still sampled rather
+    # than replaced by its header center
+    f = synth(name=name, points=3000, extent=5.)
+    x, y = centroid.lasmean(f, strategy='auto', stride=1)
+    assert (x, y) == pytest.approx(sampled_mean(f, 1), abs=1e-6)
+
+def test_memmap_falls_back_on_laz(synth):
+    f = synth(name='c.laz', points=2000)
+    assert centroid.lasmean(f, strategy='memmap', stride=5) == pytest.approx(sampled_mean(f, 5), abs=1e-6)
+
+def test_unknown_strategy(synth):
+    with pytest.raises(ValueError, match='Unknown centroid strategy'):
+        centroid.lasmean(synth(), strategy='median')
+
+@pytest.mark.parametrize('strategy', ['memmap', 'chunk'])
+@pytest.mark.parametrize('stride', [0, -3])
+def test_stride_must_be_positive(synth, strategy, stride):
+    with pytest.raises(ValueError, match='stride must be at least 1'):
+        centroid.lasmean(synth(), strategy=strategy, stride=stride)
@@ -0,0 +1,98 @@
+import os
+import json
+
+from pdgpoints import checkpoint
+
+STAGES = ['prep', 'tile', 'merge']
+
+
+def write(f, data=b'x' * 100):
+    f.write_bytes(data)
+    return f
+
+
+def test_fingerprint_missing(tmp_path):
+    assert checkpoint.fingerprint(tmp_path / 'nope') is None
+
+
+def test_fingerprint_fields(tmp_path):
+    f = write(tmp_path / 'a.bin')
+    fp = checkpoint.fingerprint(f)
+    assert fp['size'] == 100
+    assert fp['mtime_ns'] == f.stat().st_mtime_ns
+    assert 'hash' not in checkpoint.fingerprint(f, content=False)
+
+
+def test_fingerprint_sees_same_size_rewrite(tmp_path):
+    f = write(tmp_path / 'a.bin', b'a' * 100)
+    st = f.stat()
+    before = checkpoint.fingerprint(f)
+    write(f, b'b' * 100)
+    os.utime(f, ns=(st.st_atime_ns, st.st_mtime_ns))
+    after = checkpoint.fingerprint(f)
+    assert (after['size'], after['mtime_ns']) == (before['size'], before['mtime_ns'])
+    assert after['hash'] != before['hash']
+
+
+def test_fresh_after_done(tmp_path):
+    i, o = write(tmp_path / 'in.las'), write(tmp_path / 'out.las')
+    m = checkpoint.Manifest(tmp_path / 'manifest.json', {'a': 1}, STAGES)
+    assert not m.fresh('prep', [i], [o])
+    m.done('prep', [i], [o], state={'crs': 'EPSG:32606'})
+    assert m.fresh('prep', [i], [o])
+    assert m.state('prep') == {'crs': 'EPSG:32606'}
+    # a new manifest object reads the saved records
+    m2 = checkpoint.Manifest(tmp_path / 'manifest.json', {'a': 1}, STAGES)
+    assert m2.fresh('prep', [i], [o])
+    assert m2.state('prep') == {'crs': 'EPSG:32606'}
+
+
+def test_stale_on_params(tmp_path):
+    i = write(tmp_path / 'in.las')
+    checkpoint.Manifest(tmp_path / 'm.json', {'a': 1}, STAGES).done('prep', [i])
+    assert not checkpoint.Manifest(tmp_path / 'm.json', {'a': 2}, STAGES).fresh('prep', [i])
+
+
+def test_stale_on_changed_or_missing_files(tmp_path):
+    i, o = write(tmp_path / 'in.las'), write(tmp_path / 'out.las')
+    m = checkpoint.Manifest(tmp_path / 'm.json', {}, STAGES)
+    m.done('prep', [i], [o])
+    write(i, b'y' * 101)
+    assert not m.fresh('prep', [i], [o])
+    m.done('prep', [i], [o])
+    o.unlink()
+    assert not m.fresh('prep', [i], [o])
+
+
+def test_stale_on_different_file_list(tmp_path):
+    i, j = write(tmp_path / 'a.las'), write(tmp_path / 'b.las')
+    m = checkpoint.Manifest(tmp_path / 'm.json', {}, STAGES)
+    m.done('prep', [i])
+    assert not m.fresh('prep', [i, j])
+
+
+def test_done_discards_later_stages(tmp_path):
+    i = write(tmp_path / 'in.las')
+    m = checkpoint.Manifest(tmp_path / 'm.json', {}, STAGES)
+    for stage in STAGES:
+        m.done(stage, [i])
+    m.done('prep', [i])
+    assert sorted(m.records) == ['prep']
+
+
+def test_unreadable_or_old_manifest_ignored(tmp_path):
+    f = tmp_path / 'm.json'
+    f.write_text('{not json')
+    assert checkpoint.Manifest(f, {}, STAGES).records == {}
+    f.write_text(json.dumps({'manifest_version': checkpoint.MANIFEST_VERSION + 1,
+                             'stages': {'prep': {}}}))
+    assert checkpoint.Manifest(f, {}, STAGES).records == {}
+
+
+def test_clear(tmp_path):
+    i = write(tmp_path / 'in.las')
+    m = checkpoint.Manifest(tmp_path / 'm.json', {}, STAGES)
+    m.done('prep', [i])
+    m.clear()
+    assert m.records == {}
+    assert not (tmp_path / 'm.json').exists()
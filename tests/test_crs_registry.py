@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+from pyproj import CRS
+
+from pdgpoints import crs_registry
+
+@pytest.fixture(autouse=True)
+def clear():
+    crs_registry.clear()
+    yield
+    crs_registry.clear()
+
+@pytest.mark.parametrize('crs', [32618, '32618', 'EPSG:32618', 'epsg: 32618 '])
+def test_normalize_epsg_spellings(crs):
+    assert crs_registry.normalize(crs) == 'EPSG:32618'
+
+def test_get_crs_is_shared():
+    a = crs_registry.get_crs(32618)
+    assert a is crs_registry.get_crs('EPSG:32618')
+    assert a.to_epsg() == 32618
+
+def test_get_crs_passes_crs_objects_through():
+    c = CRS.from_epsg(4326)
+    assert crs_registry.get_crs(c) is c
+
+def test_get_crs_none():
+    assert crs_registry.get_crs(None) is None
+
+def test_get_crs_invalid():
+    with pytest.raises(Exception):
+        crs_registry.get_crs('not a crs')
+
+def test_transformer_shared_per_thread():
+    t = crs_registry.get_transformer(32618, 4326, always_xy=True)
+    assert t is crs_registry.get_transformer('EPSG:32618', 'EPSG:4326', always_xy=True)
+    assert t is not crs_registry.get_transformer(32618, 4326, always_xy=False)
+    other = []
+    th = threading.Thread(target=lambda: other.append(crs_registry.get_transformer(32618, 4326, always_xy=True)))
+    th.start()
+    th.join()
+    assert other[0] is not t
+    lon, lat = t.transform(500000., 4649776.)
+    assert lon == pytest.approx(-75., abs=1e-6)
+
+def test_split_compound():
+    crs, epsg_h, epsg_v, h_name, v_name = crs_registry.split_crs('EPSG:32618+5703')
+    assert crs.is_compound
+    assert (epsg_h, epsg_v) == (32618, 5703)
+    assert 'UTM zone 18N' in h_name
+    assert 'NAVD88' in v_name
+
+def test_split_horizontal_only():
+    crs, epsg_h, epsg_v, h_name, v_name = crs_registry.split_crs(4326)
+    assert (epsg_h, epsg_v, v_name) == (4326, None, None)
+
+def test_tile_without_input_crs(synth, tmp_path):
+    # a file whose WKT gives no horizontal EPSG code is tiled in its own CRS
+    from pdgpoints import py3dtiles_iface
+    f = synth(points=1000, extent=20.)
+    out = tmp_path / '3dtiles'
+    out.mkdir()
+    r = py3dtiles_iface.tile(f, out, las_crs=None, jobs=1)
+    assert r['points'] == 1000
+    assert (out / f.stem / 'tileset.json').is_file()
@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import multiprocessing
+
+from pdgpoints import distributed, utils
+
+def contend(lease_dir, owner, now, timeout, barrier, out):
+    barrier.wait()
+    lease = distributed.Lease(lease_dir, 'input', owner)
+    out.put((owner, lease.acquire(now=now, timeout=timeout), lease.generation))
+
+def race(lease_dir, n, now, timeout=60.):
+    ctx = multiprocessing.get_context('fork')
+    barrier, out = ctx.Barrier(n), ctx.Queue()
+    procs = [ctx.Process(target=contend, args=(lease_dir, 'w%s' % (i), now, timeout, barrier, out))
+             for i in range(n)]
+    for p in procs:
+        p.start()
+    results = [out.get(timeout=60) for p in procs]
+    for p in procs:
+        p.join()
+    return [r for r in results if r[1]]
+
+def test_one_of_many_acquires(tmp_path):
+    winners = race(tmp_path, 6, now=time.time())
+    assert len(winners) == 1
+    owner, won, generation = winners[0]
+    assert generation == 1
+    lease = distributed.Lease(tmp_path, 'input', owner)
+    assert lease.generations() == [1]
+    with open(lease.path(1)) as fr:
+        assert json.load(fr)['owner'] == owner
+    # nothing but the lease file is left behind
+    assert os.listdir(tmp_path) == ['input.1']
+
+def test_live_lease_is_not_taken(tmp_path):
+    held = distributed.Lease(tmp_path, 'input', 'owner')
+    assert held.acquire(now=time.time(), timeout=60.)
+    assert race(tmp_path, 4, now=time.time()) == []
+    assert held.held() and held.heartbeat()
+
+def test_expired_lease_is_reclaimed_once(tmp_path):
+    dead = distributed.Lease(tmp_path, 'input', 'dead')
+    assert dead.acquire(now=time.time(), timeout=60.)
+    old = time.time() - 600
+    os.utime(dead.path(1), (old, old))
+    winners = race(tmp_path, 4, now=time.time())
+    assert len(winners) == 1
+    assert winners[0][2] == 2
+    assert dead.generations() == [2]
+    # the crashed owner comes back and finds it has lost the lease
+    assert not dead.held()
+    assert not dead.heartbeat()
+    dead.release()
+    assert dead.generations() == [2]
+
+def test_release_frees_the_lease(tmp_path):
+    a = distributed.Lease(tmp_path, 'input', 'a')
+    b = distributed.Lease(tmp_path, 'input', 'b')
+    assert a.acquire(now=time.time(), timeout=60.)
+    assert not b.acquire(now=time.time(), timeout=60.)
+    a.release()
+    assert not a.held()
+    assert b.acquire(now=time.time(), timeout=60.)
+
+def test_file_key():
+    a = distributed.file_key(distributed.Path('/a/x.las'))
+    b = distributed.file_key(distributed.Path('/b/x.las'))
+    assert a.startswith('x-') and b.startswith('x-') and (a != b)
+
+def run_worker(source, queue_dir, kwargs, out):
+    w = distributed.Worker(source, queue_dir, heartbeat=1., lease_timeout=30., poll=0.2, **kwargs)
+    out.put(w.run())
+
+def test_workers_share_a_queue(synth, pipeline_kwargs, tmp_path):
+    files = [synth(name='in/s%s.las' % (i), points=1500, extent=40., seed=i) for i in range(3)]
+    ctx = multiprocessing.get_context('spawn')
+    out = ctx.Queue()
+    procs = [ctx.Process(target=run_worker, args=(str(files[0].parent), str(tmp_path / 'queue'), pipeline_kwargs, out))
+             for i in range(2)]
+    for p in procs:
+        p.start()
+    summaries = [out.get(timeout=300) for p in procs]
+    for p in procs:
+        p.join()
+    processed = sorted(r['file'] for s in summaries for r in s['results'])
+    assert processed == sorted(str(f) for f in files)
+    assert all(s['succeeded'] == 3 for s in summaries)
+    root = files[0].parent / '3dtiles'
+    assert all(s['merged'] == [str(root)] for s in summaries)
+    with open(root / 'tileset.json') as fr:
+        uris = sorted(c['content']['uri'] for c in json.load(fr)['root']['children'])
+    assert uris == ['s0/tileset.json', 's1/tileset.json', 's2/tileset.json']
+    assert os.listdir(tmp_path / 'queue' / 'leases') == []
+
+def record(worker, key, state, attempts):
+    utils.write_json_atomic(worker.result_dir / ('%s.json' % (key)),
+                            {'file': key, 'state': state, 'attempts': attempts, 'worker': 'other'})
+
+def test_running_record_on_last_attempt_is_not_final(tmp_path):
+    w = distributed.Worker([], tmp_path, max_attempts=1, lease_timeout=60.)
+    w.worker_file.write_text('{}')
+    other = distributed.Lease(w.lease_dir, 'k', 'other')
+    assert other.acquire(now=w.clock(), timeout=60.)
+    record(w, 'k', 'running', 1)
+    assert w.result('k')['state'] == 'running'
+    assert 'k' not in w.finished
+    record(w, 'k', 'done', 1)
+    other.release()
+    assert w.result('k')['state'] == 'done'
+    assert w.finished['k']['state'] == 'done'
+
+def test_crashed_last_attempt_is_failed_once_its_lease_expires(tmp_path):
+    w = distributed.Worker([], tmp_path, max_attempts=2, lease_timeout=60.)
+    w.worker_file.write_text('{}')
+    dead = distributed.Lease(w.lease_dir, 'k', 'other')
+    assert dead.acquire(now=w.clock(), timeout=60.)
+    record(w, 'k', 'running', 2)
+    assert w.result('k')['state'] == 'running'
+    assert 'k' not in w.finished
+    old = time.time() - 600
+    os.utime(dead.path(1), (old, old))
+    assert w.result('k')['state'] == 'failed'
+    assert w.finished['k']['state'] == 'failed'
+    # an earlier failed attempt is tried again
+    record(w, 'j', 'failed', 1)
+    assert w.result('j')['state'] == 'failed'
+    assert 'j' not in w.finished
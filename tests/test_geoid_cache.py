@@ -0,0 +1,90 @@
+import pytest
+
+from pdgpoints import geoid_cache
+from pdgpoints.geoid_cache import GeoidCache
+
+class FakeModel():
+    """
+    Stand-in for pyegt's HeightModel that records its queries.
+    """
+    calls = []
+
+    def __init__(self, lat: float, lon: float, from_model: str, region: str):
+        FakeModel.calls.append((lat, lon, from_model, region))
+        self.height = lat + lon / 1000
+
+    def __float__(self):
+        return self.height
+
+@pytest.fixture
+def cache(tmp_path):
+    FakeModel.calls = []
+    def make(**kwargs):
+        return GeoidCache(path=tmp_path / 'geoid.sqlite', height_model=FakeModel, **kwargs)
+    return make
+
+def test_lookup_queries_cell_center_once(cache):
+    c = cache(resolution=0.1)
+    h = c.lookup(44.23, -73.96, 'GEOID18', 'conus')
+    assert len(FakeModel.calls) == 1
+    lat, lon, model, region = FakeModel.calls[0]
+    assert (lat, lon) == pytest.approx((44.25, -73.95))
+    assert (model, region) == ('GEOID18', 'conus')
+    assert h == pytest.approx(44.25 - 73.95 / 1000)
+    # another point in the same cell is a hit, and gets the same height
+    assert c.lookup(44.21, -73.99, 'GEOID18', 'conus') == h
+    assert len(FakeModel.calls) == 1
+
+def test_keys_include_model_and_region(cache):
+    c = cache()
+    c.lookup(44.2, -73.9, 'GEOID18', 'conus')
+    c.lookup(44.2, -73.9, 'GEOID12B', 'conus')
+    c.lookup(44.2, -73.9, 'GEOID18', 'alaska')
+    assert len(FakeModel.calls) == 3
+
+def test_cache_persists_between_instances(cache):
+    cache().lookup(44.2, -73.9, 'GEOID18', 'conus')
+    assert cache().get(44.2, -73.9, 'GEOID18', 'conus') is not None
+    assert len(FakeModel.calls) == 1
+
+def test_ttl_expires_entries(cache, monkeypatch):
+    c = cache(ttl=60)
+    now = [1000.]
+    monkeypatch.setattr(geoid_cache.time, 'time', lambda: now[0])
+    c.lookup(44.2, -73.9, 'GEOID18', 'conus')
+    now[0] += 30
+    assert c.get(44.2, -73.9, 'GEOID18', 'conus') is not None
+    now[0] += 31
+    assert c.get(44.2, -73.9, 'GEOID18', 'conus') is None
+    c.lookup(44.2, -73.9, 'GEOID18', 'conus')
+    assert len(FakeModel.calls) == 2
+
+def test_no_ttl_never_expires(cache, monkeypatch):
+    c = cache(ttl=None)
+    now = [1000.]
+    monkeypatch.setattr(geoid_cache.time, 'time', lambda: now[0])
+    c.put(44.2, -73.9, 'GEOID18', 'conus', 1.)
+    now[0] += 10**9
+    assert c.get(44.2, -73.9, 'GEOID18', 'conus') == 1.
+
+def test_eviction_keeps_most_recently_used(cache, monkeypatch):
+    c = cache(resolution=1., max_entries=2)
+    now = [1000.]
+    monkeypatch.setattr(geoid_cache.time, 'time', lambda: now[0])
+    for lat in [10.5, 20.5]:
+        now[0] += 1
+        c.put(lat, 0.5, 'M', 'R', lat)
+    now[0] += 1
+    assert c.get(10.5, 0.5, 'M', 'R') == 10.5
+    now[0] += 1
+    c.put(30.5, 0.5, 'M', 'R', 30.5)
+    assert c.get(20.5, 0.5, 'M', 'R') is None
+    assert c.get(10.5, 0.5, 'M', 'R') == 10.5
+    assert c.get(30.5, 0.5, 'M', 'R') == 30.5
+
+def test_warm_queries_each_cell_once(cache):
+    c = cache(resolution=0.1)
+    coords = [(44.21, -73.91), (44.22, -73.92), (44.31, -73.91)]
+    assert c.warm(coords, 'GEOID18', 'conus') == 2
+    assert c.warm(coords, 'GEOID18', 'conus') == 0
+    assert len(FakeModel.calls) == 2
@@ -0,0 +1,61 @@
+import sys
+import json
+import argparse
+
+import pytest
+
+from pdgpoints import cli, hostconfig
+
+PROFILES = {
+    'default': {'jobs': 4, 'cache_size': 1000},
+    'node-*': {'jobs': 60, 'split_workers': 4},
+    'node-0*': {'jobs': 30},
+    'small-vm': {'jobs': 1, 'cache_size': 300},
+}
+
+
+@pytest.fixture
+def hosts(tmp_path):
+    f = tmp_path / 'hosts.json'
+    f.write_text(json.dumps(PROFILES))
+    return f
+
+
+def test_no_profile_file(tmp_path):
+    assert hostconfig.load_profile(f=tmp_path / 'missing.json', host='node-1') == {}
+
+
+def test_default_only(hosts):
+    assert hostconfig.load_profile(f=hosts, host='laptop') == {'jobs': 4, 'cache_size': 1000}
+
+
+def test_exact_host_overrides_default(hosts):
+    assert hostconfig.load_profile(f=hosts, host='small-vm') == {'jobs': 1, 'cache_size': 300}
+
+
+def test_first_matching_pattern(hosts):
+    # 'node-01' matches both patterns; only the first one applies
+    assert hostconfig.load_profile(f=hosts, host='node-01') == {'jobs': 60, 'cache_size': 1000, 'split_workers': 4}
+
+
+def test_exact_host_overrides_pattern(tmp_path):
+    f = tmp_path / 'hosts.json'
+    f.write_text(json.dumps({'node-*': {'jobs': 60, 'cache_size': 16000}, 'node-7': {'jobs': 2}}))
+    assert hostconfig.load_profile(f=f, host='node-7') == {'jobs': 2, 'cache_size': 16000}
+
+
+def test_default_file(hosts, monkeypatch):
+    monkeypatch.setattr(hostconfig, 'HOST_PROFILES', hosts)
+    assert hostconfig.load_profile(host='small-vm')['jobs'] == 1
+
+
+def test_parse_args_uses_profile_defaults(hosts, monkeypatch):
+    monkeypatch.setattr('socket.gethostname', lambda: 'node-9')
+    parser = argparse.ArgumentParser()
+    cli.add_pipeline_args(parser)
+    monkeypatch.setattr(sys, 'argv', ['pdgpoints', '-H', str(hosts)])
+    args = cli.parse_args(parser)
+    assert (args.jobs, args.cache_size) == (60, 1000)
+    # options given on the command line win
+    monkeypatch.setattr(sys, 'argv', ['pdgpoints', '-H', str(hosts), '-j', '3'])
+    assert cli.parse_args(parser).jobs == 3
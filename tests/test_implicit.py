@@ -0,0 +1,141 @@
+import json
+import struct
+
+import pytest
+
+from pdgpoints import bench, implicit, py3dtiles_iface
+
+def test_template_and_cell_path():
+    assert implicit.template('content', 2, '.pnts') == 'content/{level}/{x}/{y}.pnts'
+    assert implicit.template('subtrees', 3, '.subtree') == 'subtrees/{level}/{x}/{y}/{z}.subtree'
+    assert implicit.cell_path('content', 3, (5, 1, 2), '.pnts') == 'content/3/5/1/2.pnts'
+
+def test_node_name():
+    assert implicit.node_name('r.pnts') == ''
+    assert implicit.node_name('r0214.pnts') == '0214'
+    # the converter splits long names into subdirectories
+    assert implicit.node_name('02140536/r21.pnts') == '0214053621'
+
+def test_cell_and_morton():
+    # bit 4 is x, bit 2 is y, bit 1 is z
+    assert implicit.cell('4', 3) == (1, 0, 0)
+    assert implicit.cell('21', 3) == (0, 2, 1)
+    assert implicit.cell('75', 2) == (3, 2)
+    assert [implicit.morton(c) for c in [(0, 0), (1, 0), (0, 1), (1, 1), (2, 0)]] == [0, 1, 2, 3, 4]
+    assert implicit.morton((1, 1, 1)) == 7
+    assert implicit.morton((0, 0, 2)) == 32
+
+def read_subtree(f):
+    data = f.read_bytes()
+    assert data[:4] == implicit.SUBTREE_MAGIC
+    version, json_len, bin_len = struct.unpack('<IQQ', data[4:24])
+    assert version == 1 and (json_len % 8 == 0) and (bin_len % 8 == 0)
+    assert len(data) == 24 + json_len + bin_len
+    return json.loads(data[24:24 + json_len]), data[24 + json_len:]
+
+def bits(obj, subtree, buf, count):
+    if 'constant' in obj:
+        return set(range(count)) if obj['constant'] else set()
+    view = subtree['bufferViews'][obj['bitstream']]
+    data = buf[view['byteOffset']:view['byteOffset'] + view['byteLength']]
+    out = {i for i in range(count) if data[i >> 3] & (1 << (i & 7))}
+    assert len(out) == obj['availableCount']
+    return out
+
+def test_write_subtree(tmp_path):
+    f = tmp_path / 'a.subtree'
+    implicit.write_subtree(f, tiles={0, 1, 3}, contents={1, 3}, children=set(), levels=2, dims=2)
+    subtree, buf = read_subtree(f)
+    assert bits(subtree['tileAvailability'], subtree, buf, 5) == {0, 1, 3}
+    assert bits(subtree['contentAvailability'][0], subtree, buf, 5) == {1, 3}
+    assert subtree['childSubtreeAvailability'] == {'constant': 0}
+
+def test_write_subtree_constants(tmp_path):
+    f = tmp_path / 'a.subtree'
+    implicit.write_subtree(f, tiles=set(range(9)), contents=set(), children=set(range(64)), levels=2, dims=3)
+    subtree, buf = read_subtree(f)
+    assert subtree == {'tileAvailability': {'constant': 1}, 'contentAvailability': [{'constant': 0}],
+                       'childSubtreeAvailability': {'constant': 1}}
+    assert buf == b''
+
+def positions(dir):
+    import numpy as np
+    xyz = np.concatenate([implicit.read_points(f)[0] for f in sorted(dir.rglob('*.pnts'))])
+    return xyz[np.lexsort(xyz.T)]
+
+@pytest.fixture(scope='module')
+def implicit_tiles(tmp_path_factory):
+    base = tmp_path_factory.mktemp('implicit')
+    f = bench.synth_las(base / 'ds.las', points=100000, extent=200.)
+    for d in ['implicit', 'explicit']:
+        (base / d).mkdir()
+    r = py3dtiles_iface.tile(f, base / 'implicit', las_crs=bench.DEFAULT_CRS, jobs=1,
+                             implicit=True, subtree_levels=2)
+    py3dtiles_iface.tile(f, base / 'explicit', las_crs=bench.DEFAULT_CRS, jobs=1)
+    return base / 'implicit' / 'ds', r
+
+def test_tile_writes_implicit_tileset(implicit_tiles):
+    dir, r = implicit_tiles
+    assert r['implicit']['levels'] > r['implicit']['subtree_levels']
+    with open(dir / 'tileset.json') as fr:
+        tileset = json.load(fr)
+    assert tileset['asset']['version'] == '1.1'
+    child, = tileset['root']['children']
+    tiling = child['implicitTiling']
+    assert tiling['subdivisionScheme'] == r['implicit']['scheme']
+    assert tiling['availableLevels'] == r['implicit']['levels']
+    dims = {v: k for k, v in implicit.SCHEMES.items()}[tiling['subdivisionScheme']]
+    assert child['content']['uri'] == implicit.template(implicit.CONTENT_DIR, dims, '.pnts')
+    assert tiling['subtrees']['uri'] == implicit.template(implicit.SUBTREE_DIR, dims, '.subtree')
+    # nothing but the root content, the implicit tiles, and the tileset are left
+    assert sorted(p.name for p in dir.iterdir()) == sorted([implicit.CONTENT_DIR, implicit.SUBTREE_DIR,
+                                                            'r.pnts', 'tileset.json'])
+
+def test_subtrees_match_content_files(implicit_tiles):
+    dir, r = implicit_tiles
+    sl = r['implicit']['subtree_levels']
+    dims = {v: k for k, v in implicit.SCHEMES.items()}[r['implicit']['scheme']]
+    n = 2 ** dims
+    count = (n ** sl - 1) // (n - 1)
+    subtrees = {}
+    for f in (dir / implicit.SUBTREE_DIR).rglob('*.subtree'):
+        parts = f.relative_to(dir / implicit.SUBTREE_DIR).with_suffix('').parts
+        subtrees[(int(parts[0]), tuple(int(x) for x in parts[1:]))] = read_subtree(f)
+    assert len(subtrees) == r['implicit']['subtrees']
+    contents = set()
+    for f in (dir / implicit.CONTENT_DIR).rglob('*.pnts'):
+        parts = f.relative_to(dir / implicit.CONTENT_DIR).with_suffix('').parts
+        contents.add((int(parts[0]), tuple(int(x) for x in parts[1:])))
+    assert len(contents) == r['implicit']['contents']
+
+    available = set()
+    for (top, root), (subtree, buf) in subtrees.items():
+        tiles = bits(subtree['tileAvailability'], subtree, buf, count)
+        content = bits(subtree['contentAvailability'][0], subtree, buf, count)
+        assert content <= tiles
+        children = bits(subtree['childSubtreeAvailability'], subtree, buf, n ** sl)
+        for level, c in contents:
+            if level - level % sl == top and tuple(x >> (level - top) for x in c) == root:
+                local = tuple(x - (y << (level - top)) for x, y in zip(c, root))
+                index = (n ** (level - top) - 1) // (n - 1) + implicit.morton(local)
+                assert index in content
+                available.add((level, c))
+        # every available child subtree was written
+        for (t, rt) in subtrees:
+            if t == top + sl and tuple(x >> sl for x in rt) == root:
+                assert implicit.morton(tuple(x - (y << sl) for x, y in zip(rt, root))) in children
+        assert len(children) == sum(1 for (t, rt) in subtrees
+                                    if t == top + sl and tuple(x >> sl for x in rt) == root)
+    assert available == contents
+    assert sum(len(bits(s['contentAvailability'][0], s, b, count)) for s, b in subtrees.values()) == len(contents)
+
+def test_implicit_tiles_keep_every_point(implicit_tiles):
+    import numpy as np
+    dir, r = implicit_tiles
+    # the same points as the converter's own explicit tiles
+    assert np.array_equal(positions(dir), positions(dir.parent.parent / 'explicit' / 'ds'))
+
+def test_subtree_levels_must_be_positive(tmp_path):
+    import numpy as np
+    with pytest.raises(ValueError):
+        implicit.convert(tmp_path, np.zeros((2, 3)), subtree_levels=0)
@@ -0,0 +1,39 @@
+import sys
+import json
+import subprocess
+
+import pytest
+
+from pdgpoints import bench
+
+def loaded(module):
+    code = ('import sys, json; import %s; '
+            'print(json.dumps([m for m in %r if m in sys.modules]))' % (module, bench.HEAVY_MODULES))
+    p = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return json.loads(p.stdout.strip().splitlines()[-1])
+
+@pytest.mark.parametrize('module', bench.IMPORT_MODULES + ['pdgpoints.pipeline', 'pdgpoints.py3dtiles_iface',
+                                                     'pdgpoints.watch', 'pdgpoints.distributed'])
+def test_entry_points_load_no_heavy_modules(module):
+    assert loaded(module) == []
+
+def test_import_time_reports_heavy_modules():
+    r = bench.import_time('pdgpoints.cli', repeat=1)
+    assert r['heavy'] == []
+    assert r['seconds'] > 0 and len(r['runs']) == 1
+    assert 'pdgpoints.cli' not in r['slowest']
+    r = bench.import_time('numpy', repeat=1)
+    assert r['heavy'] == ['numpy']
+
+def test_import_time_fails_on_bad_module():
+    with pytest.raises(RuntimeError):
+        bench.import_time('pdgpoints.no_such_module', repeat=1)
+
+def test_compare_imports():
+    base = {'imports': {'a': {'seconds': 0.1, 'heavy': []}, 'b': {'seconds': 0.1, 'heavy': []}}}
+    cur = {'imports': {'a': {'seconds': 0.3, 'heavy': []}, 'b': {'seconds': 0.11, 'heavy': ['numpy']},
+                       'c': {'seconds': 1., 'heavy': []}}}
+    out = {r['module']: r for r in bench.compare_imports(cur, base)}
+    assert out['a']['regression'] and out['b']['regression']
+    assert not out['c']['regression']
+    assert out['c']['baseline_s'] is None
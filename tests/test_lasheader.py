@@ -0,0 +1,66 @@
+import laspy
+import pytest
+
+from pdgpoints import lasheader
+from pdgpoints.defs import MOD_LOC
+
+TESTDATA = MOD_LOC / 'testdata'
+
+@pytest.mark.parametrize('layout', ['intensity', 'rgb', 'intensity14', 'rgb14'])
+def test_read_header_matches_laspy(synth, layout):
+    f = synth(name='%s.laz' % (layout), points=1500, layout=layout)
+    h = lasheader.read_header(f)
+    with laspy.open(f) as r:
+        ref = r.header
+    assert h.version == (ref.version.major, ref.version.minor)
+    assert h.point_format == ref.point_format.id
+    assert h.point_count == ref.point_count
+    assert h.compressed
+    assert h.point_record_length == ref.point_format.size
+    assert h.scales == pytest.approx(tuple(ref.scales))
+    assert h.offsets == pytest.approx(tuple(ref.offsets))
+    assert h.mins == pytest.approx(tuple(ref.mins))
+    assert h.maxs == pytest.approx(tuple(ref.maxs))
+
+def test_geokeys_give_epsg_wkt(synth):
+    f = synth(layout='intensity')
+    h = lasheader.read_header(f)
+    keys = lasheader.get_geokeys(h)
+    assert keys[lasheader.PROJECTED_KEY] == 32618
+    assert lasheader.get_wkt(h) is None
+    assert 'UTM zone 18N' in lasheader.header_wkt(f)
+
+def test_compound_wkt_from_geokeys():
+    wkt = lasheader.wkt_from_geokeys({lasheader.PROJECTED_KEY: 32618, lasheader.VERTICAL_KEY: 5703})
+    assert wkt.startswith('COMPD_CS')
+    assert 'NAVD88' in wkt
+
+def test_wkt_record_is_read(synth):
+    f = synth(layout='intensity14')
+    wkt = lasheader.get_wkt(lasheader.read_header(f))
+    assert 'UTM zone 18N' in wkt
+
+def test_wkt_from_geokeys_without_epsg():
+    assert lasheader.wkt_from_geokeys({}) is None
+    assert lasheader.wkt_from_geokeys({lasheader.PROJECTED_KEY: lasheader.USER_DEFINED}) is None
+
+def test_not_a_las_file(tmp_path):
+    f = tmp_path / 'junk.las'
+    f.write_bytes(b'not a point cloud' * 30)
+    with pytest.raises(ValueError, match='not a LAS or LAZ file'):
+        lasheader.read_header(f)
+
+def test_lasinfo_on_test_data(tmp_path):
+    f = tmp_path / 'lp_jumps_e.laz'
+    f.write_bytes((TESTDATA / 'lp_jumps_e.laz').read_bytes())
+    epsg_h, epsg_v, wkt, wktf, h_name, v_name = lasheader.lasinfo(f)
+    assert epsg_h
+    assert wktf.read_text() == wkt
+
+def test_lasinfo_without_crs(tmp_path):
+    header = laspy.LasHeader(version='1.2', point_format=0)
+    f = tmp_path / 'nocrs.las'
+    with laspy.open(f, mode='w', header=header) as w:
+        w.write_points(laspy.ScaleAwarePointRecord.zeros(1, header=header))
+    with pytest.raises(ValueError, match='No CRS'):
+        lasheader.lasinfo(f)
@@ -0,0 +1,81 @@
+import laspy
+import numpy as np
+import pytest
+
+from pdgpoints import laspy_iface
+
+def test_scale_intensity_truncates_and_clamps():
+    out = laspy_iface.scale_intensity(np.array([0, 10, 100, 40000], dtype=np.uint16), rgb_scale=2.5)
+    assert out.dtype == np.uint16
+    assert out.tolist() == [0, 25, 250, 65535]
+
+def test_scale_intensity_clamps_negative_scale():
+    out = laspy_iface.scale_intensity(np.array([10], dtype=np.uint16), rgb_scale=-1.)
+    assert out.tolist() == [0]
+
+def test_intensity_to_rgb_shifts_into_upper_byte():
+    out = laspy_iface.intensity_to_rgb(np.array([0, 1, 255, 256, 65535], dtype=np.uint16))
+    assert out.dtype == np.uint16
+    assert out.tolist() == [0, 256, 255 * 256, 255 * 256, 255 * 256]
+
+def test_rgb_point_format():
+    assert laspy_iface.rgb_point_format(0) == 2
+    assert laspy_iface.rgb_point_format(6) == 7
+    # formats that already have color are kept
+    assert laspy_iface.rgb_point_format(3) == 3
+
+def test_las2las_copies_intensity_to_rgb(synth, tmp_path):
+    f = synth(points=5000)
+    out = tmp_path / 'out.las'
+    laspy_iface.las2las(f=f, output_file=out, rgb_scale=2., translate_z=1.5, chunk_size=1234)
+    src, dst = laspy.read(f), laspy.read(out)
+    assert len(dst.points) == len(src.points)
+    assert 'red' in dst.point_format.dimension_names
+    rgb = laspy_iface.intensity_to_rgb(laspy_iface.scale_intensity(src.intensity, rgb_scale=2.))
+    assert np.array_equal(dst.red, rgb)
+    assert np.array_equal(dst.green, rgb)
+    assert np.array_equal(dst.blue, rgb)
+    # the laspy engine keeps the fields the lastools text pipe drops
+    assert np.array_equal(dst.classification, src.classification)
+    assert np.allclose(dst.z, src.z + 1.5, atol=0.01)
+    assert np.allclose(dst.x, src.x)
+
+def test_las2las_archives_input(synth, tmp_path):
+    f = synth()
+    archive = tmp_path / 'archive'
+    archive.mkdir()
+    laspy_iface.las2las(f=f, output_file=tmp_path / 'out.las', archive_dir=archive, archive=True)
+    assert not f.exists()
+    assert (archive / f.name).is_file()
+
+def test_shift_z_moves_header_offset_and_bounds(synth):
+    f = synth(points=3000)
+    before = laspy.read(f)
+    laspy_iface.shift_z(f, translate_z=-12.25)
+    after = laspy.read(f)
+    assert after.header.offsets[2] == before.header.offsets[2] - 12.25
+    assert after.header.maxs[2] == before.header.maxs[2] - 12.25
+    assert after.header.mins[2] == before.header.mins[2] - 12.25
+    assert np.allclose(after.z, before.z - 12.25)
+    assert np.array_equal(after.X, before.X)
+
+def test_fused_rewrite_samples_mean_and_writes_wkt(synth, tmp_path):
+    f = synth(points=4000, layout='intensity14')
+    out = tmp_path / 'fused.las'
+    wkt, wktf, x, y = laspy_iface.fused_rewrite(f=f, output_file=out, intensity_to_RGB=True,
+                                                sample_every=7, chunk_size=1000)
+    src = laspy.read(f)
+    assert wktf.read_text() == wkt
+    assert 'UTM zone 18N' in wkt
+    assert np.isclose(x, np.asarray(src.x)[::7].mean())
+    assert np.isclose(y, np.asarray(src.y)[::7].mean())
+    dst = laspy.read(out)
+    assert np.array_equal(dst.red, laspy_iface.intensity_to_rgb(laspy_iface.scale_intensity(src.intensity)))
+
+def test_fused_rewrite_needs_crs(tmp_path):
+    header = laspy.LasHeader(version='1.2', point_format=0)
+    f = tmp_path / 'nocrs.las'
+    with laspy.open(f, mode='w', header=header) as w:
+        w.write_points(laspy.ScaleAwarePointRecord.zeros(3, header=header))
+    with pytest.raises(ValueError, match='No CRS'):
+        laspy_iface.fused_rewrite(f=f, output_file=tmp_path / 'out.las')
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from pdgpoints import py3dtiles_iface
+
+def read_root(d):
+    with open(d / 'tileset.json') as fr:
+        return json.load(fr)
+
+def children(ts):
+    return sorted(ts['root']['children'], key=lambda c: c['content']['uri'])
+
+def test_full_merge_lists_every_dataset(tiles_dir):
+    py3dtiles_iface.merge(tiles_dir, overwrite=True)
+    uris = [c['content']['uri'] for c in children(read_root(tiles_dir))]
+    assert uris == ['ds_a/tileset.json', 'ds_b/tileset.json', 'ds_c/tileset.json']
+
+def test_incremental_merge_matches_full_merge(tiles_dir):
+    py3dtiles_iface.merge(tiles_dir, overwrite=True)
+    full = read_root(tiles_dir)
+    (tiles_dir / 'tileset.json').unlink()
+    (tiles_dir / 'r.pnts').unlink(missing_ok=True)
+    for name in ['ds_a', 'ds_b', 'ds_c']:
+        py3dtiles_iface.merge(tiles_dir, overwrite=True, incremental=True,
+                              new=[tiles_dir / name / 'tileset.json'])
+    inc = read_root(tiles_dir)
+    assert [c['content']['uri'] for c in children(inc)] == [c['content']['uri'] for c in children(full)]
+    for a, b in zip(children(inc), children(full)):
+        assert a['boundingVolume']['box'] == pytest.approx(b['boundingVolume']['box'])
+        assert a['geometricError'] == pytest.approx(b['geometricError'])
+    assert inc['geometricError'] == pytest.approx(max(c['geometricError'] for c in children(full)))
+
+def test_incremental_merge_drops_removed_datasets(tiles_dir):
+    import shutil
+    py3dtiles_iface.merge(tiles_dir, overwrite=True, incremental=True)
+    assert len(children(read_root(tiles_dir))) == 3
+    shutil.rmtree(tiles_dir / 'ds_b')
+    py3dtiles_iface.merge(tiles_dir, overwrite=True, incremental=True, new=[])
+    assert [c['content']['uri'] for c in children(read_root(tiles_dir))] == ['ds_a/tileset.json', 'ds_c/tileset.json']
+
+def test_incremental_merge_is_idempotent(tiles_dir):
+    py3dtiles_iface.merge(tiles_dir, overwrite=True, incremental=True)
+    first = read_root(tiles_dir)
+    py3dtiles_iface.merge(tiles_dir, overwrite=True, incremental=True,
+                          new=[tiles_dir / 'ds_a' / 'tileset.json'])
+    assert read_root(tiles_dir) == first
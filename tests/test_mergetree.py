@@ -0,0 +1,121 @@
+import json
+import math
+
+import pytest
+
+from pdgpoints import mergetree, py3dtiles_iface
+
+R = 6371000.
+
+def entry(name, lon, lat, err=10.):
+    x = R * math.cos(math.radians(lat)) * math.cos(math.radians(lon))
+    y = R * math.cos(math.radians(lat)) * math.sin(math.radians(lon))
+    z = R * math.sin(math.radians(lat))
+    return {'boundingVolume': {'box': [x, y, z, 100., 0., 0., 0., 100., 0., 0., 0., 100.]},
+            'geometricError': err, 'refine': 'REPLACE',
+            'content': {'uri': '%s/tileset.json' % (name)}}
+
+def grid(n):
+    return [entry('ds%03d' % (i), -150. + (i % 10) * 0.1, 60. + (i // 10) * 0.1, err=float(i)) for i in range(n)]
+
+def datasets(dir, entries):
+    for e in entries:
+        f = dir / e['content']['uri']
+        f.parent.mkdir(parents=True, exist_ok=True)
+        f.write_text('{}')
+
+def generations(dir):
+    d = dir / mergetree.TREE_DIR
+    return sorted(p.name for p in d.iterdir()) if d.is_dir() else []
+
+def read_root(dir):
+    with open(dir / 'tileset.json') as fr:
+        return json.load(fr)
+
+def test_grid_size():
+    assert [mergetree.grid_size(f) for f in [4, 15, 16, 64, 100]] == [2, 2, 4, 8, 8]
+
+def test_center():
+    lon, lat = mergetree.center(entry('a', -147.5, 64.8))
+    assert (lon, lat) == (pytest.approx(-147.5), pytest.approx(64.8))
+
+def count_entries(node):
+    if 'entries' in node:
+        assert len(node['entries']) <= 4
+        return len(node['entries'])
+    assert len(node['nodes']) <= 4
+    return sum(count_entries(n) for n in node['nodes'])
+
+def test_partition_respects_fan_out():
+    items = [mergetree.center(c) + (c,) for c in grid(100)]
+    assert count_entries(mergetree.partition(items, 4)) == 100
+
+def test_partition_coincident_centers():
+    items = [mergetree.center(c) + (c,) for c in [entry('ds%s' % (i), 10., 10.) for i in range(10)]]
+    tree = mergetree.partition(items, 4)
+    assert count_entries(tree) == 10
+
+def test_write_tree_round_trip(tmp_path):
+    children = grid(100)
+    depth = mergetree.write_tree(tmp_path, children, fan_out=4)
+    assert depth >= 3
+    root = read_root(tmp_path)
+    assert len(root['root']['children']) <= 4
+    assert root['geometricError'] == 99.
+    back = mergetree.read_tree(tmp_path, root)
+    assert sorted(c['content']['uri'] for c in back) == sorted(c['content']['uri'] for c in children)
+    assert len(generations(tmp_path)) == 1
+    assert mergetree.current_generation(tmp_path) == generations(tmp_path)[0]
+
+def test_small_tree_has_no_nodes(tmp_path):
+    assert mergetree.write_tree(tmp_path, grid(3), fan_out=4) == 0
+    assert generations(tmp_path) == []
+    assert mergetree.current_generation(tmp_path) is None
+
+def test_fan_out_too_small(tmp_path):
+    with pytest.raises(ValueError):
+        mergetree.write_tree(tmp_path, grid(10), fan_out=2)
+
+def test_previous_generation_is_kept(tmp_path):
+    mergetree.write_tree(tmp_path, grid(20), fan_out=4)
+    first = mergetree.current_generation(tmp_path)
+    mergetree.write_tree(tmp_path, grid(30), fan_out=4)
+    second = mergetree.current_generation(tmp_path)
+    # a client that loaded the first root can still fetch its nodes
+    assert generations(tmp_path) == sorted([first, second])
+    mergetree.write_tree(tmp_path, grid(40), fan_out=4)
+    assert generations(tmp_path) == sorted([second, mergetree.current_generation(tmp_path)])
+
+def test_flat_merge_keeps_replaced_tree_once(tmp_path):
+    children = grid(20)
+    datasets(tmp_path, children)
+    mergetree.write_tree(tmp_path, children, fan_out=4)
+    gen = mergetree.current_generation(tmp_path)
+    assert py3dtiles_iface.merge_incremental(tmp_path, new=[])
+    assert mergetree.current_generation(tmp_path) is None
+    assert len(read_root(tmp_path)['root']['children']) == 20
+    assert generations(tmp_path) == [gen]
+    assert py3dtiles_iface.merge_incremental(tmp_path, new=[])
+    assert not (tmp_path / mergetree.TREE_DIR).exists()
+
+def test_incremental_tree_merge_reads_back_entries(tmp_path):
+    children = grid(20)
+    datasets(tmp_path, children)
+    mergetree.write_tree(tmp_path, children, fan_out=4)
+    assert py3dtiles_iface.merge_incremental(tmp_path, new=[], fan_out=4)
+    back = mergetree.read_tree(tmp_path, read_root(tmp_path))
+    assert sorted(c['content']['uri'] for c in back) == sorted(c['content']['uri'] for c in children)
+
+def test_tree_merge_of_tiled_datasets(tiles_dir):
+    import shutil
+    for name in ['ds_d', 'ds_e']:
+        shutil.copytree(tiles_dir / 'ds_a', tiles_dir / name)
+    py3dtiles_iface.merge(tiles_dir, overwrite=True, fan_out=4)
+    root = read_root(tiles_dir)
+    assert all(c['content']['uri'].startswith(mergetree.TREE_DIR + '/') for c in root['root']['children'])
+    back = mergetree.read_tree(tiles_dir, root)
+    assert sorted(c['content']['uri'] for c in back) == ['ds_%s/tileset.json' % (c) for c in 'abcde']
+    # a flat merge replaces the tree root
+    py3dtiles_iface.merge(tiles_dir, overwrite=True)
+    assert len(read_root(tiles_dir)['root']['children']) == 5
+    assert mergetree.current_generation(tiles_dir) is None
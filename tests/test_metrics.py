@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from pdgpoints import metrics
+from pdgpoints import profiling
+
+def test_stage_records_time_sizes_and_points(tmp_path):
+    m = metrics.Metrics(name='x.las')
+    src = tmp_path / 'in.bin'
+    src.write_bytes(b'a' * 100)
+    out = tmp_path / 'out'
+    with m.stage('copy', points=1000, inputs=[src], outputs=[out]) as st:
+        out.mkdir()
+        (out / 'a').write_bytes(b'b' * 30)
+        (out / 'b').write_bytes(b'c' * 12)
+        st['extra'] = 1
+    r = m.stages['copy']
+    assert r['ok'] and (r['extra'] == 1)
+    assert (r['input_bytes'], r['output_bytes']) == (100, 42)
+    assert r['wall_s'] >= 0 and r['cpu_s'] >= 0
+    assert r['points'] == 1000
+    assert r['points_per_s'] > 0
+
+def test_failed_stage_is_recorded(tmp_path):
+    m = metrics.Metrics()
+    with pytest.raises(RuntimeError):
+        with m.stage('boom'):
+            raise RuntimeError('boom')
+    assert m.stages['boom']['ok'] is False
+    assert 'wall_s' in m.stages['boom']
+
+def test_skip_and_counters():
+    m = metrics.Metrics()
+    m.skip('tile')
+    with m.stage('merge'):
+        profiling.count('merge.tilesets', 3)
+        profiling.count('merge.tilesets')
+    assert m.stages['tile'] == {'ok': True, 'skipped': True}
+    assert m.stages['merge']['counters'] == {'merge.tilesets': 4}
+    assert m.counters == {'merge.tilesets': 4}
+    # counts outside a stage are ignored
+    profiling.count('merge.tilesets')
+    assert m.counters == {'merge.tilesets': 4}
+
+def test_write_report(tmp_path):
+    m = metrics.Metrics(name='x.las')
+    with m.stage('a'):
+        pass
+    f = m.write(tmp_path / 'sub' / 'report.json', ok=True, points=5)
+    with open(f) as fr:
+        r = json.load(fr)
+    assert (r['name'], r['ok'], r['points']) == ('x.las', True, 5)
+    assert set(r['stages']) == {'a'}
+    assert {'wall_s', 'cpu_s', 'peak_rss_bytes'} <= set(r['total'])
+    assert not list((tmp_path / 'sub').glob('.*.tmp'))
+
+def test_pipeline_writes_report(synth, pipeline_kwargs):
+    from pdgpoints.pipeline import Pipeline
+    f = synth(points=2000, extent=40.)
+    p = Pipeline(f=f, **pipeline_kwargs)
+    p.run()
+    with open(p.report_name) as fr:
+        r = json.load(fr)
+    assert r['ok'] and (r['points'] == 2000)
+    assert {'fused_rewrite', 'tile', 'cleanup'} <= set(r['stages'])
+    assert r['stages']['tile']['points'] == 2000
@@ -0,0 +1,117 @@
+import os
+import gzip
+import json
+
+import pytest
+
+from pdgpoints import mergetree, precompress
+
+def write(f, data):
+    f.parent.mkdir(parents=True, exist_ok=True)
+    f.write_bytes(data)
+    return f
+
+def tileset(dir):
+    write(dir / 'tileset.json', json.dumps({'root': {'children': [{}] * 200}}).encode())
+    write(dir / 'r.pnts', b'pnts' * 1000)
+    write(dir / 'r0' / 'r01.pnts', b'\x01\x02' * 2000)
+    write(dir / 'tiny.json', b'{}')
+    write(dir / 'report.json', b'{"ok": true}' * 100)
+    write(dir / '.tileset.json.tmp', b'{}' * 100)
+    write(dir / 'notes.txt', b'x' * 1000)
+
+def manifest(dir):
+    with open(dir / precompress.MANIFEST_NAME) as fr:
+        return json.load(fr)
+
+def test_available_skips_unknown_and_missing_brotli():
+    assert precompress.available(['gzip', 'nope', 'gzip']) == ['gzip']
+    brotli = precompress.find_spec('brotli') is not None
+    assert precompress.available(['br', 'gzip']) == (['br', 'gzip'] if brotli else ['gzip'])
+
+def test_precompress_rejects_encodings():
+    with pytest.raises(ValueError):
+        precompress.precompress('.', files=[], encodings=['nope'])
+
+def test_precompress_needs_brotli(tmp_path):
+    if precompress.find_spec('brotli') is not None:
+        pytest.skip('brotli is installed')
+    with pytest.raises(ImportError):
+        precompress.precompress(tmp_path, encodings=['br'])
+    assert not (tmp_path / precompress.MANIFEST_NAME).exists()
+
+def test_gzip_is_deterministic():
+    assert precompress.compress(b'abc' * 100, 'gzip') == precompress.compress(b'abc' * 100, 'gzip')
+
+def test_tile_files(tmp_path):
+    tileset(tmp_path)
+    assert [f.relative_to(tmp_path).as_posix() for f in precompress.tile_files(tmp_path)] == \
+        ['r.pnts', 'r0/r01.pnts', 'tileset.json', 'tiny.json']
+
+def test_writes_gzip_siblings(tmp_path):
+    tileset(tmp_path)
+    r = precompress.precompress(tmp_path)
+    assert (r['files'], r['compressed'], r['skipped'], r['dropped']) == (4, 4, 0, 0)
+    for name in ['tileset.json', 'r.pnts', 'r0/r01.pnts']:
+        f = tmp_path / name
+        g = precompress.sibling(f, 'gzip')
+        assert gzip.decompress(g.read_bytes()) == f.read_bytes()
+        assert g.stat().st_mtime_ns == f.stat().st_mtime_ns
+    # a version that is not smaller is not written
+    assert not (tmp_path / 'tiny.json.gz').exists()
+    m = manifest(tmp_path)
+    assert m['files']['tiny.json']['encodings'] == {'gzip': None}
+    assert m['totals']['files'] == 4
+    assert 0 < m['totals']['encodings']['gzip']['ratio'] < 1
+    # no temporary files are left behind
+    assert [p.name for p in tmp_path.rglob('.*')] == ['.tileset.json.tmp']
+
+def test_unchanged_files_are_skipped(tmp_path):
+    tileset(tmp_path)
+    precompress.precompress(tmp_path)
+    r = precompress.precompress(tmp_path)
+    assert (r['compressed'], r['skipped']) == (0, 4)
+    f = tmp_path / 'r.pnts'
+    f.write_bytes(b'stnp' * 1000)
+    st = f.stat()
+    os.utime(f, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    # a missing compressed file is written again
+    (tmp_path / 'tileset.json.gz').unlink()
+    r = precompress.precompress(tmp_path)
+    assert (r['compressed'], r['skipped']) == (2, 2)
+    assert gzip.decompress((tmp_path / 'r.pnts.gz').read_bytes()) == b'stnp' * 1000
+    assert (tmp_path / 'tileset.json.gz').is_file()
+
+def test_removed_files_are_dropped(tmp_path):
+    tileset(tmp_path)
+    precompress.precompress(tmp_path)
+    (tmp_path / 'r0' / 'r01.pnts').unlink()
+    r = precompress.precompress(tmp_path)
+    assert (r['files'], r['dropped']) == (3, 1)
+    assert not (tmp_path / 'r0' / 'r01.pnts.gz').exists()
+    assert 'r0/r01.pnts' not in manifest(tmp_path)['files']
+
+def test_unrequested_encodings_are_removed(tmp_path):
+    f = write(tmp_path / 'tileset.json', b'{"a": 1}' * 500)
+    stale = write(precompress.sibling(f, 'br'), b'stale')
+    precompress.precompress(tmp_path, encodings=['gzip'])
+    assert not stale.exists()
+    assert precompress.sibling(f, 'gzip').is_file()
+
+def test_unreadable_manifest_compresses_again(tmp_path):
+    tileset(tmp_path)
+    precompress.precompress(tmp_path)
+    (tmp_path / precompress.MANIFEST_NAME).write_text('{')
+    assert precompress.precompress(tmp_path)['compressed'] == 4
+
+def test_root_files(tmp_path):
+    tileset(tmp_path)
+    write(tmp_path / mergetree.TREE_DIR / 'g1' / 'n0.json', b'{}')
+    files = precompress.root_files(tmp_path)
+    assert [f.relative_to(tmp_path).as_posix() for f in files] == \
+        ['tileset.json', 'r.pnts', mergetree.TREE_DIR + '/g1/n0.json']
+    assert precompress.precompress_root(tmp_path) is None
+    r = precompress.precompress_root(tmp_path, encodings=['gzip'])
+    assert r['files'] == 3
+    # the dataset files are left to their own manifests
+    assert not (tmp_path / 'r0' / 'r01.pnts.gz').exists()
@@ -0,0 +1,64 @@
+import time
+import pstats
+import threading
+
+from pdgpoints import metrics, profiling
+
+def spin(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+def test_count_and_section_outside_a_stage_do_nothing():
+    profiling.count('x')
+    with profiling.section('y'):
+        pass
+
+def test_count_goes_to_the_stage_and_totals():
+    m = metrics.Metrics()
+    with m.stage('a'):
+        profiling.count('hits', 2)
+        with m.stage('b'):
+            profiling.count('hits')
+        profiling.count('hits')
+    assert m.stages['a']['counters'] == {'hits': 3}
+    assert m.stages['b']['counters'] == {'hits': 1}
+    assert m.counters['hits'] == 4
+
+def test_counts_stay_in_their_thread():
+    m = metrics.Metrics()
+    with m.stage('main'):
+        t = threading.Thread(target=profiling.count, args=('other',))
+        t.start()
+        t.join()
+    assert 'counters' not in m.stages['main']
+
+def test_section_without_profiler_is_free():
+    m = metrics.Metrics()
+    with m.stage('a'):
+        with profiling.section('inner'):
+            pass
+    assert 'counters' not in m.stages['a']
+
+def test_profiler_writes_stage_profiles_and_stacks(tmp_path):
+    m = metrics.Metrics(profile_dir=tmp_path / 'profile')
+    with m.stage('work'):
+        with profiling.section('hot'):
+            spin(0.1)
+        with m.stage('nested'):
+            spin(0.05)
+    m.write(tmp_path / 'report.json')
+    assert m.stages['work']['counters']['hot.seconds'] >= 0.1
+    # nested stages are sampled but only the outer one is under cProfile
+    assert sorted(p.name for p in (tmp_path / 'profile').glob('*.prof')) == ['work.prof']
+    stats = pstats.Stats(str(tmp_path / 'profile' / 'work.prof'))
+    assert any(func[2] == 'spin' for func in stats.stats)
+    lines = (tmp_path / 'profile' / profiling.STACKS_NAME).read_text().splitlines()
+    stacks = {l.rsplit(' ', 1)[0]: int(l.rsplit(' ', 1)[1]) for l in lines}
+    hot = sum(n for s, n in stacks.items() if s.startswith('work;hot;') and s.endswith('test_profiling:spin'))
+    nested = sum(n for s, n in stacks.items() if s.startswith('work;nested;'))
+    assert hot > 0 and nested > 0
+
+def test_frame_name():
+    import sys
+    assert profiling.frame_name(sys._getframe()) == 'test_profiling:test_frame_name'
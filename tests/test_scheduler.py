@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from pdgpoints import batch, scheduler
+
+MB = 2**20
+
+def job(name, peak):
+    return scheduler.Job(file=scheduler.Path(name), points=0, point_record_length=0, peak_bytes=peak)
+
+def report(points, peak, jobs=1, ok=True):
+    stage = {'ok': True, 'peak_rss_bytes': peak, 'peak_rss_children_bytes': 0}
+    return {'ok': ok, 'points': points, 'point_record_length': 10, 'parameters': {'jobs': jobs},
+            'stages': {'fused_rewrite': stage, 'tile': dict(stage, peak_rss_children_bytes=MB)}}
+
+def write_reports(d, reports):
+    for i, r in enumerate(reports):
+        (d / ('ds%s' % (i))).mkdir(parents=True)
+        with open(d / ('ds%s' % (i)) / 'report.json', 'w') as fw:
+            json.dump(r, fw)
+
+def test_model_peak_is_largest_stage():
+    m = scheduler.MemoryModel(stages={'rewrite': (100, 1.), 'tile': (10, 2.)})
+    assert m.estimate(10, 10) == {'rewrite': 200, 'tile': 210}
+    assert m.peak(10, 10) == 210
+    assert m.peak(0, 10) == 100
+
+def test_report_samples():
+    s = scheduler.report_samples(report(1000, 50 * MB, jobs=4))
+    assert s['rewrite'] == (10000, 50 * MB)
+    # the tiler's children are counted once per converter job
+    assert s['tile'] == (10000, 54 * MB)
+    assert scheduler.report_samples(report(1000, MB, ok=False)) == {}
+
+def test_report_samples_skip_skipped_stages():
+    r = report(1000, MB)
+    r['stages']['tile']['skipped'] = True
+    assert list(scheduler.report_samples(r)) == ['rewrite']
+
+def test_calibrate_needs_enough_reports(tmp_path):
+    write_reports(tmp_path, [report(1000, 100 * MB)] * (scheduler.MIN_SAMPLES - 1))
+    m = scheduler.calibrate([tmp_path])
+    assert m.stages == scheduler.DEFAULT_MODEL
+
+def test_calibrate_fits_base_and_slope(tmp_path):
+    sizes = [1000 * i for i in range(1, 11)]
+    write_reports(tmp_path, [report(n // 10, 10 * MB + 3 * n) for n in sizes])
+    (tmp_path / 'broken').mkdir()
+    (tmp_path / 'broken' / 'report.json').write_text('{')
+    m = scheduler.calibrate([tmp_path, tmp_path / 'missing'])
+    base, slope = m.stages['rewrite']
+    assert base == 10 * MB + 3000
+    assert slope == pytest.approx(3 * (10000 - 1000) / 10000)
+    assert m.samples['rewrite'] == 10
+
+def test_plan_orders_largest_first(synth, tmp_path):
+    small = synth(name='small.las', points=1000)
+    big = synth(name='big.las', points=5000)
+    broken = tmp_path / 'broken.las'
+    broken.write_bytes(b'x' * 34 * 100)
+    jobs = scheduler.plan([small, broken, big], scheduler.MemoryModel(stages={'rewrite': (0, 1.), 'tile': (0, 1.)}))
+    assert [j.file.name for j in jobs] == ['big.las', 'small.las', 'broken.las']
+    assert jobs[0].points == 5000
+    assert (jobs[2].points, jobs[2].point_record_length) == (100, 34)
+
+def test_admit():
+    pending = [job('a', 6), job('b', 4), job('c', 2)]
+    assert scheduler.admit(pending, in_use=0, running=0, budget=10).file.name == 'a'
+    # the largest that still fits
+    assert scheduler.admit(pending, in_use=5, running=1, budget=10).file.name == 'b'
+    assert scheduler.admit(pending, in_use=9, running=1, budget=10) is None
+
+def test_admit_oversized_job_runs_alone():
+    pending = [job('huge', 20), job('small', 1)]
+    assert scheduler.admit(pending, in_use=1, running=1, budget=10) is None
+    assert scheduler.admit(pending, in_use=0, running=0, budget=10).file.name == 'huge'
+
+def test_run_batch_with_budget(synth, pipeline_kwargs):
+    files = [synth(name='in/s%s.las' % (i), points=1500 * (i + 1), extent=40., seed=i) for i in range(2)]
+    (files[0].parent / 'broken.las').write_bytes(b'')
+    s = batch.run_batch(files[0].parent, workers=2, memory_gb=2., **pipeline_kwargs)
+    assert (s['total'], s['succeeded'], s['failed']) == (3, 2, 1)
+    # the reports of this batch can calibrate the next one
+    assert all(n == 2 for n in scheduler.calibrate([files[0].parent / '3dtiles']).samples.values())
@@ -0,0 +1,58 @@
+import numpy as np
+import laspy
+import pytest
+
+from pdgpoints import split, lasheader
+
+
+def test_quadtree_keeps_sparse_grid_whole():
+    counts = np.full((4, 4), 10)
+    assert (split.quadtree(counts, max_points=1000) == 0).all()
+
+
+def test_quadtree_divides_dense_quadrant():
+    counts = np.zeros((4, 4), dtype=np.int64)
+    counts[:2, :2] = 100
+    table = split.quadtree(counts, max_points=150)
+    # the dense quadrant is split into its 4 cells, the others stay whole
+    assert len(np.unique(table[:2, :2])) == 4
+    assert len(np.unique(table)) == 7
+    for lid in np.unique(table):
+        assert (counts[table == lid].sum() <= 150) or ((table == lid).sum() == 1)
+
+
+def test_cell_index_covers_bounds(synth):
+    f = synth(points=500)
+    header = lasheader.read_header(f)
+    las = laspy.read(f)
+    ix, iy = split.cell_index(np.asarray(las.X), np.asarray(las.Y), header, bins=8)
+    assert ix.min() >= 0 and ix.max() <= 7
+    assert iy.min() >= 0 and iy.max() <= 7
+    assert len(np.unique(ix)) > 1
+
+
+@pytest.mark.parametrize('name', ['big.las', 'big.laz'])
+def test_density_estimates_count(synth, name):
+    f = synth(name=name, points=20000)
+    header = lasheader.read_header(f)
+    counts = split.density(f, header, bins=4, stride=10, chunk_size=3000)
+    assert counts.sum() == pytest.approx(20000, rel=0.01)
+
+
+@pytest.mark.parametrize('name', ['big.las', 'big.laz'])
+def test_split_las_keeps_every_point(synth, tmp_path, name):
+    f = synth(name=name, points=20000)
+    out = tmp_path / 'chunks'
+    out.mkdir()
+    (out / 'stale.las').write_bytes(b'')
+    files = split.split_las(f, out, max_points=6000, bins=8, stride=10, chunk_size=3000)
+    assert len(files) > 1
+    assert not (out / 'stale.las').exists()
+    assert all(p.suffix == f.suffix for p in files)
+    src = laspy.read(f)
+    parts = [laspy.read(p) for p in files]
+    assert sum(len(p.points) for p in parts) == len(src.points)
+    assert all(len(p.points) <= 6000 * 1.5 for p in parts)
+    got = np.sort(np.concatenate([np.asarray(p.X) for p in parts]))
+    assert (got == np.sort(np.asarray(src.X))).all()
+    assert parts[0].header.parse_crs() == src.header.parse_crs()
@@ -0,0 +1,94 @@
+import sys
+import signal
+from pathlib import Path
+
+import pytest
+
+from pdgpoints import subproc, lastools_iface
+
+PY = sys.executable
+
+def py(code):
+    return [PY, '-c', code]
+
+def test_run_keeps_tail_and_matches():
+    r = subproc.run(py('for i in range(50): print("line %s" % i)'), ring_lines=5, match='line 1')
+    assert (r.returncode, r.attempts, r.lines) == (0, 1, 50)
+    assert r.tail == ['line %s' % i for i in range(45, 50)]
+    assert r.matches == ['line 1'] + ['line %s' % i for i in range(10, 20)]
+
+def test_failure_is_typed():
+    with pytest.raises(subproc.CommandFailed) as e:
+        subproc.run(py('import sys; print("oops"); sys.exit(3)'))
+    assert (e.value.returncode, e.value.attempts, e.value.tail) == (3, 1, ['oops'])
+    assert isinstance(e.value, subproc.CommandError)
+
+def test_timeout_kills():
+    with pytest.raises(subproc.CommandTimeout) as e:
+        subproc.run(py('import time; print("started", flush=True); time.sleep(30)'), timeout=1.)
+    assert e.value.tail == ['started']
+
+def test_missing_executable(tmp_path):
+    with pytest.raises(subproc.CommandNotFound):
+        subproc.run([tmp_path / 'no-such-tool', '-h'])
+
+def test_killed_command_is_retried(tmp_path):
+    marker = tmp_path / 'ran'
+    code = ('import os, signal, pathlib\n'
+            'p = pathlib.Path(%r)\n'
+            'if not p.exists():\n'
+            '    p.touch()\n'
+            '    os.kill(os.getpid(), signal.SIGKILL)\n'
+            'print("ok")' % (str(marker)))
+    r = subproc.run(py(code), retries=2, backoff=0.)
+    assert (r.attempts, r.tail) == (2, ['ok'])
+
+def test_retries_run_out():
+    with pytest.raises(subproc.CommandFailed) as e:
+        subproc.run(py('import os, signal; os.kill(os.getpid(), signal.SIGKILL)'), retries=1, backoff=0.)
+    assert (e.value.returncode, e.value.attempts) == (-signal.SIGKILL, 2)
+
+def test_other_failures_are_not_retried():
+    with pytest.raises(subproc.CommandFailed) as e:
+        subproc.run(py('import sys; sys.exit(1)'), retries=3, backoff=0.)
+    assert e.value.attempts == 1
+
+def test_pipe_ignores_sigpipe_upstream():
+    # like a C tool (e.g. las2las), the producer dies of SIGPIPE when the consumer stops reading
+    producer = py('import sys, signal\nsignal.signal(signal.SIGPIPE, signal.SIG_DFL)\n'
+                  'while True: sys.stdout.write("x" * 1000 + "\\n")')
+    consumer = py('import sys; sys.stdin.readline(); print("done")')
+    r = subproc.run_pipe([producer, consumer], timeout=30)
+    assert r.tail == ['%s: done' % (Path(PY).name)]
+
+def test_pipe_reports_the_failing_command():
+    with pytest.raises(subproc.CommandFailed) as e:
+        subproc.run_pipe([py('print("a")'), py('import sys; sys.stdin.read(); sys.exit(5)')])
+    assert e.value.returncode == 5
+    assert ' | ' in e.value.command
+
+@pytest.mark.skipif(subproc.resource is None, reason='resource limits need the resource module')
+def test_cpu_limit():
+    with pytest.raises(subproc.CommandFailed) as e:
+        subproc.run(py('while True: pass'), cpu_seconds=1, timeout=30)
+    assert e.value.returncode == -signal.SIGXCPU
+
+WKT = ('PROJCS["WGS 84 / UTM zone 18N",GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],'
+       'PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]],PROJECTION["Transverse_Mercator"],'
+       'UNIT["metre",1],AUTHORITY["EPSG","32618"]]')
+
+def test_find_wkt():
+    assert lastools_iface.find_wkt([]) == ''
+    assert lastools_iface.find_wkt(['ProjectedCSTypeGeoKey: 32618 (EPSG)']) == ''
+    assert lastools_iface.find_wkt(['    ' + WKT, 'WKT OGC COORDINATE SYSTEM: ' + WKT]) == WKT
+    with pytest.raises(lastools_iface.AmbiguousWKTError):
+        lastools_iface.find_wkt([WKT, WKT.replace('32618', '32619')])
+
+def test_run_proc_gets_single_wkt():
+    out = 'print("key 3072 ProjectedCSTypeGeoKey (EPSG)"); print("    " + %r)' % (WKT)
+    assert lastools_iface.run_proc(py(out), get_wkt=True) == WKT
+
+def test_command_error_tails_are_not_shared():
+    a, b = subproc.CommandError('a', 'x'), subproc.CommandError('b', 'y')
+    a.tail.append('line')
+    assert b.tail == []
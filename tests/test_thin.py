@@ -0,0 +1,74 @@
+import numpy as np
+import laspy
+import pytest
+
+from pdgpoints import thin, lasheader
+
+def test_plan_spacing_and_budget(synth):
+    f = synth(points=10000, extent=100.)
+    header = lasheader.read_header(f)
+    area = (header.maxs[0] - header.mins[0]) * (header.maxs[1] - header.mins[1])
+    spacing, fraction = thin.plan(header, 'voxel', spacing=2.)
+    assert (spacing, fraction) == (2., 1.)
+    spacing, fraction = thin.plan(header, 'random', budget=1000)
+    assert spacing == pytest.approx((area / 1000) ** 0.5)
+    assert fraction == pytest.approx(0.1)
+    with pytest.raises(ValueError):
+        thin.plan(header, 'nth')
+
+def test_voxel_hash_in_range():
+    ix, iy, iz = (np.arange(1000, dtype=np.int64) for i in range(3))
+    h = thin.voxel_hash(ix, iy, iz, 1 << 10)
+    assert h.max() < (1 << 10)
+    assert len(np.unique(h)) > 500
+
+def test_bitmap_bits_bounded(synth):
+    header = lasheader.read_header(synth(points=2000))
+    bits = thin.bitmap_bits(header, 1.)
+    assert bits & (bits - 1) == 0
+    assert bits >= 2000 * thin.BITS_PER_VOXEL
+    # tiny voxels: bounded by the number of points
+    assert thin.bitmap_bits(header, 1e-6) == bits
+
+@pytest.mark.parametrize('chunk_size', [100_000, 777])
+def test_voxel_keeps_one_point_per_voxel(synth, tmp_path, chunk_size):
+    f = synth(points=20000, extent=50.)
+    out = tmp_path / 'thin.las'
+    r = thin.thin_las(f, out, mode='voxel', spacing=5., chunk_size=chunk_size)
+    las = laspy.read(out)
+    assert r['points_in'] == 20000
+    assert r['points_out'] == len(las.points) < 20000
+    header = lasheader.read_header(f)
+    voxels = set(zip(*(np.floor((np.asarray(v) - header.mins[i]) / 5.).astype(int)
+                       for i, v in enumerate([las.x, las.y, las.z]))))
+    assert len(voxels) == len(las.points)
+    src = laspy.read(f)
+    all_voxels = set(zip(*(np.floor((np.asarray(v) - header.mins[i]) / 5.).astype(int)
+                           for i, v in enumerate([src.x, src.y, src.z]))))
+    # hash collisions may drop the odd voxel, but not many
+    assert len(voxels) >= 0.95 * len(all_voxels)
+
+def test_voxel_result_independent_of_chunking(synth, tmp_path):
+    f = synth(points=20000, extent=50.)
+    thin.thin_las(f, tmp_path / 'a.las', spacing=5., chunk_size=100_000)
+    thin.thin_las(f, tmp_path / 'b.las', spacing=5., chunk_size=999)
+    a, b = laspy.read(tmp_path / 'a.las'), laspy.read(tmp_path / 'b.las')
+    assert (np.asarray(a.X) == np.asarray(b.X)).all()
+
+def test_nth_across_chunks(synth, tmp_path):
+    f = synth(points=10000)
+    r = thin.thin_las(f, tmp_path / 'nth.las', mode='nth', budget=1000, chunk_size=333)
+    src, las = laspy.read(f), laspy.read(tmp_path / 'nth.las')
+    assert r['points_out'] == 1000
+    assert (np.asarray(las.X) == np.asarray(src.X)[::10]).all()
+
+def test_random_is_seeded(synth, tmp_path):
+    f = synth(points=10000)
+    a = thin.thin_las(f, tmp_path / 'a.las', mode='random', budget=2000)
+    b = thin.thin_las(f, tmp_path / 'b.las', mode='random', budget=2000)
+    assert a['points_out'] == b['points_out'] == pytest.approx(2000, rel=0.1)
+    assert (np.asarray(laspy.read(tmp_path / 'a.las').X) == np.asarray(laspy.read(tmp_path / 'b.las').X)).all()
+
+def test_unknown_mode(synth, tmp_path):
+    with pytest.raises(ValueError):
+        thin.thin_las(synth(), tmp_path / 'x.las', mode='nope', spacing=1.)
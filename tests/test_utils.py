@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+from pdgpoints import utils
+
+def test_write_json_atomic(tmp_path):
+    f = tmp_path / 'a.json'
+    utils.write_json_atomic(f, {'path': tmp_path, 'n': 1})
+    utils.write_json_atomic(f, {'n': 2}, indent=2)
+    with open(f) as fr:
+        assert json.load(fr) == {'n': 2}
+    assert f.read_text().startswith('{\n  ')
+    assert [p.name for p in tmp_path.iterdir()] == ['a.json']
+
+def test_atomic_path_keeps_old_file_on_error(tmp_path):
+    f = tmp_path / 'a.laz'
+    f.write_text('old')
+    with pytest.raises(RuntimeError):
+        with utils.atomic_path(f) as tmp:
+            # the suffix is kept for writers that go by it
+            assert (tmp.parent, tmp.suffix) == (tmp_path, '.laz')
+            tmp.write_text('new')
+            raise RuntimeError('failed')
+    assert f.read_text() == 'old'
+    assert [p.name for p in tmp_path.iterdir()] == ['a.laz']
+
+def test_atomic_paths_are_unique(tmp_path):
+    f = tmp_path / 'a.json'
+    with utils.atomic_path(f) as a, utils.atomic_path(f) as b:
+        assert a != b
+        a.write_text('a')
+        b.write_text('b')
+    assert f.read_text() == 'a'
+
+STATE = []
+
+def inherited():
+    return bool(STATE)
+
+def test_spawn_pool_starts_fresh_processes():
+    # a forked worker would inherit the state this process has built up
+    STATE.append(True)
+    try:
+        with utils.spawn_pool(1) as ex:
+            assert ex.submit(inherited).result(timeout=60) is False
+    finally:
+        STATE.clear()
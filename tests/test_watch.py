@@ -0,0 +1,112 @@
+import json
+import sqlite3
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+
+from pdgpoints import watch
+
+
+def states(w):
+    with w.connect() as con:
+        return dict(con.execute('SELECT path, state FROM files').fetchall())
+
+
+def test_scan_waits_for_files_to_settle(tmp_path):
+    drop = tmp_path / 'drop'
+    drop.mkdir()
+    f = drop / 'a.las'
+    f.write_bytes(b'x')
+    (drop / '.partial.las').write_bytes(b'x')
+    (drop / 'a-wkt.laz').write_bytes(b'x')
+    w = watch.Watcher([drop], state=tmp_path / 'q.sqlite', settle=0.)
+    # first seen: not queued until a later scan finds it unchanged
+    assert w.scan() == 0
+    assert w.scan() == 1
+    assert states(w) == {str(f.absolute()): 'queued'}
+    # already queued and unchanged: not queued again
+    assert w.scan() == 0
+
+
+def test_scan_requeues_changed_files(tmp_path):
+    drop = tmp_path / 'drop'
+    drop.mkdir()
+    f = drop / 'a.las'
+    f.write_bytes(b'x')
+    w = watch.Watcher([drop], state=tmp_path / 'q.sqlite', settle=0.)
+    w.scan(), w.scan()
+    with w.connect() as con:
+        con.execute("UPDATE files SET state='done'")
+    assert w.scan() == 0
+    f.write_bytes(b'xy')
+    w.scan()
+    assert w.scan() == 1
+
+
+def test_scan_respects_settle_time(tmp_path):
+    drop = tmp_path / 'drop'
+    drop.mkdir()
+    (drop / 'a.las').write_bytes(b'x')
+    w = watch.Watcher([drop], state=tmp_path / 'q.sqlite', settle=3600.)
+    w.scan()
+    assert w.scan() == 0
+
+
+def test_restart_requeues_running_files(tmp_path):
+    state = tmp_path / 'q.sqlite'
+    watch.Watcher([tmp_path], state=state)
+    con = sqlite3.connect(state)
+    with con:
+        con.execute("INSERT INTO files (path, size, mtime_ns, state, updated) VALUES ('f.las', 1, 1, 'running', 0)")
+    con.close()
+    w = watch.Watcher([tmp_path], state=state)
+    assert w.status() == {'queued': 1}
+
+
+def test_collect_retries_then_fails(tmp_path):
+    w = watch.Watcher([tmp_path], state=tmp_path / 'q.sqlite', max_attempts=2)
+    with w.connect() as con:
+        con.execute("INSERT INTO files (path, size, mtime_ns, state, updated) VALUES ('f.las', 1, 1, 'queued', 0)")
+    for expect in ['queued', 'failed']:
+        with w.connect() as con:
+            con.execute("UPDATE files SET state='running', attempts=attempts+1")
+        fut = Future()
+        fut.set_result({'ok': False, 'out_dir': None, 'error': 'boom'})
+        w.running = {fut: 'f.las'}
+        w.collect()
+        assert w.status() == {expect: 1}
+    assert w.running == {}
+
+
+def test_merge_pending_waits_for_quiet(tmp_path):
+    w = watch.Watcher([tmp_path], state=tmp_path / 'q.sqlite', merge_delay=3600., merge_max_wait=7200.)
+    assert w.merge_pending() == []
+    fut = Future()
+    fut.set_result({'ok': True, 'out_dir': str(tmp_path / 'out'), 'error': None})
+    with w.connect() as con:
+        con.execute("INSERT INTO files (path, size, mtime_ns, state, updated) VALUES ('f.las', 1, 1, 'running', 0)")
+    w.running = {fut: 'f.las'}
+    w.collect()
+    # a file just finished, so the merge is debounced
+    assert w.merge_pending() == []
+    with w.connect() as con:
+        assert con.execute('SELECT tileset FROM merges').fetchall() == [(str(tmp_path / 'out' / 'f' / 'tileset.json'),)]
+
+
+def test_process_and_merge(synth, pipeline_kwargs, tmp_path):
+    files = [synth(name='drop/s%s.las' % (i), points=1500, extent=40., seed=i) for i in range(2)]
+    drop = files[0].parent
+    w = watch.Watcher([drop], state=tmp_path / 'q.sqlite', settle=0., workers=2, **pipeline_kwargs)
+    w.scan()
+    assert w.scan() == 2
+    with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn')) as ex:
+        w.submit(ex)
+        assert w.status() == {'running': 2}
+        wait(list(w.running))
+    w.collect()
+    assert w.status() == {'done': 2}
+    assert w.merge_pending(force=True) == [str(drop / '3dtiles')]
+    with open(drop / '3dtiles' / 'tileset.json') as fr:
+        root = json.load(fr)
+    assert sorted(c['content']['uri'] for c in root['root']['children']) == ['s0/tileset.json', 's1/tileset.json']
+    # merged tilesets are not merged again
+    assert w.merge_pending(force=True) == []